@@ -9,16 +9,16 @@ from flask_jwt_extended import JWTManager
 from datetime import datetime, timezone, timedelta
 from app.extensions import db, setup_extensions
 from app.models import Transacao, TransactionStatus
+from app.utils.json_rapido import JSONProviderRapido
 from config import config_dict
 
 # Instância global do scheduler
 scheduler = APScheduler()
 
-# Configuração do Rate Limiter
+# Configuração do Rate Limiter (storage, timeouts e fallback em memória vêm do config.py)
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="redis://localhost:6379/0",
     strategy="fixed-window"
 )
 
@@ -43,9 +43,17 @@ def processar_monitorizacao_pagamentos(app):
             app.logger.error(f"Erro no Scheduler: {e}")
 
 
+def despachar_outbox(app):
+    """Rede de segurança da outbox: eventos que ficaram por despachar depois do commit."""
+    from app.services.outbox_service import despachar_com_contexto
+    despachar_com_contexto(app)
+
+
 def create_app(config_name='dev'):
     app = Flask(__name__)
     app.config.from_object(config_dict[config_name])
+    # jsonify com orjson: Decimal, datetime e dataclasses sem callbacks por campo
+    app.json = JSONProviderRapido(app)
 
     # Configurar CORS para permitir requisições do frontend Next.js
     # Abrange tanto as rotas de API quanto as de autenticação
@@ -53,7 +61,7 @@ def create_app(config_name='dev'):
         r"/api/*": {
             "origins": ["http://localhost:3000", "http://127.0.0.1:3000"],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key"],
             "supports_credentials": True
         },
         r"/auth/*": {
@@ -78,6 +86,54 @@ def create_app(config_name='dev'):
 
     setup_extensions(app)
 
+    # Índice de pesquisa da vitrine (listeners de sessão + CLI `flask pesquisa`)
+    from app.services import search_service
+    search_service.init_app(app)
+
+    # Invalidação do cache por tags após cada commit (Safra, Usuario, Transacao)
+    from app.services import cache_invalidation
+    cache_invalidation.init_app(app)
+
+    # KPIs financeiros materializados (resumo mantido a cada flush + CLI `flask kpis`)
+    from app.services import kpi_service
+    kpi_service.init_app(app)
+
+    # Relatórios gerados em background (CLI `flask relatorios limpar`)
+    from app.services import relatorio_service
+    relatorio_service.init_app(app)
+
+    # Respostas guardadas por Idempotency-Key (CLI `flask idempotencia limpar`)
+    from app.services import idempotencia_service
+    idempotencia_service.init_app(app)
+
+    # Outbox de notificações despachada depois do commit (CLI `flask outbox`)
+    from app.services import outbox_service
+    outbox_service.init_app(app)
+
+    # Contador de notificações não lidas em Redis + publicação para o stream SSE
+    from app.services import notificacao_service
+    notificacao_service.init_app(app)
+
+    # Cobertura de índices das consultas quentes (CLI `flask indices verificar`)
+    from app.services import plano_consultas
+    plano_consultas.init_app(app)
+
+    # Instruções e tempo de BD por pedido, Server-Timing e deteção de N+1
+    from app.services import instrumentacao_sql
+    instrumentacao_sql.init_app(app)
+
+    # Sinal `transicao_estado` emitido depois do commit de cada mudança de status
+    from app.services import maquina_estados
+    maquina_estados.init_app(app)
+
+    # Faturas pré-geradas em PDF quando a transação entra em ESCROW
+    from app.services import fatura_service
+    fatura_service.init_app(app)
+
+    # Cache L1 em processo (à frente do Redis) com invalidação por pub/sub
+    from app.services.cache_service import cache_service
+    cache_service.init_app(app)
+
     @app.context_processor
     def inject_globals():
         return {
@@ -128,7 +184,9 @@ def create_app(config_name='dev'):
             os.path.join(app.config['UPLOAD_FOLDER_PUBLIC'], 'safras'),
             os.path.join(app.config['UPLOAD_FOLDER_PUBLIC'], 'perfil'),
             os.path.join(app.config['UPLOAD_FOLDER_PRIVATE'], 'comprovativos'),
-            os.path.join(app.config['UPLOAD_FOLDER_PRIVATE'], 'documentos')
+            os.path.join(app.config['UPLOAD_FOLDER_PRIVATE'], 'documentos'),
+            os.path.join(app.config['UPLOAD_FOLDER_PRIVATE'], 'relatorios'),
+            os.path.join(app.config['UPLOAD_FOLDER_PRIVATE'], 'faturas')
         ]
         for pasta in pastas:
             if not os.path.exists(pasta):
@@ -185,6 +243,9 @@ def create_app(config_name='dev'):
             scheduler.add_job(id='audit_pagamentos', func=processar_monitorizacao_pagamentos,
                               args=[app], trigger='interval', hours=1,
                               misfire_grace_time=misfire_grace_time)
+            scheduler.add_job(id='despachar_outbox', func=despachar_outbox,
+                              args=[app], trigger='interval', minutes=1,
+                              misfire_grace_time=misfire_grace_time)
             scheduler.start()
 
     # 6. HANDLERS DE ERRO
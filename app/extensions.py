@@ -61,7 +61,14 @@ def setup_extensions(app):
             task_track_started=True,
             task_time_limit=300,  # Timeout de 5 minutos para tarefas
             worker_prefetch_multiplier=1,  # Processa uma tarefa por vez (evita memory leaks)
-            broker_transport_options={'visibility_timeout': 3600},  # 1 hora
+            broker_transport_options={
+                'visibility_timeout': 3600,  # 1 hora
+                # Timeouts curtos: publicar uma tarefa com o Redis em baixo falha depressa
+                'socket_connect_timeout': app.config.get('REDIS_CONNECT_TIMEOUT', 0.25),
+                'socket_timeout': app.config.get('REDIS_SOCKET_TIMEOUT', 0.5),
+            },
+            broker_connection_timeout=1,
+            task_publish_retry_policy={'max_retries': 1, 'interval_start': 0, 'interval_step': 0.2},
             broker_connection_retry_on_startup=True,
             worker_send_task_events=True,  # Para monitoramento com Flower
             task_send_sent_event=True,
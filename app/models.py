@@ -3,7 +3,7 @@ import uuid
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal, ROUND_HALF_UP
 
-from sqlalchemy import CheckConstraint, func, Index
+from sqlalchemy import CheckConstraint, func, Index, literal_column, text, UniqueConstraint
 from sqlalchemy.orm import validates, relationship, backref
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
@@ -152,11 +152,14 @@ class Usuario(db.Model, UserMixin):
         return num
 
     def notificacoes_nao_lidas(self):
-        """Retorna a contagem de notificações não lidas para o utilizador."""
-        return self.notificacoes.filter_by(lida=False).count()
+        """Retorna a contagem de notificações não lidas (contador em Redis, COUNT só se faltar)."""
+        from app.services.notificacao_service import contar_nao_lidas
+        return contar_nao_lidas(self.id)
 
     def ultimas_notificacoes(self, limite=5):
-        return self.notificacoes.order_by(Notificacao.data_criacao.desc()).limit(limite).all()
+        """Notificações mais recentes como dicts (as do sininho vêm da cache)."""
+        from app.services.notificacao_service import ultimas
+        return ultimas(self.id, limite)
         
     def __repr__(self):
         return f'<Usuario {self.nome}>'
@@ -207,6 +210,15 @@ class Safra(db.Model):
         CheckConstraint('quantidade_disponivel >= 0', name='ck_stock_pos'),
         CheckConstraint('preco_por_unidade > 0', name='ck_preco_pos'),
         Index('idx_safra_prod_status', 'produto_id', 'status'),  # Otimiza a vitrine
+        Index('idx_safra_status_data', 'status', 'data_criacao', 'id'),  # Paginação por cursor
+        # Pesquisa de texto completo (GIN só existe no PostgreSQL)
+        Index('idx_safra_texto_busca',
+              func.to_tsvector(literal_column("'simple'"), func.coalesce(text('texto_busca'), '')),
+              postgresql_using='gin').ddl_if(dialect='postgresql'),
+        # Vitrine: índice parcial só com as safras à venda, já na ordem de listagem
+        Index('idx_safra_vitrine', 'data_criacao', 'id',
+              postgresql_where=text("status = 'disponivel' AND quantidade_disponivel > 0"),
+              sqlite_where=text("status = 'disponivel' AND quantidade_disponivel > 0")),
     )
     id = db.Column(db.Integer, primary_key=True)
     produtor_id = db.Column(db.Integer, db.ForeignKey('usuarios.id'), nullable=False)
@@ -217,6 +229,8 @@ class Safra(db.Model):
     data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
     imagem = db.Column(db.String(150), default='default_safra.webp')
     observacoes = db.Column(db.Text)
+    # Produto, categoria e produtor normalizados (sem acentos) - mantido pelo search_service
+    texto_busca = db.Column(db.Text)
 
     produtor = db.relationship('Usuario', back_populates='safras')
     produto = db.relationship('Produto', backref='safras_rel')
@@ -250,6 +264,14 @@ class Transacao(db.Model):
     __table_args__ = (
         CheckConstraint('comprador_id != vendedor_id', name='ck_no_self_deal'),
         CheckConstraint('valor_total_pago > 0', name='ck_total_pos'),
+        # Paginação por cursor (data_criacao, id) nas listas de compras/vendas
+        Index('idx_transacao_comprador_data', 'comprador_id', 'data_criacao', 'id'),
+        Index('idx_transacao_vendedor_data', 'vendedor_id', 'data_criacao', 'id'),
+        # Listas dos dashboards filtradas por grupo de status
+        Index('idx_transacao_comprador_status_data', 'comprador_id', 'status', 'data_criacao'),
+        Index('idx_transacao_vendedor_status_data', 'vendedor_id', 'status', 'data_criacao'),
+        # Fila de liquidações do admin (status entregue e transferência por fazer)
+        Index('idx_transacao_status_transferencia', 'status', 'transferencia_concluida'),
     )
     id = db.Column(db.Integer, primary_key=True)
     fatura_ref = db.Column(db.String(50), unique=True, nullable=False, index=True)
@@ -273,6 +295,8 @@ class Transacao(db.Model):
 
     comprovativo_path = db.Column(db.String(255))
     transferencia_concluida = db.Column(db.Boolean, default=False)
+    # Lote de pagamento bancário onde a liquidação foi incluída (reservada até confirmar/cancelar)
+    lote_pagamento_id = db.Column(db.Integer, db.ForeignKey('lotes_pagamento.id', ondelete='SET NULL'), index=True)
 
     comprador = db.relationship('Usuario', foreign_keys=[comprador_id], back_populates='compras')
     vendedor = db.relationship('Usuario', foreign_keys=[vendedor_id], back_populates='vendas')
@@ -311,17 +335,12 @@ class Transacao(db.Model):
                                                                                       rounding=ROUND_HALF_UP)
                                                                                       
     def mudar_status(self, novo_status, observacao=None, usuario=None):
-        """Método seguro para mudar status e registar histórico."""
-        if self.status != novo_status:
-            historico = HistoricoStatus(
-                transacao_id=self.id,
-                status_anterior=self.status,
-                status_novo=novo_status,
-                observacao=observacao
-            )
-            self.status = novo_status
-            return historico
-        return None
+        """
+        Compatibilidade: muda o status e grava o histórico sem validar a transição.
+        Código novo usa MaquinaEstados.transitar (app/services/maquina_estados.py).
+        """
+        from app.services.maquina_estados import MaquinaEstados
+        return MaquinaEstados.transitar(self, novo_status, observacao, validar=False)
 
     def __repr__(self):
         return f'<Transacao {self.fatura_ref}>'
@@ -365,6 +384,11 @@ class Notificacao(db.Model):
     data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
     
     usuario = db.relationship('Usuario', back_populates='notificacoes')
+
+    __table_args__ = (
+        # Contagem de não lidas e "últimas N" do sininho sem ler a tabela
+        Index('idx_notificacao_usuario_lida_data', 'usuario_id', 'lida', 'data_criacao'),
+    )
     
     def to_dict(self):
         return {
@@ -385,6 +409,11 @@ class Mensagem(db.Model):
     conteudo = db.Column(db.Text, nullable=False)
     data_envio = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
     lida = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        # Conversa de uma transação por ordem de envio
+        Index('idx_mensagem_transacao_envio', 'transacao_id', 'data_envio'),
+    )
     
     transacao = db.relationship('Transacao', back_populates='mensagens')
     remetente = db.relationship('Usuario', foreign_keys=[remetente_id])
@@ -423,8 +452,207 @@ class LogAuditoria(db.Model):
 
 
 class AlertaPreferencia(db.Model):
+    """
+    Subscrição de alertas de novas safras: produto obrigatório, província e preço
+    máximo opcionais (None = qualquer). O cruzamento com cada safra publicada é feito
+    em background por um único INSERT ... SELECT (app/services/alerta_service.py).
+    """
     __tablename__ = 'alertas_preferencias'
+    __table_args__ = (
+        # Cobre o cruzamento: igualdade no produto, filtros de província e preço no índice
+        Index('idx_alerta_produto_provincia_preco', 'produto_id', 'provincia_id', 'preco_maximo', 'usuario_id'),
+        Index('idx_alerta_usuario', 'usuario_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'), nullable=False)
     produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id'), nullable=False)
+    provincia_id = db.Column(db.Integer, db.ForeignKey('provincias.id', ondelete='CASCADE'))
+    preco_maximo = db.Column(db.Numeric(12, 2))
+    data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'produto_id': self.produto_id,
+            'provincia_id': self.provincia_id,
+            'preco_maximo': float(self.preco_maximo) if self.preco_maximo is not None else None,
+            'data_criacao': self.data_criacao.isoformat() if self.data_criacao else None,
+        }
+
+
+# --- KPIs MATERIALIZADOS ---
+class ResumoFinanceiro(db.Model):
+    """
+    Totais de transações por utilizador, papel (vendedor/comprador) e status.
+    Mantido no mesmo commit que altera a Transacao (ver app/services/kpi_service.py):
+    os KPIs dos dashboards leem meia dúzia de linhas em vez de agregarem todas as transações.
+    """
+    __tablename__ = 'resumos_financeiros'
+    __table_args__ = (
+        UniqueConstraint('usuario_id', 'papel', 'status', name='uq_resumo_usuario_papel_status'),
+        Index('idx_resumo_papel_status', 'papel', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='CASCADE'), nullable=False)
+    papel = db.Column(db.String(10), nullable=False)  # 'vendedor' | 'comprador'
+    status = db.Column(db.String(30), nullable=False)
+
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    valor_liquido = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    comissao = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    data_atualizacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow, onupdate=aware_utcnow)
+
+    def __repr__(self):
+        return f'<ResumoFinanceiro {self.usuario_id}/{self.papel}/{self.status}>'
+
+
+# --- RELATÓRIOS ASSÍNCRONOS ---
+class RelatorioJob(db.Model):
+    """
+    Pedido de geração de relatório em background (Celery).
+    `chave_ativa` é única enquanto o job está pendente, em execução ou com artefacto válido:
+    pedidos idênticos em simultâneo reutilizam o mesmo job em vez de gerarem outro.
+    """
+    __tablename__ = 'relatorio_jobs'
+    PENDENTE = 'pendente'
+    EM_EXECUCAO = 'em_execucao'
+    CONCLUIDO = 'concluido'
+    FALHOU = 'falhou'
+    EXPIRADO = 'expirado'
+
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'))
+    tipo = db.Column(db.String(30), nullable=False)
+    parametros = db.Column(db.Text, nullable=False, default='{}')  # JSON canónico
+    chave = db.Column(db.String(64), nullable=False, index=True)
+    chave_ativa = db.Column(db.String(64), unique=True)
+
+    estado = db.Column(db.String(20), nullable=False, default=PENDENTE, index=True)
+    progresso = db.Column(db.Integer, nullable=False, default=0)  # 0-100
+    linhas = db.Column(db.Integer)
+    caminho = db.Column(db.String(255))
+    nome_ficheiro = db.Column(db.String(120))
+    erro = db.Column(db.String(255))
+
+    data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
+    data_inicio = db.Column(db.DateTime(timezone=True))
+    data_conclusao = db.Column(db.DateTime(timezone=True))
+    expira_em = db.Column(db.DateTime(timezone=True), index=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'estado': self.estado,
+            'progresso': self.progresso,
+            'linhas': self.linhas,
+            'erro': self.erro,
+            'data_criacao': self.data_criacao.isoformat() if self.data_criacao else None,
+            'data_conclusao': self.data_conclusao.isoformat() if self.data_conclusao else None,
+            'expira_em': self.expira_em.isoformat() if self.expira_em else None,
+        }
+
+    def __repr__(self):
+        return f'<RelatorioJob {self.id} {self.tipo} {self.estado}>'
+
+
+class ChaveIdempotencia(db.Model):
+    """
+    Resposta guardada de um pedido com cabeçalho `Idempotency-Key`.
+    Enquanto o pedido original corre a linha fica EM_CURSO (as repetições recebem 409);
+    depois guarda o status e o corpo, devolvidos tal e qual a quem repetir até `expira_em`.
+    """
+    __tablename__ = 'chaves_idempotencia'
+    EM_CURSO = 'em_curso'
+    CONCLUIDO = 'concluido'
+
+    # sha256(utilizador | endpoint | Idempotency-Key): uma chave nunca colide entre utilizadores
+    chave = db.Column(db.String(64), primary_key=True)
+    usuario_id = db.Column(db.String(36))
+    endpoint = db.Column(db.String(120), nullable=False)
+    impressao = db.Column(db.String(64), nullable=False)  # sha256 do corpo do pedido original
+    estado = db.Column(db.String(20), nullable=False, default=EM_CURSO)
+    status_code = db.Column(db.Integer)
+    corpo = db.Column(db.Text)
+    mimetype = db.Column(db.String(100))
+    data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
+    expira_em = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ChaveIdempotencia {self.endpoint} {self.estado}>'
+
+
+class LotePagamento(db.Model):
+    """
+    Ficheiro de transferências para o banco com as liquidações pendentes (ENTREGUE e
+    ainda não transferidas), somadas por produtor/IBAN. As transações ficam reservadas
+    no lote até o Admin confirmar (passam a FINALIZADO) ou cancelar (voltam à fila).
+    """
+    __tablename__ = 'lotes_pagamento'
+    GERADO = 'gerado'
+    CONFIRMADO = 'confirmado'
+    CANCELADO = 'cancelado'
+
+    id = db.Column(db.Integer, primary_key=True)
+    referencia = db.Column(db.String(35), unique=True, nullable=False,
+                           default=lambda: f"LP-{datetime.now().strftime('%Y%m%d')}-{uuid.uuid4().hex[:8].upper()}")
+    estado = db.Column(db.String(20), nullable=False, default=GERADO, index=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'))
+
+    quantidade_transacoes = db.Column(db.Integer, nullable=False, default=0)
+    quantidade_beneficiarios = db.Column(db.Integer, nullable=False, default=0)
+    valor_total = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+    # Vendas do lote que já não estavam ENTREGUE na confirmação (ex.: disputa): o banco
+    # pagou-as, ficam no lote à espera de reconciliação manual
+    quantidade_divergencias = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
+    data_confirmacao = db.Column(db.DateTime(timezone=True))
+
+    transacoes = db.relationship('Transacao', backref='lote_pagamento', lazy='dynamic')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'referencia': self.referencia,
+            'estado': self.estado,
+            'transacoes': self.quantidade_transacoes,
+            'beneficiarios': self.quantidade_beneficiarios,
+            'valor_total': float(self.valor_total or 0),
+            'divergencias': self.quantidade_divergencias or 0,
+            'data_criacao': self.data_criacao.isoformat() if self.data_criacao else None,
+            'data_confirmacao': self.data_confirmacao.isoformat() if self.data_confirmacao else None,
+        }
+
+    def __repr__(self):
+        return f'<LotePagamento {self.referencia} {self.estado}>'
+
+
+# --- OUTBOX DE EVENTOS ---
+class EventoOutbox(db.Model):
+    """
+    Evento de negócio gravado no mesmo commit que o originou (transactional outbox).
+    As notificações deixam de ser inseridas no pedido: o despachante
+    (app/services/outbox_service.py) lê os eventos em lotes, cria as notificações em
+    massa e entrega-as ao microsserviço de notificações.
+    """
+    __tablename__ = 'eventos_outbox'
+    __table_args__ = (
+        Index('idx_outbox_estado_id', 'estado', 'id'),  # fila: pendentes por ordem de chegada
+    )
+    PENDENTE = 'pendente'
+    PROCESSADO = 'processado'
+    FALHA = 'falha'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    estado = db.Column(db.String(20), nullable=False, default=PENDENTE)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    erro = db.Column(db.String(255))
+    data_criacao = db.Column(db.DateTime(timezone=True), default=aware_utcnow)
+    data_processamento = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f'<EventoOutbox {self.id} {self.tipo} {self.estado}>'
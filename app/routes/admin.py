@@ -1,9 +1,7 @@
 import os
-import pandas as pd
-from io import BytesIO
 from decimal import Decimal
 from datetime import timedelta, datetime, timezone
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, send_file, \
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, \
     send_from_directory, abort
 from flask_login import login_required, current_user
 from sqlalchemy import func, or_, case
@@ -13,6 +11,8 @@ from app.models import (
     Usuario, Transacao, Notificacao, LogAuditoria,
     Safra, Produto, TransactionStatus, db
 )
+from app.services import export_service
+from app.services.maquina_estados import MaquinaEstados
 from app.utils.status_helper import status_to_value
 from functools import wraps
 
@@ -43,7 +43,7 @@ def validar_pagamento(id):
             return redirect(url_for('admin_dashboard.dashboard'))
 
         # 2. Atualização do Status
-        venda.mudar_status(status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
+        MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
 
         # 3. Registo de Auditoria
         db.session.add(LogAuditoria(
@@ -96,10 +96,12 @@ def confirmar_transferencia(id):
         venda = Transacao.query.with_for_update().get_or_404(id)
 
         # Só pode transferir se já foi entregue e ainda não foi finalizado
-        if venda.status == status_to_value(TransactionStatus.ENTREGUE) and not venda.transferencia_concluida:
+        if venda.lote_pagamento_id:
+            flash('Esta venda está num lote de pagamento bancário: confirme ou cancele o lote.', 'warning')
+        elif venda.status == status_to_value(TransactionStatus.ENTREGUE) and not venda.transferencia_concluida:
             # 1. Mudar status para FINALIZADO
             venda.transferencia_concluida = True
-            venda.mudar_status(status_to_value(TransactionStatus.FINALIZADO), "Transferência aprovada pelo Admin")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.FINALIZADO), "Transferência aprovada pelo Admin")
             venda.data_liquidacao = datetime.now(timezone.utc)
             
             # 2. LIBERTAR SALDO AO PRODUTOR (só agora!)
@@ -150,7 +152,7 @@ def resolver_disputa(trans_id):
 
             if decisao == 'libertar':
                 # Paga ao produtor (como se tivesse sido entregue)
-                venda.mudar_status(status_to_value(TransactionStatus.ENTREGUE), "Disputa resolvida a favor do Produtor")
+                MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.ENTREGUE), "Disputa resolvida a favor do Produtor")
                 # Creditar saldo ao produtor para ele poder levantar
                 produtor = venda.vendedor
                 valor_liquido = Decimal(str(venda.valor_liquido_vendedor))
@@ -163,7 +165,7 @@ def resolver_disputa(trans_id):
 
             elif decisao == 'reembolsar':
                 # Devolve ao comprador
-                venda.mudar_status(status_to_value(TransactionStatus.CANCELADO), "Disputa resolvida com Reembolso")
+                MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.CANCELADO), "Disputa resolvida com Reembolso")
                 if venda.safra:
                     venda.safra.quantidade_disponivel += venda.quantidade_comprada
                 
@@ -195,85 +197,19 @@ def resolver_disputa(trans_id):
 @login_required
 @admin_required
 def exportar_financeiro():
-    """Gera um relatório financeiro de nível executivo para instituições."""
-    vendas = Transacao.query.all()
-
-    # 1. Estruturação dos dados com lógica de negócio clara
-    dados_vendas = []
-    for v in vendas:
-        bruto = float(v.valor_total_pago)
-        comissao = float(v.comissao_plataforma or 0)
-        liquido = bruto - comissao
-
-        dados_vendas.append({
-            'ID OPERAÇÃO': f"AGK-{v.id:06d}",
-            'DATA VALOR': v.data_criacao.strftime('%d/%m/%Y'),
-            'REF. FATURA': v.fatura_ref or "S/REF",
-            'PRODUTOR': v.vendedor.nome.upper(),
-            'NIF PRODUTOR': getattr(v.vendedor, 'nif', 'CONSULTAR'),
-            'IBAN DE DESTINO': v.vendedor.iban or 'PENDENTE',
-            'VALOR BRUTO (Kz)': bruto,
-            'TAXA SERVIÇO (Kz)': comissao,
-            'VALOR LÍQUIDO (Kz)': liquido,
-            'STATUS PAGAMENTO': v.status.replace('_', ' ').upper()
-        })
-
-    df = pd.DataFrame(dados_vendas)
-    output = BytesIO()
-
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Dashboard_Financeiro', startrow=5)
-
-        workbook = writer.book
-        worksheet = writer.sheets['Dashboard_Financeiro']
-
-        # --- DICIONÁRIO DE FORMATOS ---
-        header_fmt = workbook.add_format({
-            'bold': True, 'bg_color': '#1B4332', 'font_color': 'white',
-            'border': 1, 'align': 'center', 'valign': 'vcenter', 'font_size': 11
-        })
-
-        money_fmt = workbook.add_format({'num_format': '#,##0.00" Kz"', 'border': 1, 'font_size': 10})
-        date_fmt = workbook.add_format({'num_format': 'dd/mm/yyyy', 'border': 1, 'align': 'center'})
-        text_fmt = workbook.add_format({'border': 1, 'font_size': 10})
-        title_fmt = workbook.add_format({'bold': True, 'font_size': 18, 'font_color': '#1B4332'})
-        label_fmt = workbook.add_format({'bold': True, 'bg_color': '#F8F9FA', 'border': 1})
-
-        # 2. CABEÇALHO CORPORATIVO
-        worksheet.write('A1', 'AGROKONGO - RELATÓRIO DE CONCILIAÇÃO FINANCEIRA', title_fmt)
-        worksheet.write('A2', f'Período: Até {datetime.now().strftime("%d/%m/%Y")}')
-        worksheet.write('A3', 'Finalidade: Instrução de Transferência / Auditoria AGT')
-
-        # 3. SUMÁRIO DE TOTAIS NO TOPO (Acesso Rápido)
-        worksheet.write('F3', 'TOTAL EM CUSTÓDIA', label_fmt)
-        worksheet.write_formula('G3', f'=SUM(G6:G{len(dados_vendas) + 6})', money_fmt)
-
-        worksheet.write('H3', 'LÍQUIDO A PAGAR', label_fmt)
-        worksheet.write_formula('I3', f'=SUM(I6:I{len(dados_vendas) + 6})', money_fmt)
-
-        # 4. FORMATAÇÃO DA TABELA
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(5, col_num, value, header_fmt)
-
-        # Ajuste de larguras para legibilidade
-        worksheet.set_column('A:A', 14, text_fmt)  # ID
-        worksheet.set_column('B:B', 14, date_fmt)  # Data
-        worksheet.set_column('C:C', 16, text_fmt)  # Ref
-        worksheet.set_column('D:D', 30, text_fmt)  # Produtor
-        worksheet.set_column('E:E', 15, text_fmt)  # NIF
-        worksheet.set_column('F:F', 28, text_fmt)  # IBAN
-        worksheet.set_column('G:I', 20, money_fmt)  # Valores
-        worksheet.set_column('J:J', 20, text_fmt)  # Status
-
-        # 5. DESTAQUE VISUAL (Formatação Condicional)
-        worksheet.conditional_format(6, 9, len(dados_vendas) + 6, 9, {
-            'type': 'cell', 'criteria': 'containing', 'value': 'PAGO',
-            'format': workbook.add_format({'bg_color': '#DFF0D8', 'font_color': '#3C763D'})
-        })
-
-    output.seek(0)
-    return send_file(output, as_attachment=True,
-                     download_name=f"AGROKONGO_FINANCEIRO_{datetime.now().strftime('%d_%m_%Y')}.xlsx")
+    """
+    Gera o relatório financeiro de nível executivo para instituições.
+    Filtros opcionais: ?data_inicio=AAAA-MM-DD&data_fim=AAAA-MM-DD&status=...&formato=xlsx|csv
+    """
+    filtros, erro = export_service.validar_filtros(request.args)
+    formato = request.args.get('formato', 'xlsx')
+    if not erro and formato not in export_service.FORMATOS:
+        erro = f"Formato inválido: '{formato}'."
+    if erro:
+        flash(erro, "warning")
+        return redirect(url_for('admin_dashboard.dashboard'))
+
+    return export_service.resposta_download(formato, filtros)
 
 
 # --- UTILITÁRIOS DE SERVIDOR ---
@@ -472,9 +408,13 @@ def detalhes_usuario(user_id):
 @admin_required
 def rejeitar_pagamento(id):
     try:
-        venda = Transacao.query.get_or_404(id)
+        venda = Transacao.query.with_for_update().get_or_404(id)
         motivo = request.form.get('motivo', 'Não especificado')
 
+        if venda.status != status_to_value(TransactionStatus.ANALISE):
+            flash('Esta transação já foi processada ou não está em análise.', 'warning')
+            return redirect(url_for('admin_dashboard.dashboard'))
+
         # REGISTO DE LOG
         db.session.add(LogAuditoria(
             usuario_id=current_user.id,
@@ -483,11 +423,9 @@ def rejeitar_pagamento(id):
             ip=request.remote_addr
         ))
 
-        venda.status = TransactionStatus.PENDENTE # Volta ao início ou a AGUARDANDO_PAGAMENTO?
-        # Normalmente volta a 'AGUARDANDO_PAGAMENTO' se o erro for apenas no comprovativo
-        # Mas 'pendente' força o comprador a recomeçar o upload.
-        # Ajuste para manter consistência:
-        venda.status = TransactionStatus.AGUARDANDO_PAGAMENTO 
+        # Volta a AGUARDANDO_PAGAMENTO: o comprador só precisa de reenviar o comprovativo
+        MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO),
+                                 f"Pagamento rejeitado: {motivo}")
         
         # Apagar comprovativo inválido (opcional, pode manter para prova)
         venda.comprovativo_path = None
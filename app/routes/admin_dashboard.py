@@ -4,13 +4,14 @@ Responsável apenas por métricas e visão geral.
 """
 from flask import Blueprint, render_template
 from flask_login import login_required, current_user
-from sqlalchemy import func, case
+from sqlalchemy import func
 
 from app.extensions import db
 from app.models import (
     Usuario, Transacao, Safra, Produto, 
     TransactionStatus, LogAuditoria
 )
+from app.services.kpi_service import KpiService
 from app.utils.status_helper import status_to_value
 from functools import wraps
 
@@ -32,12 +33,8 @@ def admin_required(f):
 @admin_required
 def dashboard():
     """Painel de Gestão Centralizada e KPIs Financeiros."""
-    # 1. Agregações SQL de Alta Performance
-    financas = db.session.query(
-        func.sum(case((Transacao.status != status_to_value(TransactionStatus.CANCELADO), Transacao.valor_total_pago), else_=0)),
-        func.sum(case((Transacao.status == status_to_value(TransactionStatus.FINALIZADO), Transacao.comissao_plataforma), else_=0)),
-        func.sum(case((Transacao.status == status_to_value(TransactionStatus.ENTREGUE), Transacao.valor_liquido_vendedor), else_=0))
-    ).first()
+    # 1. KPIs Financeiros (resumo materializado, sem varrer as transações)
+    financas = KpiService.kpis_plataforma()
 
     # 2. Filas de Trabalho Prioritárias
     pendentes_validacao = Transacao.query.filter_by(status=status_to_value(TransactionStatus.ANALISE)) \
@@ -54,9 +51,9 @@ def dashboard():
         .group_by(Produto.nome).all()
 
     return render_template('admin/dashboard.html',
-                           total_vendas=financas[0] or 0,
-                           comissao_total=financas[1] or 0,
-                           divida_produtores=financas[2] or 0,
+                           total_vendas=financas['total_vendas'],
+                           comissao_total=financas['comissao_total'],
+                           divida_produtores=financas['divida_produtores'],
                            pendentes=pendentes_validacao,
                            dividas=aguardando_liquidacao,
                            safras_ativas=stock_global,
@@ -3,13 +3,14 @@ Blueprint para gestão de disputas do Admin.
 Responsável por mediação e resolução de conflitos.
 """
 from decimal import Decimal
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 
 from app.extensions import db
 from app.models import Transacao, Notificacao, LogAuditoria, TransactionStatus
 from functools import wraps
 
+from app.services.maquina_estados import MaquinaEstados, TransacaoEmLotePagamento
 from app.utils.status_helper import status_to_value
 
 admin_disputas_bp = Blueprint('admin_disputas', __name__)
@@ -45,7 +46,7 @@ def resolver_disputa(trans_id):
             decisao = request.form.get('decisao')  # 'libertar' ou 'reembolsar'
 
             if decisao == 'libertar':
-                venda.mudar_status(status_to_value(TransactionStatus.ENTREGUE), "Disputa resolvida a favor do Produtor")
+                MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.ENTREGUE), "Disputa resolvida a favor do Produtor")
                 produtor = venda.vendedor
                 valor_liquido = Decimal(str(venda.valor_liquido_vendedor))
                 produtor.saldo_disponivel = (produtor.saldo_disponivel or Decimal('0.00')) + valor_liquido
@@ -56,7 +57,7 @@ def resolver_disputa(trans_id):
                 db.session.add(Notificacao(usuario_id=venda.comprador_id, mensagem="❌ Disputa fechada a favor do vendedor."))
 
             elif decisao == 'reembolsar':
-                venda.mudar_status(status_to_value(TransactionStatus.CANCELADO), "Disputa resolvida com Reembolso")
+                MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.CANCELADO), "Disputa resolvida com Reembolso")
                 if venda.safra:
                     venda.safra.quantidade_disponivel += venda.quantidade_comprada
                 
@@ -92,7 +93,7 @@ def abrir_disputa_admin(trans_id):
         venda = Transacao.query.with_for_update().get_or_404(trans_id)
         
         if venda.status not in [status_to_value(TransactionStatus.CANCELADO), status_to_value(TransactionStatus.FINALIZADO)]:
-            venda.mudar_status(status_to_value(TransactionStatus.DISPUTA), "Disputa aberta pelo Admin")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.DISPUTA), "Disputa aberta pelo Admin")
             
             db.session.add(LogAuditoria(
                 usuario_id=current_user.id,
@@ -118,6 +119,9 @@ def abrir_disputa_admin(trans_id):
         else:
              flash("Não é possível abrir disputa para uma transação finalizada ou cancelada.", "danger")
              
+    except TransacaoEmLotePagamento as e:
+        db.session.rollback()
+        flash(str(e), "warning")
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Erro ao abrir disputa: {e}")
@@ -12,6 +12,7 @@ from app.extensions import db
 from app.models import Transacao, Notificacao, LogAuditoria, TransactionStatus
 from functools import wraps
 
+from app.services.maquina_estados import MaquinaEstados
 from app.utils.status_helper import status_to_value
 
 admin_pagamentos_bp = Blueprint('admin_pagamentos', __name__)
@@ -38,7 +39,7 @@ def validar_pagamento(id):
             flash('Esta transação já foi processada ou não está em análise.', 'warning')
             return redirect(url_for('admin_dashboard.dashboard'))
 
-        venda.mudar_status(status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
+        MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
 
         db.session.add(LogAuditoria(
             usuario_id=current_user.id,
@@ -87,9 +88,11 @@ def confirmar_transferencia(id):
     try:
         venda = Transacao.query.with_for_update().get_or_404(id)
 
-        if venda.status == status_to_value(TransactionStatus.ENTREGUE) and not venda.transferencia_concluida:
+        if venda.lote_pagamento_id:
+            flash('Esta venda está num lote de pagamento bancário: confirme ou cancele o lote.', 'warning')
+        elif venda.status == status_to_value(TransactionStatus.ENTREGUE) and not venda.transferencia_concluida:
             venda.transferencia_concluida = True
-            venda.status = status_to_value(TransactionStatus.FINALIZADO)
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.FINALIZADO), "Liquidado ao produtor")
             venda.data_liquidacao = datetime.now(timezone.utc)
             
             db.session.add(LogAuditoria(
@@ -123,9 +126,13 @@ def confirmar_transferencia(id):
 @admin_required
 def rejeitar_pagamento(id):
     try:
-        venda = Transacao.query.get_or_404(id)
+        venda = Transacao.query.with_for_update().get_or_404(id)
         motivo = request.form.get('motivo', 'Não especificado')
 
+        if venda.status != status_to_value(TransactionStatus.ANALISE):
+            flash('Esta transação já foi processada ou não está em análise.', 'warning')
+            return redirect(url_for('admin_dashboard.dashboard'))
+
         db.session.add(LogAuditoria(
             usuario_id=current_user.id,
             acao="REJEICAO_PAGAMENTO",
@@ -133,7 +140,8 @@ def rejeitar_pagamento(id):
             ip=request.remote_addr
         ))
 
-        venda.status = status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO)
+        MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO),
+                                 f"Pagamento rejeitado: {motivo}")
         venda.comprovativo_path = None
 
         db.session.add(Notificacao(
@@ -2,18 +2,29 @@
 Blueprint de API REST para o marketplace AgroKongo.
 Endpoints para frontend (Next.js), mobile e SPA.
 """
-from flask import Blueprint, jsonify, request, abort, url_for, current_app
+from flask import Blueprint, jsonify, request, abort, url_for, current_app, send_file
 from flask_login import login_required, current_user
-from sqlalchemy.orm import joinedload
-from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload, selectinload
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, timezone
 
 from app.extensions import db, csrf # Importar CSRF
-from app.models import Safra, Produto, Usuario, Provincia, Transacao, TransactionStatus, Notificacao, LogAuditoria
+from app.models import Safra, Produto, Usuario, Provincia, Transacao, TransactionStatus, Notificacao, LogAuditoria, RelatorioJob, LotePagamento
+from app.services.maquina_estados import MaquinaEstados
 from app.utils.status_helper import status_to_value, get_status_description
 from app.services.cache_service import cache_service
+from app.services import instrumentacao_sql, outbox_service, search_service
+from app.services.alerta_service import AlertaService
+from app.services.kpi_service import KpiService
+from app.services.relatorio_service import RelatorioService
+from app.services.compra_service import CompraService
+from app.services.pagamento_service import PagamentoService, LOTE_OK, MSG_ERRO_LOTE
+from app.services.lote_pagamento_service import (
+    LotePagamentoService, FORMATOS as FORMATOS_LOTE, MSG_ERRO_TECNICO as MSG_ERRO_TECNICO_LOTE,
+    MSG_LOTE_NAO_ENCONTRADO, MSG_VENDA_FORA_DO_LOTE)
 from app.utils.helpers import salvar_ficheiro
+from app.utils.pagination import paginar_por_cursor
+from app.utils.decorators import idempotente
 
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
@@ -45,18 +56,46 @@ def api_success(data, message='Sucesso'):
 def listar_produtos():
     """Lista todos os produtos disponíveis."""
     try:
-        produtos = Produto.query.order_by(Produto.nome).all()
-        data = [{
-            'id': p.id,
-            'nome': p.nome,
-            'categoria': p.categoria
-        } for p in produtos]
+        def carregar_produtos():
+            return [{
+                'id': p.id,
+                'nome': p.nome,
+                'categoria': p.categoria
+            } for p in Produto.query.order_by(Produto.nome).all()]
         
-        return api_success(data)
+        return api_success(cache_service.obter_produtos(carregar_produtos))
     except Exception as e:
         return api_error(str(e), 500)
 
 
+# Ordenações suportadas pela vitrine (o id desempata para uma paginação estável)
+ORDENACOES_VITRINE = {
+    'recentes': (Safra.data_criacao.desc(), Safra.id.desc()),
+    'preco_asc': (Safra.preco_por_unidade.asc(), Safra.id.desc()),
+    'preco_desc': (Safra.preco_por_unidade.desc(), Safra.id.desc()),
+}
+
+
+def _serializar_safra_vitrine(safra):
+    """Representação de uma safra nas listagens da vitrine."""
+    return {
+        'id': safra.id,
+        'produto': safra.produto.nome,
+        'categoria': safra.produto.categoria,
+        'quantidade': float(safra.quantidade_disponivel),
+        'preco_unitario': float(safra.preco_por_unidade),
+        'preco_total': float(safra.quantidade_disponivel * safra.preco_por_unidade),
+        'produtor': {
+            'id': safra.produtor.id,
+            'nome': safra.produtor.nome,
+            'provincia': safra.produtor.provincia.nome if safra.produtor.provincia else None,
+            'rating': float(safra.produtor.rating_vendedor) if safra.produtor.rating_vendedor else 0
+        },
+        'imagem': f'/uploads/safras/{safra.imagem}' if safra.imagem else None,
+        'observacoes': safra.observacoes
+    }
+
+
 @api_bp.route('/safras', methods=['GET'])
 def listar_safras():
     """
@@ -67,20 +106,22 @@ def listar_safras():
     - categoria: ID da categoria
     - q: Termo de busca
     - page: Número da página (default: 1)
-    - per_page: Itens por página (default: 12)
+    - per_page: Itens por página (default: 12, máx: 100)
+    - sort: recentes | preco_asc | preco_desc (default: recentes; relevância se houver `q`)
+    - cursor: Ativa a paginação por cursor (vazio = primeira página); ignora `page` e `sort`
+    - total: none | approx | exact (só no modo cursor, default: none)
     """
     try:
         prov_id = request.args.get('provincia', type=int)
         cat_id = request.args.get('categoria', type=int)
         termo = request.args.get('q', '').strip()
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 12, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 12, type=int), 1), 100)
+        sort = request.args.get('sort', 'recentes')
+        modo_cursor = 'cursor' in request.args
         
-        # TENTAR CACHE PRIMEIRO (apenas se não houver termo de busca)
-        if not termo:
-            cache_key_data = cache_service.get_safras_disponiveis(prov_id, cat_id)
-            if cache_key_data:
-                return api_success(cache_key_data)
+        if sort not in ORDENACOES_VITRINE:
+            return api_error(f"Ordenação inválida: {sort}", 400)
         
         query = Safra.query.options(
             joinedload(Safra.produto),
@@ -95,50 +136,43 @@ def listar_safras():
         if cat_id:
             query = query.filter(Safra.produto_id == cat_id)
         if termo:
-            from sqlalchemy import or_
-            query = query.join(Produto).filter(
-                or_(
-                    Produto.nome.ilike(f'%{termo}%'),
-                    Usuario.nome.ilike(f'%{termo}%')
+            # Texto completo (GIN no PostgreSQL); por relevância só no modo página
+            ordenar_relevancia = not modo_cursor and sort == 'recentes'
+            query = search_service.filtrar_safras(query, termo, ordenar=ordenar_relevancia)
+        
+        if modo_cursor:
+            try:
+                pagination = paginar_por_cursor(
+                    query, Safra,
+                    cursor=request.args.get('cursor'),
+                    per_page=per_page,
+                    total=request.args.get('total', 'none')
                 )
-            )
-        
-        pagination = query.order_by(Safra.data_criacao.desc())\
-            .paginate(page=page, per_page=per_page, error_out=False)
-        
-        safras = []
-        for safra in pagination.items:
-            safras.append({
-                'id': safra.id,
-                'produto': safra.produto.nome,
-                'categoria': safra.produto.categoria,
-                'quantidade': float(safra.quantidade_disponivel),
-                'preco_unitario': float(safra.preco_por_unidade),
-                'preco_total': float(safra.quantidade_disponivel * safra.preco_por_unidade),
-                'produtor': {
-                    'id': safra.produtor.id,
-                    'nome': safra.produtor.nome,
-                    'provincia': safra.produtor.provincia.nome if safra.produtor.provincia else None,
-                    'rating': float(safra.produtor.rating_vendedor) if safra.produtor.rating_vendedor else 0
-                },
-                'imagem': f'/uploads/safras/{safra.imagem}' if safra.imagem else None,
-                'observacoes': safra.observacoes
+            except ValueError as e:
+                return api_error(str(e), 400)
+            return api_success({
+                'safras': [_serializar_safra_vitrine(s) for s in pagination.items],
+                'pagination': pagination.meta()
             })
         
-        response_data = {
-            'safras': safras,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
+        def montar_pagina():
+            pagination = query.order_by(*ORDENACOES_VITRINE[sort])\
+                .paginate(page=page, per_page=per_page, error_out=False)
+            return {
+                'safras': [_serializar_safra_vitrine(s) for s in pagination.items],
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': pagination.total,
+                    'pages': pagination.pages
+                }
             }
-        }
-        
-        # SALVAR NO CACHE (apenas se não houver termo de busca)
-        if not termo:
-            cache_service.cache_safras_disponiveis(response_data, prov_id, cat_id)
         
+        # Cache por filtros + página + ordenação + termo; só um worker recalcula cada chave
+        response_data = cache_service.obter_vitrine(
+            montar_pagina, prov_id, cat_id,
+            page=page, per_page=per_page, sort=sort, termo=termo or None
+        )
         return api_success(response_data)
         
     except Exception as e:
@@ -193,14 +227,15 @@ def detalhar_safra(id):
 def listar_provincias():
     """Lista todas as províncias de Angola."""
     try:
-        provincias = Provincia.query.all()
-        data = [{
-            'id': p.id,
-            'nome': p.nome,
-            'municipios': [{'id': m.id, 'nome': m.nome} for m in p.municipios]
-        } for p in provincias]
+        def carregar_provincias():
+            provincias = Provincia.query.options(selectinload(Provincia.municipios)).all()
+            return [{
+                'id': p.id,
+                'nome': p.nome,
+                'municipios': [{'id': m.id, 'nome': m.nome} for m in p.municipios]
+            } for p in provincias]
         
-        return api_success(data)
+        return api_success(cache_service.obter_geografia(carregar_provincias, 'provincias:api'))
     except Exception as e:
         return api_error(str(e), 500)
 
@@ -236,22 +271,8 @@ def dashboard_comprador():
         return api_error('Acesso não autorizado', 403)
         
     try:
-        # KPIs
-        total_gasto = db.session.query(func.sum(Transacao.valor_total_pago)).filter(
-            Transacao.comprador_id == current_user.id,
-            Transacao.status.in_([
-                status_to_value(TransactionStatus.ESCROW),
-                status_to_value(TransactionStatus.ENVIADO),
-                status_to_value(TransactionStatus.ENTREGUE),
-                status_to_value(TransactionStatus.FINALIZADO)
-            ])
-        ).scalar() or 0
-        
-        compras_ativas_count = Transacao.query.filter(
-            Transacao.comprador_id == current_user.id,
-            Transacao.status != status_to_value(TransactionStatus.FINALIZADO),
-            Transacao.status != status_to_value(TransactionStatus.CANCELADO)
-        ).count()
+        # KPIs (resumo materializado)
+        kpis = KpiService.kpis_comprador(current_user.id)
         
         # Últimas Compras (Lista simplificada para o dashboard)
         ultimas_compras = Transacao.query.filter_by(comprador_id=current_user.id)\
@@ -270,8 +291,8 @@ def dashboard_comprador():
             
         return api_success({
             'kpis': {
-                'total_gasto': float(total_gasto),
-                'compras_ativas': compras_ativas_count
+                'total_gasto': float(kpis['total_gasto']),
+                'compras_ativas': kpis['compras_ativas']
             },
             'ultimas_compras': compras_data
         })
@@ -289,17 +310,8 @@ def dashboard_produtor():
         return api_error('Acesso não autorizado', 403)
         
     try:
-        # 1. KPIs Financeiros
-        stats = db.session.query(
-            # Receita Total: Transações FINALIZADAS
-            func.sum(case((Transacao.status == status_to_value(TransactionStatus.FINALIZADO), Transacao.valor_liquido_vendedor), else_=0)),
-            # Valor em Custódia: ESCROW + ENVIADO
-            func.sum(case((Transacao.status.in_([status_to_value(TransactionStatus.ESCROW), 
-                                                status_to_value(TransactionStatus.ENVIADO)]),
-                        Transacao.valor_liquido_vendedor), else_=0)),
-            # A Liquidar: ENTREGUE
-            func.sum(case((Transacao.status == status_to_value(TransactionStatus.ENTREGUE), Transacao.valor_liquido_vendedor), else_=0))
-        ).filter(Transacao.vendedor_id == current_user.id).first()
+        # 1. KPIs Financeiros (resumo materializado)
+        kpis = KpiService.kpis_produtor(current_user.id)
         
         # 2. Últimas Vendas
         ultimas_vendas = Transacao.query.filter_by(vendedor_id=current_user.id)\
@@ -319,9 +331,9 @@ def dashboard_produtor():
             
         return api_success({
             'kpis': {
-                'receita_total': float(stats[0] or 0),
-                'em_custodia': float(stats[1] or 0),
-                'a_liquidar': float(stats[2] or 0),
+                'receita_total': float(kpis['receita_total']),
+                'em_custodia': float(kpis['em_custodia']),
+                'a_liquidar': float(kpis['a_liquidar']),
                 'saldo_disponivel': float(current_user.saldo_disponivel or 0)
             },
             'ultimas_vendas': vendas_data
@@ -343,13 +355,9 @@ def dashboard_admin():
         # KPIs Globais
         total_users = Usuario.query.count()
         
-        volume_vendas = db.session.query(func.sum(Transacao.valor_total_pago)).filter(
-            Transacao.status == status_to_value(TransactionStatus.FINALIZADO)
-        ).scalar() or 0
-        
-        comissoes = db.session.query(func.sum(Transacao.comissao_plataforma)).filter(
-            Transacao.status == status_to_value(TransactionStatus.FINALIZADO)
-        ).scalar() or 0
+        kpis = KpiService.kpis_plataforma()
+        volume_vendas = kpis['volume_finalizado']
+        comissoes = kpis['comissao_total']
         
         transacoes_pendentes = Transacao.query.filter(
             Transacao.status.in_([
@@ -450,6 +458,7 @@ def admin_validar_usuario(id):
 # --- TRANSAÇÕES (COMPRAR) ---
 @api_bp.route('/comprar', methods=['POST'])
 @login_required
+@idempotente()
 def criar_pedido():
     """Cria uma reserva de compra (transação PENDENTE)."""
     if current_user.tipo != 'comprador':
@@ -460,63 +469,16 @@ def criar_pedido():
         if not data:
             return api_error('Dados inválidos', 400)
             
-        safra_id = data.get('safra_id')
-        quantidade = Decimal(str(data.get('quantidade', 0)))
-        
-        if quantidade <= 0:
-            return api_error('Quantidade inválida', 400)
-            
-        # Lock da Safra (Para evitar condições de corrida)
-        safra = Safra.query.with_for_update().get(safra_id)
-        
-        if not safra:
-            return api_error('Safra não encontrada', 404)
-            
-        if safra.produtor_id == current_user.id:
-            return api_error('Não pode comprar os seus próprios produtos', 400)
-            
-        if safra.status != 'disponivel' or safra.quantidade_disponivel < quantidade:
-            return api_error('Stock insuficiente ou safra indisponível', 400)
-            
-        # Criar Transação
-        valor_total = (safra.preco_por_unidade * quantidade)
-        
-        nova_transacao = Transacao(
-            safra_id=safra.id,
-            comprador_id=current_user.id,
-            vendedor_id=safra.produtor_id,
-            quantidade_comprada=quantidade,
-            valor_total_pago=valor_total,
-            status=status_to_value(TransactionStatus.PENDENTE)
-        )
-        
-        # Abater Stock Temporariamente (Reserva)
-        safra.quantidade_disponivel -= quantidade
-        
-        db.session.add(nova_transacao)
-        db.session.flush() # Gera o ID e Fatura Ref
-        
-        # Notificar Produtor
-        db.session.add(Notificacao(
-            usuario_id=safra.produtor_id,
-            mensagem=f"📦 Novo pedido de {quantidade}kg na safra de {safra.produto.nome}!",
-            link=url_for('produtor.vendas') # ou endpoint da API
-        ))
-        
-        # Log
-        db.session.add(LogAuditoria(
-            usuario_id=current_user.id,
-            acao="CRIAR_PEDIDO",
-            detalhes=f"Ref: {nova_transacao.fatura_ref} | Qtd: {quantidade}",
-            ip=request.remote_addr
-        ))
-        
-        db.session.commit()
+        sucesso, nova_transacao, mensagem = CompraService.iniciar_compra(
+            data.get('safra_id'), current_user.id, data.get('quantidade', 0),
+            ip=request.remote_addr, origem="CRIAR_PEDIDO")
+        if not sucesso:
+            return api_error(mensagem, CompraService.codigo_http(mensagem))
         
         return api_success({
             'transacao_id': nova_transacao.id,
             'ref': nova_transacao.fatura_ref,
-            'valor_total': float(valor_total)
+            'valor_total': float(nova_transacao.valor_total_pago)
         }, message='Pedido criado com sucesso!')
         
     except Exception as e:
@@ -524,6 +486,41 @@ def criar_pedido():
         return api_error(f"Erro ao processar pedido: {str(e)}", 500)
 
 
+# --- ALERTAS DE NOVAS SAFRAS ---
+
+@api_bp.route('/alertas', methods=['GET', 'POST'])
+@login_required
+def alertas():
+    """
+    GET: alertas do utilizador.
+    POST: { "produto_id": 1, "provincia_id": 2 (opcional), "preco_maximo": 350 (opcional) }
+    """
+    if request.method == 'GET':
+        return api_success([a.to_dict() for a in AlertaService.listar(current_user.id)])
+
+    data = request.get_json(silent=True) or {}
+    try:
+        produto_id = int(data['produto_id'])
+        provincia_id = int(data['provincia_id']) if data.get('provincia_id') is not None else None
+    except (KeyError, TypeError, ValueError):
+        return api_error('produto_id é obrigatório e provincia_id deve ser numérico', 400)
+
+    sucesso, alerta, mensagem = AlertaService.subscrever(current_user.id, produto_id, provincia_id,
+                                                         data.get('preco_maximo'))
+    if not sucesso:
+        return api_error(mensagem, 400)
+    return api_success(alerta.to_dict(), message=mensagem), 201
+
+
+@api_bp.route('/alertas/<int:id>', methods=['DELETE'])
+@login_required
+def remover_alerta(id):
+    sucesso, mensagem = AlertaService.remover(current_user.id, id)
+    if not sucesso:
+        return api_error(mensagem, 404)
+    return api_success(None, message=mensagem)
+
+
 # --- FLUXO DO PRODUTOR (PUBLICAR E GERIR) ---
 
 @api_bp.route('/produtor/nova-safra', methods=['POST'])
@@ -581,6 +578,12 @@ def api_nova_safra():
         db.session.add(nova_s)
         db.session.flush()
 
+        # Alertas dos compradores interessados: cruzados em background pela outbox
+        outbox_service.publicar(outbox_service.SAFRA_PUBLICADA, {
+            'safra_id': nova_s.id,
+            'link': url_for('mercado.detalhes_safra', id=nova_s.id),
+        })
+
         # Log
         db.session.add(LogAuditoria(
             usuario_id=current_user.id,
@@ -632,7 +635,7 @@ def api_mudar_status_transacao(id):
             if transacao.status != status_to_value(TransactionStatus.PENDENTE):
                 return api_error('Só pode aceitar reservas pendentes', 400)
                 
-            transacao.mudar_status(status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), "Aceite pelo produtor")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), "Aceite pelo produtor")
             mensagem = "Pedido aceite! O comprador foi notificado para pagar."
             
             # Notificar Comprador
@@ -650,7 +653,7 @@ def api_mudar_status_transacao(id):
             if transacao.safra:
                 transacao.safra.quantidade_disponivel += transacao.quantidade_comprada
                 
-            transacao.mudar_status(status_to_value(TransactionStatus.CANCELADO), "Recusada pelo produtor")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.CANCELADO), "Recusada pelo produtor")
             mensagem = "Reserva recusada e stock reposto."
             
             # Notificar Comprador
@@ -664,7 +667,7 @@ def api_mudar_status_transacao(id):
             if transacao.status != status_to_value(TransactionStatus.ESCROW):
                 return api_error('O pagamento deve ser confirmado antes do envio (Status: Escrow)', 400)
                 
-            transacao.mudar_status(status_to_value(TransactionStatus.ENVIADO), "Mercadoria enviada")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.ENVIADO), "Mercadoria enviada")
             transacao.data_envio = datetime.now(timezone.utc)
             if hasattr(transacao, 'calcular_janela_logistica'):
                 transacao.calcular_janela_logistica()
@@ -699,6 +702,28 @@ def api_mudar_status_transacao(id):
 
 # --- FLUXO DO ADMIN (FINANCEIRO) ---
 
+@api_bp.route('/admin/cache', methods=['GET'])
+@login_required
+def admin_cache_stats():
+    """Acertos/falhas por nível de cache (L1 em processo e Redis) deste worker."""
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+    return api_success(cache_service.estatisticas())
+
+
+@api_bp.route('/admin/sql', methods=['GET'])
+@login_required
+def admin_sql_stats():
+    """Piores endpoints deste worker por instruções SQL, tempo de BD ou pedidos com N+1."""
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+    ordem = request.args.get('ordem', 'instrucoes')
+    if ordem not in instrumentacao_sql.ORDENACOES:
+        return api_error(f"ordem deve ser uma de: {', '.join(instrumentacao_sql.ORDENACOES)}", 400)
+    limite = min(request.args.get('limite', 20, type=int), 100)
+    return api_success(instrumentacao_sql.agregado.piores(ordem, limite))
+
+
 @api_bp.route('/admin/tarefas', methods=['GET'])
 @login_required
 def admin_tarefas():
@@ -709,7 +734,8 @@ def admin_tarefas():
     try:
         # 1. Pagamentos para Validar (Comprovativos enviados)
         # Status: ANALISE
-        validacoes = Transacao.query.filter_by(status=status_to_value(TransactionStatus.ANALISE)).all()
+        validacoes = Transacao.query.options(joinedload(Transacao.comprador)) \
+            .filter_by(status=status_to_value(TransactionStatus.ANALISE)).all()
         lista_validacoes = [{
             'id': t.id,
             'ref': t.fatura_ref,
@@ -720,10 +746,11 @@ def admin_tarefas():
         } for t in validacoes]
 
         # 2. Liquidações Pendentes (Entregas confirmadas, dinheiro por transferir ao produtor)
-        # Status: ENTREGUE, e transferencia_concluida = False
-        liquidacoes = Transacao.query.filter_by(
+        # Status: ENTREGUE, e transferencia_concluida = False (as já incluídas num lote de pagamento ficam de fora)
+        liquidacoes = Transacao.query.options(joinedload(Transacao.vendedor)).filter_by(
             status=status_to_value(TransactionStatus.ENTREGUE),
-            transferencia_concluida=False
+            transferencia_concluida=False,
+            lote_pagamento_id=None
         ).all()
         
         lista_liquidacoes = [{
@@ -751,6 +778,7 @@ def admin_tarefas():
 
 @api_bp.route('/admin/transacoes/<int:id>/processar', methods=['POST'])
 @login_required
+@idempotente()
 def admin_processar_transacao(id):
     """
     Endpoint centralizado para decisões do Admin:
@@ -773,7 +801,7 @@ def admin_processar_transacao(id):
             if transacao.status != status_to_value(TransactionStatus.ANALISE):
                 return api_error('Transação não está em análise', 400)
             
-            transacao.mudar_status(status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
             msg_sucesso = "Pagamento validado! O produtor pode enviar a mercadoria."
             
             # Notificar Produtor
@@ -784,8 +812,11 @@ def admin_processar_transacao(id):
             ))
 
         elif acao == 'rejeitar':
+            if transacao.status != status_to_value(TransactionStatus.ANALISE):
+                return api_error('Transação não está em análise', 400)
+
             # Se rejeitar, volta para AGUARDANDO_PAGAMENTO para o comprador tentar de novo
-            transacao.mudar_status(status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), f"Rejeitado: {motivo}")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), f"Rejeitado: {motivo}")
             transacao.comprovativo_path = None # Limpa para novo upload
             msg_sucesso = "Comprovativo rejeitado. O comprador foi notificado."
 
@@ -799,9 +830,11 @@ def admin_processar_transacao(id):
         elif acao == 'liquidar':
             if transacao.status != status_to_value(TransactionStatus.ENTREGUE):
                 return api_error('A encomenda deve estar entregue para ser liquidada', 400)
+            if transacao.lote_pagamento_id:
+                return api_error('A transação está num lote de pagamento bancário', 409)
             
             transacao.transferencia_concluida = True
-            transacao.mudar_status(status_to_value(TransactionStatus.FINALIZADO), "Liquidado ao produtor")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.FINALIZADO), "Liquidado ao produtor")
             transacao.data_liquidacao = datetime.now(timezone.utc)
             msg_sucesso = "Liquidação registada com sucesso! O ciclo fechou."
 
@@ -831,6 +864,178 @@ def admin_processar_transacao(id):
         return api_error(f"Erro no processamento: {str(e)}", 500)
 
 
+@api_bp.route('/admin/transacoes/lote', methods=['POST'])
+@login_required
+@idempotente()
+def admin_processar_lote():
+    """
+    Processamento em lote das filas do Admin (fecho do dia):
+    - VALIDAR (Analise -> Escrow) ou LIQUIDAR (Entregue -> Finalizado)
+    Body: { "acao": "validar" | "liquidar", "ids": [1, 2, ...] }
+    Devolve o resultado de cada id: ok, nao_encontrada, estado_invalido ou em_processamento.
+    """
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list):
+        return api_error('Indique a lista de ids', 400)
+
+    sucesso, resultados, mensagem = PagamentoService.processar_lote(
+        data.get('acao'), ids, current_user.id, ip=request.remote_addr)
+    if not sucesso:
+        return api_error(mensagem, 500 if mensagem == MSG_ERRO_LOTE else 400)
+
+    return api_success({
+        'resultados': {str(i): r for i, r in resultados.items()},
+        'processadas': sum(1 for r in resultados.values() if r == LOTE_OK),
+    }, message=mensagem)
+
+
+# --- LOTES DE PAGAMENTO BANCÁRIO ---
+
+@api_bp.route('/admin/lotes-pagamento', methods=['GET', 'POST'])
+@login_required
+def admin_lotes_pagamento():
+    """
+    GET: últimos lotes de pagamento.
+    POST: gera um lote com as liquidações pendentes. Body opcional: { "limite": 1000 }
+    """
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+
+    if request.method == 'GET':
+        lotes = LotePagamento.query.order_by(LotePagamento.id.desc()).limit(20).all()
+        return api_success([l.to_dict() for l in lotes])
+
+    data = request.get_json(silent=True) or {}
+    limite = data.get('limite')
+    if limite is not None and (not isinstance(limite, int) or limite <= 0):
+        return api_error('Limite inválido', 400)
+
+    sucesso, lote, mensagem = LotePagamentoService.criar_lote(current_user.id, limite)
+    if not sucesso:
+        return api_error(mensagem, 500 if mensagem == MSG_ERRO_TECNICO_LOTE else 400)
+    return api_success(lote.to_dict(), message=mensagem), 201
+
+
+@api_bp.route('/admin/lotes-pagamento/<int:id>/ficheiro', methods=['GET'])
+@login_required
+def admin_ficheiro_lote(id):
+    """Ficheiro para importar no banco: ?formato=csv (padrão) ou xml (ISO 20022 pain.001)."""
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+
+    formato = request.args.get('formato', 'csv')
+    if formato not in FORMATOS_LOTE:
+        return api_error(f"Formato inválido. Use: {', '.join(FORMATOS_LOTE)}", 400)
+    lote = db.session.get(LotePagamento, id)
+    if not lote:
+        return api_error('Lote de pagamento não encontrado', 404)
+    return LotePagamentoService.resposta_download(lote, formato)
+
+
+@api_bp.route('/admin/lotes-pagamento/<int:id>/<acao>', methods=['POST'])
+@login_required
+@idempotente()
+def admin_fechar_lote(id, acao):
+    """CONFIRMAR (o banco executou o ficheiro: liquida tudo) ou CANCELAR (volta à fila)."""
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+
+    if acao == 'confirmar':
+        sucesso, resultados, mensagem = LotePagamentoService.confirmar_lote(id, current_user.id, request.remote_addr)
+        dados = {'resultados': {str(i): r for i, r in resultados.items()}}
+    elif acao == 'cancelar':
+        sucesso, mensagem = LotePagamentoService.cancelar_lote(id, current_user.id, request.remote_addr)
+        dados = {}
+    else:
+        return api_error('Ação desconhecida', 404)
+
+    if not sucesso:
+        if mensagem == MSG_LOTE_NAO_ENCONTRADO:
+            return api_error(mensagem, 404)
+        return api_error(mensagem, 500 if mensagem == MSG_ERRO_TECNICO_LOTE else 409)
+    return api_success(dados, message=mensagem)
+
+
+@api_bp.route('/admin/lotes-pagamento/<int:id>/divergencias', methods=['GET'])
+@login_required
+def admin_divergencias_lote(id):
+    """Vendas pagas pelo banco que mudaram de estado antes da confirmação do lote."""
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+    if not db.session.get(LotePagamento, id):
+        return api_error(MSG_LOTE_NAO_ENCONTRADO, 404)
+    return api_success(LotePagamentoService.divergencias(id))
+
+
+@api_bp.route('/admin/lotes-pagamento/<int:id>/reconciliar/<int:transacao_id>', methods=['POST'])
+@login_required
+@idempotente()
+def admin_reconciliar_venda_lote(id, transacao_id):
+    """Fecha uma divergência do lote depois de o Admin resolver o caso."""
+    if current_user.tipo != 'admin':
+        return api_error('Acesso restrito', 403)
+
+    sucesso, mensagem = LotePagamentoService.reconciliar_venda(id, transacao_id, current_user.id,
+                                                               request.remote_addr)
+    if not sucesso:
+        if mensagem in (MSG_LOTE_NAO_ENCONTRADO, MSG_VENDA_FORA_DO_LOTE):
+            return api_error(mensagem, 404)
+        return api_error(mensagem, 500 if mensagem == MSG_ERRO_TECNICO_LOTE else 409)
+    return api_success({}, message=mensagem)
+
+
+# --- RELATÓRIOS ASSÍNCRONOS ---
+def _job_com_links(job):
+    dados = job.to_dict()
+    dados['links'] = {'estado': url_for('api.estado_relatorio', job_id=job.id)}
+    if job.estado == RelatorioJob.CONCLUIDO:
+        dados['links']['download'] = url_for('api.descarregar_relatorio', job_id=job.id)
+    return dados
+
+
+@api_bp.route('/relatorios', methods=['POST'])
+@login_required
+def pedir_relatorio():
+    """
+    Pede a geração de um relatório em background.
+    Payload: { tipo: 'financeiro' | 'fatura', parametros: {...} }
+    """
+    data = request.get_json(silent=True) or {}
+    sucesso, job, mensagem = RelatorioService.submeter(data.get('tipo'), data.get('parametros') or {}, current_user)
+    if not sucesso:
+        return api_error(mensagem, 400)
+    return api_success(_job_com_links(job), message=mensagem), 202
+
+
+@api_bp.route('/relatorios/<job_id>', methods=['GET'])
+@login_required
+def estado_relatorio(job_id):
+    """Estado e progresso (0-100) de um relatório pedido."""
+    job = db.session.get(RelatorioJob, job_id)
+    if not job or not RelatorioService.pode_aceder(job, current_user):
+        return api_error('Relatório não encontrado', 404)
+    return api_success(_job_com_links(job))
+
+
+@api_bp.route('/relatorios/<job_id>/download', methods=['GET'])
+@login_required
+def descarregar_relatorio(job_id):
+    """Download do artefacto gerado (disponível até `expira_em`)."""
+    job = db.session.get(RelatorioJob, job_id)
+    if not job or not RelatorioService.pode_aceder(job, current_user):
+        return api_error('Relatório não encontrado', 404)
+    caminho = RelatorioService.caminho_artefacto(job)
+    if not caminho:
+        if job.estado in (RelatorioJob.PENDENTE, RelatorioJob.EM_EXECUCAO):
+            return api_error('Relatório ainda em preparação', 409)
+        return api_error('Relatório indisponível ou expirado', 410)
+    return send_file(caminho, as_attachment=True, download_name=job.nome_ficheiro)
+
+
 # --- HEALTH CHECK DA API ---
 @api_bp.route('/health', methods=['GET'])
 def health_check():
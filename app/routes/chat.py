@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, abort
 from flask_login import login_required, current_user
 from app.extensions import db
-from app.models import Mensagem, Transacao, Notificacao
+from app.models import Mensagem, Transacao
+from app.services import outbox_service
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -30,7 +31,7 @@ def abrir_chat(trans_id):
         abort(403)
 
     mensagens = Mensagem.query.filter_by(transacao_id=trans_id) \
-        .order_by(Mensagem.data_criacao.asc()).all()
+        .order_by(Mensagem.data_envio.asc()).all()
 
     return render_template('chat/conversa.html', venda=venda, mensagens=mensagens)
 
@@ -50,31 +51,25 @@ def enviar_mensagem(trans_id):
     if not conteudo:
         return redirect(url_for('chat.abrir_chat', trans_id=trans_id))
 
+    destinatario_id = venda.vendedor_id if current_user.id == venda.comprador_id else venda.comprador_id
+
     # 1. Gravação da Mensagem
     nova_msg = Mensagem(
         transacao_id=trans_id,
         remetente_id=current_user.id,
+        destinatario_id=destinatario_id,
         conteudo=conteudo
     )
     db.session.add(nova_msg)
 
-    # 2. Lógica de Notificação Inteligente
-    destinatario_id = venda.vendedor_id if current_user.id == venda.comprador_id else venda.comprador_id
-
-    # Verifica se já existe uma notificação não lida deste chat para evitar SPAM
-    notif_existente = Notificacao.query.filter_by(
-        usuario_id=destinatario_id,
-        link=url_for('chat.abrir_chat', trans_id=trans_id),
-        lida=False
-    ).first()
-
-    if not notif_existente:
-        notif = Notificacao(
-            usuario_id=destinatario_id,
-            mensagem=f"💬 Nova mensagem de {current_user.nome} sobre a Ref {venda.fatura_ref}",
-            link=url_for('chat.abrir_chat', trans_id=trans_id)
-        )
-        db.session.add(notif)
+    # 2. Notificação via outbox: o despachante agrupa mensagens seguidas e não repete
+    # enquanto houver uma notificação deste chat por ler (anti-SPAM)
+    outbox_service.publicar(outbox_service.MENSAGEM_CHAT, {
+        'transacao_id': trans_id,
+        'remetente_id': current_user.id,
+        'destinatario_id': destinatario_id,
+        'link': url_for('chat.abrir_chat', trans_id=trans_id),
+    })
 
     db.session.commit()
     return redirect(url_for('chat.abrir_chat', trans_id=trans_id))
\ No newline at end of file
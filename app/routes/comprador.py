@@ -10,14 +10,16 @@ from flask import (
     flash, request, current_app, abort, make_response
 )
 from flask_login import login_required, current_user
-from sqlalchemy import func
 
 from app.extensions import db
 from app.models import (
     Transacao, Safra, Usuario, LogAuditoria,
     HistoricoStatus, Notificacao, Avaliacao, TransactionStatus
 )
+from app.services.kpi_service import KpiService
 from app.utils.helpers import salvar_ficheiro
+from app.utils.pagination import paginar_por_cursor, CursorInvalido
+from app.services.maquina_estados import MaquinaEstados, TransacaoEmLotePagamento
 from app.utils.status_helper import status_to_value
 
 comprador_bp = Blueprint('comprador', __name__)
@@ -58,19 +60,12 @@ def dashboard():
         status_to_value(TransactionStatus.DISPUTA)
     ])).order_by(Transacao.data_entrega.desc()).all()
 
-    # 3. KPIs do Comprador
+    # 3. KPIs do Comprador (resumo materializado)
     # Total Gasto: Inclui tudo que já foi pago (ESCROW, ENVIADO, ENTREGUE, FINALIZADO)
-    total_gasto = db.session.query(func.sum(Transacao.valor_total_pago)).filter(
-        Transacao.comprador_id == current_user.id,
-        Transacao.status.in_([
-            status_to_value(TransactionStatus.ESCROW),
-            status_to_value(TransactionStatus.ENVIADO),
-            status_to_value(TransactionStatus.ENTREGUE),
-            status_to_value(TransactionStatus.FINALIZADO)
-        ])
-    ).scalar() or 0
-
-    compras_ativas = query.filter(Transacao.status != status_to_value(TransactionStatus.FINALIZADO)).count()
+    # Compras Ativas: tudo o que ainda não foi finalizado nem cancelado
+    kpis = KpiService.kpis_comprador(current_user.id)
+    total_gasto = kpis['total_gasto']
+    compras_ativas = kpis['compras_ativas']
 
     return render_template('painel/comprador.html',
                            pendentes=pendentes,
@@ -135,7 +130,7 @@ def submeter_comprovativo(trans_id):
 
         if nome_foto:
             venda.comprovativo_path = nome_foto
-            venda.mudar_status(status_to_value(TransactionStatus.ANALISE), "Comprovativo enviado pelo comprador")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.ANALISE), "Comprovativo enviado pelo comprador")
 
             db.session.add(LogAuditoria(
                 usuario_id=current_user.id,
@@ -168,12 +163,22 @@ def minhas_compras():
         status_to_value(TransactionStatus.ENVIADO), status_to_value(TransactionStatus.ENTREGUE),
         status_to_value(TransactionStatus.FINALIZADO), status_to_value(TransactionStatus.DISPUTA)
     ]
-    compras = Transacao.query.filter(
+    query = Transacao.query.filter(
         Transacao.comprador_id == current_user.id,
         Transacao.status.in_(status_compras)
-    ).order_by(Transacao.data_criacao.desc()).all()
+    )
 
-    return render_template('comprador/minhas_compras.html', compras=compras)
+    # Paginação por cursor; a contagem por comprador é barata (índice em comprador_id)
+    try:
+        pagina = paginar_por_cursor(query, Transacao, cursor=request.args.get('cursor'),
+                                    per_page=20, total='exact')
+    except CursorInvalido:
+        abort(400)
+
+    return render_template('comprador/minhas_compras.html',
+                           compras=pagina.items,
+                           total_compras=pagina.total,
+                           proximo_cursor=pagina.next_cursor)
 
 
 @comprador_bp.route('/confirmar-recebimento/<int:trans_id>', methods=['POST'])
@@ -195,7 +200,7 @@ def confirmar_recebimento(trans_id):
             return redirect(url_for('comprador.dashboard'))
 
         # Muda para ENTREGUE (ainda NÃO libera saldo!)
-        transacao.mudar_status(status_to_value(TransactionStatus.ENTREGUE), "Entrega confirmada pelo comprador")
+        MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.ENTREGUE), "Entrega confirmada pelo comprador")
         transacao.data_entrega = datetime.now(timezone.utc)
         # NOTA: data_liquidacao será definida apenas quando o admin aprovar a transferência
 
@@ -274,7 +279,7 @@ def abrir_disputa(trans_id):
 
         # Só pode abrir disputa se não estiver finalizada (dinheiro já entregue)
         if venda.status not in [status_to_value(TransactionStatus.FINALIZADO), status_to_value(TransactionStatus.CANCELADO)]:
-            venda.mudar_status(status_to_value(TransactionStatus.DISPUTA), "Disputa aberta pelo comprador")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.DISPUTA), "Disputa aberta pelo comprador")
             
             db.session.add(LogAuditoria(
                 usuario_id=current_user.id,
@@ -295,6 +300,9 @@ def abrir_disputa(trans_id):
         else:
              flash("Não é possível abrir disputa para uma transação finalizada ou cancelada.", "danger")
              
+    except TransacaoEmLotePagamento as e:
+        db.session.rollback()
+        flash(str(e), "warning")
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Erro ao abrir disputa: {e}")
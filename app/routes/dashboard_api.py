@@ -2,8 +2,8 @@ from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import Usuario, Transacao, TransactionStatus
 from app.utils.decorators import role_required
-from sqlalchemy import func, case
-from app.extensions import db
+from app.services.kpi_service import KpiService
+from app.services import projecoes
 
 dashboard_api_bp = Blueprint('dashboard_api', __name__)
 
@@ -17,15 +17,11 @@ def get_produtor_dashboard():
     user_id = get_jwt_identity()
     
     # KPIs Financeiros
-    stats = db.session.query(
-        func.sum(case((Transacao.status == TransactionStatus.FINALIZADO, Transacao.valor_liquido_vendedor), else_=0)),
-        func.sum(case((Transacao.status.in_([TransactionStatus.ESCROW, TransactionStatus.ENVIADO]), Transacao.valor_liquido_vendedor), else_=0)),
-        func.sum(case((Transacao.status == TransactionStatus.ENTREGUE, Transacao.valor_liquido_vendedor), else_=0))
-    ).filter(Transacao.vendedor_id == user_id).first()
+    kpis = KpiService.kpis_produtor(user_id)
 
-    # Listas de Vendas
-    query = Transacao.query.filter_by(vendedor_id=user_id)
-    reservas = query.filter_by(status=TransactionStatus.PENDENTE).order_by(Transacao.data_criacao.desc()).all()
+    # Listas de Vendas (projeções: uma query por lista, sem lazy loads por linha)
+    query = projecoes.query_transacoes().filter(Transacao.vendedor_id == user_id)
+    reservas = query.filter(Transacao.status == TransactionStatus.PENDENTE).order_by(Transacao.data_criacao.desc()).all()
     vendas_ativas = query.filter(Transacao.status.in_([
         TransactionStatus.AGUARDANDO_PAGAMENTO, TransactionStatus.ANALISE,
         TransactionStatus.ESCROW, TransactionStatus.ENVIADO
@@ -40,15 +36,15 @@ def get_produtor_dashboard():
         "success": True,
         "data": {
             "kpis": {
-                "receita_total": float(stats[0] or 0),
-                "receita_pendente": float(stats[1] or 0),
-                "receita_a_liquidar": float(stats[2] or 0),
+                "receita_total": float(kpis['receita_total']),
+                "receita_pendente": float(kpis['em_custodia']),
+                "receita_a_liquidar": float(kpis['a_liquidar']),
                 "saldo_disponivel": float(user.saldo_disponivel or 0)
             },
             "listas": {
-                "reservas": [v.to_dict() for v in reservas],
-                "vendas_ativas": [v.to_dict() for v in vendas_ativas],
-                "historico": [v.to_dict() for v in historico]
+                "reservas": projecoes.transacoes(reservas),
+                "vendas_ativas": projecoes.transacoes(vendas_ativas),
+                "historico": projecoes.transacoes(historico)
             }
         }
     })
@@ -61,7 +57,7 @@ def get_comprador_dashboard():
     """
     user_id = get_jwt_identity()
 
-    query = Transacao.query.filter_by(comprador_id=user_id)
+    query = projecoes.query_transacoes().filter(Transacao.comprador_id == user_id)
 
     # Listas
     pendentes = query.filter(Transacao.status.in_([TransactionStatus.PENDENTE, TransactionStatus.AGUARDANDO_PAGAMENTO])).all()
@@ -69,26 +65,19 @@ def get_comprador_dashboard():
     historico = query.filter(Transacao.status.in_([TransactionStatus.ENTREGUE, TransactionStatus.FINALIZADO, TransactionStatus.CANCELADO])).all()
 
     # KPIs
-    total_gasto = db.session.query(func.sum(Transacao.valor_total_pago)).filter(
-        Transacao.comprador_id == user_id,
-        Transacao.status.in_([TransactionStatus.ENTREGUE, TransactionStatus.FINALIZADO])
-    ).scalar() or 0
-    compras_ativas = query.filter(Transacao.status.in_([
-        TransactionStatus.PENDENTE, TransactionStatus.AGUARDANDO_PAGAMENTO,
-        TransactionStatus.ANALISE, TransactionStatus.ESCROW, TransactionStatus.ENVIADO
-    ])).count()
+    kpis = KpiService.kpis_comprador(user_id)
 
     return jsonify({
         "success": True,
         "data": {
             "kpis": {
-                "total_gasto": float(total_gasto),
-                "compras_ativas": compras_ativas
+                "total_gasto": float(kpis['total_gasto']),
+                "compras_ativas": kpis['compras_ativas']
             },
             "listas": {
-                "pendentes": [p.to_dict() for p in pendentes],
-                "em_transito": [t.to_dict() for t in em_transito],
-                "historico": [h.to_dict() for h in historico]
+                "pendentes": projecoes.transacoes(pendentes),
+                "em_transito": projecoes.transacoes(em_transito),
+                "historico": projecoes.transacoes(historico)
             }
         }
     })
@@ -101,29 +90,28 @@ def get_admin_dashboard():
     Fornece todos os dados necessários para o painel do admin.
     """
     # KPIs
-    financas = db.session.query(
-        func.sum(case((Transacao.status != TransactionStatus.CANCELADO, Transacao.valor_total_pago), else_=0)),
-        func.sum(case((Transacao.status == TransactionStatus.FINALIZADO, Transacao.comissao_plataforma), else_=0)),
-        func.sum(case((Transacao.status == TransactionStatus.ENTREGUE, Transacao.valor_liquido_vendedor), else_=0))
-    ).first()
+    financas = KpiService.kpis_plataforma()
     total_utilizadores = Usuario.query.count()
 
     # Listas de Tarefas
-    pendentes_validacao = Transacao.query.filter_by(status=TransactionStatus.ANALISE).order_by(Transacao.data_criacao.asc()).all()
-    aguardando_liquidacao = Transacao.query.filter_by(status=TransactionStatus.ENTREGUE, transferencia_concluida=False).all()
+    query = projecoes.query_transacoes()
+    pendentes_validacao = query.filter(Transacao.status == TransactionStatus.ANALISE) \
+        .order_by(Transacao.data_criacao.asc()).all()
+    aguardando_liquidacao = query.filter(Transacao.status == TransactionStatus.ENTREGUE,
+                                         Transacao.transferencia_concluida.is_(False)).all()
 
     return jsonify({
         "success": True,
         "data": {
             "kpis": {
-                "total_vendas": float(financas[0] or 0),
-                "comissao_total": float(financas[1] or 0),
-                "divida_produtores": float(financas[2] or 0),
+                "total_vendas": float(financas['total_vendas']),
+                "comissao_total": float(financas['comissao_total']),
+                "divida_produtores": float(financas['divida_produtores']),
                 "total_utilizadores": total_utilizadores
             },
             "tarefas": {
-                "validar_pagamentos": [p.to_dict() for p in pendentes_validacao],
-                "liquidar_pagamentos": [l.to_dict() for l in aguardando_liquidacao]
+                "validar_pagamentos": projecoes.transacoes(pendentes_validacao),
+                "liquidar_pagamentos": projecoes.transacoes(aguardando_liquidacao)
             }
         }
     })
\ No newline at end of file
@@ -1,11 +1,6 @@
 import os
-import hashlib
-import base64
-import io
-import qrcode
-import pdfkit
 from decimal import Decimal
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app, abort,send_from_directory,make_response
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, current_app, abort,send_from_directory,make_response,send_file
 from flask_login import login_required, current_user
 from sqlalchemy import func
 from app.extensions import db
@@ -14,8 +9,9 @@ from app.models import (
     Municipio, Avaliacao, Usuario, Transacao, TransactionStatus
 )
 from app.utils.helpers import salvar_ficheiro
-# Exemplo usando pdfkit ou weasyprint (ajusta conforme a tua biblioteca)
-import pdfkit
+from app.services.cache_service import cache_service
+from app.services import fatura_service, notificacao_service
+from app.utils.circuit_breaker import obter_breaker
 
 
 main_bp = Blueprint('main', __name__)
@@ -112,8 +108,11 @@ def ler_notificacao(id):
 @main_bp.route('/api/municipios/<int:provincia_id>')
 def get_municipios(provincia_id):
     """Dropdown dinâmico para os municípios de Angola."""
-    municipios = Municipio.query.filter_by(provincia_id=provincia_id).order_by(Municipio.nome).all()
-    return jsonify([{'id': m.id, 'nome': m.nome} for m in municipios])
+    def carregar_municipios():
+        municipios = Municipio.query.filter_by(provincia_id=provincia_id).order_by(Municipio.nome).all()
+        return [{'id': m.id, 'nome': m.nome} for m in municipios]
+
+    return jsonify(cache_service.obter_geografia(carregar_municipios, f'municipios:{provincia_id}'))
 
 
 @main_bp.route('/perfil')
@@ -142,6 +141,7 @@ def limpar_notificacoes():
     Versão com redirecionamento (caso use um botão físico 'Marcar todas como lidas').
     """
     Notificacao.query.filter_by(usuario_id=current_user.id, lida=False).update({Notificacao.lida: True})
+    notificacao_service.registar_lidas(db.session, current_user.id)
     db.session.commit()
     return redirect(request.referrer or url_for('main.index'))
 
@@ -150,10 +150,25 @@ def limpar_notificacoes():
 def marcar_notificacoes_lidas():
     """Limpa o contador via AJAX quando o utilizador abre o menu do sininho."""
     Notificacao.query.filter_by(usuario_id=current_user.id, lida=False).update({'lida': True})
+    notificacao_service.registar_lidas(db.session, current_user.id)
     db.session.commit()
     return jsonify({'status': 'success', 'message': 'Notificações marcadas como lidas'})
 
 
+@main_bp.route('/notificacoes/resumo')
+@login_required
+def resumo_notificacoes():
+    """Polling curto do sininho (workers síncronos, sem SSE)."""
+    return jsonify(notificacao_service.resumo(current_user.id))
+
+
+@main_bp.route('/notificacoes/stream')
+@login_required
+def stream_notificacoes():
+    """Server-Sent Events: notificações novas e contador do sininho, sem polling."""
+    return notificacao_service.resposta_stream(current_user.id)
+
+
 @main_bp.route('/produtor/<int:id>')
 def perfil_produtor(id):
     produtor = Usuario.query.get_or_404(id)
@@ -239,6 +254,27 @@ def servir_privado(subpasta, filename):
         abort(404)
 
 
+def _verificar_workers_celery():
+    """Pergunta aos workers com timeout curto; sem workers, o breaker evita repetir a espera."""
+    from app.extensions import celery, CELERY_AVAILABLE
+    if not CELERY_AVAILABLE or celery is None:
+        return 'not available (Celery disabled)'
+
+    breaker = obter_breaker('celery-workers', limite_falhas=1, tempo_reset=60.0)
+    if not breaker.permitir():
+        return 'warning: no active workers'
+    try:
+        respostas = celery.control.inspect(timeout=0.5).ping()
+    except Exception as e:
+        breaker.registar_falha()
+        return f'error: {str(e)}'
+    if respostas:
+        breaker.registar_sucesso()
+        return 'ok'
+    breaker.registar_falha()
+    return 'warning: no active workers'
+
+
 @main_bp.route('/health')
 def health_check():
     """
@@ -247,6 +283,7 @@ def health_check():
     """
     from app.extensions import db
     from datetime import datetime, timezone
+    from sqlalchemy import text
     
     health_status = {
         'status': 'healthy',
@@ -257,34 +294,30 @@ def health_check():
     
     # Check 1: Database
     try:
-        db.session.execute('SELECT 1')
+        db.session.execute(text('SELECT 1'))
         health_status['checks']['database'] = 'ok'
     except Exception as e:
         health_status['checks']['database'] = f'error: {str(e)}'
         health_status['status'] = 'unhealthy'
     
-    # Check 2: Redis (se configurado)
+    # Check 2: Redis (se configurado), sempre através do circuit breaker:
+    # com o Redis em baixo a resposta é imediata em vez de esperar timeouts
     try:
         redis_url = current_app.config.get('REDIS_URL')
-        if redis_url:
-            from app.extensions import celery, CELERY_AVAILABLE
-            if CELERY_AVAILABLE and celery is not None:
-                inspect = celery.control.inspect()
-                active_queues = inspect.active_queues()
-                if active_queues:
-                    health_status['checks']['redis'] = 'ok'
-                else:
-                    health_status['checks']['redis'] = 'warning: no active workers'
-            else:
-                health_status['checks']['redis'] = 'not available (Celery disabled)'
-        else:
+        if not redis_url:
             health_status['checks']['redis'] = 'not configured'
+        elif cache_service.ping():
+            health_status['checks']['redis'] = 'ok'
+            health_status['checks']['celery'] = _verificar_workers_celery()
+        else:
+            health_status['checks']['redis'] = f'error: unavailable (circuit {cache_service.breaker.estado})'
+            health_status['status'] = 'degraded'
     except Exception as e:
         health_status['checks']['redis'] = f'error: {str(e)}'
         health_status['status'] = 'degraded'
     
-    # Return status code based on health
-    status_code = 200 if health_status['status'] == 'healthy' else 503
+    # Degradado (sem Redis) continua a servir pedidos com fallbacks: só a DB tira a instância do balanceador
+    status_code = 503 if health_status['status'] == 'unhealthy' else 200
     
     return jsonify(health_status), status_code
 
@@ -327,59 +360,22 @@ def baixar_fatura(trans_id):
     if current_user.id not in [venda.vendedor_id, venda.comprador_id] and not is_admin:
         abort(403)
 
-    # 3. Gerar Hash de Verificação Único (SHA-256)
-    hash_seed = f"{venda.id}-{venda.data_criacao}-{venda.valor_total_pago}"
-    verificacao_hash = hashlib.sha256(hash_seed.encode()).hexdigest()[:16].upper()
-
-    # 4. Gerar QR Code em Base64 para o template
-    qr_data = f"https://agrokongo.ao/verificar/{venda.fatura_ref or venda.id}"
-    qr = qrcode.QRCode(version=1, box_size=10, border=1)
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-
-    img_buffer = io.BytesIO()
-    img = qr.make_image(fill_color="#1B4332", back_color="white")
-    img.save(img_buffer, format="PNG")
-    qr_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-
-    # 5. Renderizar o HTML
-    html = render_template(
-        'documentos/fatura_padrao.html',
-        venda=venda,
-        qr_base64=qr_base64,
-        verificacao_hash=verificacao_hash
-    )
-
-    # 6. CONFIGURAÇÃO CRÍTICA: Caminho do wkhtmltopdf no Windows
-    # O 'r' antes das aspas é obrigatório para caminhos do Windows
-    path_wkhtmltopdf = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
-    config = pdfkit.configuration(wkhtmltopdf=path_wkhtmltopdf)
-
-    # 7. Opções do PDF
-    options = {
-        'page-size': 'A4',
-        'margin-top': '0mm',
-        'margin-right': '0mm',
-        'margin-bottom': '0mm',
-        'margin-left': '0mm',
-        'encoding': "UTF-8",
-        'no-outline': None,
-        'enable-local-file-access': None,
-        'quiet': ''  # Evita logs desnecessários
-    }
-
-    # 8. Gerar o binário do PDF com a configuração explícita
+    # 3. Faturas pagas são servidas do cache em disco; as restantes geradas em memória
     try:
-        pdf = pdfkit.from_string(html, False, configuration=config, options=options)
+        caminho = fatura_service.obter_pdf_fatura(venda)
+        pdf = None if caminho else fatura_service.gerar_pdf_fatura(venda)
     except Exception as e:
-        # Se falhar aqui, verifique se o caminho em path_wkhtmltopdf está correto
+        # Se falhar aqui, verifique o motor de PDF (FATURA_MOTOR_PDF / WKHTMLTOPDF_PATH)
         return f"Erro técnico ao gerar PDF: {str(e)}", 500
 
-    # 9. Criar a resposta e forçar o download
+    if caminho:
+        return send_file(caminho, mimetype='application/pdf', as_attachment=True,
+                         download_name=fatura_service.nome_ficheiro_fatura(venda), conditional=True)
+
+    # 4. Criar a resposta e forçar o download
     response = make_response(pdf)
     response.headers['Content-Type'] = 'application/pdf'
-    nome_arquivo = f"Fatura_AgroKongo_{venda.fatura_ref or venda.id}.pdf"
-    response.headers['Content-Disposition'] = f'attachment; filename={nome_arquivo}'
+    response.headers['Content-Disposition'] = f'attachment; filename={fatura_service.nome_ficheiro_fatura(venda)}'
 
     return response
 
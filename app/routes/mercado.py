@@ -1,15 +1,16 @@
 import uuid
-from decimal import Decimal, InvalidOperation
 from flask import Blueprint, render_template, redirect, url_for, flash, request, abort, current_app
 from flask_login import login_required, current_user
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func, or_
+from sqlalchemy import func
 from app.extensions import db
 from app.models import (
-    Safra, Produto, Provincia, Transacao,
-    Usuario, TransactionStatus, LogAuditoria
+    Safra, Produto, Provincia, Transacao, Usuario
 )
-from app.utils.status_helper import status_to_value
+from app.services import search_service
+from app.services.compra_service import CompraService
+from app.services.reserva_service import MSG_SAFRA_NAO_ENCONTRADA
+from app.utils.pagination import paginar_por_cursor, CursorInvalido
 
 mercado_bp = Blueprint('mercado', __name__)
 
@@ -34,19 +35,20 @@ def explorar():
     if cat_id:
         query = query.filter(Safra.produto_id == cat_id)
     if termo:
-        # Busca por nome do produto ou nome do produtor
-        query = query.join(Produto).filter(
-            or_(
-                Produto.nome.ilike(f'%{termo}%'),
-                Usuario.nome.ilike(f'%{termo}%')
-            )
-        )
-
-    # Paginação para não carregar tudo de uma vez
-    page = request.args.get('page', 1, type=int)
-    per_page = 12
-    pagination = query.order_by(Safra.data_criacao.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    
+        # Busca por nome do produto, categoria ou produtor (sem acentos, por prefixo).
+        # Os resultados seguem a relevância, que o cursor (por data) não preserva:
+        # a pesquisa pagina por página, como a API em modo offset
+        query = search_service.filtrar_safras(query, termo)
+        pagination = query.order_by(Safra.data_criacao.desc()).paginate(
+            page=request.args.get('page', 1, type=int), per_page=12, error_out=False)
+    else:
+        # Paginação por cursor: "Ver mais" custa o mesmo em qualquer profundidade
+        try:
+            pagination = paginar_por_cursor(query, Safra, cursor=request.args.get('cursor'),
+                                            per_page=12, total='approx')
+        except CursorInvalido:
+            abort(400)
+
     safras = pagination.items
 
     return render_template('mercado/explorar.html',
@@ -108,81 +110,26 @@ def iniciar_encomenda(id):
         flash('Produtores não podem comprar safras. Registe uma conta de Comprador.', 'warning')
         return redirect(url_for('mercado.detalhes_safra', id=id))
 
-    if not current_user.conta_validada and not current_user.perfil_completo:
+    if not current_user.conta_validada or not current_user.perfil_completo:
         flash('⚠️ Complete o seu perfil para realizar compras.', 'warning')
         return redirect(url_for('main.perfil'))
 
-    try:
-        # Uso de transação explícita para garantir integridade
-        with db.session.begin_nested():
-            # Lock de linha (FOR UPDATE) para evitar race conditions no stock
-            safra = Safra.query.with_for_update().get_or_404(id)
-
-            # Auto-compra não permitida (redundante com verificação de tipo, mas seguro)
-            if safra.produtor_id == current_user.id:
-                flash('Não pode comprar a sua própria safra.', 'danger')
-                return redirect(url_for('mercado.detalhes_safra', id=id))
-
-            raw_qtd = request.form.get('quantidade', '0').replace(',', '.')
-            try:
-                quantidade = Decimal(raw_qtd)
-            except InvalidOperation:
-                flash("Quantidade inválida.", "danger")
-                return redirect(url_for('mercado.detalhes_safra', id=id))
-
-            if quantidade <= 0:
-                flash("A quantidade deve ser maior que zero.", "danger")
-                return redirect(url_for('mercado.detalhes_safra', id=id))
-
-            if quantidade > safra.quantidade_disponivel:
-                flash(f"Quantidade indisponível. Máximo: {safra.quantidade_disponivel}kg", "danger")
-                return redirect(url_for('mercado.detalhes_safra', id=id))
-
-            valor_total = (quantidade * safra.preco_por_unidade).quantize(Decimal('0.01'))
-
-            # Criação da Transação
-            nova_reserva = Transacao(
-                safra_id=safra.id,
-                comprador_id=current_user.id,
-                vendedor_id=safra.produtor_id,
-                quantidade_comprada=quantidade,
-                valor_total_pago=valor_total,
-                status=status_to_value(TransactionStatus.PENDENTE)
-            )
-            # O __init__ da Transacao já gera a fatura_ref e calcula comissões
-
-            # Abate do stock imediato
-            safra.quantidade_disponivel -= quantidade
-            if safra.quantidade_disponivel <= 0:
-                safra.status = 'esgotado'
-
-            db.session.add(nova_reserva)
-            
-            # Registo de Histórico
-            nova_reserva.mudar_status(status_to_value(TransactionStatus.PENDENTE), "Reserva criada pelo comprador.")
-            
-            # Log de Auditoria
-            db.session.add(LogAuditoria(
-                usuario_id=current_user.id,
-                acao="COMPRA_INICIADA",
-                detalhes=f"Ref: {nova_reserva.fatura_ref} | Qtd: {quantidade} | Safra: {safra.id}",
-                ip=request.remote_addr
-            ))
-
-        # Commit é feito automaticamente ao sair do bloco with se não houver erro
-        db.session.commit()
-
-        flash(f"✅ Reserva {nova_reserva.fatura_ref} efetuada! Aguarde a confirmação do produtor.", "success")
-        # Redirecionar para detalhes da encomenda (assumindo rota existente ou usando lista)
-        return redirect(url_for('comprador.encomenda_detalhe', id=nova_reserva.id)) 
-        # Nota: Se 'comprador.encomenda_detalhe' não existir, usar 'comprador.minhas_reservas'
-
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"ERRO COMPRA: {str(e)}")
-        flash("Ocorreu um erro ao processar a encomenda. Tente novamente.", "danger")
+    # Reserva pelo caminho único de compra (abate atómico do stock + histórico + auditoria)
+    quantidade = request.form.get('quantidade', '0')
+    sucesso, nova_reserva, mensagem = CompraService.iniciar_compra(
+        id, current_user.id, quantidade, ip=request.remote_addr)
+
+    if not sucesso:
+        if mensagem == MSG_SAFRA_NAO_ENCONTRADA:
+            abort(404)
+        flash(mensagem, "danger")
         return redirect(url_for('mercado.detalhes_safra', id=id))
 
+    flash(f"✅ Reserva {nova_reserva.fatura_ref} efetuada! Aguarde a confirmação do produtor.", "success")
+    # Redirecionar para detalhes da encomenda (assumindo rota existente ou usando lista)
+    return redirect(url_for('comprador.encomenda_detalhe', id=nova_reserva.id))
+    # Nota: Se 'comprador.encomenda_detalhe' não existir, usar 'comprador.minhas_reservas'
+
 
 # --- 4. VALIDAÇÃO DE DOCUMENTOS (PÚBLICO) ---
 @mercado_bp.route('/validar-fatura/<code>')
@@ -2,8 +2,10 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import Safra, Produto, Usuario
 from app.services.transaction_service import TransactionService
-from app.utils.decorators import kyc_required
-from sqlalchemy.orm import joinedload
+from app.services.compra_service import CompraService
+from app.services import search_service, projecoes
+from app.utils.pagination import paginar_por_cursor
+from app.utils.decorators import kyc_required, idempotente
 
 # Blueprint para a API do Mercado
 mercado_api_bp = Blueprint('mercado_api', __name__)
@@ -13,6 +15,7 @@ def get_safras():
     """
     Endpoint para listar todas as safras disponíveis, com filtros.
     Rota: GET /api/market/safras
+    Com `?cursor=` usa paginação por cursor (scroll infinito); `total=none|approx|exact`.
     """
     try:
         # Extrair query params
@@ -21,32 +24,44 @@ def get_safras():
         categoria_id = request.args.get('categoria_id', type=int)
         page = request.args.get('page', 1, type=int)
         per_page = 12 
+        modo_cursor = 'cursor' in request.args
 
-        query = Safra.query.options(
-            joinedload(Safra.produto),
-            joinedload(Safra.produtor).joinedload(Usuario.provincia),
-            joinedload(Safra.produtor).joinedload(Usuario.municipio)
-        ).filter(
+        # Projeção só de colunas: produto, produtor e localização num único SELECT
+        query = projecoes.query_safras().filter(
             Safra.status == 'disponivel',
             Safra.quantidade_disponivel > 0
         )
 
         if q:
-            query = query.join(Produto).join(Usuario).filter(
-                (Produto.nome.ilike(f'%{q}%')) |
-                (Usuario.nome.ilike(f'%{q}%'))
-            )
+            query = search_service.filtrar_safras(query, q, ordenar=not modo_cursor)
         if provincia_id:
-            query = query.join(Usuario).filter(Usuario.provincia_id == provincia_id)
+            query = query.filter(Usuario.provincia_id == provincia_id)
         if categoria_id:
             query = query.filter(Safra.produto_id == categoria_id)
 
+        if modo_cursor:
+            try:
+                pagina = paginar_por_cursor(
+                    query, Safra,
+                    cursor=request.args.get('cursor'),
+                    per_page=request.args.get('per_page', per_page, type=int),
+                    total=request.args.get('total', 'none')
+                )
+            except ValueError as e:
+                return jsonify({"success": False, "errors": [str(e)]}), 400
+
+            return jsonify({
+                "success": True,
+                "data": projecoes.safras(pagina.items),
+                "meta": pagina.meta()
+            }), 200
+
         pagination = query.order_by(Safra.data_criacao.desc()).paginate(
             page=page, per_page=per_page, error_out=False
         )
         
         safras = pagination.items
-        safras_dict = [safra.to_dict() for safra in safras]
+        safras_dict = projecoes.safras(safras)
 
         return jsonify({
             "success": True,
@@ -70,17 +85,14 @@ def get_safra_detalhe(id):
     Rota: GET /api/market/safras/<id>
     """
     try:
-        safra = Safra.query.options(
-            joinedload(Safra.produto),
-            joinedload(Safra.produtor).joinedload(Usuario.provincia)
-        ).get(id)
+        safra = projecoes.query_safras().filter(Safra.id == id).first()
 
         if not safra:
             return jsonify({"success": False, "errors": ["Safra não encontrada"]}), 404
 
         return jsonify({
             "success": True,
-            "data": safra.to_dict()
+            "data": projecoes.safra_dict(safra)
         }), 200
 
     except Exception as e:
@@ -90,6 +102,7 @@ def get_safra_detalhe(id):
 @mercado_api_bp.route('/buy', methods=['POST', 'OPTIONS'])
 @jwt_required() # Requer Token JWT válido
 @kyc_required() # Requer conta validada pelo Admin
+@idempotente() # Repetições com a mesma Idempotency-Key devolvem a resposta original
 def buy_safra():
     """
     Endpoint para comprar uma safra.
@@ -114,7 +127,8 @@ def buy_safra():
         comprador_id = get_jwt_identity()
 
         # Chamar Serviço de Transação
-        sucesso, resultado = TransactionService.criar_reserva(safra_id, comprador_id, quantidade)
+        sucesso, resultado = TransactionService.criar_reserva(safra_id, comprador_id, quantidade,
+                                                              ip=request.remote_addr)
 
         if sucesso:
             return jsonify({
@@ -126,7 +140,7 @@ def buy_safra():
             return jsonify({
                 "success": False,
                 "errors": [resultado] # resultado contém a mensagem de erro
-            }), 400
+            }), CompraService.codigo_http(resultado)
 
     except Exception as e:
         return jsonify({"success": False, "errors": [str(e)]}), 500
\ No newline at end of file
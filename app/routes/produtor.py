@@ -1,13 +1,16 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort
 from flask_login import login_required, current_user
-from app.models import Safra, Produto, Transacao, Notificacao, TransactionStatus, AlertaPreferencia, LogAuditoria, db
+from app.models import Safra, Produto, Transacao, Notificacao, TransactionStatus, LogAuditoria, db
 from app.utils.helpers import salvar_ficheiro
 from functools import wraps
 from decimal import Decimal, InvalidOperation
 from datetime import datetime, timezone
-from sqlalchemy import func, case
 
+from app.services import outbox_service
+from app.services.kpi_service import KpiService
+from app.services.maquina_estados import MaquinaEstados
 from app.utils.status_helper import status_to_value
+from app.utils.pagination import paginar_por_cursor, CursorInvalido
 
 produtor_bp = Blueprint('produtor', __name__)
 
@@ -33,17 +36,9 @@ def dashboard():
     # Garantir que temos os dados mais recentes do usuário
     db.session.refresh(current_user)
 
-    # 1. KPIs Financeiros usando Agregação SQL (Single Hit na DB)
-    stats = db.session.query(
-        # Receita Total: Transações FINALIZADAS (dinheiro já recebido)
-        func.sum(case((Transacao.status == status_to_value(TransactionStatus.FINALIZADO), Transacao.valor_liquido_vendedor), else_=0)),
-        # Valor em Custódia: ESCROW + ENVIADO (pagamento confirmado, mercadoria a caminho)
-        func.sum(case((Transacao.status.in_([status_to_value(TransactionStatus.ESCROW), 
-                                              status_to_value(TransactionStatus.ENVIADO)]),
-                       Transacao.valor_liquido_vendedor), else_=0)),
-        # A Liquidar: ENTREGUE (mercadoria chegou, aguardando confirmação final)
-        func.sum(case((Transacao.status == status_to_value(TransactionStatus.ENTREGUE), Transacao.valor_liquido_vendedor), else_=0))
-    ).filter(Transacao.vendedor_id == current_user.id).first()
+    # 1. KPIs Financeiros lidos do resumo materializado (não percorre as transações)
+    # Receita Total: FINALIZADAS | Custódia: ESCROW + ENVIADO | A Liquidar: ENTREGUE
+    kpis = KpiService.kpis_produtor(current_user.id)
 
     # 2. Filtros por Workflow para as abas (Tabs)
     query = Transacao.query.filter_by(vendedor_id=current_user.id)
@@ -68,9 +63,9 @@ def dashboard():
     ])).order_by(Transacao.data_criacao.desc()).all()
 
     return render_template('painel/produtor.html',
-                           receita_total=stats[0] or 0,
-                           receita_pendente=stats[1] or 0,
-                           receita_a_liquidar=stats[2] or 0, 
+                           receita_total=kpis['receita_total'],
+                           receita_pendente=kpis['em_custodia'],
+                           receita_a_liquidar=kpis['a_liquidar'], 
                            receita_disponivel=current_user.saldo_disponivel or 0,
                            reservas=reservas,
                            vendas=vendas,
@@ -89,7 +84,7 @@ def aceitar_reserva(trans_id):
 
         if venda.status == status_to_value(TransactionStatus.PENDENTE):
             # Usa o método centralizado para registar histórico
-            venda.mudar_status(status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), "Aceite pelo produtor")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), "Aceite pelo produtor")
 
             # Notificação em tempo real
             db.session.add(Notificacao(
@@ -155,16 +150,12 @@ def nova_safra():
             db.session.add(nova_s)
             db.session.flush()  # Gera o ID da safra antes do commit final
 
-            # --- MOTOR DE ALERTAS (Background-ready) ---
-            interessados = AlertaPreferencia.query.filter_by(produto_id=nova_s.produto_id).all()
-            for alerta in interessados:
-                # Evitar notificar o próprio produtor se ele tiver alerta (pouco provável mas possível)
-                if alerta.usuario_id != current_user.id:
-                    db.session.add(Notificacao(
-                        usuario_id=alerta.usuario_id,
-                        mensagem=f"🚨 Nova safra de {nova_s.produto.nome} em {current_user.provincia.nome}!",
-                        link=url_for('mercado.detalhes_safra', id=nova_s.id)
-                    ))
+            # --- MOTOR DE ALERTAS ---
+            # Um só evento na outbox: os interessados são notificados em background
+            outbox_service.publicar(outbox_service.SAFRA_PUBLICADA, {
+                'safra_id': nova_s.id,
+                'link': url_for('mercado.detalhes_safra', id=nova_s.id),
+            })
             
             db.session.add(LogAuditoria(
                 usuario_id=current_user.id,
@@ -204,7 +195,7 @@ def confirmar_envio(trans_id):
             flash("Ação inválida. O pagamento deve ser confirmado primeiro.", "warning")
             return redirect(url_for('produtor.dashboard'))
 
-        transacao.mudar_status(status_to_value(TransactionStatus.ENVIADO), "Mercadoria enviada pelo produtor.")
+        MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.ENVIADO), "Mercadoria enviada pelo produtor.")
         transacao.data_envio = datetime.now(timezone.utc)
 
         # 1. Lógica de previsão
@@ -302,7 +293,7 @@ def recusar_reserva(trans_id):
         if venda.safra:
              venda.safra.quantidade_disponivel += venda.quantidade_comprada
         
-        venda.mudar_status(status_to_value(TransactionStatus.CANCELADO), "Recusada pelo produtor")
+        MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.CANCELADO), "Recusada pelo produtor")
         
         db.session.add(Notificacao(
             usuario_id=venda.comprador_id,
@@ -372,22 +363,39 @@ def eliminar_safra(id):
 @login_required
 @produtor_required
 def vendas():
-    # 1. Filtramos todas as vendas DESTE produtor
-    vendas_total = Transacao.query.filter_by(vendedor_id=current_user.id) \
-        .order_by(Transacao.data_criacao.desc()).all()
+    # 1. Reservas e vendas em curso são um conjunto pequeno e limitado: carregamos tudo
+    status_reservas = [status_to_value(TransactionStatus.PENDENTE), status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO)]
+    status_ativas = [status_to_value(TransactionStatus.ANALISE), status_to_value(TransactionStatus.ESCROW), status_to_value(TransactionStatus.ENVIADO)]
+    status_historico = [status_to_value(TransactionStatus.FINALIZADO), status_to_value(TransactionStatus.CANCELADO), status_to_value(TransactionStatus.DISPUTA), status_to_value(TransactionStatus.ENTREGUE)]
 
-    # 2. Categorizamos
-    reservas = [v for v in vendas_total if v.status in [status_to_value(TransactionStatus.PENDENTE), status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO)]]
+    em_curso = Transacao.query.filter(
+        Transacao.vendedor_id == current_user.id,
+        Transacao.status.in_(status_reservas + status_ativas)
+    ).order_by(Transacao.data_criacao.desc()).all()
 
-    vendas_ativas = [v for v in vendas_total if
-                     v.status in [status_to_value(TransactionStatus.ANALISE), status_to_value(TransactionStatus.ESCROW), status_to_value(TransactionStatus.ENVIADO)]]
+    reservas = [v for v in em_curso if v.status in status_reservas]
+    vendas_ativas = [v for v in em_curso if v.status in status_ativas]
 
-    historico = [v for v in vendas_total if v.status in [status_to_value(TransactionStatus.FINALIZADO), status_to_value(TransactionStatus.CANCELADO), status_to_value(TransactionStatus.DISPUTA), status_to_value(TransactionStatus.ENTREGUE)]]
+    # 2. O histórico cresce sem limite: paginação por cursor
+    try:
+        pagina_historico = paginar_por_cursor(
+            Transacao.query.filter(
+                Transacao.vendedor_id == current_user.id,
+                Transacao.status.in_(status_historico)
+            ),
+            Transacao,
+            cursor=request.args.get('cursor'),
+            per_page=20
+        )
+    except CursorInvalido:
+        abort(400)
 
     return render_template('produtor/vendas.html',
                            reservas=reservas,
                            vendas=vendas_ativas,
-                           historico=historico)
+                           historico=pagina_historico.items,
+                           historico_cursor=pagina_historico.next_cursor,
+                           aba_historico='cursor' in request.args)
 
 @produtor_bp.route('/gerar-guia/<int:trans_id>')
 @login_required
@@ -1,5 +1,7 @@
 from flask import Blueprint, jsonify
+from sqlalchemy.orm import selectinload
 from app.models import Provincia
+from app.services.cache_service import cache_service
 
 utils_api_bp = Blueprint('utils_api', __name__)
 
@@ -10,14 +12,19 @@ def get_geografia():
     Essencial para preencher formulários de registo e filtros no frontend.
     """
     try:
-        provincias = Provincia.query.all()
+        def carregar_geografia():
+            provincias = Provincia.query.options(selectinload(Provincia.municipios)).all()
+            
+            # Usar o to_dict() dos modelos para serializar
+            resultado = []
+            for prov in provincias:
+                prov_dict = prov.to_dict()
+                prov_dict['municipios'] = [mun.to_dict() for mun in prov.municipios]
+                resultado.append(prov_dict)
+            return resultado
         
-        # Usar o to_dict() dos modelos para serializar
-        resultado = []
-        for prov in provincias:
-            prov_dict = prov.to_dict()
-            prov_dict['municipios'] = [mun.to_dict() for mun in prov.municipios]
-            resultado.append(prov_dict)
+        # Quase estático: servido do cache em processo (L1) na maioria dos pedidos
+        resultado = cache_service.obter_geografia(carregar_geografia, 'provincias:completo')
 
         return jsonify({
             "success": True,
@@ -0,0 +1,124 @@
+"""
+Motor de Alertas de Safras AgroKongo.
+Os compradores subscrevem um produto, opcionalmente restrito a uma província e a
+um preço máximo por unidade. Quando uma safra é publicada, a outbox chama
+`notificar_safra` em background: o cruzamento com todas as subscrições e a
+criação das notificações são um único INSERT ... SELECT, sem carregar as
+subscrições para Python nem fazer lazy loads por alerta.
+
+O índice (produto_id, provincia_id, preco_maximo, usuario_id) cobre o cruzamento:
+igualdade no produto e os filtros de província/preço resolvidos no próprio índice.
+"""
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import Boolean, DateTime, String, insert, literal, or_, select
+
+from app.extensions import db
+from app.models import AlertaPreferencia, Notificacao, Produto, Provincia, Safra, Usuario, aware_utcnow
+from app.services import notificacao_service
+
+MAX_ALERTAS_POR_USUARIO = 50
+
+
+def _correspondencias(safra) -> list:
+    """Condições de uma subscrição que casa com a safra (None = qualquer)."""
+    return [
+        AlertaPreferencia.produto_id == safra.produto_id,
+        or_(AlertaPreferencia.provincia_id.is_(None), AlertaPreferencia.provincia_id == safra.provincia_id),
+        or_(AlertaPreferencia.preco_maximo.is_(None), AlertaPreferencia.preco_maximo >= safra.preco_por_unidade),
+        # O próprio produtor pode ter alerta para o produto que vende
+        AlertaPreferencia.usuario_id != safra.produtor_id,
+    ]
+
+
+def notificar_safra(safra_id: int, link: str = None) -> Dict[Tuple, List[int]]:
+    """
+    Cria as notificações de todos os alertas que casam com a safra (não faz commit).
+
+    Returns:
+        {(mensagem, link): [usuario_ids notificados]} (formato da outbox)
+    """
+    safra = db.session.execute(
+        select(Safra.produto_id, Safra.produtor_id, Safra.preco_por_unidade, Usuario.provincia_id,
+               Produto.nome.label('produto'), Provincia.nome.label('provincia'))
+        .join(Produto, Produto.id == Safra.produto_id)
+        .join(Usuario, Usuario.id == Safra.produtor_id)
+        .outerjoin(Provincia, Provincia.id == Usuario.provincia_id)
+        .where(Safra.id == safra_id)).first()
+    if not safra:
+        return {}
+
+    mensagem = f"🚨 Nova safra de {safra.produto} em {safra.provincia or 'Angola'}!"[:255]
+    interessados = select(AlertaPreferencia.usuario_id).where(*_correspondencias(safra)).distinct()
+    linhas = select(
+        interessados.subquery().c.usuario_id,
+        literal(mensagem, String), literal(link, String), literal(False, Boolean),
+        literal(aware_utcnow(), DateTime(timezone=True)),
+    )
+    instrucao = insert(Notificacao).from_select(['usuario_id', 'mensagem', 'link', 'lida', 'data_criacao'], linhas)
+
+    if db.session.get_bind(mapper=Notificacao.__mapper__).dialect.insert_returning:
+        usuarios = db.session.execute(instrucao.returning(Notificacao.usuario_id)).scalars().all()
+    else:
+        db.session.execute(instrucao)
+        usuarios = db.session.execute(interessados).scalars().all()
+    notificacao_service.registar_novas(db.session, ((u, mensagem, link) for u in usuarios))
+    return {(mensagem, link): list(usuarios)} if usuarios else {}
+
+
+class AlertaService:
+    """Gestão das subscrições de alertas de cada utilizador."""
+
+    @staticmethod
+    def listar(usuario_id: int) -> List[AlertaPreferencia]:
+        return AlertaPreferencia.query.filter_by(usuario_id=usuario_id) \
+            .order_by(AlertaPreferencia.id.desc()).all()
+
+    @staticmethod
+    def subscrever(usuario_id: int, produto_id: int, provincia_id: int = None,
+                   preco_maximo=None) -> Tuple[bool, Optional[AlertaPreferencia], str]:
+        """
+        Cria (ou devolve, se já existir igual) uma subscrição de alertas.
+
+        Returns:
+            Tuple[success, alerta, mensagem]
+        """
+        try:
+            if preco_maximo is not None:
+                preco_maximo = Decimal(str(preco_maximo)).quantize(Decimal('0.01'))
+                if preco_maximo <= 0:
+                    return False, None, "O preço máximo deve ser positivo."
+        except (InvalidOperation, ValueError):
+            return False, None, "Preço máximo inválido."
+
+        if not db.session.get(Produto, produto_id):
+            return False, None, "Produto não encontrado."
+        if provincia_id is not None and not db.session.get(Provincia, provincia_id):
+            return False, None, "Província não encontrada."
+
+        existente = AlertaPreferencia.query.filter_by(
+            usuario_id=usuario_id, produto_id=produto_id,
+            provincia_id=provincia_id, preco_maximo=preco_maximo).first()
+        if existente:
+            return True, existente, "Já tem este alerta ativo."
+        if AlertaPreferencia.query.filter_by(usuario_id=usuario_id).count() >= MAX_ALERTAS_POR_USUARIO:
+            return False, None, f"Limite de {MAX_ALERTAS_POR_USUARIO} alertas atingido."
+
+        try:
+            alerta = AlertaPreferencia(usuario_id=usuario_id, produto_id=produto_id,
+                                       provincia_id=provincia_id, preco_maximo=preco_maximo)
+            db.session.add(alerta)
+            db.session.commit()
+            return True, alerta, "Alerta criado. Vai ser avisado de novas safras."
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"ERRO_ALERTA (Usuário {usuario_id}): {e}")
+            return False, None, "Erro técnico ao criar o alerta."
+
+    @staticmethod
+    def remover(usuario_id: int, alerta_id: int) -> Tuple[bool, str]:
+        removidos = AlertaPreferencia.query.filter_by(id=alerta_id, usuario_id=usuario_id).delete()
+        db.session.commit()
+        return (True, "Alerta removido.") if removidos else (False, "Alerta não encontrado.")
@@ -0,0 +1,124 @@
+"""
+Barramento de Invalidação do Cache AgroKongo.
+Listeners de sessão SQLAlchemy que traduzem alterações em Safra, Usuario, Transacao,
+Produto e geografia em tags de cache (`safra:{id}`, `prov:{id}`, `cat:{id}`,
+`vitrine`, `stats`, `produtos`, `geografia`).
+
+As tags são recolhidas em `after_flush` e só aplicadas em `after_commit`:
+um rollback nunca invalida nada e um commit nunca deixa a vitrine desatualizada.
+"""
+from typing import Set
+
+from sqlalchemy import event, inspect as sa_inspect
+
+from app.extensions import db
+from app.models import Safra, Usuario, Transacao, Produto, Provincia, Municipio
+from app.services.cache_service import cache_service
+
+# Colunas do produtor que aparecem nas listagens da vitrine
+CAMPOS_PRODUTOR_VITRINE = ('nome', 'provincia_id', 'municipio_id', 'rating_vendedor', 'tipo')
+
+
+def _valores(obj, atributo: str) -> Set:
+    """Valor atual e valores anteriores (se alterado no flush) de um atributo."""
+    historico = sa_inspect(obj).attrs[atributo].history
+    valores = set(historico.added or ()) | set(historico.unchanged or ()) | set(historico.deleted or ())
+    valores.add(getattr(obj, atributo))
+    return {v for v in valores if v is not None}
+
+
+def _alterado(obj, atributos) -> bool:
+    estado = sa_inspect(obj)
+    return any(estado.attrs[a].history.has_changes() for a in atributos)
+
+
+def _provincia_do_produtor(session, produtor_id):
+    produtor = session.get(Usuario, produtor_id)
+    return produtor.provincia_id if produtor else None
+
+
+def tags_safra(session, safra: Safra) -> Set[str]:
+    tags = {'vitrine'}
+    if safra.id is not None:
+        tags.add(f'safra:{safra.id}')
+    tags.update(f'cat:{pid}' for pid in _valores(safra, 'produto_id'))
+    for produtor_id in _valores(safra, 'produtor_id'):
+        provincia_id = _provincia_do_produtor(session, produtor_id)
+        if provincia_id:
+            tags.add(f'prov:{provincia_id}')
+    return tags
+
+
+def tags_produtor(session, usuario: Usuario) -> Set[str]:
+    """Um produtor renomeado/mudado de província altera todas as listagens onde aparece."""
+    tags = {'vitrine'}
+    tags.update(f'prov:{pid}' for pid in _valores(usuario, 'provincia_id'))
+    linhas = session.query(Safra.id, Safra.produto_id).filter(Safra.produtor_id == usuario.id).all()
+    for safra_id, produto_id in linhas:
+        tags.add(f'safra:{safra_id}')
+        tags.add(f'cat:{produto_id}')
+    return tags
+
+
+def tags_produto(session, produto: Produto) -> Set[str]:
+    """O nome/categoria do produto aparece em todas as listagens das suas safras."""
+    tags = {'produtos', 'vitrine'}
+    if produto.id is None:
+        return tags
+    tags.add(f'cat:{produto.id}')
+    provincias = session.query(Usuario.provincia_id).join(Safra, Safra.produtor_id == Usuario.id) \
+        .filter(Safra.produto_id == produto.id).distinct().all()
+    tags.update(f'prov:{pid}' for (pid,) in provincias if pid)
+    return tags
+
+
+def registar_safra(session, safra_id: int, produto_id: int, produtor_id: int):
+    """Agenda a invalidação de uma safra alterada por UPDATE direto (sem passar pelo flush)."""
+    tags = {'vitrine', f'safra:{safra_id}', f'cat:{produto_id}'}
+    provincia_id = _provincia_do_produtor(session, produtor_id)
+    if provincia_id:
+        tags.add(f'prov:{provincia_id}')
+    session.info.setdefault('cache_tags_pendentes', set()).update(tags)
+
+
+def registar_transacoes(session):
+    """Agenda a invalidação das estatísticas após transações alteradas por UPDATE direto."""
+    session.info.setdefault('cache_tags_pendentes', set()).add('stats')
+
+
+def _after_flush(session, flush_context):
+    tags = session.info.setdefault('cache_tags_pendentes', set())
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Safra):
+                if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+                    continue
+                tags.update(tags_safra(session, obj))
+            elif isinstance(obj, Transacao):
+                tags.add('stats')
+            elif isinstance(obj, Produto):
+                tags.update(tags_produto(session, obj))
+            elif isinstance(obj, (Provincia, Municipio)):
+                tags.add('geografia')
+            elif isinstance(obj, Usuario) and obj not in session.new:
+                if obj.tipo == 'produtor' and _alterado(obj, CAMPOS_PRODUTOR_VITRINE):
+                    tags.update(tags_produtor(session, obj))
+
+
+def _after_commit(session):
+    tags = session.info.pop('cache_tags_pendentes', None)
+    if tags:
+        cache_service.invalidate_tags(*tags)
+
+
+def _after_rollback(session):
+    session.info.pop('cache_tags_pendentes', None)
+
+
+def init_app(app):
+    """Regista os listeners de invalidação na sessão da aplicação."""
+    for nome, listener in (('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, nome, listener):
+            event.listen(db.session, nome, listener)
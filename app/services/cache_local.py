@@ -0,0 +1,100 @@
+"""
+Cache Local (L1) em Processo para AgroKongo.
+LRU limitado por tamanho em bytes e por TTL, à frente do Redis (L2) no CacheService.
+Guarda os objetos já desserializados: um acerto não custa rede nem json.loads.
+
+Os valores devolvidos são partilhados entre pedidos e devem ser tratados como só-leitura.
+"""
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+# Sentinela para distinguir "não existe" de um valor None em cache
+AUSENTE = object()
+
+
+class CacheLocalLRU:
+    """LRU thread-safe com expiração por entrada e limite total em bytes."""
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entradas: int = 10000):
+        self.max_bytes = max_bytes
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        # key -> (valor, tamanho_bytes, expira_em)
+        self._dados: "OrderedDict[str, Tuple[Any, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any:
+        """Devolve o valor ou AUSENTE (expirado conta como ausente)."""
+        with self._lock:
+            entrada = self._dados.get(key)
+            if entrada is None:
+                self.misses += 1
+                return AUSENTE
+            valor, _, expira_em = entrada
+            if time.monotonic() >= expira_em:
+                self._remover(key)
+                self.misses += 1
+                return AUSENTE
+            self._dados.move_to_end(key)
+            self.hits += 1
+            return valor
+
+    def set(self, key: str, valor: Any, tamanho: int, ttl_segundos: float):
+        """Guarda o valor; `tamanho` é o comprimento da forma serializada."""
+        if tamanho > self.max_bytes or ttl_segundos <= 0:
+            return
+        with self._lock:
+            self._remover(key)
+            self._dados[key] = (valor, tamanho, time.monotonic() + ttl_segundos)
+            self._bytes += tamanho
+            while self._bytes > self.max_bytes or len(self._dados) > self.max_entradas:
+                antiga, _ = next(iter(self._dados.items()))
+                self._remover(antiga)
+                self.evictions += 1
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._remover(key))
+
+    def delete_pattern(self, pattern: str) -> int:
+        with self._lock:
+            alvos = [key for key in self._dados if fnmatch.fnmatchcase(key, pattern)]
+            for key in alvos:
+                self._remover(key)
+            return len(alvos)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+            self._bytes = 0
+
+    def keys(self) -> Iterable[str]:
+        with self._lock:
+            return list(self._dados)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entradas': len(self._dados),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+    # Chamar com o lock adquirido
+    def _remover(self, key: str) -> bool:
+        entrada = self._dados.pop(key, None)
+        if entrada is None:
+            return False
+        self._bytes -= entrada[1]
+        return True
@@ -1,23 +1,144 @@
 """
 Serviço de Cache Estratégico para AgroKongo.
 Cache em Redis para vitrine de produtos e dados frequentemente acessados.
+
+Invalidação por tags: cada entrada regista-se em conjuntos `tag:<nome>` (SADD) e
+`invalidate_tags` remove só as entradas afetadas (SMEMBERS + DEL), sem KEYS.
+Cada invalidação incrementa também a geração da tag (`gen:<nome>`): get_or_compute
+lê as gerações antes de calcular e só guarda o resultado se nenhuma mudou entretanto,
+para um cálculo feito antes de um commit nunca ficar em cache depois da invalidação.
+As tags são emitidas pelos listeners em `cache_invalidation.py`.
+
+Proteção contra "stampede" (get_or_compute): as entradas guardam um prazo de
+frescura inferior ao TTL real; quando expira, só o worker que obtém o lock
+(SET NX) recalcula, enquanto os restantes continuam a servir o valor antigo.
+
+Dois níveis: as chaves de POLITICA_L1 ficam também num LRU em processo (L1,
+ver cache_local.py). Remoções são difundidas por pub/sub para todos os workers;
+sem subscritor ativo o L1 fica desligado, para nunca servir dados invalidados.
+
+Degradação controlada: timeouts curtos no cliente e um circuit breaker à frente
+de todas as operações. Com o Redis em baixo, cada chamada devolve o fallback
+em microssegundos (get -> None, get_or_compute -> calcula) em vez de esperar
+pelo timeout do socket. As invalidações que não chegam ao Redis (circuito aberto
+ou erro de ligação) ficam em memória e são repetidas quando o circuito fecha:
+numa falha parcial o Redis mantém os dados e, sem isso, voltaria a servi-los.
 """
 import redis
 import json
-from typing import Optional, List, Dict, Any
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Optional, List, Dict, Any, Callable, Tuple
 from datetime import timedelta
-from decimal import Decimal
 import logging
 
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from app.services.cache_local import CacheLocalLRU, AUSENTE
+from app.utils import json_rapido
+from app.utils.circuit_breaker import CircuitBreaker, FECHADO
+
 logger = logging.getLogger(__name__)
 
+# Só falhas de ligação abrem o circuito; outros erros significam que o Redis respondeu
+ERROS_LIGACAO = (RedisConnectionError, RedisTimeoutError, OSError)
+
 
 class CacheService:
     """Gerencia cache estratégico com Redis."""
     
-    def __init__(self, redis_url: str = 'redis://localhost:6379/0'):
-        self.redis = redis.from_url(redis_url, decode_responses=True)
+    # Os conjuntos de tags vivem mais do que qualquer entrada que referenciam
+    TAG_TTL = timedelta(days=1)
+
+    # Stampede: janela em que um valor expirado ainda pode ser servido e duração do lock
+    STALE_TTL = timedelta(minutes=5)
+    LOCK_TTL = timedelta(seconds=10)
+    ESPERA_MAXIMA_LOCK = 2.0  # segundos que um worker sem lock espera por um valor frio
+
+    # Liberta o lock apenas se ainda pertencer a quem o adquiriu
+    _SCRIPT_LIBERTAR_LOCK = (
+        "if redis.call('get', KEYS[1]) == ARGV[1] then "
+        "return redis.call('del', KEYS[1]) else return 0 end"
+    )
+
+    # Soma só a contadores que existem (em falta, quem lê recalcula-o da BD);
+    # um valor negativo denuncia deriva e também obriga a recalcular
+    _SCRIPT_INCR_EXISTENTE = (
+        "if redis.call('exists', KEYS[1]) == 0 then return false end "
+        "local v = redis.call('incrby', KEYS[1], ARGV[1]) "
+        "if v < 0 then redis.call('del', KEYS[1]) return false end return v"
+    )
+    # Guarda a entrada (e regista-a nas tags) só se as gerações das tags forem as
+    # lidas antes do cálculo. KEYS: entrada, gen:<tag> x n, tag:<tag> x n;
+    # ARGV: valor, TTL, TTL das tags, gerações lidas x n
+    _SCRIPT_GUARDAR_SE_GERACAO = (
+        "local n = (#KEYS - 1) / 2 "
+        "for i = 1, n do "
+        "if (redis.call('get', KEYS[1 + i]) or '0') ~= ARGV[3 + i] then return 0 end end "
+        "redis.call('setex', KEYS[1], ARGV[2], ARGV[1]) "
+        "for i = 1, n do "
+        "redis.call('sadd', KEYS[1 + n + i], KEYS[1]) "
+        "redis.call('expire', KEYS[1 + n + i], ARGV[3]) end "
+        "return 1"
+    )
+    BLOCO_PIPELINE = 1000
+
+    # Invalidações adiadas guardadas em memória; acima do limite, a recuperação
+    # apaga por padrão tudo o que o cache guarda em vez de as repetir uma a uma
+    LIMITE_INVALIDACOES_ADIADAS = 10000
+    PADROES_RECUPERACAO = ('safras:*', 'safra:*', 'stats:*', 'produtos:*', 'geo:*')
+
+    # L1: prefixo da chave -> TTL máximo em processo (segundos)
+    POLITICA_L1 = (
+        ('geo:', 3600),                 # Províncias e municípios: quase estáticos
+        ('produtos:', 600),             # Catálogo de produtos
+        ('safras:disponiveis', 15),     # Vitrine: curto, pub/sub cobre o resto
+    )
+    CANAL_INVALIDACAO = 'cache:invalidacao'
+    RETRY_SUBSCRITOR = 30  # segundos entre tentativas de ligar o subscritor
+
+    def __init__(self, redis_url: str = 'redis://localhost:6379/0',
+                 connect_timeout: float = 0.25, socket_timeout: float = 0.5):
+        self.redis = self._criar_cliente(redis_url, connect_timeout, socket_timeout)
         self.default_ttl = timedelta(minutes=15)
+        self.breaker = CircuitBreaker('redis-cache', limite_falhas=3, tempo_reset=15.0,
+                                      ao_fechar=self._repetir_invalidacoes)
+        self._adiadas = self._sem_adiadas()
+        self._lock_adiadas = threading.Lock()
+
+        self.l1 = CacheLocalLRU()
+        self.l1_habilitado = False  # Ligado por init_app
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self._subscritor = None
+        self._subscritor_pid = None
+        self._proxima_tentativa = 0.0
+        self._lock_subscritor = threading.Lock()
+
+    @staticmethod
+    def _criar_cliente(redis_url: str, connect_timeout: float, socket_timeout: float):
+        return redis.from_url(
+            redis_url, decode_responses=True,
+            socket_connect_timeout=connect_timeout,
+            socket_timeout=socket_timeout,
+            retry_on_timeout=False,
+        )
+
+    def init_app(self, app):
+        """Liga ao Redis configurado e configura o L1 (desligado em testes por defeito)."""
+        if app.config.get('REDIS_URL'):
+            self.redis = self._criar_cliente(
+                app.config['REDIS_URL'],
+                app.config.get('REDIS_CONNECT_TIMEOUT', 0.25),
+                app.config.get('REDIS_SOCKET_TIMEOUT', 0.5),
+            )
+        self.l1_habilitado = app.config.get('CACHE_L1_ENABLED', not app.testing)
+        self.l1.max_bytes = app.config.get('CACHE_L1_MAX_BYTES', self.l1.max_bytes)
+        if self.l1_habilitado:
+            self._garantir_subscritor()
         
     # --- CHAVES PADRONIZADAS ---
     @staticmethod
@@ -26,12 +147,23 @@ class CacheService:
     
     @staticmethod
     def _key_safras_disponiveis(provincia_id: Optional[int] = None, 
-                                  categoria_id: Optional[int] = None) -> str:
+                                  categoria_id: Optional[int] = None,
+                                  page: Optional[int] = None,
+                                  per_page: Optional[int] = None,
+                                  sort: Optional[str] = None,
+                                  termo: Optional[str] = None) -> str:
         key = "safras:disponiveis"
         if provincia_id:
             key += f":prov:{provincia_id}"
         if categoria_id:
             key += f":cat:{categoria_id}"
+        if page is not None:
+            key += f":p:{page}:pp:{per_page}"
+        if sort:
+            key += f":sort:{sort}"
+        if termo:
+            # Hash do termo: chaves curtas e sem caracteres arbitrários do utilizador
+            key += f":q:{hashlib.sha1(termo.strip().lower().encode()).hexdigest()[:16]}"
         return key
     
     @staticmethod
@@ -45,79 +177,555 @@ class CacheService:
     @staticmethod
     def _key_stats_dashboard() -> str:
         return "stats:dashboard:admin"
+
+    @staticmethod
+    def _key_tag(tag: str) -> str:
+        return f"tag:{tag}"
+
+    @staticmethod
+    def _key_geracao(tag: str) -> str:
+        return f"gen:{tag}"
+
+    @staticmethod
+    def _key_lock(key: str) -> str:
+        return f"lock:{key}"
+
+    # --- TAGS DE INVALIDAÇÃO ---
+    @staticmethod
+    def tags_vitrine(provincia_id: Optional[int] = None,
+                     categoria_id: Optional[int] = None) -> List[str]:
+        """
+        Tag de uma listagem da vitrine. Uma alteração emite sempre
+        {vitrine, prov:X, cat:Y}, logo basta a tag do filtro mais específico:
+        a listagem só é invalidada por safras que possam fazer parte dela.
+        """
+        if provincia_id:
+            return [f"prov:{provincia_id}"]
+        if categoria_id:
+            return [f"cat:{categoria_id}"]
+        return ["vitrine"]
     
     # --- SERIALIZAÇÃO INTELIGENTE ---
     @staticmethod
     def _serialize(data: Any) -> str:
-        """Serializa dados para JSON, lidando com Decimal e datetime."""
-        def default_serializer(obj):
-            if isinstance(obj, Decimal):
-                return str(obj)
-            elif hasattr(obj, 'isoformat'):  # datetime
-                return obj.isoformat()
-            return str(obj)
-        
-        return json.dumps(data, default=default_serializer)
+        """Serializa dados para JSON (orjson); Decimal como texto exato, datetime em ISO."""
+        return json_rapido.dumps(data, decimal_como=json_rapido.DECIMAL_TEXTO, estrito=False)
     
     @staticmethod
     def _deserialize(data: str) -> Any:
         """Desserializa JSON para dict/list."""
         if not data:
             return None
-        return json.loads(data)
+        return json_rapido.loads(data)
     
+    # --- CIRCUIT BREAKER ---
+    def _falha(self, operacao: str, erro: Exception):
+        """Regista o erro; só erros de ligação contam para abrir o circuito."""
+        if isinstance(erro, ERROS_LIGACAO):
+            self.breaker.registar_falha()
+        else:
+            self.breaker.registar_sucesso()
+        logger.error(f"Erro ao {operacao}: {erro}")
+
+    # --- INVALIDAÇÕES ADIADAS ---
+    @staticmethod
+    def _sem_adiadas() -> Dict[str, set]:
+        return {'tags': set(), 'keys': set(), 'padroes': set()}
+
+    def _adiar_invalidacao(self, tags=(), keys=(), padroes=()):
+        """Guarda uma invalidação que não chegou ao Redis para a repetir na recuperação."""
+        with self._lock_adiadas:
+            for tipo, valores in (('tags', tags), ('keys', keys), ('padroes', padroes)):
+                self._adiadas[tipo].update(valores)
+            if sum(len(valores) for valores in self._adiadas.values()) > self.LIMITE_INVALIDACOES_ADIADAS:
+                self._adiadas = self._sem_adiadas()
+                self._adiadas['padroes'].update(self.PADROES_RECUPERACAO)
+
+    def _repetir_invalidacoes(self):
+        """Chamado pelo breaker ao fechar: repete as invalidações perdidas enquanto esteve aberto."""
+        with self._lock_adiadas:
+            adiadas, self._adiadas = self._adiadas, self._sem_adiadas()
+        total = sum(len(valores) for valores in adiadas.values())
+        if not total:
+            return
+        logger.warning(f"Redis recuperado: a repetir {total} invalidações adiadas")
+        # Se o circuito voltar a abrir a meio, cada operação volta a adiar o que lhe cabe
+        if adiadas['tags']:
+            self.invalidate_tags(*adiadas['tags'])
+        if adiadas['keys']:
+            self.delete_many(sorted(adiadas['keys']))
+        for padrao in sorted(adiadas['padroes']):
+            self.invalidate_pattern(padrao)
+
+    def ping(self) -> bool:
+        """Verifica o Redis através do breaker (não espera se o circuito estiver aberto)."""
+        if not self.breaker.permitir():
+            return False
+        try:
+            self.redis.ping()
+            self.breaker.registar_sucesso()
+            return True
+        except Exception as e:
+            self._falha("contactar o Redis", e)
+            return False
+
+    # --- CACHE LOCAL (L1) E PUB/SUB ---
+    def _ttl_l1(self, key: str) -> Optional[int]:
+        for prefixo, ttl in self.POLITICA_L1:
+            if key.startswith(prefixo):
+                return ttl
+        return None
+
+    def _l1_ativo(self) -> bool:
+        """O L1 só serve valores enquanto este processo recebe invalidações."""
+        if not self.l1_habilitado:
+            return False
+        if self._subscritor_pid == os.getpid() and self._subscritor and self._subscritor.is_alive():
+            return True
+        return self._garantir_subscritor()
+
+    def _garantir_subscritor(self) -> bool:
+        """(Re)inicia a thread de pub/sub; após fork cada worker cria a sua."""
+        if time.monotonic() < self._proxima_tentativa or self.breaker.estado != FECHADO:
+            return False
+        with self._lock_subscritor:
+            if self._subscritor_pid == os.getpid() and self._subscritor and self._subscritor.is_alive():
+                return True
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self.CANAL_INVALIDACAO: self._on_invalidacao})
+                self._subscritor = pubsub.run_in_thread(
+                    sleep_time=1.0, daemon=True, exception_handler=self._on_erro_subscritor
+                )
+                self._subscritor_pid = os.getpid()
+                self.l1.clear()
+                return True
+            except Exception as e:
+                logger.warning(f"Cache L1 desligado (pub/sub indisponível): {e}")
+                self._proxima_tentativa = time.monotonic() + self.RETRY_SUBSCRITOR
+                return False
+
+    def _on_erro_subscritor(self, erro, pubsub, thread):
+        logger.error(f"Subscritor de invalidação caiu, L1 desligado: {erro}")
+        self.l1.clear()
+        self._proxima_tentativa = time.monotonic() + self.RETRY_SUBSCRITOR
+        thread.stop()
+
+    def _origem(self) -> str:
+        return f"{id(self)}:{os.getpid()}"
+
+    def _on_invalidacao(self, mensagem):
+        try:
+            dados = json.loads(mensagem['data'])
+        except (TypeError, ValueError, KeyError):
+            return
+        if dados.get('origem') == self._origem():
+            return  # Remoção já aplicada localmente
+        if dados.get('keys'):
+            self.l1.delete(*dados['keys'])
+        if dados.get('pattern'):
+            self.l1.delete_pattern(dados['pattern'])
+
+    def _propagar_remocao(self, keys: Optional[List[str]] = None, pattern: Optional[str] = None):
+        """Remove do L1 local e avisa os outros workers (só para chaves elegíveis)."""
+        keys = [key for key in (keys or []) if self._ttl_l1(key) is not None]
+        if keys:
+            self.l1.delete(*keys)
+        if pattern:
+            self.l1.delete_pattern(pattern)
+        if not keys and not pattern:
+            return
+        try:
+            self.redis.publish(self.CANAL_INVALIDACAO, json.dumps(
+                {'origem': self._origem(), 'keys': keys, 'pattern': pattern}
+            ))
+        except Exception as e:
+            self._falha("publicar invalidação", e)
+
+    def _get_bruto(self, key: str) -> Any:
+        """L1 -> Redis. Propaga exceções do Redis (quem chama decide o fallback)."""
+        ttl_l1 = self._ttl_l1(key)
+        usa_l1 = ttl_l1 is not None and self._l1_ativo()
+        if usa_l1:
+            valor = self.l1.get(key)
+            if valor is not AUSENTE:
+                return valor
+
+        data = self.redis.get(key)
+        if data is None:
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        valor = self._deserialize(data)
+        if usa_l1:
+            self.l1.set(key, valor, len(data), ttl_l1)
+        return valor
+
+    def estatisticas(self) -> Dict:
+        """Contadores de acertos/falhas por nível."""
+        total_l2 = self.l2_hits + self.l2_misses
+        return {
+            'l1': dict(self.l1.estatisticas(), ativo=self._l1_ativo()),
+            'l2': {
+                'hits': self.l2_hits,
+                'misses': self.l2_misses,
+                'hit_ratio': round(self.l2_hits / total_l2, 4) if total_l2 else None,
+            },
+            'circuit_breaker': self.breaker.resumo(),
+        }
+
     # --- OPERAÇÕES DE CACHE ---
     def get(self, key: str) -> Optional[Any]:
-        """Obtém valor do cache."""
+        """Obtém valor do cache (L1 em processo, depois Redis)."""
+        if not self.breaker.permitir():
+            return None
         try:
-            data = self.redis.get(key)
-            return self._deserialize(data)
+            valor = self._get_bruto(key)
+            self.breaker.registar_sucesso()
+            return valor
         except Exception as e:
-            logger.error(f"Erro ao obter cache {key}: {e}")
+            self._falha(f"obter cache {key}", e)
             return None
     
-    def set(self, key: str, value: Any, ttl: Optional[timedelta] = None) -> bool:
-        """Armazena valor no cache com TTL."""
+    def set(self, key: str, value: Any, ttl: Optional[timedelta] = None,
+            tags: Optional[List[str]] = None, geracoes: Optional[List[str]] = None) -> bool:
+        """
+        Armazena valor no cache com TTL, associando-o opcionalmente a tags.
+        Com `geracoes` (lidas por `_geracoes(tags)` antes de calcular o valor) só
+        guarda se nenhuma das tags foi invalidada desde essa leitura.
+        """
+        if not self.breaker.permitir():
+            return False
         try:
             serialized = self._serialize(value)
             expire_seconds = int((ttl or self.default_ttl).total_seconds())
-            return self.redis.setex(key, expire_seconds, serialized)
+            if tags and geracoes is not None:
+                tag_ttl = int(self.TAG_TTL.total_seconds())
+                chaves = [key] + [self._key_geracao(tag) for tag in tags] + [self._key_tag(tag) for tag in tags]
+                resultado = bool(self.redis.eval(self._SCRIPT_GUARDAR_SE_GERACAO, len(chaves), *chaves,
+                                                 serialized, expire_seconds, tag_ttl, *geracoes))
+                if not resultado:
+                    logger.debug(f"Cache {key} não guardado: tags invalidadas durante o cálculo")
+                    self.breaker.registar_sucesso()
+                    return False
+            elif tags:
+                # Entrada e tags no mesmo MULTI: nenhuma invalidação corre entre o SETEX e
+                # o SADD, e a invalidação só remove os membros que leu (SREM), nunca o
+                # conjunto, por isso a entrada nunca fica no Redis sem a sua tag
+                pipe = self.redis.pipeline(transaction=True)
+                tag_ttl = int(self.TAG_TTL.total_seconds())
+                pipe.setex(key, expire_seconds, serialized)
+                for tag in tags:
+                    pipe.sadd(self._key_tag(tag), key)
+                    pipe.expire(self._key_tag(tag), tag_ttl)
+                resultado = pipe.execute()[0]
+            else:
+                resultado = self.redis.setex(key, expire_seconds, serialized)
+            ttl_l1 = self._ttl_l1(key)
+            if ttl_l1 is not None and self._l1_ativo():
+                # Os outros workers descartam a cópia antiga; aqui guarda-se a
+                # forma desserializada para L1 e Redis devolverem os mesmos tipos
+                self._propagar_remocao(keys=[key])
+                self.l1.set(key, self._deserialize(serialized), len(serialized),
+                            min(ttl_l1, expire_seconds))
+            self.breaker.registar_sucesso()
+            return resultado
         except Exception as e:
-            logger.error(f"Erro ao definir cache {key}: {e}")
+            self._falha(f"definir cache {key}", e)
             return False
     
     def delete(self, key: str) -> bool:
         """Remove valor do cache."""
+        if not self.breaker.permitir():
+            self.l1.delete(key)
+            self._adiar_invalidacao(keys=[key])
+            return False
         try:
-            return bool(self.redis.delete(key))
+            removida = bool(self.redis.delete(key))
+            self.breaker.registar_sucesso()
+            self._propagar_remocao(keys=[key])
+            return removida
         except Exception as e:
-            logger.error(f"Erro ao deletar cache {key}: {e}")
+            self._falha(f"deletar cache {key}", e)
+            if isinstance(e, ERROS_LIGACAO):
+                self._adiar_invalidacao(keys=[key])
             return False
     
+    def delete_many(self, keys: List[str]) -> int:
+        """Remove várias chaves de uma vez (DEL em blocos)."""
+        keys = list(keys)
+        if not keys:
+            return 0
+        if not self.breaker.permitir():
+            self.l1.delete(*keys)
+            self._adiar_invalidacao(keys=keys)
+            return 0
+        try:
+            total = 0
+            for inicio in range(0, len(keys), self.BLOCO_PIPELINE):
+                total += self.redis.delete(*keys[inicio:inicio + self.BLOCO_PIPELINE])
+            self.breaker.registar_sucesso()
+            self._propagar_remocao(keys=keys)
+            return total
+        except Exception as e:
+            self._falha("deletar várias chaves", e)
+            if isinstance(e, ERROS_LIGACAO):
+                self._adiar_invalidacao(keys=keys)
+            return 0
+
     def exists(self, key: str) -> bool:
         """Verifica se chave existe no cache."""
+        if not self.breaker.permitir():
+            return False
         try:
-            return self.redis.exists(key) > 0
+            existe = self.redis.exists(key) > 0
+            self.breaker.registar_sucesso()
+            return existe
         except Exception as e:
-            logger.error(f"Erro ao verificar cache {key}: {e}")
+            self._falha(f"verificar cache {key}", e)
             return False
     
-    def invalidate_pattern(self, pattern: str) -> int:
-        """Invalida todas as chaves que match com um padrão."""
+    def invalidate_pattern(self, pattern: str, batch_size: int = 500) -> int:
+        """
+        Invalida todas as chaves que match com um padrão.
+        Usa SCAN incremental (não bloqueia o Redis como KEYS) e apaga em lotes.
+        """
+        if not self.breaker.permitir():
+            self._adiar_invalidacao(padroes=[pattern])
+            return 0
         try:
-            keys = self.redis.keys(pattern)
-            if keys:
-                return self.redis.delete(*keys)
+            total = 0
+            lote = []
+            for key in self.redis.scan_iter(match=pattern, count=batch_size):
+                lote.append(key)
+                if len(lote) >= batch_size:
+                    total += self.redis.delete(*lote)
+                    lote = []
+            if lote:
+                total += self.redis.delete(*lote)
+            self.breaker.registar_sucesso()
+            self._propagar_remocao(pattern=pattern)
+            return total
+        except Exception as e:
+            self._falha(f"invalidar padrão {pattern}", e)
+            if isinstance(e, ERROS_LIGACAO):
+                self._adiar_invalidacao(padroes=[pattern])
             return 0
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """
+        Remove todas as entradas associadas às tags.
+        Tira dos conjuntos só os membros lidos (SREM): uma entrada registada por um
+        `set` concorrente depois do SMEMBERS continua na tag para a próxima invalidação.
+        """
+        tags = sorted({tag for tag in tags if tag})
+        if not tags:
+            return 0
+        if not self.breaker.permitir():
+            self._adiar_invalidacao(tags=tags)
+            return 0
+        try:
+            tag_keys = [self._key_tag(tag) for tag in tags]
+            pipe = self.redis.pipeline(transaction=False)
+            for tag_key in tag_keys:
+                pipe.smembers(tag_key)
+            por_tag = {tag_key: grupo for tag_key, grupo in zip(tag_keys, pipe.execute()) if grupo}
+            membros = set().union(*por_tag.values())
+
+            # A geração muda sempre, mesmo sem membros: um cálculo em curso (ainda
+            # sem entrada no conjunto) deixa de poder guardar o seu resultado
+            pipe = self.redis.pipeline(transaction=True)
+            if membros:
+                pipe.delete(*membros)
+            for tag_key, grupo in por_tag.items():
+                pipe.srem(tag_key, *grupo)
+            tag_ttl = int(self.TAG_TTL.total_seconds())
+            for tag in tags:
+                pipe.incr(self._key_geracao(tag))
+                pipe.expire(self._key_geracao(tag), tag_ttl)
+            resultados = pipe.execute()
+            removidas = resultados[0] if membros else 0
+            self.breaker.registar_sucesso()
+            self._propagar_remocao(keys=list(membros))
+            logger.debug(f"Invalidação por tags {tags}: {removidas} entradas")
+            return removidas
         except Exception as e:
-            logger.error(f"Erro ao invalidar padrão {pattern}: {e}")
+            self._falha(f"invalidar tags {tags}", e)
+            if isinstance(e, ERROS_LIGACAO):
+                self._adiar_invalidacao(tags=tags)
             return 0
     
+    # --- CONTADORES E PUB/SUB (fora do L1) ---
+    def obter_contador(self, key: str) -> Optional[int]:
+        """Valor inteiro guardado em `key`, ou None (em falta ou Redis indisponível)."""
+        if not self.breaker.permitir():
+            return None
+        try:
+            valor = self.redis.get(key)
+            self.breaker.registar_sucesso()
+            return int(valor) if valor is not None else None
+        except Exception as e:
+            self._falha(f"obter contador {key}", e)
+            return None
+
+    def definir_contador(self, key: str, valor: int, ttl: timedelta, apenas_se_ausente: bool = True) -> bool:
+        if not self.breaker.permitir():
+            return False
+        try:
+            definido = self.redis.set(key, int(valor), ex=int(ttl.total_seconds()), nx=apenas_se_ausente)
+            self.breaker.registar_sucesso()
+            return bool(definido)
+        except Exception as e:
+            self._falha(f"definir contador {key}", e)
+            return False
+
+    def ajustar_contadores(self, deltas: Dict[str, int]) -> Dict[str, int]:
+        """
+        INCRBY atómico apenas nos contadores existentes.
+
+        Returns:
+            {key: novo valor} dos contadores ajustados
+        """
+        if not deltas or not self.breaker.permitir():
+            return {}
+        novos = {}
+        try:
+            itens = [(k, d) for k, d in deltas.items() if d]
+            for inicio in range(0, len(itens), self.BLOCO_PIPELINE):
+                bloco = itens[inicio:inicio + self.BLOCO_PIPELINE]
+                pipe = self.redis.pipeline(transaction=False)
+                for key, delta in bloco:
+                    pipe.eval(self._SCRIPT_INCR_EXISTENTE, 1, key, delta)
+                for (key, _), valor in zip(bloco, pipe.execute()):
+                    if valor is not None:
+                        novos[key] = int(valor)
+            self.breaker.registar_sucesso()
+        except Exception as e:
+            self._falha("ajustar contadores", e)
+        return novos
+
+    def publicar(self, mensagens: List[Tuple[str, str]]) -> bool:
+        """PUBLISH de (canal, mensagem) em pipeline."""
+        if not mensagens or not self.breaker.permitir():
+            return False
+        try:
+            for inicio in range(0, len(mensagens), self.BLOCO_PIPELINE):
+                pipe = self.redis.pipeline(transaction=False)
+                for canal, mensagem in mensagens[inicio:inicio + self.BLOCO_PIPELINE]:
+                    pipe.publish(canal, mensagem)
+                pipe.execute()
+            self.breaker.registar_sucesso()
+            return True
+        except Exception as e:
+            self._falha("publicar mensagens", e)
+            return False
+
+    def subscrever(self, *canais: str):
+        """PubSub já subscrito aos canais (quem chama fecha-o), ou None sem Redis."""
+        if not self.breaker.permitir():
+            return None
+        try:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(*canais)
+            self.breaker.registar_sucesso()
+            return pubsub
+        except Exception as e:
+            self._falha(f"subscrever {canais}", e)
+            return None
+
+    # --- RECÁLCULO PROTEGIDO CONTRA STAMPEDE ---
+    def _adquirir_lock(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        ms = int(self.LOCK_TTL.total_seconds() * 1000)
+        if self.redis.set(self._key_lock(key), token, nx=True, px=ms):
+            return token
+        return None
+
+    def _libertar_lock(self, key: str, token: str):
+        try:
+            self.redis.eval(self._SCRIPT_LIBERTAR_LOCK, 1, self._key_lock(key), token)
+        except Exception as e:
+            self._falha(f"libertar lock {key}", e)
+
+    def _geracoes(self, tags: List[str]) -> List[str]:
+        """Geração atual de cada tag ('0' se nunca foi invalidada). Propaga exceções do Redis."""
+        valores = self.redis.mget([self._key_geracao(tag) for tag in tags])
+        return [str(valor) if valor is not None else '0' for valor in valores]
+
+    def _guardar_envelope(self, key: str, value: Any, ttl: timedelta,
+                          tags: Optional[List[str]] = None,
+                          geracoes: Optional[List[str]] = None) -> bool:
+        envelope = {'v': value, 'fresco_ate': time.time() + ttl.total_seconds()}
+        return self.set(key, envelope, ttl=ttl + self.STALE_TTL, tags=tags, geracoes=geracoes)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any],
+                       ttl: Optional[timedelta] = None,
+                       tags: Optional[List[str]] = None) -> Any:
+        """
+        Devolve o valor em cache ou calcula-o uma única vez entre todos os workers.
+
+        - Valor fresco: devolvido diretamente.
+        - Valor expirado (dentro de STALE_TTL): quem obtém o lock recalcula,
+          os restantes servem o valor antigo sem esperar.
+        - Sem valor: quem obtém o lock calcula, os restantes esperam até
+          ESPERA_MAXIMA_LOCK pelo resultado antes de calcularem por conta própria.
+        - Redis indisponível (ou circuito aberto): calcula sempre, sem esperar.
+
+        Com tags, as gerações são lidas antes de calcular: se um commit invalidar
+        uma das tags durante o cálculo, o valor é devolvido mas não fica em cache.
+        """
+        ttl = ttl or self.default_ttl
+        if not self.breaker.permitir():
+            return compute()
+        try:
+            envelope = self._get_bruto(key)
+            self.breaker.registar_sucesso()
+        except Exception as e:
+            self._falha(f"obter cache {key}", e)
+            return compute()
+
+        if envelope and time.time() < envelope.get('fresco_ate', 0):
+            return envelope.get('v')
+
+        try:
+            token = self._adquirir_lock(key)
+        except Exception as e:
+            self._falha(f"adquirir lock {key}", e)
+            return compute()
+
+        if token:
+            try:
+                geracoes = self._geracoes(tags) if tags else None
+            except Exception as e:
+                self._libertar_lock(key, token)
+                self._falha(f"ler gerações {tags}", e)
+                return compute()
+            try:
+                valor = compute()
+                self._guardar_envelope(key, valor, ttl, tags, geracoes)
+                return valor
+            finally:
+                self._libertar_lock(key, token)
+
+        if envelope:
+            # Outro worker já está a recalcular: servir o valor antigo
+            return envelope.get('v')
+
+        limite = time.monotonic() + self.ESPERA_MAXIMA_LOCK
+        while time.monotonic() < limite and self.breaker.estado == FECHADO:
+            time.sleep(0.05)
+            envelope = self.get(key)
+            if envelope:
+                return envelope.get('v')
+
+        logger.warning(f"Timeout à espera do recálculo de {key}; a calcular localmente")
+        return compute()
+
     # --- MÉTODOS ESPECÍFICOS PARA SAFRAS ---
     def cache_safra(self, safra_data: Dict) -> bool:
         """Cache de dados de uma safra específica."""
         key = self._key_safra(safra_data['id'])
-        return self.set(key, safra_data, ttl=timedelta(minutes=30))
+        return self.set(key, safra_data, ttl=timedelta(hours=2), tags=[key])
     
     def get_safra(self, safra_id: int) -> Optional[Dict]:
         """Obtém safra do cache."""
@@ -130,15 +738,42 @@ class CacheService:
     def cache_safras_disponiveis(self, safras: List[Dict], 
                                    provincia_id: Optional[int] = None,
                                    categoria_id: Optional[int] = None) -> bool:
-        """Cache da lista de safras disponíveis."""
+        """
+        Cache da lista de safras disponíveis.
+        TTL longo: a invalidação por tags remove a entrada assim que o stock muda.
+        """
         key = self._key_safras_disponiveis(provincia_id, categoria_id)
-        return self.set(key, safras, ttl=timedelta(minutes=10))
+        return self.set(key, safras, ttl=timedelta(hours=1),
+                        tags=self.tags_vitrine(provincia_id, categoria_id))
     
     def get_safras_disponiveis(self, provincia_id: Optional[int] = None,
                                 categoria_id: Optional[int] = None) -> Optional[List[Dict]]:
         """Obtém lista de safras do cache."""
         return self.get(self._key_safras_disponiveis(provincia_id, categoria_id))
     
+    def obter_vitrine(self, compute: Callable[[], Dict],
+                      provincia_id: Optional[int] = None,
+                      categoria_id: Optional[int] = None,
+                      page: int = 1, per_page: int = 12,
+                      sort: Optional[str] = None,
+                      termo: Optional[str] = None) -> Dict:
+        """
+        Página da vitrine com chave completa (filtros, página, ordenação e termo)
+        e recálculo protegido contra stampede.
+        """
+        key = self._key_safras_disponiveis(provincia_id, categoria_id, page, per_page, sort, termo)
+        return self.get_or_compute(key, compute, ttl=timedelta(hours=1),
+                                   tags=self.tags_vitrine(provincia_id, categoria_id))
+    
+    # --- DADOS QUASE ESTÁTICOS (SERVIDOS PELO L1) ---
+    def obter_geografia(self, compute: Callable[[], List[Dict]], chave: str = 'provincias') -> List[Dict]:
+        """Províncias/municípios (geo:<chave>), invalidados pela tag 'geografia'."""
+        return self.get_or_compute(f"geo:{chave}", compute, ttl=timedelta(hours=24), tags=["geografia"])
+    
+    def obter_produtos(self, compute: Callable[[], List[Dict]]) -> List[Dict]:
+        """Catálogo de produtos, invalidado pela tag 'produtos'."""
+        return self.get_or_compute("produtos:catalogo", compute, ttl=timedelta(hours=6), tags=["produtos"])
+    
     def invalidate_safras_cache(self) -> int:
         """Invalida todo cache de safras (útil quando há nova safra)."""
         return self.invalidate_pattern("safras:*")
@@ -146,7 +781,7 @@ class CacheService:
     # --- CACHE DE ESTATÍSTICAS DO DASHBOARD ---
     def cache_dashboard_stats(self, stats: Dict) -> bool:
         """Cache de estatísticas do dashboard admin."""
-        return self.set(self._key_stats_dashboard(), stats, ttl=timedelta(minutes=5))
+        return self.set(self._key_stats_dashboard(), stats, ttl=timedelta(minutes=5), tags=["stats"])
     
     def get_dashboard_stats(self) -> Optional[Dict]:
         """Obtém estatísticas do cache."""
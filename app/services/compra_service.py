@@ -9,31 +9,63 @@ from flask import current_app
 
 from app.extensions import db
 from app.models import (
-    Transacao, Safra, Usuario, Notificacao, 
+    Transacao, Usuario, Notificacao, 
     LogAuditoria, HistoricoStatus, TransactionStatus
 )
+from app.services.reserva_service import ReservaService, MSG_SAFRA_NAO_ENCONTRADA, MSG_AUTO_COMPRA
+from app.services.maquina_estados import MaquinaEstados
 from app.utils.status_helper import status_to_value
 
+MSG_ERRO_TECNICO = "Erro técnico ao processar a encomenda."
+
 
 class CompraService:
     """Serviço responsável por gerir todo o ciclo de vida de uma compra."""
     
+    # Mensagens com código HTTP próprio nas APIs (as restantes recusas são 400)
+    ERROS_HTTP = {
+        MSG_SAFRA_NAO_ENCONTRADA: 404,
+        MSG_AUTO_COMPRA: 403,
+        MSG_ERRO_TECNICO: 500,
+    }
+
+    @staticmethod
+    def codigo_http(mensagem: str) -> int:
+        """Código HTTP de uma recusa de iniciar_compra, para as rotas de API."""
+        return CompraService.ERROS_HTTP.get(mensagem, 400)
+
     @staticmethod
-    def iniciar_compra(safra_id: int, comprador_id: int, quantidade: Decimal) -> Tuple[bool, Optional[Transacao], str]:
+    def iniciar_compra(safra_id: int, comprador_id: int, quantidade, ip: Optional[str] = None,
+                       origem: str = "COMPRA_INICIADA") -> Tuple[bool, Optional[Transacao], str]:
         """
         Inicia uma nova compra no marketplace.
+        Caminho único de compra (web, API de sessão, APIs JWT e TransactionService):
+        1. validações sem lock; 2. abate atómico do stock (ReservaService);
+        3. Transacao + HistoricoStatus e commit; 4. auditoria e notificação ao produtor
+        num commit próprio, fora da secção crítica.
         
         Args:
             safra_id: ID da safra a ser comprada
             comprador_id: ID do comprador
-            quantidade: Quantidade a ser comprada
+            quantidade: Quantidade a ser comprada (Decimal, número ou texto)
+            ip: IP do pedido, para a auditoria
+            origem: Ação registada no LogAuditoria
             
         Returns:
             Tuple[success, transacao, mensagem]
         """
         try:
             # 1. Validações preliminares
-            comprador = Usuario.query.get(comprador_id)
+            try:
+                quantidade = Decimal(str(quantidade).replace(',', '.'))
+                comprador_id = int(comprador_id)
+            except (InvalidOperation, TypeError, ValueError):
+                return False, None, "Valores numéricos inválidos."
+            
+            if not quantidade.is_finite() or quantidade <= 0:
+                return False, None, "A quantidade deve ser maior que zero."
+            
+            comprador = db.session.get(Usuario, comprador_id)
             if not comprador:
                 return False, None, "Comprador não encontrado."
             
@@ -43,67 +75,44 @@ class CompraService:
             if not comprador.conta_validada or not comprador.perfil_completo:
                 return False, None, "Complete seu perfil para realizar compras."
             
-            # 2. Obter safra com lock pessimista
-            safra = Safra.query.with_for_update().get(safra_id)
-            if not safra:
-                return False, None, "Safra não encontrada."
-            
-            # 3. Validações de stock
-            if safra.produtor_id == comprador_id:
-                return False, None, "Não pode comprar a sua própria safra."
-            
-            if quantidade <= 0:
-                return False, None, "A quantidade deve ser maior que zero."
-            
-            if quantidade > safra.quantidade_disponivel:
-                return False, None, f"Quantidade indisponível. Máximo: {safra.quantidade_disponivel}kg"
+            # 2. Abater stock com UPDATE condicional (sem SELECT ... FOR UPDATE prévio)
+            sucesso, reserva, mensagem = ReservaService.reservar(safra_id, comprador_id, quantidade)
+            if not sucesso:
+                db.session.rollback()
+                return False, None, mensagem
             
-            # 4. Cálculos financeiros
-            valor_total = (quantidade * safra.preco_por_unidade).quantize(Decimal('0.01'))
-            
-            # 5. Criar transação
+            # 3. Transação e histórico (preço devolvido pelo próprio UPDATE)
+            valor_total = (quantidade * reserva.preco_por_unidade).quantize(Decimal('0.01'))
+            pendente = status_to_value(TransactionStatus.PENDENTE)
             nova_transacao = Transacao(
-                safra_id=safra.id,
+                safra_id=reserva.id,
                 comprador_id=comprador_id,
-                vendedor_id=safra.produtor_id,
+                vendedor_id=reserva.produtor_id,
                 quantidade_comprada=quantidade,
                 valor_total_pago=valor_total,
-                status=status_to_value(TransactionStatus.PENDENTE)
+                status=pendente
             )
-            
-            # 6. Abater stock
-            safra.quantidade_disponivel -= quantidade
-            if safra.quantidade_disponivel <= 0:
-                safra.status = 'esgotado'
-            
-            # Adicionar transação à sessão primeiro
             db.session.add(nova_transacao)
-            
-            # Fazer flush para gerar o ID da transação
-            db.session.flush()
-            
-            # 7. Registar histórico (agora com ID disponível)
-            nova_transacao.mudar_status(status_to_value(TransactionStatus.PENDENTE), "Reserva criada pelo comprador.")
-            
-            # 8. Log de auditoria
-            db.session.add(LogAuditoria(
-                usuario_id=comprador_id,
-                acao="COMPRA_INICIADA",
-                detalhes=f"Ref: {nova_transacao.fatura_ref} | Qtd: {quantidade} | Safra: {safra.id}",
-                ip=None  # Será preenchido pela rota
+            db.session.add(HistoricoStatus(
+                transacao=nova_transacao,
+                status_anterior=None,
+                status_novo=pendente,
+                observacao="Reserva criada pelo comprador."
             ))
             
-            # Commit explícito para persistir alterações
+            # Commit explícito: liberta a linha da safra o mais cedo possível
             db.session.commit()
             
+            # 4. Auditoria e notificação ao produtor fora da secção crítica
+            ReservaService.registar_efeitos(nova_transacao, quantidade, acao=origem, ip=ip,
+                                            notificar_produtor=True)
+            
             return True, nova_transacao, f"Reserva {nova_transacao.fatura_ref} efetuada!"
             
-        except InvalidOperation as e:
-            current_app.logger.error(f"Erro de conversão numérica: {str(e)}")
-            return False, None, "Valores numéricos inválidos."
         except Exception as e:
+            db.session.rollback()
             current_app.logger.error(f"Erro ao iniciar compra: {str(e)}")
-            return False, None, "Erro técnico ao processar a encomenda."
+            return False, None, MSG_ERRO_TECNICO
     
     @staticmethod
     def aceitar_reserva(transacao_id: int, produtor_id: int) -> Tuple[bool, Optional[str]]:
@@ -130,7 +139,7 @@ class CompraService:
                 return False, "Esta reserva já não está pendente."
             
             # Atualizar status
-            venda.mudar_status(status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), "Aceite pelo produtor")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), "Aceite pelo produtor")
             
             # Notificar comprador
             db.session.add(Notificacao(
@@ -180,18 +189,11 @@ class CompraService:
             if venda.status != status_to_value(TransactionStatus.PENDENTE):
                 return False, "Só é possível recusar reservas pendentes."
             
-            # Devolver stock
-            if venda.safra:
-                venda.safra.quantidade_disponivel += venda.quantidade_comprada
-            else:
-                # Carregar safra se não estiver disponível
-                from app.models import Safra
-                safra = Safra.query.get(venda.safra_id)
-                if safra:
-                    safra.quantidade_disponivel += venda.quantidade_comprada
+            # Devolver stock (incremento atómico; reativa a safra se estava esgotada)
+            ReservaService.devolver(venda.safra_id, venda.quantidade_comprada)
             
             # Atualizar status
-            venda.mudar_status(status_to_value(TransactionStatus.CANCELADO), "Recusada pelo produtor")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.CANCELADO), "Recusada pelo produtor")
             
             # Notificar comprador
             db.session.add(Notificacao(
@@ -232,7 +234,7 @@ class CompraService:
                 return False, "O pagamento deve ser confirmado primeiro."
             
             # Atualizar status
-            transacao.mudar_status(status_to_value(TransactionStatus.ENVIADO), "Mercadoria enviada pelo produtor.")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.ENVIADO), "Mercadoria enviada pelo produtor.")
             transacao.data_envio = datetime.now(timezone.utc)
             
             # Calcular previsão de entrega
@@ -285,7 +287,7 @@ class CompraService:
                 return False, "Esta encomenda não está em estado de receção."
             
             # Atualizar status
-            transacao.mudar_status(status_to_value(TransactionStatus.FINALIZADO), "Entrega confirmada pelo comprador")
+            MaquinaEstados.transitar(transacao, status_to_value(TransactionStatus.FINALIZADO), "Entrega confirmada pelo comprador")
             transacao.data_entrega = datetime.now(timezone.utc)
             transacao.data_liquidacao = datetime.now(timezone.utc)
             
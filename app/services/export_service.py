@@ -0,0 +1,222 @@
+"""
+Motor de Exportação Financeira AgroKongo.
+Gera o relatório de conciliação (Excel ou CSV) em memória constante:
+- as transações são lidas em lotes (`yield_per`) com o vendedor já carregado (sem N+1);
+- o Excel é escrito linha a linha pelo xlsxwriter em modo `constant_memory` para ficheiro;
+- o CSV é produzido por um gerador e enviado ao cliente à medida que é lido.
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, Optional, Tuple
+
+import xlsxwriter
+from flask import Response, send_file, stream_with_context
+from sqlalchemy.orm import contains_eager, load_only
+
+from app.models import Transacao, Usuario
+from app.utils.status_helper import get_all_status_values
+
+TAMANHO_LOTE = 1000
+FORMATOS = ('xlsx', 'csv')
+
+# (cabeçalho, largura, formato da coluna no Excel)
+COLUNAS = (
+    ('ID OPERAÇÃO', 14, 'texto'),
+    ('DATA VALOR', 14, 'data'),
+    ('REF. FATURA', 16, 'texto'),
+    ('PRODUTOR', 30, 'texto'),
+    ('NIF PRODUTOR', 15, 'texto'),
+    ('IBAN DE DESTINO', 28, 'texto'),
+    ('VALOR BRUTO (Kz)', 20, 'dinheiro'),
+    ('TAXA SERVIÇO (Kz)', 20, 'dinheiro'),
+    ('VALOR LÍQUIDO (Kz)', 20, 'dinheiro'),
+    ('STATUS PAGAMENTO', 20, 'texto'),
+)
+LINHA_CABECALHO = 5
+
+
+def validar_filtros(args) -> Tuple[Dict, Optional[str]]:
+    """
+    Lê os filtros do pedido (data_inicio, data_fim em AAAA-MM-DD e status).
+
+    Returns:
+        Tuple[filtros, mensagem_de_erro]
+    """
+    filtros = {}
+    try:
+        for campo in ('data_inicio', 'data_fim'):
+            if args.get(campo):
+                filtros[campo] = datetime.strptime(args[campo], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return {}, "Datas inválidas. Use o formato AAAA-MM-DD."
+
+    if filtros.get('data_inicio') and filtros.get('data_fim') and filtros['data_inicio'] > filtros['data_fim']:
+        return {}, "A data inicial não pode ser posterior à data final."
+
+    status = args.get('status')
+    if status:
+        if status not in get_all_status_values():
+            return {}, f"Status inválido: '{status}'."
+        filtros['status'] = status
+    return filtros, None
+
+
+def consulta_transacoes(data_inicio=None, data_fim=None, status=None):
+    """Transações do relatório, por ordem de id, com o vendedor carregado no mesmo SELECT."""
+    query = Transacao.query.join(Transacao.vendedor).options(
+        load_only(Transacao.id, Transacao.data_criacao, Transacao.fatura_ref, Transacao.status,
+                  Transacao.valor_total_pago, Transacao.comissao_plataforma),
+        contains_eager(Transacao.vendedor).load_only(Usuario.nome, Usuario.nif, Usuario.iban),
+    )
+    if data_inicio:
+        query = query.filter(Transacao.data_criacao >= data_inicio)
+    if data_fim:
+        # Data final inclusiva (até ao fim do dia)
+        query = query.filter(Transacao.data_criacao < data_fim + timedelta(days=1))
+    if status:
+        query = query.filter(Transacao.status == status)
+    return query.order_by(Transacao.id).yield_per(TAMANHO_LOTE)
+
+
+def linhas_financeiras(**filtros) -> Iterator[tuple]:
+    """Uma tupla por transação, na ordem de COLUNAS."""
+    for v in consulta_transacoes(**filtros):
+        bruto = float(v.valor_total_pago)
+        comissao = float(v.comissao_plataforma or 0)
+        yield (
+            f"AGK-{v.id:06d}",
+            v.data_criacao,
+            v.fatura_ref or "S/REF",
+            v.vendedor.nome.upper(),
+            v.vendedor.nif or 'CONSULTAR',
+            v.vendedor.iban or 'PENDENTE',
+            bruto,
+            comissao,
+            bruto - comissao,
+            (v.status or '').replace('_', ' ').upper(),
+        )
+
+
+def _descricao_periodo(data_inicio=None, data_fim=None, **_) -> str:
+    inicio = data_inicio.strftime('%d/%m/%Y') if data_inicio else None
+    fim = (data_fim or datetime.now()).strftime('%d/%m/%Y')
+    return f'Período: {inicio} a {fim}' if inicio else f'Período: Até {fim}'
+
+
+def escrever_excel(destino, progresso=None, **filtros) -> int:
+    """
+    Escreve o relatório em xlsx no caminho/ficheiro `destino`.
+
+    Args:
+        destino: Caminho ou objeto ficheiro (o xlsxwriter só guarda uma linha em memória)
+        progresso: Callback opcional chamado com o número de linhas escritas
+
+    Returns:
+        Número de transações exportadas
+    """
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True, 'remove_timezone': True})
+    worksheet = workbook.add_worksheet('Dashboard_Financeiro')
+
+    header_fmt = workbook.add_format({
+        'bold': True, 'bg_color': '#1B4332', 'font_color': 'white',
+        'border': 1, 'align': 'center', 'valign': 'vcenter', 'font_size': 11
+    })
+    formatos = {
+        'dinheiro': workbook.add_format({'num_format': '#,##0.00" Kz"', 'border': 1, 'font_size': 10}),
+        'data': workbook.add_format({'num_format': 'dd/mm/yyyy', 'border': 1, 'align': 'center'}),
+        'texto': workbook.add_format({'border': 1, 'font_size': 10}),
+    }
+    title_fmt = workbook.add_format({'bold': True, 'font_size': 18, 'font_color': '#1B4332'})
+    label_fmt = workbook.add_format({'bold': True, 'bg_color': '#F8F9FA', 'border': 1})
+
+    for indice, (_, largura, formato) in enumerate(COLUNAS):
+        worksheet.set_column(indice, indice, largura, formatos[formato])
+
+    # Em constant_memory as linhas têm de ser escritas por ordem: o sumário usa
+    # intervalos abertos porque o total de linhas só é conhecido no fim
+    worksheet.write('A1', 'AGROKONGO - RELATÓRIO DE CONCILIAÇÃO FINANCEIRA', title_fmt)
+    worksheet.write('A2', _descricao_periodo(**filtros))
+    worksheet.write('A3', 'Finalidade: Instrução de Transferência / Auditoria AGT')
+    worksheet.write('F3', 'TOTAL EM CUSTÓDIA', label_fmt)
+    worksheet.write_formula('G3', f'=SUM(G{LINHA_CABECALHO + 2}:G1048576)', formatos['dinheiro'])
+    worksheet.write('H3', 'LÍQUIDO A PAGAR', label_fmt)
+    worksheet.write_formula('I3', f'=SUM(I{LINHA_CABECALHO + 2}:I1048576)', formatos['dinheiro'])
+
+    for indice, (cabecalho, _, _) in enumerate(COLUNAS):
+        worksheet.write(LINHA_CABECALHO, indice, cabecalho, header_fmt)
+
+    total = 0
+    for total, linha in enumerate(linhas_financeiras(**filtros), start=1):
+        row = LINHA_CABECALHO + total
+        for indice, (valor, (_, _, formato)) in enumerate(zip(linha, COLUNAS)):
+            if formato == 'data' and valor is not None:
+                worksheet.write_datetime(row, indice, valor, formatos['data'])
+            else:
+                worksheet.write(row, indice, valor, formatos[formato])
+        if progresso and total % TAMANHO_LOTE == 0:
+            progresso(total)
+
+    if total:
+        ultima = LINHA_CABECALHO + total
+        worksheet.conditional_format(LINHA_CABECALHO + 1, 9, ultima, 9, {
+            'type': 'text', 'criteria': 'containing', 'value': 'PAGO',
+            'format': workbook.add_format({'bg_color': '#DFF0D8', 'font_color': '#3C763D'})
+        })
+
+    workbook.close()
+    return total
+
+
+def gerar_csv(progresso=None, **filtros) -> Iterator[str]:
+    """
+    Gera o relatório em CSV (separador ';', compatível com Excel PT) em blocos de texto.
+    `progresso` é chamado a cada bloco e, no fim, com o total de linhas escritas.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+
+    buffer.write('\ufeff')  # BOM: o Excel abre acentos corretamente
+    escritor.writerow([cabecalho for cabecalho, _, _ in COLUNAS])
+
+    total = 0
+    for total, linha in enumerate(linhas_financeiras(**filtros), start=1):
+        linha = list(linha)
+        linha[1] = linha[1].strftime('%d/%m/%Y') if linha[1] else ''
+        linha[6:9] = [f'{valor:.2f}' for valor in linha[6:9]]
+        escritor.writerow(linha)
+        if total % TAMANHO_LOTE == 0:
+            if progresso:
+                progresso(total)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    if progresso:
+        progresso(total)
+    yield buffer.getvalue()
+
+
+def nome_ficheiro(formato: str) -> str:
+    return f"AGROKONGO_FINANCEIRO_{datetime.now().strftime('%d_%m_%Y')}.{formato}"
+
+
+def resposta_download(formato: str, filtros: Dict) -> Response:
+    """Resposta HTTP do relatório: CSV em streaming ou xlsx escrito para ficheiro temporário."""
+    if formato == 'csv':
+        resposta = Response(stream_with_context(gerar_csv(**filtros)), mimetype='text/csv; charset=utf-8')
+        resposta.headers['Content-Disposition'] = f'attachment; filename="{nome_ficheiro("csv")}"'
+        return resposta
+
+    descritor, caminho = tempfile.mkstemp(suffix='.xlsx', prefix='agk_export_')
+    os.close(descritor)
+    try:
+        escrever_excel(caminho, **filtros)
+    except Exception:
+        os.remove(caminho)
+        raise
+    resposta = send_file(caminho, as_attachment=True, download_name=nome_ficheiro('xlsx'))
+    resposta.call_on_close(lambda: os.path.exists(caminho) and os.remove(caminho))
+    return resposta
@@ -0,0 +1,313 @@
+"""
+Serviço de Faturas AgroKongo.
+Geração do PDF da fatura (QR code de verificação + template HTML + motor de PDF),
+partilhada pela rota de download e pelos jobs de relatórios.
+
+Depois do pagamento os dados impressos na fatura já não mudam: o PDF é gerado uma
+vez (pré-gerado quando a transação entra em ESCROW) e guardado em
+`UPLOAD_FOLDER_PRIVATE/faturas/<fatura_ref>-<hash>.pdf`. O download passa a servir
+um ficheiro estático; uma alteração de valor muda o hash e, com ele, o ficheiro.
+"""
+import base64
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Optional
+
+import qrcode
+from flask import current_app, render_template
+from sqlalchemy import event, inspect as sa_inspect
+from werkzeug.utils import secure_filename
+
+from app.extensions import db
+from app.models import Transacao, TransactionStatus
+
+try:
+    from weasyprint import HTML
+    WEASYPRINT_AVAILABLE = True
+except ImportError:  # pragma: no cover - depende do ambiente
+    HTML = None
+    WEASYPRINT_AVAILABLE = False
+
+try:
+    import pdfkit
+    PDFKIT_AVAILABLE = True
+except ImportError:  # pragma: no cover - depende do ambiente
+    pdfkit = None
+    PDFKIT_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+PASTA_FATURAS = 'faturas'
+
+# Caminho do wkhtmltopdf na instalação Windows por defeito (último recurso)
+WKHTMLTOPDF_PADRAO = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
+
+OPCOES_PDF = {
+    'page-size': 'A4',
+    'margin-top': '0mm',
+    'margin-right': '0mm',
+    'margin-bottom': '0mm',
+    'margin-left': '0mm',
+    'encoding': "UTF-8",
+    'no-outline': None,
+    'enable-local-file-access': None,
+    'quiet': ''  # Evita logs desnecessários
+}
+
+# A partir do pagamento a fatura é imutável e pode ir para o cache em disco
+ESTADOS_FATURA_FINAL = (TransactionStatus.ESCROW, TransactionStatus.ENVIADO,
+                        TransactionStatus.ENTREGUE, TransactionStatus.FINALIZADO)
+
+# Chave em session.info com as transações que entraram em ESCROW nesta transação
+_PENDENTES = 'faturas_pregerar'
+
+
+class MotorPDFIndisponivel(RuntimeError):
+    """Nenhum motor de PDF está instalado/configurado."""
+
+
+def hash_verificacao(venda: Transacao) -> str:
+    """Hash de verificação único (SHA-256) impresso na fatura."""
+    hash_seed = f"{venda.id}-{venda.data_criacao}-{venda.valor_total_pago}"
+    return hashlib.sha256(hash_seed.encode()).hexdigest()[:16].upper()
+
+
+@lru_cache(maxsize=1024)
+def _qr_png_base64(dados: str) -> str:
+    qr = qrcode.QRCode(version=1, box_size=10, border=1)
+    qr.add_data(dados)
+    qr.make(fit=True)
+
+    img_buffer = io.BytesIO()
+    img = qr.make_image(fill_color="#1B4332", back_color="white")
+    img.save(img_buffer, format="PNG")
+    return base64.b64encode(img_buffer.getvalue()).decode()
+
+
+def qr_code_base64(venda: Transacao) -> str:
+    """QR code do link público de verificação, em PNG base64 (memorizado por link)."""
+    return _qr_png_base64(f"https://agrokongo.ao/verificar/{venda.fatura_ref or venda.id}")
+
+
+def _caminho_wkhtmltopdf() -> Optional[str]:
+    """WKHTMLTOPDF_PATH, o binário no PATH ou a instalação Windows por defeito."""
+    configurado = current_app.config.get('WKHTMLTOPDF_PATH')
+    if configurado:
+        return configurado
+    return shutil.which('wkhtmltopdf') or (WKHTMLTOPDF_PADRAO if os.path.exists(WKHTMLTOPDF_PADRAO) else None)
+
+
+def motor_pdf() -> str:
+    """
+    Motor em uso: FATURA_MOTOR_PDF ('weasyprint' ou 'wkhtmltopdf') ou, por defeito,
+    o WeasyPrint (em processo, sem binários externos) e depois o wkhtmltopdf.
+    """
+    escolhido = current_app.config.get('FATURA_MOTOR_PDF')
+    if escolhido:
+        return escolhido
+    if WEASYPRINT_AVAILABLE:
+        return 'weasyprint'
+    if PDFKIT_AVAILABLE and _caminho_wkhtmltopdf():
+        return 'wkhtmltopdf'
+    raise MotorPDFIndisponivel("Instale o WeasyPrint ou configure WKHTMLTOPDF_PATH.")
+
+
+def motor_disponivel() -> bool:
+    """Há um motor de PDF utilizável neste processo (sem ele, gerar uma fatura falha sempre)."""
+    try:
+        motor = motor_pdf()
+    except MotorPDFIndisponivel:
+        return False
+    if motor == 'weasyprint':
+        return WEASYPRINT_AVAILABLE
+    return PDFKIT_AVAILABLE and _caminho_wkhtmltopdf() is not None
+
+
+def _renderizar_html(venda: Transacao) -> str:
+    return render_template(
+        'documentos/fatura_padrao.html',
+        venda=venda,
+        qr_base64=qr_code_base64(venda),
+        verificacao_hash=hash_verificacao(venda)
+    )
+
+
+def gerar_pdf_fatura(venda: Transacao) -> bytes:
+    """Renderiza a fatura e devolve o binário do PDF."""
+    html = _renderizar_html(venda)
+    if motor_pdf() == 'weasyprint':
+        return HTML(string=html, base_url=current_app.root_path).write_pdf()
+
+    caminho = _caminho_wkhtmltopdf()
+    if not PDFKIT_AVAILABLE or not caminho:
+        raise MotorPDFIndisponivel("wkhtmltopdf não encontrado: configure WKHTMLTOPDF_PATH.")
+    config = pdfkit.configuration(wkhtmltopdf=caminho)
+    return pdfkit.from_string(html, False, configuration=config, options=OPCOES_PDF)
+
+
+def nome_ficheiro_fatura(venda: Transacao) -> str:
+    return f"Fatura_AgroKongo_{venda.fatura_ref or venda.id}.pdf"
+
+
+# --- CACHE EM DISCO ---
+def fatura_imutavel(venda: Transacao) -> bool:
+    return venda.status in ESTADOS_FATURA_FINAL
+
+
+def caminho_cache(venda: Transacao) -> str:
+    """Caminho endereçado pelo conteúdo: referência da fatura + hash de verificação."""
+    pasta = os.path.join(current_app.config['UPLOAD_FOLDER_PRIVATE'], PASTA_FATURAS)
+    referencia = secure_filename(venda.fatura_ref or str(venda.id))
+    return os.path.join(pasta, f"{referencia}-{hash_verificacao(venda)}.pdf")
+
+
+def obter_pdf_fatura(venda: Transacao) -> Optional[str]:
+    """
+    Caminho do PDF em cache, gerado agora se ainda não existir.
+    Devolve None para faturas ainda não pagas (o conteúdo pode mudar: gerar em memória).
+    """
+    if not fatura_imutavel(venda):
+        return None
+
+    caminho = caminho_cache(venda)
+    if os.path.exists(caminho):
+        return caminho
+
+    pdf = gerar_pdf_fatura(venda)
+    pasta = os.path.dirname(caminho)
+    os.makedirs(pasta, exist_ok=True)
+    # Escrita atómica: um download concorrente nunca lê um PDF a meio
+    descritor, temporario = tempfile.mkstemp(suffix='.parcial', dir=pasta)
+    try:
+        with os.fdopen(descritor, 'wb') as ficheiro:
+            ficheiro.write(pdf)
+        os.replace(temporario, caminho)
+    except Exception:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    return caminho
+
+
+def pregerar_fatura(transacao_id: int) -> bool:
+    """Gera o PDF em cache de uma transação paga. Falhas ficam para o download."""
+    venda = db.session.get(Transacao, transacao_id)
+    if not venda:
+        return False
+    try:
+        return obter_pdf_fatura(venda) is not None
+    except Exception as e:
+        logger.warning(f"Pré-geração da fatura {venda.fatura_ref} falhou: {e}")
+        return False
+
+
+def pregerar_faturas(transacao_ids) -> int:
+    """Pré-gera as faturas de um lote (uma sessão curta por fatura). Devolve quantas ficaram em cache."""
+    geradas = 0
+    for transacao_id in transacao_ids:
+        try:
+            geradas += pregerar_fatura(transacao_id)
+        finally:
+            db.session.remove()
+    return geradas
+
+
+# --- PRÉ-GERAÇÃO AO ENTRAR EM ESCROW ---
+# Sem broker, um único thread por processo drena as faturas pendentes: uma validação
+# em lote (até LIMITE_LOTE vendas) nunca abre um thread nem uma ligação por fatura
+_fila_local = set()
+_fila_lock = threading.Lock()
+_drenar_ativo = False
+
+
+def _despachar(transacao_ids):
+    from app.extensions import celery, CELERY_AVAILABLE
+    from app.services.cache_service import cache_service
+    transacao_ids = sorted(transacao_ids)
+    # O broker é o mesmo Redis do cache: com o circuito aberto nem tentamos publicar
+    if CELERY_AVAILABLE and celery is not None and cache_service.ping():
+        try:
+            celery.send_task('tasks.pregerar_faturas', args=[transacao_ids], ignore_result=True)
+            return
+        except Exception as e:
+            logger.warning(f"Broker indisponível, {len(transacao_ids)} faturas geradas localmente: {e}")
+
+    _enfileirar_local(current_app._get_current_object(), transacao_ids)
+
+
+def _enfileirar_local(app, transacao_ids):
+    global _drenar_ativo
+    with _fila_lock:
+        _fila_local.update(transacao_ids)
+        if _drenar_ativo:
+            return  # o thread em curso apanha estas faturas na próxima volta
+        _drenar_ativo = True
+    threading.Thread(target=_drenar_fila, args=(app,), name='faturas', daemon=True).start()
+
+
+def _drenar_fila(app):
+    global _drenar_ativo
+    try:
+        with app.app_context():
+            while True:
+                with _fila_lock:
+                    lote = sorted(_fila_local)
+                    _fila_local.clear()
+                    if not lote:
+                        _drenar_ativo = False
+                        return
+                pregerar_faturas(lote)
+    except Exception as e:
+        logger.error(f"Erro na pré-geração local de faturas: {e}")
+        with _fila_lock:
+            _drenar_ativo = False
+
+
+def _pregerar_ativo() -> bool:
+    return current_app.config.get('FATURAS_PREGERAR', True) and motor_disponivel()
+
+
+def registar_escrow(session, transacao_ids):
+    """
+    Agenda as faturas de transações postas em ESCROW por UPDATE direto (sem flush).
+    Sem motor de PDF instalado não agenda nada: o download gera em memória.
+    """
+    if transacao_ids and _pregerar_ativo():
+        session.info.setdefault(_PENDENTES, set()).update(transacao_ids)
+
+
+def _after_flush(session, flush_context):
+    escrow = TransactionStatus.ESCROW
+    novas = [obj.id for obj in list(session.new) + list(session.dirty)
+             if isinstance(obj, Transacao) and obj.status == escrow
+             and escrow in sa_inspect(obj).attrs.status.history.added]
+    if novas and _pregerar_ativo():
+        session.info.setdefault(_PENDENTES, set()).update(novas)
+
+
+def _after_commit(session):
+    pendentes = session.info.pop(_PENDENTES, None)
+    if not pendentes:
+        return
+    try:
+        _despachar(pendentes)
+    except Exception as e:
+        logger.warning(f"Não foi possível agendar {len(pendentes)} faturas: {e}")
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDENTES, None)
+
+
+def init_app(app):
+    """Regista a pré-geração das faturas quando uma transação passa a ESCROW."""
+    for nome, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, nome, listener):
+            event.listen(db.session, nome, listener)
@@ -0,0 +1,147 @@
+"""
+Chaves de Idempotência AgroKongo.
+Clientes móveis em redes instáveis repetem POSTs: com o cabeçalho `Idempotency-Key`
+a primeira execução fica registada e as repetições recebem a mesma resposta sem
+voltar a correr a rota (nem a tocar no stock da safra).
+
+- A tabela `chaves_idempotencia` é a fonte de verdade: o INSERT da chave é o lock
+  do pedido em curso (chave primária) e guarda depois o status e o corpo.
+- As respostas concluídas são também copiadas para o Redis: uma repetição é
+  normalmente servida por um GET, sem ir à base de dados.
+- As linhas são escritas numa ligação própria, independente da sessão da rota.
+"""
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+import click
+from flask import current_app
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import ChaveIdempotencia
+
+logger = logging.getLogger(__name__)
+
+PREFIXO_CACHE = 'idem:'
+# Um pedido "em curso" há mais do que isto perdeu o worker: a chave pode ser retomada
+PRAZO_EM_CURSO = timedelta(minutes=2)
+
+# Resultado de IdempotenciaService.iniciar
+NOVO = 'novo'
+REPETIDO = 'repetido'
+EM_CURSO = 'em_curso'
+CONFLITO = 'conflito'
+
+_tabela = ChaveIdempotencia.__table__
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def _ttl() -> timedelta:
+    return timedelta(hours=current_app.config.get('IDEMPOTENCIA_TTL_HORAS', 24))
+
+
+def _cache():
+    from app.services.cache_service import cache_service
+    return cache_service
+
+
+class IdempotenciaService:
+    """Registo, repetição e expiração das respostas idempotentes."""
+
+    @staticmethod
+    def chave(usuario_id, endpoint: str, cabecalho: str) -> str:
+        return hashlib.sha256(f"{usuario_id}|{endpoint}|{cabecalho}".encode()).hexdigest()
+
+    @staticmethod
+    def impressao(corpo: bytes) -> str:
+        return hashlib.sha256(corpo or b'').hexdigest()
+
+    @staticmethod
+    def iniciar(chave: str, usuario_id, endpoint: str, impressao: str) -> Tuple[str, Optional[Dict]]:
+        """
+        Reclama a chave para este pedido.
+
+        Returns:
+            Tuple[resultado, resposta_guardada]: NOVO (executar a rota), REPETIDO (devolver
+            a resposta guardada), EM_CURSO (o pedido original ainda corre) ou CONFLITO
+            (a mesma chave foi usada com outro corpo)
+        """
+        guardada = _cache().get(PREFIXO_CACHE + chave)
+        if guardada:
+            return (REPETIDO, guardada) if guardada['impressao'] == impressao else (CONFLITO, None)
+
+        agora = _agora()
+        valores = dict(chave=chave, usuario_id=str(usuario_id) if usuario_id is not None else None,
+                       endpoint=endpoint, impressao=impressao, estado=ChaveIdempotencia.EM_CURSO,
+                       status_code=None, corpo=None, mimetype=None,
+                       data_criacao=agora, expira_em=agora + _ttl())
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(_tabela.insert().values(**valores))
+            return NOVO, None
+        except IntegrityError:
+            pass
+
+        with db.engine.begin() as conn:
+            # Chave expirada ou pedido em curso abandonado: retoma-a atomicamente
+            retomada = conn.execute(
+                update(_tabela).where(
+                    _tabela.c.chave == chave,
+                    or_(_tabela.c.expira_em <= agora,
+                        (_tabela.c.estado == ChaveIdempotencia.EM_CURSO)
+                        & (_tabela.c.data_criacao <= agora - PRAZO_EM_CURSO)),
+                ).values(**valores)
+            ).rowcount
+            if retomada:
+                return NOVO, None
+            linha = conn.execute(select(_tabela).where(_tabela.c.chave == chave)).mappings().first()
+
+        if linha is None:
+            # Apagada entre o INSERT e a leitura (limpeza): trata como em curso, o cliente repete
+            return EM_CURSO, None
+        if linha['impressao'] != impressao:
+            return CONFLITO, None
+        if linha['estado'] == ChaveIdempotencia.EM_CURSO:
+            return EM_CURSO, None
+        return REPETIDO, {'status': linha['status_code'], 'corpo': linha['corpo'],
+                          'mimetype': linha['mimetype'], 'impressao': linha['impressao']}
+
+    @staticmethod
+    def concluir(chave: str, status: int, corpo: str, mimetype: str, impressao: str):
+        """Guarda a resposta do pedido original (base de dados e Redis)."""
+        with db.engine.begin() as conn:
+            conn.execute(update(_tabela).where(_tabela.c.chave == chave).values(
+                estado=ChaveIdempotencia.CONCLUIDO, status_code=status, corpo=corpo, mimetype=mimetype))
+        _cache().set(PREFIXO_CACHE + chave,
+                     {'status': status, 'corpo': corpo, 'mimetype': mimetype, 'impressao': impressao},
+                     ttl=_ttl())
+
+    @staticmethod
+    def libertar(chave: str):
+        """Pedido falhou (erro 5xx ou exceção): a chave fica livre para nova tentativa."""
+        with db.engine.begin() as conn:
+            conn.execute(delete(_tabela).where(_tabela.c.chave == chave))
+
+    @staticmethod
+    def limpar_expirados() -> int:
+        with db.engine.begin() as conn:
+            return conn.execute(delete(_tabela).where(_tabela.c.expira_em <= _agora())).rowcount
+
+
+def init_app(app):
+    """Regista o comando `flask idempotencia limpar`."""
+
+    @app.cli.group('idempotencia')
+    def idempotencia_cli():
+        """Gestão das chaves de idempotência."""
+
+    @idempotencia_cli.command('limpar')
+    def limpar_cmd():
+        """Apaga as chaves de idempotência expiradas."""
+        click.echo(f"✅ {IdempotenciaService.limpar_expirados()} chaves expiradas removidas.")
@@ -0,0 +1,178 @@
+"""
+Instrumentação SQL por Pedido AgroKongo.
+Listeners `before_cursor_execute`/`after_cursor_execute` no motor da app contam,
+em cada pedido, as instruções enviadas à base de dados, o tempo passado nelas e
+quantas vezes se repete cada impressão digital (o SQL com os literais e as listas
+IN normalizados). Uma impressão digital repetida `SQL_N_MAIS_1_LIMIAR` vezes é um
+N+1: por exemplo `SELECT ... FROM usuarios WHERE usuarios.id = ?` uma vez por
+linha de um `to_dict` que lê `t.comprador`.
+
+Cada pedido:
+- ganha o header `Server-Timing: db;dur=<ms>;desc="<n> queries"` (DevTools);
+- escreve um resumo no log em DEBUG e um WARNING quando há suspeita de N+1;
+- soma-se ao agregado por endpoint deste worker, servido em
+  `GET /api/v1/admin/sql` (piores endpoints primeiro).
+
+As instruções de respostas em streaming (`stream_with_context`) contam no
+agregado, fechado no teardown do pedido, mas não no header, que já foi enviado.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import List
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+# Tamanho máximo do exemplo de N+1 guardado no agregado e escrito no log
+TAMANHO_EXEMPLO = 300
+ORDENACOES = ('instrucoes', 'tempo', 'n_mais_1')
+
+_LISTA_IN = re.compile(r'\bIN\s*\((?:[^()]|\([^()]*\))*\)', re.IGNORECASE)
+_POSTCOMPILE = re.compile(r'\(?__\[POSTCOMPILE_\w+\]\)?')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACOS = re.compile(r'\s+')
+_COLUNAS = re.compile(r'^SELECT (?:DISTINCT )?.+? FROM ', re.IGNORECASE)
+
+
+def impressao_digital(sql: str) -> str:
+    """SQL sem literais nem tamanho das listas IN: o mesmo padrão dá a mesma impressão."""
+    sql = _POSTCOMPILE.sub('(?)', sql)
+    sql = _LISTA_IN.sub('IN (?)', sql)
+    sql = _LITERAL.sub('?', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+def _exemplo(impressao: str) -> str:
+    """Impressão digital legível: sem a lista de colunas (o que identifica o N+1 é o FROM/WHERE)."""
+    return _COLUNAS.sub('SELECT ... FROM ', impressao)[:TAMANHO_EXEMPLO]
+
+
+class MedicaoPedido:
+    """Instruções de um pedido (vive em `g` entre o before_request e o teardown)."""
+
+    def __init__(self):
+        self.instrucoes = 0
+        self.tempo = 0.0
+        self.repeticoes: Counter = Counter()
+
+    def registar(self, sql: str, duracao: float):
+        self.instrucoes += 1
+        self.tempo += duracao
+        self.repeticoes[impressao_digital(sql)] += 1
+
+    def n_mais_1(self, limiar: int) -> List[tuple]:
+        """(impressão digital, vezes) das instruções repetidas pelo menos `limiar` vezes."""
+        return [(sql, vezes) for sql, vezes in self.repeticoes.most_common() if vezes >= limiar]
+
+
+class AgregadoEndpoints:
+    """Totais por endpoint deste worker (thread-safe, em memória)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dados = defaultdict(lambda: {'pedidos': 0, 'instrucoes': 0, 'instrucoes_max': 0,
+                                           'tempo_ms': 0.0, 'tempo_max_ms': 0.0,
+                                           'pedidos_n_mais_1': 0, 'exemplo_n_mais_1': None})
+
+    def registar(self, endpoint: str, medicao: MedicaoPedido, suspeitas: List[tuple]):
+        tempo_ms = medicao.tempo * 1000
+        with self._lock:
+            dados = self._dados[endpoint]
+            dados['pedidos'] += 1
+            dados['instrucoes'] += medicao.instrucoes
+            dados['instrucoes_max'] = max(dados['instrucoes_max'], medicao.instrucoes)
+            dados['tempo_ms'] += tempo_ms
+            dados['tempo_max_ms'] = max(dados['tempo_max_ms'], tempo_ms)
+            if suspeitas:
+                dados['pedidos_n_mais_1'] += 1
+                sql, vezes = suspeitas[0]
+                dados['exemplo_n_mais_1'] = {'sql': _exemplo(sql), 'vezes': vezes}
+
+    def piores(self, ordem: str = 'instrucoes', limite: int = 20) -> List[dict]:
+        """Endpoints pela média de instruções, pela média de tempo ou por pedidos com N+1."""
+        with self._lock:
+            linhas = [dict(dados, endpoint=endpoint,
+                           instrucoes_media=round(dados['instrucoes'] / dados['pedidos'], 2),
+                           tempo_medio_ms=round(dados['tempo_ms'] / dados['pedidos'], 3),
+                           tempo_ms=round(dados['tempo_ms'], 3), tempo_max_ms=round(dados['tempo_max_ms'], 3))
+                      for endpoint, dados in self._dados.items()]
+        chave = {'instrucoes': lambda d: (d['instrucoes_media'], d['tempo_medio_ms']),
+                 'tempo': lambda d: (d['tempo_medio_ms'], d['instrucoes_media']),
+                 'n_mais_1': lambda d: (d['pedidos_n_mais_1'], d['instrucoes_media'])}[ordem]
+        return sorted(linhas, key=chave, reverse=True)[:limite]
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+agregado = AgregadoEndpoints()
+
+
+# --- Listeners do motor ---
+def _medicao_atual():
+    return g.get('_medicao_sql') if has_request_context() else None
+
+
+# O início fica no contexto de execução, que morre com a instrução: uma instrução
+# que falha (sem after_cursor_execute) não deixa nada na ligação do pool
+def _before_cursor_execute(conn, cursor, sql, parametros, context, executemany):
+    if context is not None and _medicao_atual() is not None:
+        context._agk_inicio = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, sql, parametros, context, executemany):
+    medicao = _medicao_atual()
+    inicio = getattr(context, '_agk_inicio', None)
+    if medicao is not None and inicio is not None:
+        medicao.registar(sql, time.perf_counter() - inicio)
+
+
+# --- Hooks do pedido ---
+def _iniciar_pedido():
+    g._medicao_sql = MedicaoPedido()
+
+
+def _server_timing(resposta):
+    medicao = g.get('_medicao_sql')
+    if medicao is not None and current_app.config.get('SQL_SERVER_TIMING'):
+        valor = f'db;dur={medicao.tempo * 1000:.2f};desc="{medicao.instrucoes} queries"'
+        existente = resposta.headers.get('Server-Timing')
+        resposta.headers['Server-Timing'] = f'{existente}, {valor}' if existente else valor
+    return resposta
+
+
+def _fechar_pedido(erro=None):
+    medicao = g.pop('_medicao_sql', None)
+    if medicao is None or request.endpoint is None:
+        return
+    suspeitas = medicao.n_mais_1(current_app.config.get('SQL_N_MAIS_1_LIMIAR', 5))
+    agregado.registar(request.endpoint, medicao, suspeitas)
+
+    logger.debug("SQL %s %s: %d instruções em %.2f ms", request.method, request.endpoint,
+                 medicao.instrucoes, medicao.tempo * 1000)
+    for sql, vezes in suspeitas:
+        logger.warning("Possível N+1 em %s: %d x %s", request.endpoint, vezes, _exemplo(sql))
+
+
+def init_app(app):
+    """Regista os listeners no motor da app e os hooks de cada pedido."""
+    if not app.config.get('SQL_INSTRUMENTACAO', True):
+        return
+    with app.app_context():
+        motor = db.engine
+    for nome, listener in (('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute)):
+        if not event.contains(motor, nome, listener):
+            event.listen(motor, nome, listener)
+
+    app.before_request(_iniciar_pedido)
+    app.after_request(_server_timing)
+    app.teardown_request(_fechar_pedido)
@@ -0,0 +1,342 @@
+"""
+Serviço de KPIs Financeiros AgroKongo.
+Os dashboards leem a tabela `resumos_financeiros` (totais por utilizador, papel e status)
+em vez de somarem todas as transações do utilizador a cada visualização.
+
+A tabela é mantida incrementalmente num listener `after_flush`: cada alteração de
+status/valores de uma Transacao aplica o delta (antigo -> novo) na mesma transação
+da base de dados, por isso um rollback nunca deixa os totais desalinhados.
+`KpiService.reconciliar` compara os totais com os agregados reais e corrige desvios.
+As duas leituras da reconciliação são feitas no mesmo instantâneo (ligação própria em
+REPEATABLE READ): uma transação confirmada entre elas não aparece como divergência.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+import click
+from flask import current_app
+from sqlalchemy import event, func, inspect as sa_inspect, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.extensions import db
+from app.models import Transacao, ResumoFinanceiro, TransactionStatus, aware_utcnow
+
+PAPEIS = (('vendedor', 'vendedor_id'), ('comprador', 'comprador_id'))
+CAMPOS_TRANSACAO = ('status', 'vendedor_id', 'comprador_id', 'valor_total_pago',
+                    'valor_liquido_vendedor', 'comissao_plataforma')
+
+# Baldes de status usados pelos dashboards (definição única para web, API e admin)
+ESTADOS_CUSTODIA = (TransactionStatus.ESCROW, TransactionStatus.ENVIADO)
+ESTADOS_PAGOS = (TransactionStatus.ESCROW, TransactionStatus.ENVIADO,
+                 TransactionStatus.ENTREGUE, TransactionStatus.FINALIZADO)
+ESTADOS_ENCERRADOS = (TransactionStatus.FINALIZADO, TransactionStatus.CANCELADO)
+
+# Isolamento da reconciliação por dialeto. Em SQLite (desenvolvimento) o pysqlite não abre
+# transação antes de um SELECT: as leituras não partilham instantâneo, mas há um só escritor
+ISOLAMENTO_RECONCILIACAO = {'postgresql': 'REPEATABLE READ', 'mysql': 'REPEATABLE READ'}
+TENTATIVAS_RECONCILIACAO = 3
+ERRO_SERIALIZACAO = '40001'
+
+ZERO = Decimal('0.00')
+CENTIMO = Decimal('0.01')
+
+Chave = Tuple[int, str, str]
+
+
+def _decimal(valor) -> Decimal:
+    if valor is None:
+        return ZERO
+    return (valor if isinstance(valor, Decimal) else Decimal(str(valor))).quantize(CENTIMO)
+
+
+# --- MANUTENÇÃO INCREMENTAL ---
+def _valores_transacao(transacao: Transacao, anteriores: bool) -> Dict:
+    """Valores atuais da transação ou, com `anteriores`, os que estavam na base de dados."""
+    estado = sa_inspect(transacao)
+    valores = {}
+    for campo in CAMPOS_TRANSACAO:
+        historico = estado.attrs[campo].history
+        if anteriores and historico.deleted:
+            valores[campo] = historico.deleted[0]
+        else:
+            valores[campo] = getattr(transacao, campo)
+    return valores
+
+
+def _acumular(deltas: Dict[Chave, List], valores: Dict, sinal: int):
+    if not valores['status']:
+        return
+    for papel, coluna in PAPEIS:
+        usuario_id = valores[coluna]
+        if usuario_id is None:
+            continue
+        delta = deltas[(usuario_id, papel, valores['status'])]
+        delta[0] += sinal
+        delta[1] += sinal * _decimal(valores['valor_total_pago'])
+        delta[2] += sinal * _decimal(valores['valor_liquido_vendedor'])
+        delta[3] += sinal * _decimal(valores['comissao_plataforma'])
+
+
+def _aplicar_deltas(connection, deltas: Dict[Chave, List]):
+    """Soma os deltas às linhas do resumo (upsert atómico em PostgreSQL/SQLite)."""
+    tabela = ResumoFinanceiro.__table__
+    dialeto = connection.dialect.name
+    agora = aware_utcnow()
+
+    for (usuario_id, papel, status), (quantidade, total, liquido, comissao) in deltas.items():
+        if not quantidade and not total and not liquido and not comissao:
+            continue
+        valores = dict(usuario_id=usuario_id, papel=papel, status=status, quantidade=quantidade,
+                       valor_total=total, valor_liquido=liquido, comissao=comissao,
+                       data_atualizacao=agora)
+
+        if dialeto in ('postgresql', 'sqlite'):
+            insert = pg_insert if dialeto == 'postgresql' else sqlite_insert
+            stmt = insert(tabela).values(**valores)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['usuario_id', 'papel', 'status'],
+                set_={
+                    'quantidade': tabela.c.quantidade + stmt.excluded.quantidade,
+                    'valor_total': tabela.c.valor_total + stmt.excluded.valor_total,
+                    'valor_liquido': tabela.c.valor_liquido + stmt.excluded.valor_liquido,
+                    'comissao': tabela.c.comissao + stmt.excluded.comissao,
+                    'data_atualizacao': stmt.excluded.data_atualizacao,
+                })
+            connection.execute(stmt)
+            continue
+
+        resultado = connection.execute(
+            tabela.update()
+            .where(tabela.c.usuario_id == usuario_id, tabela.c.papel == papel, tabela.c.status == status)
+            .values(quantidade=tabela.c.quantidade + quantidade,
+                    valor_total=tabela.c.valor_total + total,
+                    valor_liquido=tabela.c.valor_liquido + liquido,
+                    comissao=tabela.c.comissao + comissao,
+                    data_atualizacao=agora))
+        if resultado.rowcount == 0:
+            connection.execute(tabela.insert().values(**valores))
+
+
+def _carregar_valor_anterior(transacao, valor, anterior, iniciador):
+    """Listener vazio: registado com active_history para o valor antigo entrar no histórico."""
+    return valor
+
+
+def registar_transicoes(session, linhas: Iterable[Dict], origem: str, destino: str):
+    """Aplica os deltas de uma mudança de estado feita por UPDATE em massa (sem flush)."""
+    deltas: Dict[Chave, List] = defaultdict(lambda: [0, ZERO, ZERO, ZERO])
+    for linha in linhas:
+        _acumular(deltas, {**linha, 'status': origem}, -1)
+        _acumular(deltas, {**linha, 'status': destino}, +1)
+    if deltas:
+        _aplicar_deltas(session.connection(), deltas)
+
+
+def _after_flush(session, flush_context):
+    deltas: Dict[Chave, List] = defaultdict(lambda: [0, ZERO, ZERO, ZERO])
+
+    for obj in session.new:
+        if isinstance(obj, Transacao):
+            _acumular(deltas, _valores_transacao(obj, anteriores=False), +1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Transacao):
+            continue
+        estado = sa_inspect(obj)
+        if not any(estado.attrs[c].history.has_changes() for c in CAMPOS_TRANSACAO):
+            continue
+        _acumular(deltas, _valores_transacao(obj, anteriores=True), -1)
+        _acumular(deltas, _valores_transacao(obj, anteriores=False), +1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Transacao):
+            _acumular(deltas, _valores_transacao(obj, anteriores=True), -1)
+
+    if deltas:
+        _aplicar_deltas(session.connection(), deltas)
+
+
+# --- LEITURA ---
+class KpiService:
+    """KPIs dos dashboards em tempo constante (lidos da tabela de resumo)."""
+
+    @staticmethod
+    def _totais(papel: str, usuario_id: int = None) -> Dict[str, Dict]:
+        """Totais por status para um utilizador (ou para toda a plataforma)."""
+        query = db.session.query(
+            ResumoFinanceiro.status,
+            func.sum(ResumoFinanceiro.quantidade),
+            func.sum(ResumoFinanceiro.valor_total),
+            func.sum(ResumoFinanceiro.valor_liquido),
+            func.sum(ResumoFinanceiro.comissao),
+        ).filter(ResumoFinanceiro.papel == papel)
+        if usuario_id is not None:
+            query = query.filter(ResumoFinanceiro.usuario_id == usuario_id)
+
+        return {
+            status: {
+                'quantidade': int(quantidade or 0),
+                'valor_total': _decimal(total),
+                'valor_liquido': _decimal(liquido),
+                'comissao': _decimal(comissao),
+            }
+            for status, quantidade, total, liquido, comissao in query.group_by(ResumoFinanceiro.status)
+        }
+
+    @staticmethod
+    def _somar(totais: Dict[str, Dict], campo: str, estados: Iterable[str] = None,
+               excluir: Iterable[str] = ()):
+        vazio = 0 if campo == 'quantidade' else ZERO
+        return sum((linha[campo] for status, linha in totais.items()
+                    if (estados is None or status in estados) and status not in excluir), vazio)
+
+    @staticmethod
+    def kpis_produtor(usuario_id: int) -> Dict[str, Decimal]:
+        """Receita finalizada, valor em custódia (escrow/enviado) e valor a liquidar (entregue)."""
+        totais = KpiService._totais('vendedor', usuario_id)
+        return {
+            'receita_total': KpiService._somar(totais, 'valor_liquido', (TransactionStatus.FINALIZADO,)),
+            'em_custodia': KpiService._somar(totais, 'valor_liquido', ESTADOS_CUSTODIA),
+            'a_liquidar': KpiService._somar(totais, 'valor_liquido', (TransactionStatus.ENTREGUE,)),
+        }
+
+    @staticmethod
+    def kpis_comprador(usuario_id: int) -> Dict:
+        """Total já pago (escrow em diante) e número de compras ainda em curso."""
+        totais = KpiService._totais('comprador', usuario_id)
+        return {
+            'total_gasto': KpiService._somar(totais, 'valor_total', ESTADOS_PAGOS),
+            'compras_ativas': KpiService._somar(totais, 'quantidade', excluir=ESTADOS_ENCERRADOS),
+        }
+
+    @staticmethod
+    def kpis_plataforma() -> Dict[str, Decimal]:
+        """KPIs globais do admin (soma das linhas dos vendedores, não das transações)."""
+        totais = KpiService._totais('vendedor')
+        return {
+            'total_vendas': KpiService._somar(totais, 'valor_total', excluir=(TransactionStatus.CANCELADO,)),
+            'volume_finalizado': KpiService._somar(totais, 'valor_total', (TransactionStatus.FINALIZADO,)),
+            'volume_pago': KpiService._somar(totais, 'valor_total',
+                                             excluir=(TransactionStatus.CANCELADO, TransactionStatus.PENDENTE)),
+            'comissao_total': KpiService._somar(totais, 'comissao', (TransactionStatus.FINALIZADO,)),
+            'receita_realizada': KpiService._somar(totais, 'comissao', ESTADOS_PAGOS),
+            'divida_produtores': KpiService._somar(totais, 'valor_liquido', (TransactionStatus.ENTREGUE,)),
+        }
+
+    # --- RECONCILIAÇÃO ---
+    @staticmethod
+    def _agregados_reais(conexao) -> Dict[Chave, Tuple]:
+        reais = {}
+        for papel, coluna in PAPEIS:
+            coluna_usuario = getattr(Transacao, coluna)
+            linhas = conexao.execute(select(
+                coluna_usuario, Transacao.status,
+                func.count(Transacao.id),
+                func.sum(Transacao.valor_total_pago),
+                func.sum(Transacao.valor_liquido_vendedor),
+                func.sum(Transacao.comissao_plataforma),
+            ).group_by(coluna_usuario, Transacao.status))
+            for usuario_id, status, quantidade, total, liquido, comissao in linhas:
+                if status:
+                    reais[(usuario_id, papel, status)] = (
+                        int(quantidade), _decimal(total), _decimal(liquido), _decimal(comissao))
+        return reais
+
+    @staticmethod
+    def _resumo_guardado(conexao) -> Dict[Chave, Tuple]:
+        tabela = ResumoFinanceiro.__table__
+        return {
+            (r.usuario_id, r.papel, r.status): (
+                int(r.quantidade or 0), _decimal(r.valor_total), _decimal(r.valor_liquido), _decimal(r.comissao))
+            for r in conexao.execute(select(tabela))
+        }
+
+    @staticmethod
+    def reconciliar(corrigir: bool = False) -> Dict:
+        """
+        Compara o resumo com os agregados reais das transações.
+
+        Os agregados e o resumo são lidos na mesma transação REPEATABLE READ (ligação
+        própria), por isso a diferença entre eles é deriva real e não um commit que caiu
+        entre as duas leituras. A correção é aplicada como delta: os deltas de transações
+        confirmadas depois do instantâneo somam-se a ela em vez de serem apagados. Em
+        PostgreSQL, uma linha a corrigir alterada depois do instantâneo faz o UPDATE falhar
+        com erro de serialização; a reconciliação é repetida (TENTATIVAS_RECONCILIACAO).
+
+        Args:
+            corrigir: Aplica a diferença encontrada a cada linha divergente
+
+        Returns:
+            Dict com o número de linhas verificadas e a lista de divergências
+        """
+        for tentativa in range(1, TENTATIVAS_RECONCILIACAO + 1):
+            try:
+                return KpiService._reconciliar(corrigir)
+            except DBAPIError as e:
+                if tentativa == TENTATIVAS_RECONCILIACAO or getattr(e.orig, 'pgcode', None) != ERRO_SERIALIZACAO:
+                    raise
+                current_app.logger.info(f"Reconciliação de KPIs em conflito com escritas concorrentes; "
+                                        f"tentativa {tentativa + 1}.")
+
+    @staticmethod
+    def _reconciliar(corrigir: bool) -> Dict:
+        motor = db.engine
+        nivel = ISOLAMENTO_RECONCILIACAO.get(motor.dialect.name)
+        opcoes = {'isolation_level': nivel} if nivel else {}
+
+        with motor.connect().execution_options(**opcoes) as conexao, conexao.begin():
+            reais = KpiService._agregados_reais(conexao)
+            resumo = KpiService._resumo_guardado(conexao)
+
+            vazio = (0, ZERO, ZERO, ZERO)
+            divergencias = []
+            correcoes: Dict[Chave, List] = {}
+            for chave in set(reais) | set(resumo):
+                real, guardado = reais.get(chave, vazio), resumo.get(chave, vazio)
+                if real == guardado:
+                    continue
+                usuario_id, papel, status = chave
+                divergencias.append({
+                    'usuario_id': usuario_id, 'papel': papel, 'status': status,
+                    'esperado': [str(v) for v in real], 'encontrado': [str(v) for v in guardado],
+                })
+                correcoes[chave] = [a - b for a, b in zip(real, guardado)]
+
+            if corrigir and correcoes:
+                _aplicar_deltas(conexao, correcoes)
+
+        if divergencias:
+            current_app.logger.warning(f"Resumo financeiro com {len(divergencias)} linhas divergentes.")
+        return {'verificadas': len(set(reais) | set(resumo)), 'divergencias': divergencias}
+
+
+def init_app(app):
+    """Regista o listener de manutenção do resumo e o comando `flask kpis reconciliar`."""
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+    # Depois de um commit os atributos estão expirados: sem active_history, mudar o status
+    # não guardaria o valor anterior e o delta sairia do balde errado
+    for campo in CAMPOS_TRANSACAO:
+        atributo = getattr(Transacao, campo)
+        if not event.contains(atributo, 'set', _carregar_valor_anterior):
+            event.listen(atributo, 'set', _carregar_valor_anterior, active_history=True, retval=True)
+
+    @app.cli.group('kpis')
+    def kpis_cli():
+        """Gestão dos KPIs financeiros materializados."""
+
+    @kpis_cli.command('reconciliar')
+    @click.option('--corrigir', is_flag=True, help='Corrige as linhas divergentes.')
+    def reconciliar_cmd(corrigir):
+        """Verifica o resumo financeiro contra as transações."""
+        resultado = KpiService.reconciliar(corrigir=corrigir)
+        for d in resultado['divergencias']:
+            click.echo(f"⚠️ {d['usuario_id']}/{d['papel']}/{d['status']}: "
+                       f"esperado {d['esperado']}, encontrado {d['encontrado']}")
+        estado = 'corrigidas' if corrigir else 'encontradas'
+        click.echo(f"✅ {resultado['verificadas']} linhas verificadas, "
+                   f"{len(resultado['divergencias'])} divergências {estado}.")
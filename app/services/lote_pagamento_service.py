@@ -0,0 +1,331 @@
+"""
+Lotes de Pagamento Bancário AgroKongo.
+Em vez de transferir liquidação a liquidação, o Admin gera um lote com todas as
+vendas ENTREGUE ainda por transferir e importa um único ficheiro no banco:
+
+- as transações ficam reservadas no lote (`lote_pagamento_id`) com um só UPDATE;
+- o ficheiro tem uma transferência por produtor/IBAN com a soma das suas vendas e é
+  gerado em streaming: CSV (';', compatível com Excel PT) ou XML ISO 20022 pain.001;
+- confirmar o lote liquida todas as transações num só commit (PagamentoService.aplicar_lote).
+
+Enquanto a venda está no lote só o lote a pode fechar: a máquina de estados recusa
+ENTREGUE -> DISPUTA/FINALIZADO por outra via. Uma venda que mesmo assim já não
+esteja ENTREGUE na confirmação (ex.: disputa aberta antes desta regra) foi paga
+pelo banco: continua no lote, conta em `quantidade_divergencias` e fica à espera
+de reconciliação manual (`divergencias` / `reconciliar_venda`). Nunca volta à fila.
+"""
+import csv
+import io
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import distinct, func, select, update
+
+from app.extensions import db
+from app.models import LogAuditoria, LotePagamento, Transacao, TransactionStatus, Usuario
+from app.services.pagamento_service import PagamentoService
+
+FORMATOS = ('csv', 'xml')
+MOEDA = 'AOA'
+TAMANHO_BLOCO = 500
+
+MSG_LOTE_NAO_ENCONTRADO = "Lote de pagamento não encontrado."
+MSG_VENDA_FORA_DO_LOTE = "Venda não encontrada neste lote."
+MSG_ERRO_TECNICO = "Erro técnico ao processar o lote de pagamento."
+
+# Resultado de confirmar_lote para as vendas pagas pelo banco que mudaram de estado
+RESULTADO_RECONCILIAR = 'reconciliacao_manual'
+
+COLUNAS_CSV = ('REF. LOTE', 'N.º', 'BENEFICIÁRIO', 'NIF', 'IBAN', 'VALOR (Kz)', 'VENDAS', 'DESCRITIVO')
+
+
+def _liquidacoes_pendentes():
+    """Vendas entregues, por transferir, fora de qualquer lote e com IBAN do produtor."""
+    return select(Transacao.id).join(Usuario, Usuario.id == Transacao.vendedor_id).where(
+        Transacao.status == TransactionStatus.ENTREGUE,
+        Transacao.transferencia_concluida.isnot(True),
+        Transacao.lote_pagamento_id.is_(None),
+        Usuario.iban.isnot(None),
+        Usuario.iban != '',
+    )
+
+
+def _iban(valor: str) -> str:
+    return (valor or '').replace(' ', '').upper()
+
+
+def _descritivo(lote: LotePagamento, vendas: int) -> str:
+    return f"AgroKongo {lote.referencia} ({vendas} vendas)"
+
+
+class LotePagamentoService:
+    """Geração, ficheiro bancário, confirmação e cancelamento dos lotes de pagamento."""
+
+    @staticmethod
+    def criar_lote(admin_id: int, limite: int = None) -> Tuple[bool, Optional[LotePagamento], str]:
+        """
+        Reserva as liquidações pendentes num novo lote (SKIP LOCKED: as que outro admin
+        está a liquidar ficam de fora).
+
+        Returns:
+            Tuple[success, lote, mensagem]
+        """
+        try:
+            pendentes = _liquidacoes_pendentes().order_by(Transacao.id) \
+                .with_for_update(skip_locked=True, of=Transacao)
+            if limite:
+                pendentes = pendentes.limit(limite)
+
+            lote = LotePagamento(admin_id=admin_id)
+            db.session.add(lote)
+            db.session.flush()
+            db.session.execute(
+                update(Transacao).where(Transacao.id.in_(pendentes.scalar_subquery()))
+                .values(lote_pagamento_id=lote.id).execution_options(synchronize_session=False))
+
+            quantidade, beneficiarios, total = db.session.execute(
+                select(func.count(Transacao.id), func.count(distinct(Transacao.vendedor_id)),
+                       func.sum(Transacao.valor_liquido_vendedor))
+                .where(Transacao.lote_pagamento_id == lote.id)).one()
+            if not quantidade:
+                db.session.rollback()
+                return False, None, "Não há liquidações pendentes com IBAN registado."
+
+            lote.quantidade_transacoes = quantidade
+            lote.quantidade_beneficiarios = beneficiarios
+            lote.valor_total = Decimal(str(total or 0)).quantize(Decimal('0.01'))
+            db.session.add(LogAuditoria(
+                usuario_id=admin_id,
+                acao="LOTE_PAGAMENTO_GERADO",
+                detalhes=f"{lote.referencia}: {quantidade} vendas, {beneficiarios} produtores, {lote.valor_total} Kz"
+            ))
+            db.session.commit()
+            return True, lote, f"Lote {lote.referencia} gerado com {quantidade} liquidações."
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"ERRO_LOTE_PAGAMENTO: {e}")
+            return False, None, MSG_ERRO_TECNICO
+
+    @staticmethod
+    def beneficiarios(lote_id: int) -> Iterator:
+        """Uma linha por produtor: (id, nome, nif, iban, vendas, valor), lida em blocos."""
+        consulta = select(
+            Usuario.id, Usuario.nome, Usuario.nif, Usuario.iban,
+            func.count(Transacao.id).label('vendas'),
+            func.sum(Transacao.valor_liquido_vendedor).label('valor'),
+        ).join(Usuario, Usuario.id == Transacao.vendedor_id) \
+            .where(Transacao.lote_pagamento_id == lote_id) \
+            .group_by(Usuario.id, Usuario.nome, Usuario.nif, Usuario.iban) \
+            .order_by(Usuario.id)
+        return db.session.execute(consulta.execution_options(yield_per=TAMANHO_BLOCO))
+
+    @staticmethod
+    def gerar_csv(lote: LotePagamento) -> Iterator[str]:
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer, delimiter=';')
+        buffer.write('\ufeff')  # BOM: o Excel abre acentos corretamente
+        escritor.writerow(COLUNAS_CSV)
+
+        for numero, b in enumerate(LotePagamentoService.beneficiarios(lote.id), start=1):
+            escritor.writerow([lote.referencia, numero, b.nome, b.nif or '', _iban(b.iban),
+                               f'{Decimal(str(b.valor)):.2f}', b.vendas, _descritivo(lote, b.vendas)])
+            if numero % TAMANHO_BLOCO == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    @staticmethod
+    def gerar_pain001(lote: LotePagamento) -> Iterator[str]:
+        """Ordem de transferências a crédito ISO 20022 (pain.001.001.03), um CdtTrfTxInf por produtor."""
+        config = current_app.config
+        total = f'{lote.valor_total:.2f}'
+        devedor = escape(config.get('PLATAFORMA_NOME', 'AgroKongo'))
+        bic = config.get('PLATAFORMA_BIC')
+        agente = f'<BIC>{escape(bic)}</BIC>' if bic else '<Othr><Id>NOTPROVIDED</Id></Othr>'
+
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:pain.001.001.03"><CstmrCdtTrfInitn>'
+               f'<GrpHdr><MsgId>{lote.referencia}</MsgId>'
+               f'<CreDtTm>{lote.data_criacao.strftime("%Y-%m-%dT%H:%M:%S")}</CreDtTm>'
+               f'<NbOfTxs>{lote.quantidade_beneficiarios}</NbOfTxs><CtrlSum>{total}</CtrlSum>'
+               f'<InitgPty><Nm>{devedor}</Nm></InitgPty></GrpHdr>'
+               f'<PmtInf><PmtInfId>{lote.referencia}</PmtInfId><PmtMtd>TRF</PmtMtd>'
+               f'<NbOfTxs>{lote.quantidade_beneficiarios}</NbOfTxs><CtrlSum>{total}</CtrlSum>'
+               f'<ReqdExctnDt>{datetime.now(timezone.utc).date().isoformat()}</ReqdExctnDt>'
+               f'<Dbtr><Nm>{devedor}</Nm></Dbtr>'
+               f'<DbtrAcct><Id><IBAN>{_iban(config.get("PLATAFORMA_IBAN"))}</IBAN></Id><Ccy>{MOEDA}</Ccy></DbtrAcct>'
+               f'<DbtrAgt><FinInstnId>{agente}</FinInstnId></DbtrAgt>\n')
+
+        blocos = []
+        for numero, b in enumerate(LotePagamentoService.beneficiarios(lote.id), start=1):
+            blocos.append(
+                f'<CdtTrfTxInf><PmtId><EndToEndId>{lote.referencia}-{numero}</EndToEndId></PmtId>'
+                f'<Amt><InstdAmt Ccy="{MOEDA}">{Decimal(str(b.valor)):.2f}</InstdAmt></Amt>'
+                f'<Cdtr><Nm>{escape(b.nome[:70])}</Nm></Cdtr>'
+                f'<CdtrAcct><Id><IBAN>{_iban(b.iban)}</IBAN></Id></CdtrAcct>'
+                f'<RmtInf><Ustrd>{escape(_descritivo(lote, b.vendas))}</Ustrd></RmtInf></CdtTrfTxInf>\n')
+            if len(blocos) == TAMANHO_BLOCO:
+                yield ''.join(blocos)
+                blocos = []
+        yield ''.join(blocos) + '</PmtInf></CstmrCdtTrfInitn></Document>\n'
+
+    @staticmethod
+    def resposta_download(lote: LotePagamento, formato: str) -> Response:
+        """Ficheiro do lote para importar no banco, enviado à medida que é gerado."""
+        if formato == 'xml':
+            gerador, mimetype = LotePagamentoService.gerar_pain001(lote), 'application/xml'
+        else:
+            gerador, mimetype = LotePagamentoService.gerar_csv(lote), 'text/csv; charset=utf-8'
+        resposta = Response(stream_with_context(gerador), mimetype=mimetype)
+        resposta.headers['Content-Disposition'] = f'attachment; filename="{lote.referencia}.{formato}"'
+        return resposta
+
+    @staticmethod
+    def confirmar_lote(lote_id: int, admin_id: int, ip: str = None) -> Tuple[bool, Dict[int, str], str]:
+        """
+        O banco executou o ficheiro: liquida todas as transações do lote num só commit.
+        As linhas do lote são bloqueadas à espera (FOR UPDATE, sem SKIP LOCKED). As que
+        entretanto mudaram de estado ficam no lote como divergências (RESULTADO_RECONCILIAR).
+
+        Returns:
+            Tuple[success, {transacao_id: resultado}, mensagem]
+        """
+        try:
+            lote = db.session.get(LotePagamento, lote_id, with_for_update=True)
+            if not lote:
+                return False, {}, MSG_LOTE_NAO_ENCONTRADO
+            if lote.estado != LotePagamento.GERADO:
+                return False, {}, f"Este lote já foi {lote.estado}."
+
+            linhas = db.session.execute(
+                select(Transacao.id, Transacao.fatura_ref, Transacao.status)
+                .where(Transacao.lote_pagamento_id == lote.id).order_by(Transacao.id).with_for_update()
+            ).all()
+            ids = [l.id for l in linhas]
+            transitados = PagamentoService.aplicar_lote('liquidar', ids, admin_id, ip, lote.id)
+            divergentes = [l for l in linhas if l.id not in set(transitados)]
+
+            lote.estado = LotePagamento.CONFIRMADO
+            lote.data_confirmacao = datetime.now(timezone.utc)
+            lote.quantidade_divergencias = len(divergentes)
+            db.session.add(LogAuditoria(
+                usuario_id=admin_id,
+                acao="LOTE_PAGAMENTO_CONFIRMADO",
+                detalhes=f"{lote.referencia}: {len(transitados)} de {len(ids)} vendas liquidadas.",
+                ip=ip
+            ))
+            db.session.add_all([LogAuditoria(
+                usuario_id=admin_id,
+                acao="LOTE_PAGAMENTO_DIVERGENCIA",
+                detalhes=f"{lote.referencia}: Ref {l.fatura_ref} paga pelo banco em '{l.status}'. Reconciliar.",
+                ip=ip
+            ) for l in divergentes])
+            db.session.commit()
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"ERRO_CONFIRMAR_LOTE (ID: {lote_id}): {e}")
+            return False, {}, MSG_ERRO_TECNICO
+
+        resultados = PagamentoService.classificar_lote('liquidar', ids, transitados)
+        mensagem = f"{len(transitados)} de {len(ids)} liquidações confirmadas."
+        if divergentes:
+            current_app.logger.warning(
+                f"Lote {lote_id}: {len(divergentes)} vendas pagas pelo banco já não estavam ENTREGUE.")
+            resultados.update({l.id: RESULTADO_RECONCILIAR for l in divergentes})
+            mensagem += f" {len(divergentes)} para reconciliação manual."
+        return True, resultados, mensagem
+
+    @staticmethod
+    def divergencias(lote_id: int) -> List[dict]:
+        """Vendas de um lote confirmado que o banco pagou mas que não foram liquidadas."""
+        linhas = db.session.execute(
+            select(Transacao.id, Transacao.fatura_ref, Transacao.status, Transacao.vendedor_id,
+                   Transacao.valor_liquido_vendedor)
+            .join(LotePagamento, LotePagamento.id == Transacao.lote_pagamento_id)
+            .where(Transacao.lote_pagamento_id == lote_id, LotePagamento.estado == LotePagamento.CONFIRMADO,
+                   Transacao.transferencia_concluida.isnot(True))
+            .order_by(Transacao.id)).all()
+        return [{'id': l.id, 'ref': l.fatura_ref, 'status': l.status, 'vendedor_id': l.vendedor_id,
+                 'valor': float(l.valor_liquido_vendedor or 0)} for l in linhas]
+
+    @staticmethod
+    def reconciliar_venda(lote_id: int, transacao_id: int, admin_id: int, ip: str = None) -> Tuple[bool, str]:
+        """
+        Fecha uma divergência depois de o Admin tratar o caso:
+        - de volta a ENTREGUE (disputa resolvida a favor do produtor): liquida-a pelo lote;
+        - CANCELADO (comprador reembolsado): regista só que a transferência foi feita,
+          a recuperação do valor junto do produtor é tratada fora da plataforma.
+        Com a disputa ainda aberta não há nada a reconciliar.
+        """
+        try:
+            lote = db.session.get(LotePagamento, lote_id, with_for_update=True)
+            if not lote:
+                return False, MSG_LOTE_NAO_ENCONTRADO
+            if lote.estado != LotePagamento.CONFIRMADO:
+                return False, "Só se reconciliam vendas de lotes confirmados."
+            venda = db.session.execute(
+                select(Transacao).where(Transacao.id == transacao_id, Transacao.lote_pagamento_id == lote.id)
+                .with_for_update()).scalar_one_or_none()
+            if venda is None:
+                return False, MSG_VENDA_FORA_DO_LOTE
+            if venda.transferencia_concluida:
+                return False, f"A venda {venda.fatura_ref} já está reconciliada."
+
+            if venda.status == TransactionStatus.ENTREGUE:
+                PagamentoService.aplicar_lote('liquidar', [venda.id], admin_id, ip, lote.id)
+                detalhe = "liquidada pelo lote"
+            elif venda.status == TransactionStatus.CANCELADO:
+                venda.transferencia_concluida = True
+                venda.data_liquidacao = datetime.now(timezone.utc)
+                detalhe = "cancelada com transferência já feita ao produtor"
+            else:
+                return False, f"A venda {venda.fatura_ref} está em '{venda.status}': resolva-a antes de reconciliar."
+
+            lote.quantidade_divergencias = max((lote.quantidade_divergencias or 0) - 1, 0)
+            db.session.add(LogAuditoria(
+                usuario_id=admin_id,
+                acao="LOTE_PAGAMENTO_RECONCILIADO",
+                detalhes=f"{lote.referencia}: Ref {venda.fatura_ref} {detalhe}.",
+                ip=ip
+            ))
+            db.session.commit()
+            return True, f"Venda {venda.fatura_ref} reconciliada ({detalhe})."
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"ERRO_RECONCILIAR_LOTE (ID: {lote_id}, venda {transacao_id}): {e}")
+            return False, MSG_ERRO_TECNICO
+
+    @staticmethod
+    def cancelar_lote(lote_id: int, admin_id: int, ip: str = None) -> Tuple[bool, str]:
+        """O ficheiro não foi executado: as transações voltam à fila de liquidação."""
+        try:
+            lote = db.session.get(LotePagamento, lote_id, with_for_update=True)
+            if not lote:
+                return False, MSG_LOTE_NAO_ENCONTRADO
+            if lote.estado != LotePagamento.GERADO:
+                return False, f"Este lote já foi {lote.estado}."
+
+            db.session.execute(
+                update(Transacao).where(Transacao.lote_pagamento_id == lote.id)
+                .values(lote_pagamento_id=None).execution_options(synchronize_session=False))
+            lote.estado = LotePagamento.CANCELADO
+            db.session.add(LogAuditoria(
+                usuario_id=admin_id,
+                acao="LOTE_PAGAMENTO_CANCELADO",
+                detalhes=f"{lote.referencia} cancelado.",
+                ip=ip
+            ))
+            db.session.commit()
+            return True, f"Lote {lote.referencia} cancelado."
+
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"ERRO_CANCELAR_LOTE (ID: {lote_id}): {e}")
+            return False, MSG_ERRO_TECNICO
@@ -0,0 +1,229 @@
+"""
+Máquina de Estados das Transações AgroKongo.
+Todas as mudanças de `Transacao.status` passam por aqui: a tabela TRANSICOES diz
+de que estado se pode ir para qual, cada mudança grava sempre um HistoricoStatus
+e, depois do commit, emite o sinal `transicao_estado`.
+
+- `MaquinaEstados.transitar` muda uma transação carregada (passa pelo flush, por
+  isso os listeners de KPIs, cache e faturas veem-na como qualquer alteração).
+- `MaquinaEstados.transitar_em_lote` muda N transações com um único UPDATE
+  condicional e um único INSERT de histórico. O UPDATE em massa não passa pelos
+  listeners de flush: os deltas de KPIs, as tags de cache e as faturas a pré-gerar
+  são registados à mão, na mesma transação.
+"""
+import logging
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from blinker import Namespace
+from flask import current_app
+from sqlalchemy import event, func, insert, inspect as sa_inspect, select, update
+
+from app.extensions import db
+from app.models import HistoricoStatus, Transacao, TransactionStatus, aware_utcnow
+from app.services import cache_invalidation, fatura_service, kpi_service
+
+logger = logging.getLogger(__name__)
+
+S = TransactionStatus
+
+# Origem -> destinos permitidos. A disputa pode ser aberta em qualquer estado não final.
+TRANSICOES: Dict[str, FrozenSet[str]] = {
+    S.PENDENTE: frozenset({S.AGUARDANDO_PAGAMENTO, S.CANCELADO, S.DISPUTA}),
+    S.AGUARDANDO_PAGAMENTO: frozenset({S.ANALISE, S.CANCELADO, S.DISPUTA}),
+    S.ANALISE: frozenset({S.ESCROW, S.AGUARDANDO_PAGAMENTO, S.DISPUTA}),
+    S.ESCROW: frozenset({S.ENVIADO, S.DISPUTA}),
+    S.ENVIADO: frozenset({S.ENTREGUE, S.FINALIZADO, S.DISPUTA}),
+    S.ENTREGUE: frozenset({S.FINALIZADO, S.DISPUTA}),
+    S.DISPUTA: frozenset({S.ENTREGUE, S.CANCELADO}),
+    S.FINALIZADO: frozenset(),
+    S.CANCELADO: frozenset(),
+}
+
+# Carimbo temporal preenchido na primeira entrada em cada estado
+CARIMBOS = {
+    S.ESCROW: 'data_pagamento_escrow',
+    S.ENVIADO: 'data_envio',
+    S.ENTREGUE: 'data_entrega',
+    S.FINALIZADO: 'data_liquidacao',
+}
+
+_sinais = Namespace()
+# Emitido depois do commit: sender=app, transacao_ids, origem, destino
+transicao_estado = _sinais.signal('transicao-estado')
+
+_PENDENTES = 'transicoes_pendentes'
+
+# Colunas devolvidas pelo UPDATE em massa (as necessárias aos deltas dos KPIs)
+_COLUNAS_LOTE = (Transacao.id, *(getattr(Transacao, c) for c in kpi_service.CAMPOS_TRANSACAO if c != 'status'))
+
+
+# Saídas de ENTREGUE bloqueadas enquanto a venda está reservada num lote de pagamento
+# bancário: o banco pode já a ter pago, só a confirmação/reconciliação do lote a fecha
+SAIDAS_BLOQUEADAS_EM_LOTE = frozenset({S.DISPUTA, S.FINALIZADO})
+
+
+class TransicaoInvalida(ValueError):
+    """Mudança de estado que a tabela TRANSICOES não permite."""
+
+
+class TransacaoEmLotePagamento(TransicaoInvalida):
+    """Venda ENTREGUE reservada num lote de pagamento: só esse lote a pode fechar."""
+
+
+def pode_transitar(origem: Optional[str], destino: str) -> bool:
+    return destino in TRANSICOES.get(origem, ())
+
+
+def _observacao(texto: Optional[str]) -> Optional[str]:
+    # HistoricoStatus.observacao é String(255); motivos de rejeição vêm do formulário
+    return texto[:255] if texto else texto
+
+
+def _registar_eventos(session, transacoes: Iterable, origem: str, destino: str):
+    session.info.setdefault(_PENDENTES, []).extend((t, origem, destino) for t in transacoes)
+
+
+def _suporta_returning() -> bool:
+    return db.session.get_bind(mapper=Transacao.__mapper__).dialect.update_returning
+
+
+class MaquinaEstados:
+    """Transições validadas, com histórico e eventos, individuais ou em lote."""
+
+    @staticmethod
+    def transitar(transacao: Transacao, destino: str, observacao: str = None,
+                  validar: bool = True, lote_pagamento_id: int = None) -> Optional[HistoricoStatus]:
+        """
+        Muda o estado de uma transação (não faz commit).
+
+        Args:
+            validar: Com False aceita qualquer destino (só para `Transacao.mudar_status`)
+            lote_pagamento_id: Lote de pagamento que autoriza fechar a venda nele reservada
+
+        Returns:
+            O HistoricoStatus adicionado à sessão, ou None se já estava no destino
+
+        Raises:
+            TransicaoInvalida: se TRANSICOES não permitir a mudança
+            TransacaoEmLotePagamento: ENTREGUE -> DISPUTA/FINALIZADO de uma venda
+                                      reservada noutro lote (também com validar=False)
+        """
+        origem = transacao.status
+        if origem == destino:
+            return None
+        if validar and not pode_transitar(origem, destino):
+            raise TransicaoInvalida(f"Transição inválida: {origem} -> {destino}")
+        if origem == S.ENTREGUE and destino in SAIDAS_BLOQUEADAS_EM_LOTE \
+                and transacao.lote_pagamento_id is not None and transacao.lote_pagamento_id != lote_pagamento_id:
+            raise TransacaoEmLotePagamento(
+                f"A venda {transacao.fatura_ref} está num lote de pagamento bancário: "
+                f"confirme ou cancele o lote antes de a mudar para {destino}.")
+
+        transacao.status = destino
+        coluna = CARIMBOS.get(destino)
+        if coluna and getattr(transacao, coluna) is None:
+            setattr(transacao, coluna, aware_utcnow())
+
+        historico = HistoricoStatus(transacao=transacao, status_anterior=origem,
+                                    status_novo=destino, observacao=_observacao(observacao))
+        db.session.add(historico)
+        _registar_eventos(db.session, [transacao], origem, destino)
+        return historico
+
+    @staticmethod
+    def transitar_em_lote(ids: Iterable[int], origem: str, destino: str,
+                          observacao: str = None, extra: Dict = None,
+                          lote_pagamento_id: int = None) -> List[int]:
+        """
+        Muda de `origem` para `destino` todas as transações de `ids` que ainda
+        estejam em `origem`, num único UPDATE (não faz commit).
+
+        Args:
+            extra: Outras colunas escritas no mesmo UPDATE (ex.: transferencia_concluida)
+            lote_pagamento_id: Em ENTREGUE -> DISPUTA/FINALIZADO só mudam as vendas deste
+                               lote de pagamento (por omissão, as que não estão em nenhum)
+
+        Returns:
+            Ids efetivamente transitados (os restantes já não estavam em `origem`)
+
+        Raises:
+            TransicaoInvalida: se TRANSICOES não permitir a mudança
+        """
+        if not pode_transitar(origem, destino):
+            raise TransicaoInvalida(f"Transição inválida: {origem} -> {destino}")
+        ids = sorted({int(i) for i in ids})
+        if not ids:
+            return []
+
+        agora = aware_utcnow()
+        valores = {**(extra or {}), 'status': destino}
+        coluna = CARIMBOS.get(destino)
+        if coluna and coluna not in valores:
+            valores[coluna] = func.coalesce(getattr(Transacao, coluna), agora)
+        condicoes = [Transacao.id.in_(ids), Transacao.status == origem]
+        if origem == S.ENTREGUE and destino in SAIDAS_BLOQUEADAS_EM_LOTE:
+            condicoes.append(Transacao.lote_pagamento_id.is_(None) if lote_pagamento_id is None
+                             else Transacao.lote_pagamento_id == lote_pagamento_id)
+        instrucao = update(Transacao).where(*condicoes) \
+            .values(**valores).execution_options(synchronize_session='fetch')
+
+        if _suporta_returning():
+            linhas = db.session.execute(instrucao.returning(*_COLUNAS_LOTE)).all()
+        else:
+            # Sem RETURNING (MySQL): bloqueia e lê as elegíveis antes de as atualizar
+            linhas = db.session.execute(
+                select(*_COLUNAS_LOTE).where(*condicoes).with_for_update()).all()
+            if linhas:
+                db.session.execute(instrucao.where(Transacao.id.in_([l.id for l in linhas])))
+        if not linhas:
+            return []
+
+        transitados = [l.id for l in linhas]
+        db.session.execute(insert(HistoricoStatus), [
+            dict(transacao_id=i, status_anterior=origem, status_novo=destino,
+                 observacao=_observacao(observacao), data_mudanca=agora)
+            for i in transitados
+        ])
+
+        kpi_service.registar_transicoes(db.session, [l._mapping for l in linhas], origem, destino)
+        cache_invalidation.registar_transacoes(db.session)
+        if destino == S.ESCROW:
+            fatura_service.registar_escrow(db.session, transitados)
+        _registar_eventos(db.session, transitados, origem, destino)
+        return transitados
+
+
+def _transacao_id(transacao) -> Optional[int]:
+    if isinstance(transacao, int):
+        return transacao
+    # Depois do commit os atributos estão expirados: a identidade evita um SELECT
+    identidade = sa_inspect(transacao).identity
+    return identidade[0] if identidade else None
+
+
+def _after_commit(session):
+    pendentes = session.info.pop(_PENDENTES, None)
+    if not pendentes or not transicao_estado.receivers:
+        return
+    agrupados = defaultdict(list)
+    for transacao, origem, destino in pendentes:
+        agrupados[(origem, destino)].append(_transacao_id(transacao))
+
+    app = current_app._get_current_object()
+    for (origem, destino), ids in agrupados.items():
+        try:
+            transicao_estado.send(app, transacao_ids=ids, origem=origem, destino=destino)
+        except Exception as e:
+            logger.error(f"Falha num recetor de transição {origem} -> {destino}: {e}")
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDENTES, None)
+
+
+def init_app(app):
+    """Regista a emissão dos sinais de transição depois de cada commit."""
+    for nome, listener in (('after_commit', _after_commit), ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, nome, listener):
+            event.listen(db.session, nome, listener)
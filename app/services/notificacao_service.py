@@ -0,0 +1,212 @@
+"""
+Notificações em Tempo Real AgroKongo.
+O sininho da navbar deixa de fazer um COUNT em cada página e o browser deixa
+de fazer polling:
+
+- contador de não lidas em Redis (`notif:nao_lidas:<id>`), mantido por deltas
+  depois de cada commit: +1 por notificação criada, -1 por notificação lida e
+  0 quando o utilizador marca todas como lidas. Se faltar (TTL, Redis reiniciado)
+  é recalculado com um COUNT e volta a ser mantido por deltas;
+- as 5 mais recentes (dropdown do sininho) ficam em `notif:ultimas:<id>` e são
+  descartadas depois de qualquer commit que mexa nas notificações do utilizador;
+- cada notificação criada é publicada no canal `notif:usuario:<id>`; com
+  NOTIFICACOES_SSE ligado o endpoint SSE `/notificacoes/stream` reencaminha-as ao
+  browser (EventSource). Cada stream prende um worker, por isso só se liga com
+  workers assíncronos (gevent/eventlet); com workers síncronos o browser faz
+  polling curto a `/notificacoes/resumo` (ver `resumo`).
+
+Em estado estacionário a navbar não faz nenhuma query; quando falta a cache, o
+índice (usuario_id, lida, data_criacao) resolve o COUNT só com o índice e limita o
+TOP 5 às linhas do utilizador.
+
+Os INSERT/UPDATE em massa não passam pelo flush: quem os faz regista os efeitos
+com `registar_novas` / `registar_lidas`, na mesma transação (como nos KPIs).
+Sem Redis o contador volta ao COUNT e o stream só envia o valor atual, pedindo
+ao browser que volte a ligar mais tarde (long-poll lento).
+"""
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Iterable, List, Tuple
+
+from flask import Response, current_app
+from sqlalchemy import event, inspect as sa_inspect, select
+
+from app.extensions import db
+from app.models import Notificacao
+from app.services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+CHAVE_CONTADOR = 'notif:nao_lidas:{}'
+CHAVE_ULTIMAS = 'notif:ultimas:{}'
+CANAL = 'notif:usuario:{}'
+LIMITE_ULTIMAS = 5
+# O contador corrige qualquer deriva (ex.: corrida com o recálculo) ao expirar
+TTL_CONTADOR = timedelta(hours=1)
+TTL_ULTIMAS = timedelta(minutes=10)
+
+HEARTBEAT = 15  # segundos entre comentários ': ping' (proxies fecham ligações mudas)
+RETRY_MS = 3000  # reconexão do EventSource ao fim de cada stream
+RETRY_SEM_REDIS_MS = 30000
+
+# Chave em session.info com os efeitos a aplicar depois do commit
+_PENDENTES = 'notificacoes_pendentes'
+
+
+def _pendentes(session) -> dict:
+    return session.info.setdefault(_PENDENTES, {'deltas': defaultdict(int), 'zerar': set(), 'novas': []})
+
+
+def contar_nao_lidas(usuario_id: int) -> int:
+    """Não lidas do utilizador: Redis em estado estacionário, COUNT só quando falta o contador."""
+    chave = CHAVE_CONTADOR.format(usuario_id)
+    valor = cache_service.obter_contador(chave)
+    if valor is not None:
+        return valor
+    total = Notificacao.query.filter_by(usuario_id=usuario_id, lida=False).count()
+    cache_service.definir_contador(chave, total, TTL_CONTADOR)
+    return total
+
+
+def ultimas(usuario_id: int, limite: int = LIMITE_ULTIMAS) -> List[dict]:
+    """
+    Notificações mais recentes como dicts (mensagem, link, lida, data). Só a
+    vista do sininho (LIMITE_ULTIMAS) fica em cache.
+    """
+    chave = CHAVE_ULTIMAS.format(usuario_id)
+    if limite == LIMITE_ULTIMAS:
+        cacheadas = cache_service.get(chave)
+        if cacheadas is not None:
+            return cacheadas
+    linhas = db.session.execute(
+        select(Notificacao.mensagem, Notificacao.link, Notificacao.lida, Notificacao.data_criacao)
+        .where(Notificacao.usuario_id == usuario_id)
+        .order_by(Notificacao.data_criacao.desc(), Notificacao.id.desc())
+        .limit(limite)).all()
+    resultado = [{'mensagem': l.mensagem, 'link': l.link, 'lida': bool(l.lida),
+                  'data': l.data_criacao.isoformat() if l.data_criacao else None} for l in linhas]
+    if limite == LIMITE_ULTIMAS:
+        cache_service.set(chave, resultado, ttl=TTL_ULTIMAS)
+    return resultado
+
+
+def resumo(usuario_id: int) -> dict:
+    """Contador e últimas notificações para o polling do sininho (sem queries em estado estacionário)."""
+    return {'nao_lidas': contar_nao_lidas(usuario_id), 'ultimas': ultimas(usuario_id)}
+
+
+def registar_novas(session, notificacoes: Iterable[Tuple[int, str, str]]):
+    """Notificações (usuario_id, mensagem, link) inseridas por INSERT direto, sem flush."""
+    pendentes = _pendentes(session)
+    for usuario_id, mensagem, link in notificacoes:
+        pendentes['deltas'][usuario_id] += 1
+        pendentes['novas'].append((usuario_id, mensagem, link))
+
+
+def registar_lidas(session, usuario_id: int):
+    """O utilizador marcou todas as notificações como lidas (UPDATE direto)."""
+    _pendentes(session)['zerar'].add(usuario_id)
+
+
+def _after_flush(session, flush_context):
+    # Um delta 0 também marca o utilizador: as últimas em cache mudaram na mesma
+    pendentes = None
+    for obj in session.new:
+        if isinstance(obj, Notificacao):
+            pendentes = pendentes or _pendentes(session)
+            pendentes['deltas'][obj.usuario_id] += 0 if obj.lida else 1
+            if not obj.lida:
+                pendentes['novas'].append((obj.usuario_id, obj.mensagem, obj.link))
+    for obj in session.dirty:
+        if isinstance(obj, Notificacao) and session.is_modified(obj):
+            pendentes = pendentes or _pendentes(session)
+            historico = sa_inspect(obj).attrs.lida.history
+            delta = 0
+            if historico.added and historico.deleted and bool(historico.added[0]) != bool(historico.deleted[0]):
+                delta = -1 if historico.added[0] else 1
+            pendentes['deltas'][obj.usuario_id] += delta
+    for obj in session.deleted:
+        if isinstance(obj, Notificacao):
+            pendentes = pendentes or _pendentes(session)
+            pendentes['deltas'][obj.usuario_id] += 0 if obj.lida else -1
+
+
+def _after_commit(session):
+    pendentes = session.info.pop(_PENDENTES, None)
+    if not pendentes:
+        return
+    zerar = pendentes['zerar']
+    afetados = set(pendentes['deltas']) | zerar | {u for u, _, _ in pendentes['novas']}
+    cache_service.delete_many([CHAVE_ULTIMAS.format(u) for u in afetados])
+    for usuario_id in zerar:
+        cache_service.definir_contador(CHAVE_CONTADOR.format(usuario_id), 0, TTL_CONTADOR, apenas_se_ausente=False)
+    novos = cache_service.ajustar_contadores({
+        CHAVE_CONTADOR.format(u): d for u, d in pendentes['deltas'].items() if u not in zerar})
+
+    mensagens = [(CANAL.format(u), json.dumps({'tipo': 'lidas', 'nao_lidas': 0})) for u in zerar]
+    for usuario_id, mensagem, link in pendentes['novas']:
+        dados = {'tipo': 'nova', 'mensagem': mensagem, 'link': link}
+        contador = novos.get(CHAVE_CONTADOR.format(usuario_id))
+        if contador is not None:
+            dados['nao_lidas'] = contador
+        mensagens.append((CANAL.format(usuario_id), json.dumps(dados)))
+    cache_service.publicar(mensagens)
+
+
+def _after_rollback(session):
+    session.info.pop(_PENDENTES, None)
+
+
+# --- SERVER-SENT EVENTS ---
+def _evento(nome: str, dados) -> str:
+    texto = dados if isinstance(dados, str) else json.dumps(dados)
+    return f"event: {nome}\ndata: {texto}\n\n"
+
+
+def resposta_stream(usuario_id: int) -> Response:
+    """
+    Stream SSE das notificações do utilizador. Termina ao fim de
+    NOTIFICACOES_STREAM_SEGUNDOS (o EventSource volta a ligar sozinho), para não
+    prender um worker indefinidamente. Com NOTIFICACOES_SSE desligado (workers
+    síncronos) envia só o contador atual e fecha logo, como sem Redis.
+    """
+    nao_lidas = contar_nao_lidas(usuario_id)
+    pubsub = None
+    if current_app.config.get('NOTIFICACOES_SSE'):
+        pubsub = cache_service.subscrever(CANAL.format(usuario_id))
+    duracao = current_app.config.get('NOTIFICACOES_STREAM_SEGUNDOS', 300)
+
+    def gerar():
+        if pubsub is None:
+            yield f"retry: {RETRY_SEM_REDIS_MS}\n" + _evento('contador', {'nao_lidas': nao_lidas})
+            return
+        yield f"retry: {RETRY_MS}\n" + _evento('contador', {'nao_lidas': nao_lidas})
+        fim = time.monotonic() + duracao
+        try:
+            while time.monotonic() < fim:
+                mensagem = pubsub.get_message(ignore_subscribe_messages=True, timeout=HEARTBEAT)
+                if mensagem is None:
+                    yield ": ping\n\n"
+                    continue
+                yield _evento('notificacao', mensagem['data'])
+        except Exception as e:
+            logger.warning(f"Stream de notificações interrompido (utilizador {usuario_id}): {e}")
+        finally:
+            pubsub.close()
+
+    # Sem stream_with_context: a sessão da BD é libertada quando a view retorna
+    resposta = Response(gerar(), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    resposta.headers['X-Accel-Buffering'] = 'no'  # nginx: não fazer buffer do stream
+    return resposta
+
+
+def init_app(app):
+    """Regista a manutenção do contador e a publicação depois de cada commit."""
+    for nome, listener in (('after_flush', _after_flush), ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, nome, listener):
+            event.listen(db.session, nome, listener)
@@ -0,0 +1,315 @@
+"""
+Outbox de Notificações AgroKongo (transactional outbox).
+As ações de negócio já não inserem `Notificacao` dentro da transação do pedido:
+gravam um `EventoOutbox` (uma linha, no mesmo commit) e o despachante faz o resto.
+
+- `publicar`/`notificar` adicionam o evento à sessão atual: se o negócio fizer
+  rollback, o evento desaparece com ele; se fizer commit, a notificação é garantida.
+- Depois do commit o despachante é acordado (Celery ou thread local); um job
+  periódico apanha o que ficar para trás (worker em baixo, broker indisponível).
+- O despachante lê os eventos em lotes (SKIP LOCKED), expande-os em notificações,
+  elimina duplicados, agrupa as mensagens de chat ("3 novas mensagens") e grava
+  tudo com INSERTs em massa (os alertas de safras com um INSERT ... SELECT, ver
+  alerta_service); depois entrega-as ao microsserviço de notificações
+  (NOTIFICATION_SERVICE_URL) para email/push.
+"""
+import json
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import click
+import requests
+from flask import current_app
+from sqlalchemy import delete, event, insert, select, update
+
+from app.extensions import db
+from app.models import EventoOutbox, Notificacao, Transacao, Usuario, aware_utcnow
+from app.services import alerta_service, notificacao_service
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evento
+NOTIFICACAO = 'notificacao'
+SAFRA_PUBLICADA = 'safra_publicada'
+MENSAGEM_CHAT = 'mensagem_chat'
+
+TAMANHO_LOTE = 200  # eventos lidos por ciclo do despachante
+TAMANHO_BLOCO = 1000  # notificações por INSERT / por pedido ao microsserviço
+MAX_TENTATIVAS = 5
+MAX_CICLOS = 50  # por execução do despachante; o resto fica para a próxima
+TIMEOUT_MICROSSERVICO = 5
+
+# Chave em session.info: houve eventos novos nesta transação
+_NOVOS = 'outbox_novos'
+
+# Uma só execução local de cada vez (a thread ativa esvazia a fila até ao fim)
+_em_execucao = threading.Lock()
+
+
+def publicar(tipo: str, payload: Dict):
+    """Grava o evento na transação atual (não faz commit)."""
+    db.session.add(EventoOutbox(tipo=tipo, payload=json.dumps(payload, sort_keys=True)))
+    db.session.info[_NOVOS] = True
+
+
+def notificar(usuario_ids: Iterable[int], mensagem: str, link: str = None):
+    """Notificação in-app para um ou mais utilizadores, entregue pelo despachante."""
+    ids = sorted({int(i) for i in usuario_ids})
+    if ids:
+        publicar(NOTIFICACAO, {'usuarios': ids, 'mensagem': mensagem, 'link': link})
+
+
+# --- EXPANSÃO DOS EVENTOS EM NOTIFICAÇÕES ---
+# Cada tratador recebe os payloads de um tipo, grava as notificações e devolve
+# {(mensagem, link): [usuario_ids]}. Os tratadores simples produzem dicts
+# {usuario_id, mensagem, link, agrupar} para `_gravar`; `agrupar` = não repetir
+# enquanto houver uma notificação não lida com o mesmo link.
+
+def _notificacoes(payloads: List[Dict]) -> Iterator[Dict]:
+    for p in payloads:
+        for usuario_id in p['usuarios']:
+            yield dict(usuario_id=usuario_id, mensagem=p['mensagem'], link=p.get('link'), agrupar=False)
+
+
+def _safras_publicadas(payloads: List[Dict]) -> Dict[Tuple, List[int]]:
+    # Cruzamento com as subscrições feito na base de dados (INSERT ... SELECT)
+    gravadas = defaultdict(list)
+    for safra_id, link in {p['safra_id']: p.get('link') for p in payloads}.items():
+        for chave, usuarios in alerta_service.notificar_safra(safra_id, link).items():
+            gravadas[chave].extend(usuarios)
+    return gravadas
+
+
+def _mensagens_chat(payloads: List[Dict]) -> Iterator[Dict]:
+    # Várias mensagens para o mesmo destinatário na mesma conversa: uma só notificação
+    por_conversa = defaultdict(list)
+    for p in payloads:
+        por_conversa[(p['destinatario_id'], p['transacao_id'], p.get('link'))].append(p['remetente_id'])
+
+    nomes = dict(db.session.execute(
+        select(Usuario.id, Usuario.nome).where(Usuario.id.in_({r for rs in por_conversa.values() for r in rs}))
+    ).tuples().all())
+    referencias = dict(db.session.execute(
+        select(Transacao.id, Transacao.fatura_ref).where(Transacao.id.in_({t for _, t, _ in por_conversa}))
+    ).tuples().all())
+
+    for (destinatario_id, transacao_id, link), remetentes in por_conversa.items():
+        de = nomes.get(remetentes[-1], 'AgroKongo')
+        ref = referencias.get(transacao_id, transacao_id)
+        if len(remetentes) == 1:
+            mensagem = f"💬 Nova mensagem de {de} sobre a Ref {ref}"
+        else:
+            mensagem = f"💬 {len(remetentes)} novas mensagens de {de} sobre a Ref {ref}"
+        yield dict(usuario_id=destinatario_id, mensagem=mensagem, link=link, agrupar=True)
+
+
+TRATADORES = {
+    NOTIFICACAO: lambda payloads: _gravar(_notificacoes(payloads)),
+    SAFRA_PUBLICADA: _safras_publicadas,
+    MENSAGEM_CHAT: lambda payloads: _gravar(_mensagens_chat(payloads)),
+}
+
+
+def _gravar_bloco(bloco: List[Dict], entregues: Dict[Tuple, List[int]]):
+    agrupaveis = [n for n in bloco if n['agrupar']]
+    if agrupaveis:
+        existentes = set(db.session.execute(
+            select(Notificacao.usuario_id, Notificacao.link).where(
+                Notificacao.lida.is_(False),
+                Notificacao.usuario_id.in_({n['usuario_id'] for n in agrupaveis}),
+                Notificacao.link.in_({n['link'] for n in agrupaveis}))
+        ).tuples().all())
+        bloco = [n for n in bloco if not (n['agrupar'] and (n['usuario_id'], n['link']) in existentes)]
+    if not bloco:
+        return
+    db.session.execute(insert(Notificacao), [
+        dict(usuario_id=n['usuario_id'], mensagem=n['mensagem'][:255], link=n['link']) for n in bloco])
+    notificacao_service.registar_novas(db.session, [(n['usuario_id'], n['mensagem'][:255], n['link']) for n in bloco])
+    for n in bloco:
+        entregues[(n['mensagem'][:255], n['link'])].append(n['usuario_id'])
+
+
+def _gravar(notificacoes: Iterable[Dict]) -> Dict[Tuple, List[int]]:
+    """INSERTs em massa, sem duplicados. Devolve {(mensagem, link): [usuario_ids]}."""
+    entregues = defaultdict(list)
+    vistas = set()
+    bloco = []
+    for n in notificacoes:
+        chave = (n['usuario_id'], n['link']) if n['agrupar'] else (n['usuario_id'], n['mensagem'], n['link'])
+        if chave in vistas:
+            continue
+        vistas.add(chave)
+        bloco.append(n)
+        if len(bloco) == TAMANHO_BLOCO:
+            _gravar_bloco(bloco, entregues)
+            bloco = []
+    if bloco:
+        _gravar_bloco(bloco, entregues)
+    return entregues
+
+
+def _entregar_microsservico(entregues: Dict[Tuple, List[int]]):
+    """Passa as notificações gravadas ao microsserviço (email/push). Falhas só ficam no log."""
+    url = current_app.config.get('NOTIFICATION_SERVICE_URL')
+    if not url or not entregues:
+        return
+    endpoint = f"{url.rstrip('/')}/api/v1/notificacoes/broadcast"
+    for (mensagem, link), usuarios in entregues.items():
+        for i in range(0, len(usuarios), TAMANHO_BLOCO):
+            try:
+                resposta = requests.post(endpoint, timeout=TIMEOUT_MICROSSERVICO, json={
+                    'usuarios_ids': usuarios[i:i + TAMANHO_BLOCO], 'mensagem': mensagem, 'link': link})
+                resposta.raise_for_status()
+            except requests.RequestException as e:
+                # As notificações in-app já estão gravadas: não insistir com o serviço em baixo
+                logger.warning(f"Microsserviço de notificações indisponível: {e}")
+                return
+
+
+class OutboxService:
+    """Despacho dos eventos pendentes e manutenção da tabela de outbox."""
+
+    @staticmethod
+    def despachar(limite: int = TAMANHO_LOTE) -> int:
+        """
+        Processa um lote de eventos pendentes num só commit.
+
+        Returns:
+            Número de eventos processados com sucesso
+        """
+        eventos = db.session.execute(
+            select(EventoOutbox.id, EventoOutbox.tipo, EventoOutbox.payload, EventoOutbox.tentativas)
+            .where(EventoOutbox.estado == EventoOutbox.PENDENTE)
+            .order_by(EventoOutbox.id).limit(limite)
+            .with_for_update(skip_locked=True)).all()
+        if not eventos:
+            db.session.rollback()
+            return 0
+
+        por_tipo = defaultdict(list)
+        for e in eventos:
+            por_tipo[e.tipo].append(e)
+
+        entregues = defaultdict(list)
+        processados, falhados = [], []
+        for tipo, lista in por_tipo.items():
+            try:
+                tratador = TRATADORES.get(tipo)
+                if tratador is None:
+                    raise ValueError(f"Tipo de evento desconhecido: {tipo}")
+                with db.session.begin_nested():
+                    gravadas = tratador([json.loads(e.payload) for e in lista])
+            except Exception as erro:
+                logger.error(f"Falha a despachar eventos '{tipo}': {erro}")
+                falhados.extend((e, str(erro)[:255]) for e in lista)
+                continue
+            for chave, usuarios in gravadas.items():
+                entregues[chave].extend(usuarios)
+            processados.extend(e.id for e in lista)
+
+        if processados:
+            db.session.execute(
+                update(EventoOutbox).where(EventoOutbox.id.in_(processados))
+                .values(estado=EventoOutbox.PROCESSADO, data_processamento=aware_utcnow(), erro=None))
+        for e, erro in falhados:
+            tentativas = e.tentativas + 1
+            db.session.execute(
+                update(EventoOutbox).where(EventoOutbox.id == e.id).values(
+                    tentativas=tentativas, erro=erro,
+                    estado=EventoOutbox.FALHA if tentativas >= MAX_TENTATIVAS else EventoOutbox.PENDENTE))
+        db.session.commit()
+
+        _entregar_microsservico(entregues)
+        return len(processados)
+
+    @staticmethod
+    def despachar_pendentes() -> int:
+        """Esvazia a fila (até MAX_CICLOS lotes). Para quando um ciclo não avança."""
+        total = 0
+        for _ in range(MAX_CICLOS):
+            processados = OutboxService.despachar()
+            if not processados:
+                break
+            total += processados
+        return total
+
+    @staticmethod
+    def limpar_processados(dias: int = None) -> int:
+        """Apaga os eventos processados há mais de OUTBOX_RETENCAO_DIAS."""
+        dias = dias if dias is not None else current_app.config.get('OUTBOX_RETENCAO_DIAS', 7)
+        limite = aware_utcnow() - timedelta(days=dias)
+        resultado = db.session.execute(
+            delete(EventoOutbox).where(EventoOutbox.estado == EventoOutbox.PROCESSADO,
+                                       EventoOutbox.data_processamento < limite))
+        db.session.commit()
+        return resultado.rowcount or 0
+
+
+# --- DESPACHO DEPOIS DO COMMIT ---
+def despachar_com_contexto(app):
+    """Esvazia a fila num contexto próprio (thread local ou scheduler)."""
+    if not _em_execucao.acquire(blocking=False):
+        return  # a execução em curso apanha os eventos novos no próximo ciclo
+    try:
+        with app.app_context():
+            try:
+                OutboxService.despachar_pendentes()
+            except Exception as e:
+                logger.error(f"Erro no despachante da outbox: {e}")
+            finally:
+                db.session.remove()
+    finally:
+        _em_execucao.release()
+
+
+def _acordar_despachante():
+    from app.extensions import celery, CELERY_AVAILABLE
+    from app.services.cache_service import cache_service
+    # O broker é o mesmo Redis do cache: com o circuito aberto nem tentamos publicar
+    if CELERY_AVAILABLE and celery is not None and cache_service.ping():
+        try:
+            celery.send_task('tasks.despachar_outbox', ignore_result=True)
+            return
+        except Exception as e:
+            logger.warning(f"Broker indisponível, outbox despachada localmente: {e}")
+
+    app = current_app._get_current_object()
+    threading.Thread(target=despachar_com_contexto, args=(app,), name='outbox', daemon=True).start()
+
+
+def _after_commit(session):
+    if not session.info.pop(_NOVOS, False) or not current_app.config.get('OUTBOX_DESPACHO_IMEDIATO', True):
+        return
+    try:
+        _acordar_despachante()
+    except Exception as e:
+        logger.warning(f"Não foi possível acordar o despachante da outbox: {e}")
+
+
+def _after_rollback(session):
+    session.info.pop(_NOVOS, None)
+
+
+def init_app(app):
+    """Regista o despacho depois do commit e os comandos `flask outbox despachar|limpar`."""
+    for nome, listener in (('after_commit', _after_commit), ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, nome, listener):
+            event.listen(db.session, nome, listener)
+
+    @app.cli.group('outbox')
+    def outbox_cli():
+        """Outbox de eventos (notificações)."""
+
+    @outbox_cli.command('despachar')
+    def despachar_cmd():
+        """Processa os eventos pendentes."""
+        click.echo(f"✅ {OutboxService.despachar_pendentes()} eventos despachados.")
+
+    @outbox_cli.command('limpar')
+    @click.option('--dias', type=int, default=None, help='Retenção (padrão: OUTBOX_RETENCAO_DIAS).')
+    def limpar_cmd(dias):
+        """Apaga os eventos já processados."""
+        click.echo(f"✅ {OutboxService.limpar_processados(dias)} eventos removidos.")
@@ -2,16 +2,41 @@
 Serviço de Gestão de Pagamentos
 Responsável por validação, liquidação e gestão financeira.
 """
+from collections import defaultdict
 from decimal import Decimal
 from datetime import datetime, timezone
-from typing import Tuple, Optional
+from typing import Dict, Iterable, List, Tuple, Optional
 from flask import current_app
+from sqlalchemy import bindparam, func, insert, select, update
 
 from app import scheduler
 from app.extensions import db
-from app.models import Transacao, Notificacao, LogAuditoria, TransactionStatus
+from app.models import Transacao, Notificacao, LogAuditoria, TransactionStatus, Usuario
+from app.services import notificacao_service
+from app.services.maquina_estados import MaquinaEstados
 from app.utils.status_helper import status_to_value
 
+# Máximo de transações por pedido de processamento em lote
+LIMITE_LOTE = 500
+
+# Resultado por transação de PagamentoService.processar_lote
+LOTE_OK = 'ok'
+LOTE_NAO_ENCONTRADA = 'nao_encontrada'
+LOTE_ESTADO_INVALIDO = 'estado_invalido'
+LOTE_EM_PROCESSAMENTO = 'em_processamento'  # bloqueada por outro admin (SKIP LOCKED)
+
+MSG_ERRO_LOTE = "Erro técnico ao processar o lote."
+
+# acao -> (origem, destino, observação, ação de auditoria, detalhe, notificação ao produtor, link)
+ACOES_LOTE = {
+    'validar': (TransactionStatus.ANALISE, TransactionStatus.ESCROW, "Pagamento validado pelo Admin (lote)",
+                "VALIDACAO_PAGAMENTO", "Ref {ref} aprovada (lote).",
+                "💰 Pagamento confirmado para {ref}! Pode enviar a mercadoria.", '/produtor/vendas'),
+    'liquidar': (TransactionStatus.ENTREGUE, TransactionStatus.FINALIZADO, "Liquidado ao produtor (lote)",
+                 "LIQUIDACAO_PRODUTOR", "Ref {ref} liquidada (lote). Valor: {valor} Kz",
+                 "💵 Transferência realizada para a venda {ref}!", '/produtor/dashboard'),
+}
+
 
 class PagamentoService:
     """Serviço responsável por gerir todo o ciclo de pagamentos."""
@@ -35,7 +60,7 @@ class PagamentoService:
                 return False, "Esta transação já foi processada ou não está em análise."
             
             # Atualizar status para ESCROW
-            venda.mudar_status(status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.ESCROW), "Pagamento validado pelo Admin")
             
             # Log de auditoria
             db.session.add(LogAuditoria(
@@ -90,10 +115,12 @@ class PagamentoService:
             # Verificar se está pronta para liquidação
             if not (venda.status == status_to_value(TransactionStatus.ENTREGUE) and not venda.transferencia_concluida):
                 return False, "Esta transação não está pronta para liquidação."
+            if venda.lote_pagamento_id:
+                return False, "Esta transação já está num lote de pagamento bancário."
             
             # Marcar como transferida e finalizada
             venda.transferencia_concluida = True
-            venda.status = status_to_value(TransactionStatus.FINALIZADO)
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.FINALIZADO), "Liquidado ao produtor")
             venda.data_liquidacao = datetime.now(timezone.utc)
             
             # Log de auditoria
@@ -131,7 +158,10 @@ class PagamentoService:
             Tuple[success, mensagem]
         """
         try:
-            venda = Transacao.query.get_or_404(transacao_id)
+            venda = Transacao.query.with_for_update().get_or_404(transacao_id)
+            
+            if venda.status != status_to_value(TransactionStatus.ANALISE):
+                return False, "Esta transação já foi processada ou não está em análise."
             
             # Log de auditoria
             db.session.add(LogAuditoria(
@@ -142,7 +172,7 @@ class PagamentoService:
             ))
             
             # Voltar ao estado de aguardando pagamento
-            venda.mudar_status(status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), f"Pagamento rejeitado: {motivo}")
+            MaquinaEstados.transitar(venda, status_to_value(TransactionStatus.AGUARDANDO_PAGAMENTO), f"Pagamento rejeitado: {motivo}")
             venda.comprovativo_path = None
             
             # Notificar comprador
@@ -158,6 +188,124 @@ class PagamentoService:
             current_app.logger.error(f"Erro rejeitar pagamento: {e}")
             return False, "Erro ao rejeitar pagamento."
     
+    @staticmethod
+    def processar_lote(acao: str, ids: Iterable[int], admin_id: int,
+                       ip: str = None) -> Tuple[bool, Dict[int, str], str]:
+        """
+        Valida pagamentos (ANALISE -> ESCROW) ou liquida vendas (ENTREGUE -> FINALIZADO)
+        de centenas de transações num só commit.
+
+        As linhas são bloqueadas com `FOR UPDATE SKIP LOCKED`: as que outro admin está a
+        processar ficam EM_PROCESSAMENTO em vez de esperar. A mudança de estado é um único
+        UPDATE, o saldo dos produtores um UPDATE agregado por produtor e as notificações
+        e logs de auditoria dois INSERT em massa.
+
+        Returns:
+            Tuple[success, {transacao_id: resultado}, mensagem]
+        """
+        if acao not in ACOES_LOTE:
+            return False, {}, "Ação desconhecida."
+        try:
+            ids = sorted({int(i) for i in ids})
+        except (TypeError, ValueError):
+            return False, {}, "Lista de ids inválida."
+        if not ids:
+            return False, {}, "Nenhuma transação indicada."
+        if len(ids) > LIMITE_LOTE:
+            return False, {}, f"Máximo de {LIMITE_LOTE} transações por lote."
+
+        try:
+            transitados = PagamentoService.aplicar_lote(acao, ids, admin_id, ip)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"ERRO_LOTE_{acao.upper()} ({len(ids)} ids): {e}")
+            return False, {}, MSG_ERRO_LOTE
+
+        resultados = PagamentoService.classificar_lote(acao, ids, transitados)
+        return True, resultados, f"{len(transitados)} de {len(ids)} transações processadas."
+
+    @staticmethod
+    def aplicar_lote(acao: str, ids: List[int], admin_id: int, ip: str = None,
+                     lote_pagamento_id: int = None) -> List[int]:
+        """
+        Núcleo de processar_lote, sem limite de ids e sem commit (usado também na
+        confirmação dos lotes de pagamento bancário).
+
+        Args:
+            lote_pagamento_id: Na liquidação só entram as transações deste lote bancário
+                               (por omissão, as que não estão em nenhum). O banco já pagou
+                               o lote: as linhas são bloqueadas à espera (FOR UPDATE), nunca
+                               saltadas como no SKIP LOCKED do processamento manual
+
+        Returns:
+            Ids efetivamente transitados
+        """
+        origem, destino, observacao, acao_log, detalhe, mensagem, link = ACOES_LOTE[acao]
+        liquidar = acao == 'liquidar'
+
+        elegiveis = select(Transacao.id).where(Transacao.id.in_(ids), Transacao.status == origem)
+        if liquidar:
+            elegiveis = elegiveis.where(Transacao.transferencia_concluida.isnot(True),
+                                        Transacao.lote_pagamento_id.is_(None) if lote_pagamento_id is None
+                                        else Transacao.lote_pagamento_id == lote_pagamento_id)
+        bloqueados = db.session.execute(
+            elegiveis.order_by(Transacao.id).with_for_update(skip_locked=lote_pagamento_id is None)
+        ).scalars().all()
+
+        extra = {'transferencia_concluida': True} if liquidar else None
+        transitados = MaquinaEstados.transitar_em_lote(bloqueados, origem, destino, observacao, extra=extra,
+                                                       lote_pagamento_id=lote_pagamento_id)
+        if not transitados:
+            return []
+        linhas = db.session.execute(
+            select(Transacao.id, Transacao.fatura_ref, Transacao.vendedor_id, Transacao.valor_liquido_vendedor)
+            .where(Transacao.id.in_(transitados))).all()
+
+        if liquidar:
+            # Saldo libertado: um UPDATE por produtor com a soma das suas vendas
+            por_produtor = defaultdict(lambda: [Decimal('0.00'), 0])
+            for linha in linhas:
+                por_produtor[linha.vendedor_id][0] += Decimal(str(linha.valor_liquido_vendedor or 0))
+                por_produtor[linha.vendedor_id][1] += 1
+            usuarios = Usuario.__table__
+            db.session.execute(
+                update(usuarios).where(usuarios.c.id == bindparam('produtor_id')).values(
+                    saldo_disponivel=func.coalesce(usuarios.c.saldo_disponivel, 0) + bindparam('soma'),
+                    vendas_concluidas=func.coalesce(usuarios.c.vendas_concluidas, 0) + bindparam('vendas')),
+                [{'produtor_id': pid, 'soma': soma, 'vendas': n} for pid, (soma, n) in por_produtor.items()])
+
+        db.session.execute(insert(LogAuditoria), [
+            dict(usuario_id=admin_id, acao=acao_log, ip=ip,
+                 detalhes=detalhe.format(ref=l.fatura_ref, valor=l.valor_liquido_vendedor))
+            for l in linhas])
+        notificacoes = [(l.vendedor_id, mensagem.format(ref=l.fatura_ref), link) for l in linhas]
+        db.session.execute(insert(Notificacao), [
+            dict(usuario_id=u, mensagem=m, link=lk) for u, m, lk in notificacoes])
+        notificacao_service.registar_novas(db.session, notificacoes)
+        return transitados
+
+    @staticmethod
+    def classificar_lote(acao: str, ids: List[int], transitados: List[int]) -> Dict[int, str]:
+        """Resultado por id; os não processados são lidos de novo (já sem locks)."""
+        origem = ACOES_LOTE[acao][0]
+        resultados = {i: LOTE_OK for i in transitados}
+        restantes = [i for i in ids if i not in resultados]
+        if not restantes:
+            return resultados
+        existentes = {l.id: l for l in db.session.execute(
+            select(Transacao.id, Transacao.status, Transacao.transferencia_concluida)
+            .where(Transacao.id.in_(restantes)))}
+        for i in restantes:
+            linha = existentes.get(i)
+            if linha is None:
+                resultados[i] = LOTE_NAO_ENCONTRADA
+            elif linha.status != origem or (acao == 'liquidar' and linha.transferencia_concluida):
+                resultados[i] = LOTE_ESTADO_INVALIDO
+            else:
+                resultados[i] = LOTE_EM_PROCESSAMENTO
+        return resultados
+
     @staticmethod
     def calcular_comissao(valor_total: Decimal, taxa: Decimal = Decimal('0.05')) -> Tuple[Decimal, Decimal]:
         """
@@ -0,0 +1,210 @@
+"""
+Verificação de Planos das Consultas Quentes AgroKongo.
+Corre as consultas mais frequentes da app sob EXPLAIN e indica, para cada uma,
+os índices usados, as tabelas lidas por varrimento sequencial e as ordenações
+feitas fora de índice, para que a cobertura dos índices seja verificada e não
+adivinhada:
+
+    flask indices verificar [--sem-seqscan] [--estrito]
+
+Funciona em PostgreSQL (EXPLAIN FORMAT JSON) e SQLite (EXPLAIN QUERY PLAN).
+`capturar()` regista o SQL que um bloco de código emite e `explicar_sql` analisa
+essas instruções tal como foram enviadas ao driver (testes de regressão dos
+planos dos endpoints em tests/integration/test_planos_endpoints.py).
+Em PostgreSQL com poucas linhas o planner prefere varrimentos sequenciais mesmo
+com índice; `--sem-seqscan` desliga-os na transação do EXPLAIN, para confirmar
+que existe um índice utilizável. `--estrito` termina com código 1 se alguma
+consulta ler uma tabela inteira (para CI).
+"""
+import json
+import re
+import sys
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+import click
+from sqlalchemy import event, func, or_, select
+
+from app.extensions import db
+from app.models import (AlertaPreferencia, Mensagem, Notificacao, Safra, Transacao, TransactionStatus)
+
+# Grupos de status das listas dos dashboards
+ATIVAS = [TransactionStatus.AGUARDANDO_PAGAMENTO, TransactionStatus.ANALISE,
+          TransactionStatus.ESCROW, TransactionStatus.ENVIADO]
+HISTORICO = [TransactionStatus.ENTREGUE, TransactionStatus.FINALIZADO, TransactionStatus.CANCELADO]
+
+# Nome -> construtor da instrução (parâmetros representativos)
+CONSULTAS_QUENTES: Dict[str, Callable] = {
+    'vitrine': lambda: select(Safra.id).where(
+        Safra.status == 'disponivel', Safra.quantidade_disponivel > 0)
+        .order_by(Safra.data_criacao.desc(), Safra.id.desc()).limit(13),
+    'vendas_produtor': lambda: select(Transacao.id).where(
+        Transacao.vendedor_id == 1, Transacao.status.in_(ATIVAS)).order_by(Transacao.data_criacao.desc()),
+    'compras_comprador': lambda: select(Transacao.id).where(
+        Transacao.comprador_id == 1, Transacao.status.in_(HISTORICO)).order_by(Transacao.data_criacao.desc()),
+    'minhas_compras_cursor': lambda: select(Transacao.id).where(Transacao.comprador_id == 1)
+        .order_by(Transacao.data_criacao.desc(), Transacao.id.desc()).limit(21),
+    'liquidacoes_pendentes': lambda: select(Transacao.id).where(
+        Transacao.status == TransactionStatus.ENTREGUE, Transacao.transferencia_concluida.isnot(True),
+        Transacao.lote_pagamento_id.is_(None)),
+    'validacoes_pendentes': lambda: select(Transacao.id).where(
+        Transacao.status == TransactionStatus.ANALISE).order_by(Transacao.data_criacao.asc()),
+    'inbox_chat': lambda: select(Transacao.id).where(
+        or_(Transacao.comprador_id == 1, Transacao.vendedor_id == 1)).order_by(Transacao.data_criacao.desc()),
+    'conversa_chat': lambda: select(Mensagem.id).where(Mensagem.transacao_id == 1)
+        .order_by(Mensagem.data_envio.asc()),
+    'notificacoes_nao_lidas': lambda: select(func.count()).select_from(Notificacao).where(
+        Notificacao.usuario_id == 1, Notificacao.lida.is_(False)),
+    'ultimas_notificacoes': lambda: select(Notificacao.id).where(Notificacao.usuario_id == 1)
+        .order_by(Notificacao.data_criacao.desc()).limit(5),
+    'alertas_safra': lambda: select(AlertaPreferencia.usuario_id).where(AlertaPreferencia.produto_id == 1),
+}
+
+
+# --- EXPLAIN ---
+def _compilar(instrucao, dialeto):
+    compilado = instrucao.compile(dialect=dialeto, compile_kwargs={'render_postcompile': True})
+    if compilado.positiontup is not None:
+        return str(compilado), tuple(compilado.params[nome] for nome in compilado.positiontup)
+    return str(compilado), compilado.params
+
+
+def _vazio() -> dict:
+    return {'indices': [], 'seq_scans': [], 'ordenacao': False, 'linhas_estimadas': None,
+            'loops_aninhados': []}
+
+
+def _analisar_postgres(plano) -> dict:
+    resultado = _vazio()
+
+    def visitar(no):
+        tipo = no.get('Node Type', '')
+        if tipo == 'Nested Loop':
+            # Linhas estimadas do lado externo x interno: o custo real de um nested loop
+            filhos = no.get('Plans', [])
+            if len(filhos) == 2:
+                resultado['loops_aninhados'].append(filhos[0].get('Plan Rows', 0) * filhos[1].get('Plan Rows', 0))
+        if tipo == 'Seq Scan':
+            resultado['seq_scans'].append(no.get('Relation Name'))
+        elif 'Index Name' in no:
+            resultado['indices'].append(no['Index Name'])
+        elif tipo in ('Sort', 'Incremental Sort'):
+            resultado['ordenacao'] = True
+        for filho in no.get('Plans', []):
+            visitar(filho)
+
+    raiz = plano[0]['Plan']
+    resultado['linhas_estimadas'] = raiz.get('Plan Rows')
+    visitar(raiz)
+    resultado['detalhe'] = json.dumps(raiz, indent=2)
+    return resultado
+
+
+_SQLITE_INDICE = re.compile(r'USING (?:COVERING )?INDEX (\w+)|USING (INTEGER PRIMARY KEY)')
+
+
+def _analisar_sqlite(linhas) -> dict:
+    """O SQLite não estima linhas; um SCAN dentro de um join já aparece em seq_scans."""
+    resultado = _vazio()
+    for linha in linhas:
+        detalhe = linha[-1]
+        palavras = detalhe.replace(' TABLE ', ' ').split()
+        if detalhe.startswith('USE TEMP B-TREE'):
+            resultado['ordenacao'] = True
+        elif palavras[0] in ('SCAN', 'SEARCH') and palavras[1].isidentifier() and palavras[1] != 'CONSTANT':
+            indice = _SQLITE_INDICE.search(detalhe)
+            if indice:
+                resultado['indices'].append(indice.group(1) or indice.group(2))
+            elif palavras[0] == 'SCAN':
+                resultado['seq_scans'].append(palavras[1])
+    resultado['detalhe'] = '\n'.join(linha[-1] for linha in linhas)
+    return resultado
+
+
+def explicar(instrucao, sem_seqscan: bool = False) -> dict:
+    """
+    Plano de uma instrução Select (sem a executar).
+
+    Returns:
+        {'indices': [...], 'seq_scans': [tabelas], 'ordenacao': bool,
+         'linhas_estimadas': int | None, 'loops_aninhados': [linhas externo x interno],
+         'detalhe': str}
+    """
+    sql, parametros = _compilar(instrucao, db.session.connection().dialect)
+    return explicar_sql(sql, parametros, sem_seqscan)
+
+
+def explicar_sql(sql: str, parametros=(), sem_seqscan: bool = False) -> dict:
+    """Plano de SQL já compilado (ex.: capturado com `capturar`), no formato de `explicar`."""
+    conexao = db.session.connection()
+    dialeto = conexao.dialect
+
+    if dialeto.name == 'postgresql':
+        transacao = conexao.begin_nested()
+        try:
+            if sem_seqscan:
+                conexao.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            plano = conexao.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", parametros).scalar()
+        finally:
+            transacao.rollback()  # SET LOCAL não sobrevive ao savepoint
+        return _analisar_postgres(json.loads(plano) if isinstance(plano, str) else plano)
+    if dialeto.name == 'sqlite':
+        return _analisar_sqlite(conexao.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", parametros).all())
+    raise NotImplementedError(f"EXPLAIN não suportado para {dialeto.name}")
+
+
+@contextmanager
+def capturar():
+    """
+    Regista as instruções enviadas à base de dados dentro do bloco:
+    lista de (sql, parametros), pela ordem de execução.
+    """
+    instrucoes = []
+
+    def registar(conn, cursor, sql, parametros, context, executemany):
+        instrucoes.append((sql, parametros))
+
+    motor = db.engine
+    event.listen(motor, 'before_cursor_execute', registar)
+    try:
+        yield instrucoes
+    finally:
+        event.remove(motor, 'before_cursor_execute', registar)
+
+
+def verificar(consultas: Dict[str, Callable] = None, sem_seqscan: bool = False) -> List[dict]:
+    """Plano de cada consulta quente, com o nome."""
+    return [dict(explicar(construir(), sem_seqscan), nome=nome)
+            for nome, construir in (consultas or CONSULTAS_QUENTES).items()]
+
+
+def init_app(app):
+    """Regista o comando `flask indices verificar`."""
+
+    @app.cli.group('indices')
+    def indices_cli():
+        """Cobertura de índices das consultas quentes."""
+
+    @indices_cli.command('verificar')
+    @click.option('--sem-seqscan', is_flag=True, help='PostgreSQL: desliga seq scans no EXPLAIN.')
+    @click.option('--estrito', is_flag=True, help='Código de saída 1 se houver varrimentos sequenciais.')
+    @click.option('--detalhe', is_flag=True, help='Mostra o plano completo de cada consulta.')
+    def verificar_cmd(sem_seqscan, estrito, detalhe):
+        """Corre as consultas quentes sob EXPLAIN e lista seq scans e ordenações."""
+        problemas = 0
+        for plano in verificar(sem_seqscan=sem_seqscan):
+            if plano['seq_scans']:
+                problemas += 1
+            simbolo = '⚠️ ' if plano['seq_scans'] else '✅'
+            linha = f"{simbolo} {plano['nome']}: índices {', '.join(plano['indices']) or '-'}"
+            if plano['seq_scans']:
+                linha += f" | SEQ SCAN em {', '.join(plano['seq_scans'])}"
+            if plano['ordenacao']:
+                linha += " | ordenação fora de índice"
+            click.echo(linha)
+            if detalhe:
+                click.echo(plano['detalhe'])
+        db.session.rollback()
+        click.echo(f"{problemas} consultas com varrimentos sequenciais.")
+        if estrito and problemas:
+            sys.exit(1)
@@ -0,0 +1,98 @@
+"""
+Projeções de Leitura AgroKongo.
+Os `to_dict` de Transacao e Safra navegam relações (safra.produto, comprador,
+vendedor, produtor.municipio/provincia): numa lista isso são 3-4 lazy loads por
+linha. Aqui cada lista é uma única query só de colunas, com os joins feitos uma
+vez, e as linhas são convertidas nos mesmos dicts que o `to_dict` produz.
+
+As queries devolvidas são Query normais: aceitam filter/order_by/paginate e
+`paginar_por_cursor` (as linhas expõem `id` e `data_criacao`).
+"""
+from typing import Iterable, List
+
+from sqlalchemy.orm import aliased
+
+from app.extensions import db
+from app.models import Municipio, Produto, Provincia, Safra, Transacao, Usuario
+
+Comprador = aliased(Usuario, name='comprador')
+Vendedor = aliased(Usuario, name='vendedor')
+
+
+# --- TRANSAÇÕES ---
+def query_transacoes():
+    """Colunas de Transacao.to_dict; filtrar com Transacao.*, Comprador.* ou Vendedor.*."""
+    return db.session.query(
+        Transacao.id, Transacao.fatura_ref, Transacao.safra_id, Transacao.quantidade_comprada,
+        Transacao.valor_total_pago, Transacao.status, Transacao.data_criacao, Transacao.previsao_entrega,
+        Produto.nome.label('produto'),
+        Comprador.nome.label('comprador'),
+        Vendedor.nome.label('vendedor'),
+    ).select_from(Transacao) \
+        .join(Safra, Safra.id == Transacao.safra_id) \
+        .join(Produto, Produto.id == Safra.produto_id) \
+        .join(Comprador, Comprador.id == Transacao.comprador_id) \
+        .join(Vendedor, Vendedor.id == Transacao.vendedor_id)
+
+
+def transacao_dict(linha) -> dict:
+    """Mesmo formato de Transacao.to_dict."""
+    return {
+        'id': linha.id,
+        'ref': linha.fatura_ref,
+        'produto': linha.produto,
+        'safra_id': linha.safra_id,
+        'quantidade': float(linha.quantidade_comprada),
+        'valor_total': float(linha.valor_total_pago),
+        'status': linha.status,
+        'data_criacao': linha.data_criacao.isoformat(),
+        'comprador': linha.comprador,
+        'vendedor': linha.vendedor,
+        'previsao_entrega': linha.previsao_entrega.strftime('%d/%m/%Y') if linha.previsao_entrega else None
+    }
+
+
+def transacoes(linhas: Iterable) -> List[dict]:
+    return [transacao_dict(linha) for linha in linhas]
+
+
+# --- SAFRAS ---
+def query_safras():
+    """Colunas de Safra.to_dict; o produtor é o próprio Usuario (filtrar com Usuario.*)."""
+    return db.session.query(
+        Safra.id, Safra.quantidade_disponivel, Safra.preco_por_unidade, Safra.status,
+        Safra.data_criacao, Safra.imagem, Safra.observacoes,
+        Produto.nome.label('produto'), Produto.categoria,
+        Usuario.id.label('produtor_id'), Usuario.nome.label('produtor_nome'),
+        Usuario.rating_vendedor,
+        Municipio.nome.label('municipio'), Provincia.nome.label('provincia'),
+    ).select_from(Safra) \
+        .join(Produto, Produto.id == Safra.produto_id) \
+        .join(Usuario, Usuario.id == Safra.produtor_id) \
+        .outerjoin(Municipio, Municipio.id == Usuario.municipio_id) \
+        .outerjoin(Provincia, Provincia.id == Usuario.provincia_id)
+
+
+def safra_dict(linha) -> dict:
+    """Mesmo formato de Safra.to_dict."""
+    return {
+        'id': linha.id,
+        'produto': linha.produto,
+        'categoria': linha.categoria,
+        'quantidade': float(linha.quantidade_disponivel),
+        'preco': float(linha.preco_por_unidade),
+        'status': linha.status,
+        'data_criacao': linha.data_criacao.isoformat(),
+        'imagem_url': f"/uploads/safras/{linha.imagem}" if linha.imagem else None,
+        'observacoes': linha.observacoes,
+        'produtor': {
+            'id': linha.produtor_id,
+            'nome': linha.produtor_nome,
+            'rating': float(linha.rating_vendedor),
+            'localizacao': f"{linha.municipio}, {linha.provincia}" if linha.municipio else "Localização N/D"
+        }
+    }
+
+
+def safras(linhas: Iterable) -> List[dict]:
+    return [safra_dict(linha) for linha in linhas]
@@ -0,0 +1,329 @@
+"""
+Serviço de Relatórios Assíncronos AgroKongo.
+Exportações financeiras e PDFs de faturas são gerados fora do pedido HTTP:
+o cliente submete o pedido, recebe o id do job, consulta o progresso e descarrega
+o artefacto guardado em `UPLOAD_FOLDER_PRIVATE/relatorios` enquanto não expirar.
+
+Pedidos idênticos (mesmo tipo e parâmetros) partilham o job em curso ou o artefacto
+ainda válido. Uma exportação financeira sem `data_fim` vai até ao momento do pedido:
+só é partilhada dentro da mesma janela de `JANELA_INTERVALO_ABERTO`. A execução corre no Celery; sem broker, corre numa thread do processo.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional, Tuple
+
+import click
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.models import RelatorioJob, Transacao, Usuario
+from app.services import export_service, fatura_service
+
+logger = logging.getLogger(__name__)
+
+PASTA_RELATORIOS = 'relatorios'
+# Jobs pendentes há mais do que isto perderam o worker: libertam a chave para novo pedido
+PRAZO_PENDENTE = timedelta(hours=1)
+# Intervalos sem fim ("até agora") só são reutilizados dentro da mesma janela
+JANELA_INTERVALO_ABERTO = timedelta(hours=1)
+
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+
+def _utc(data: Optional[datetime]) -> Optional[datetime]:
+    """SQLite devolve datas sem fuso: assumimos UTC para poder comparar."""
+    if data is not None and data.tzinfo is None:
+        return data.replace(tzinfo=timezone.utc)
+    return data
+
+
+def _pasta() -> str:
+    pasta = os.path.join(current_app.config['UPLOAD_FOLDER_PRIVATE'], PASTA_RELATORIOS)
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+
+# --- GERADORES POR TIPO ---
+def _validar_financeiro(parametros: Dict, usuario: Usuario) -> Tuple[Dict, Optional[str]]:
+    if usuario.tipo != 'admin':
+        return {}, "Apenas administradores podem exportar relatórios financeiros."
+    _, erro = export_service.validar_filtros(parametros)
+    formato = parametros.get('formato', 'xlsx')
+    if not erro and formato not in export_service.FORMATOS:
+        erro = f"Formato inválido: '{formato}'."
+    limpos = {k: parametros[k] for k in ('data_inicio', 'data_fim', 'status') if parametros.get(k)}
+    limpos['formato'] = formato
+    return limpos, erro
+
+
+def _gerar_financeiro(parametros: Dict, destino: str, progresso: Callable) -> Tuple[int, str]:
+    filtros, _ = export_service.validar_filtros(parametros)
+    formato = parametros['formato']
+    # Só o denominador do progresso: as linhas do job são as efetivamente escritas
+    estimativa = export_service.consulta_transacoes(**filtros).order_by(None).count() or 1
+    escritas = [0]
+
+    def avancar(linhas):
+        escritas[0] = linhas
+        progresso(min(99, linhas * 100 // estimativa), linhas)
+
+    if formato == 'csv':
+        with open(destino, 'w', encoding='utf-8', newline='') as ficheiro:
+            for bloco in export_service.gerar_csv(progresso=avancar, **filtros):
+                ficheiro.write(bloco)
+        linhas = escritas[0]
+    else:
+        linhas = export_service.escrever_excel(destino, progresso=avancar, **filtros)
+    return linhas, export_service.nome_ficheiro(formato)
+
+
+def _validar_fatura(parametros: Dict, usuario: Usuario) -> Tuple[Dict, Optional[str]]:
+    try:
+        transacao_id = int(parametros.get('transacao_id'))
+    except (TypeError, ValueError):
+        return {}, "transacao_id é obrigatório."
+    venda = db.session.get(Transacao, transacao_id)
+    if not venda:
+        return {}, "Transação não encontrada."
+    if usuario.tipo != 'admin' and usuario.id not in (venda.vendedor_id, venda.comprador_id):
+        return {}, "Sem permissão para esta fatura."
+    return {'transacao_id': transacao_id}, None
+
+
+def _gerar_fatura(parametros: Dict, destino: str, progresso: Callable) -> Tuple[int, str]:
+    venda = db.session.get(Transacao, parametros['transacao_id'])
+    if not venda:
+        raise ValueError("Transação não encontrada.")
+    caminho = fatura_service.obter_pdf_fatura(venda)
+    if caminho:
+        shutil.copyfile(caminho, destino)
+    else:
+        with open(destino, 'wb') as ficheiro:
+            ficheiro.write(fatura_service.gerar_pdf_fatura(venda))
+    return 1, fatura_service.nome_ficheiro_fatura(venda)
+
+
+# tipo -> (validação dos parâmetros, gerador, extensão do artefacto)
+TIPOS = {
+    'financeiro': (_validar_financeiro, _gerar_financeiro, lambda p: p['formato']),
+    'fatura': (_validar_fatura, _gerar_fatura, lambda p: 'pdf'),
+}
+
+
+class RelatorioService:
+    """Ciclo de vida dos jobs: submeter, executar, descarregar e expirar."""
+
+    @staticmethod
+    def chave(tipo: str, parametros: Dict) -> str:
+        """Hash do tipo e dos parâmetros; um financeiro sem data_fim leva também a janela atual."""
+        if tipo == 'financeiro' and not parametros.get('data_fim'):
+            janela = int(_agora().timestamp() // JANELA_INTERVALO_ABERTO.total_seconds())
+            parametros = dict(parametros, _janela=janela)
+        canonico = json.dumps(parametros, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{tipo}:{canonico}".encode()).hexdigest()
+
+    @staticmethod
+    def submeter(tipo: str, parametros: Dict, usuario: Usuario) -> Tuple[bool, Optional[RelatorioJob], str]:
+        """
+        Cria (ou reutiliza) um job de relatório e envia-o para execução.
+
+        Returns:
+            Tuple[success, job, mensagem]
+        """
+        if tipo not in TIPOS:
+            return False, None, f"Tipo de relatório inválido: '{tipo}'."
+        validar, _, _ = TIPOS[tipo]
+        parametros, erro = validar(parametros or {}, usuario)
+        if erro:
+            return False, None, erro
+
+        chave = RelatorioService.chave(tipo, parametros)
+        existente = RelatorioService._job_ativo(chave)
+        if existente:
+            return True, existente, "Relatório já pedido: a reutilizar o mesmo job."
+
+        job = RelatorioJob(usuario_id=usuario.id, tipo=tipo, chave=chave, chave_ativa=chave,
+                           parametros=json.dumps(parametros, sort_keys=True))
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Pedido idêntico concorrente ganhou a corrida: reutiliza o job dele
+            db.session.rollback()
+            existente = RelatorioJob.query.filter_by(chave_ativa=chave).first()
+            if existente:
+                return True, existente, "Relatório já pedido: a reutilizar o mesmo job."
+            raise
+
+        RelatorioService._despachar(job.id)
+        return True, job, "Relatório em preparação."
+
+    @staticmethod
+    def _job_ativo(chave: str) -> Optional[RelatorioJob]:
+        """Job reutilizável para a chave; liberta-a se o job expirou ou ficou pendurado."""
+        job = RelatorioJob.query.filter_by(chave_ativa=chave).first()
+        if not job:
+            return None
+
+        agora = _agora()
+        expirado = job.estado == RelatorioJob.CONCLUIDO and (
+            (_utc(job.expira_em) and _utc(job.expira_em) <= agora) or not RelatorioService.caminho_artefacto(job))
+        pendurado = job.estado in (RelatorioJob.PENDENTE, RelatorioJob.EM_EXECUCAO) and \
+            _utc(job.data_criacao) <= agora - PRAZO_PENDENTE
+        if expirado:
+            RelatorioService._expirar(job)
+        elif pendurado:
+            job.estado = RelatorioJob.FALHOU
+            job.erro = "Tempo de execução excedido."
+            job.chave_ativa = None
+        else:
+            return job
+        db.session.commit()
+        return None
+
+    @staticmethod
+    def _despachar(job_id: str):
+        from app.extensions import celery, CELERY_AVAILABLE
+        from app.services.cache_service import cache_service
+        # O broker é o mesmo Redis do cache: com o circuito aberto nem tentamos publicar
+        if CELERY_AVAILABLE and celery is not None and cache_service.ping():
+            try:
+                # O estado vive na tabela relatorio_jobs: o result backend não é necessário
+                celery.send_task('tasks.gerar_relatorio', args=[job_id], ignore_result=True)
+                return
+            except Exception as e:
+                logger.warning(f"Broker indisponível, relatório {job_id} gerado localmente: {e}")
+
+        # Sem broker: executa numa thread para não prender o pedido
+        app = current_app._get_current_object()
+        threading.Thread(target=RelatorioService._executar_com_contexto, args=(app, job_id),
+                         name=f'relatorio-{job_id}', daemon=True).start()
+
+    @staticmethod
+    def _executar_com_contexto(app, job_id: str):
+        with app.app_context():
+            try:
+                RelatorioService.executar(job_id)
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _registar_progresso(job_id: str, progresso: int, linhas: int):
+        """Atualiza o progresso numa ligação própria (visível de imediato a quem consulta)."""
+        with db.engine.begin() as conn:
+            conn.execute(update(RelatorioJob.__table__)
+                         .where(RelatorioJob.__table__.c.id == job_id)
+                         .values(progresso=progresso, linhas=linhas))
+
+    @staticmethod
+    def executar(job_id: str) -> bool:
+        """Gera o artefacto do job. Devolve False se o job não existir ou já tiver sido reclamado."""
+        # Reclamação atómica: uma reentrega do Celery não gera o mesmo job duas vezes
+        reclamado = db.session.execute(
+            update(RelatorioJob)
+            .where(RelatorioJob.id == job_id, RelatorioJob.estado == RelatorioJob.PENDENTE)
+            .values(estado=RelatorioJob.EM_EXECUCAO, data_inicio=_agora())
+        ).rowcount
+        db.session.commit()
+        if not reclamado:
+            return False
+
+        job = db.session.get(RelatorioJob, job_id)
+        _, gerar, extensao = TIPOS[job.tipo]
+        parametros = json.loads(job.parametros)
+        nome_artefacto = f"{job.id}.{extensao(parametros)}"
+        final = os.path.join(_pasta(), nome_artefacto)
+        parcial = f"{final}.parcial"
+
+        try:
+            linhas, nome_ficheiro = gerar(
+                parametros, parcial,
+                lambda progresso, n: RelatorioService._registar_progresso(job_id, progresso, n))
+            os.replace(parcial, final)
+        except Exception as e:
+            db.session.rollback()
+            if os.path.exists(parcial):
+                os.remove(parcial)
+            job = db.session.get(RelatorioJob, job_id)
+            job.estado = RelatorioJob.FALHOU
+            job.erro = str(e)[:255]
+            job.chave_ativa = None
+            job.data_conclusao = _agora()
+            db.session.commit()
+            logger.error(f"Falha ao gerar relatório {job_id}: {e}")
+            return True
+
+        job = db.session.get(RelatorioJob, job_id)
+        job.estado = RelatorioJob.CONCLUIDO
+        job.progresso = 100
+        job.linhas = linhas
+        job.caminho = nome_artefacto
+        job.nome_ficheiro = nome_ficheiro
+        job.data_conclusao = _agora()
+        job.expira_em = job.data_conclusao + timedelta(hours=current_app.config.get('RELATORIOS_TTL_HORAS', 24))
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def pode_aceder(job: RelatorioJob, usuario: Usuario) -> bool:
+        if usuario.tipo == 'admin' or job.usuario_id == usuario.id:
+            return True
+        if job.tipo == 'fatura':
+            venda = db.session.get(Transacao, json.loads(job.parametros).get('transacao_id'))
+            return bool(venda) and usuario.id in (venda.vendedor_id, venda.comprador_id)
+        return False
+
+    @staticmethod
+    def caminho_artefacto(job: RelatorioJob) -> Optional[str]:
+        """Caminho do ficheiro pronto para download (None se não existir ou expirou)."""
+        if job.estado != RelatorioJob.CONCLUIDO or not job.caminho:
+            return None
+        if job.expira_em and _utc(job.expira_em) <= _agora():
+            return None
+        caminho = os.path.join(_pasta(), job.caminho)
+        return caminho if os.path.isfile(caminho) else None
+
+    @staticmethod
+    def _expirar(job: RelatorioJob):
+        if job.caminho:
+            caminho = os.path.join(_pasta(), job.caminho)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        job.estado = RelatorioJob.EXPIRADO
+        job.caminho = None
+        job.chave_ativa = None
+
+    @staticmethod
+    def limpar_expirados() -> int:
+        """Remove os artefactos expirados e liberta as respetivas chaves."""
+        expirados = RelatorioJob.query.filter(
+            RelatorioJob.estado == RelatorioJob.CONCLUIDO,
+            RelatorioJob.expira_em <= _agora()
+        ).all()
+        for job in expirados:
+            RelatorioService._expirar(job)
+        db.session.commit()
+        return len(expirados)
+
+
+def init_app(app):
+    """Regista o comando `flask relatorios limpar`."""
+
+    @app.cli.group('relatorios')
+    def relatorios_cli():
+        """Gestão dos relatórios gerados em background."""
+
+    @relatorios_cli.command('limpar')
+    def limpar_cmd():
+        """Apaga os artefactos de relatórios expirados."""
+        total = RelatorioService.limpar_expirados()
+        click.echo(f"✅ {total} relatórios expirados removidos.")
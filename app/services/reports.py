@@ -3,6 +3,8 @@ from app.models import db, Transacao, TransactionStatus
 from datetime import datetime, timezone, timedelta
 from decimal import Decimal
 
+from app.services.kpi_service import KpiService
+
 
 def obter_relatorio_financeiro():
     """
@@ -13,25 +15,12 @@ def obter_relatorio_financeiro():
     agora = datetime.now(timezone.utc)
     primeiro_dia_mes = agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
-    # 2. Volume Total Bruto (GMV)
-    # Ignora apenas transações canceladas ou pendentes iniciais
-    volume_total = db.session.query(func.sum(Transacao.valor_total_pago)).filter(
-        Transacao.status.notin_([
-            TransactionStatus.CANCELADO,
-            TransactionStatus.PENDENTE
-        ])
-    ).scalar() or Decimal('0.00')
-
-    # 3. Receita Realizada (Comissões em posse da plataforma)
-    # Apenas o que já foi pago pelo comprador (Escrow em diante)
-    receita_total = db.session.query(func.sum(Transacao.comissao_plataforma)).filter(
-        Transacao.status.in_([
-            TransactionStatus.ESCROW,
-            TransactionStatus.ENVIADO,
-            TransactionStatus.ENTREGUE,
-            TransactionStatus.FINALIZADO
-        ])
-    ).scalar() or Decimal('0.00')
+    # 2 e 3. Totais lidos do resumo materializado (KpiService)
+    # Volume Total Bruto (GMV): ignora apenas transações canceladas ou pendentes iniciais
+    # Receita Realizada: comissões do que já foi pago pelo comprador (Escrow em diante)
+    kpis = KpiService.kpis_plataforma()
+    volume_total = kpis['volume_pago']
+    receita_total = kpis['receita_realizada']
 
     # 4. Volume Mensal (Query indexada por intervalo)
     volume_mes = db.session.query(func.sum(Transacao.valor_total_pago)).filter(
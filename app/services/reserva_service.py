@@ -0,0 +1,150 @@
+"""
+Motor de Reservas de Stock AgroKongo.
+Abate o stock de uma safra com um único UPDATE condicional em vez de
+`SELECT ... FOR UPDATE` seguido de escrita:
+
+    UPDATE safras SET quantidade_disponivel = quantidade_disponivel - :q
+     WHERE id = :id AND status = 'disponivel' AND quantidade_disponivel >= :q
+    RETURNING ...
+
+A linha da safra só fica bloqueada desde este UPDATE até ao commit da reserva.
+Auditoria e notificações são escritas depois desse commit, fora da secção crítica.
+"""
+import logging
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from sqlalchemy import case, select, update
+from sqlalchemy.engine import Row
+
+from app.extensions import db
+from app.models import LogAuditoria, Notificacao, Safra
+from app.services import cache_invalidation, search_service
+
+logger = logging.getLogger(__name__)
+
+ESGOTADO = 'esgotado'
+DISPONIVEL = 'disponivel'
+
+MSG_SAFRA_NAO_ENCONTRADA = "Safra não encontrada."
+MSG_AUTO_COMPRA = "Não pode comprar a sua própria safra."
+
+# Colunas devolvidas pela reserva (preço lido no mesmo statement que abate o stock)
+_COLUNAS_RESERVA = (Safra.id, Safra.produtor_id, Safra.produto_id, Safra.preco_por_unidade,
+                    Safra.quantidade_disponivel, Safra.status)
+
+
+def _suporta_returning() -> bool:
+    return db.session.get_bind(mapper=Safra.__mapper__).dialect.update_returning
+
+
+def _executar(instrucao, safra_id: int) -> Optional[Row]:
+    """Executa o UPDATE condicional e devolve a linha atualizada (ou None se não abateu)."""
+    # 'fetch': uma Safra já carregada na sessão fica com o stock atualizado
+    instrucao = instrucao.execution_options(synchronize_session='fetch')
+    if _suporta_returning():
+        return db.session.execute(instrucao.returning(*_COLUNAS_RESERVA)).first()
+    if db.session.execute(instrucao).rowcount == 0:
+        return None
+    # Sem RETURNING (MySQL): a linha já está bloqueada pelo UPDATE, a leitura é consistente
+    return db.session.execute(select(*_COLUNAS_RESERVA).where(Safra.id == safra_id)).first()
+
+
+def _registar_alteracao(linha: Row, estado_anterior: Optional[str] = None):
+    """O UPDATE em massa não passa pelos listeners de flush: agenda cache e índice à mão."""
+    cache_invalidation.registar_safra(db.session, linha.id, linha.produto_id, linha.produtor_id)
+    ativa = linha.status == DISPONIVEL and linha.quantidade_disponivel > 0
+    if not ativa:
+        search_service.registar_safra(db.session, linha.id, None, False)
+    elif estado_anterior == ESGOTADO:
+        texto = db.session.execute(select(Safra.texto_busca).where(Safra.id == linha.id)).scalar()
+        search_service.registar_safra(db.session, linha.id, texto, True)
+
+
+class ReservaService:
+    """Reserva e devolução de stock sem bloqueio pessimista prévio."""
+
+    @staticmethod
+    def reservar(safra_id: int, comprador_id: int, quantidade: Decimal) -> Tuple[bool, Optional[Row], str]:
+        """
+        Abate `quantidade` ao stock da safra (não faz commit).
+
+        Returns:
+            Tuple[success, linha (id, produtor_id, produto_id, preco_por_unidade,
+            quantidade_disponivel, status), mensagem]
+        """
+        if quantidade is None or quantidade <= 0:
+            return False, None, "A quantidade deve ser maior que zero."
+
+        restante = Safra.quantidade_disponivel - quantidade
+        instrucao = update(Safra).where(
+            Safra.id == safra_id,
+            Safra.status == DISPONIVEL,
+            Safra.produtor_id != comprador_id,
+            Safra.quantidade_disponivel >= quantidade,
+        ).values(
+            quantidade_disponivel=restante,
+            status=case((restante <= 0, ESGOTADO), else_=Safra.status),
+        )
+
+        linha = _executar(instrucao, safra_id)
+        if linha is None:
+            return False, None, ReservaService._motivo_recusa(safra_id, comprador_id)
+
+        _registar_alteracao(linha)
+        return True, linha, "Stock reservado."
+
+    @staticmethod
+    def _motivo_recusa(safra_id: int, comprador_id: int) -> str:
+        """Diagnóstico (sem lock) de um UPDATE que não abateu nenhuma linha."""
+        safra = db.session.execute(
+            select(Safra.produtor_id, Safra.status, Safra.quantidade_disponivel).where(Safra.id == safra_id)
+        ).first()
+        if not safra:
+            return MSG_SAFRA_NAO_ENCONTRADA
+        if safra.produtor_id == comprador_id:
+            return MSG_AUTO_COMPRA
+        if safra.status != DISPONIVEL:
+            return f"Safra indisponível (Status: {safra.status})."
+        return f"Quantidade indisponível. Máximo: {safra.quantidade_disponivel}kg"
+
+    @staticmethod
+    def devolver(safra_id: int, quantidade: Decimal) -> bool:
+        """Repõe stock de uma reserva cancelada; uma safra esgotada volta a ficar disponível."""
+        reposto = Safra.quantidade_disponivel + quantidade
+        instrucao = update(Safra).where(Safra.id == safra_id).values(
+            quantidade_disponivel=reposto,
+            status=case(((Safra.status == ESGOTADO) & (reposto > 0), DISPONIVEL), else_=Safra.status),
+        )
+        linha = _executar(instrucao, safra_id)
+        if linha is None:
+            return False
+        _registar_alteracao(linha, estado_anterior=ESGOTADO)
+        return True
+
+    @staticmethod
+    def registar_efeitos(transacao, quantidade: Decimal, acao: str = "COMPRA_INICIADA",
+                         ip: Optional[str] = None, notificar_produtor: bool = False) -> bool:
+        """
+        Auditoria e notificação da reserva, num commit próprio depois do commit da reserva.
+        Uma falha aqui não desfaz a compra: fica apenas registada no log.
+        """
+        try:
+            db.session.add(LogAuditoria(
+                usuario_id=transacao.comprador_id,
+                acao=acao,
+                detalhes=f"Ref: {transacao.fatura_ref} | Qtd: {quantidade} | Safra: {transacao.safra_id}",
+                ip=ip
+            ))
+            if notificar_produtor:
+                db.session.add(Notificacao(
+                    usuario_id=transacao.vendedor_id,
+                    mensagem=f"📦 Novo pedido de {quantidade}kg ({transacao.fatura_ref})!",
+                    link='/produtor/vendas'
+                ))
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Auditoria da reserva {transacao.fatura_ref} não registada: {e}")
+            return False
@@ -0,0 +1,353 @@
+"""
+Serviço de Pesquisa da Vitrine AgroKongo.
+Substitui os filtros ILIKE '%termo%' por um índice de texto completo:
+- PostgreSQL: tsvector + índice GIN sobre a coluna normalizada `safras.texto_busca`.
+- SQLite (desenvolvimento/testes): índice invertido em memória com correspondência por prefixo.
+
+A normalização remove acentos ("mandióca" == "mandioca") e é feita em Python,
+pelo que não depende da extensão `unaccent` do PostgreSQL.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import click
+from flask import current_app
+from sqlalchemy import bindparam, event, func, case, false, literal_column, inspect as sa_inspect
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.extensions import db
+from app.models import Safra, Usuario, Produto
+
+# Configuração 'simple' do PostgreSQL: sem stemming, o texto já chega normalizado.
+# Vai como literal (não parâmetro) para o planner reconhecer a expressão do índice GIN.
+TS_CONFIG = literal_column("'simple'")
+
+# Limite de resultados do índice em memória (evita listas IN gigantes no SQLite)
+MAX_RESULTADOS_FALLBACK = 1000
+
+_RE_NAO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+
+
+# --- NORMALIZAÇÃO ---
+def normalizar(texto: Optional[str]) -> str:
+    """Remove acentos, converte para minúsculas e colapsa separadores."""
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return _RE_NAO_ALFANUMERICO.sub(' ', sem_acentos.lower()).strip()
+
+
+def tokenizar(texto: Optional[str]) -> List[str]:
+    """Divide o texto normalizado em tokens únicos (mantendo a ordem)."""
+    vistos = []
+    for token in normalizar(texto).split():
+        if token not in vistos:
+            vistos.append(token)
+    return vistos
+
+
+def documento_safra(safra: Safra) -> str:
+    """Constrói o texto pesquisável de uma safra (produto, categoria e produtor)."""
+    produto = safra.produto or (Produto.query.get(safra.produto_id) if safra.produto_id else None)
+    produtor = safra.produtor or (Usuario.query.get(safra.produtor_id) if safra.produtor_id else None)
+
+    partes = [
+        produto.nome if produto else None,
+        produto.categoria if produto else None,
+        produtor.nome if produtor else None,
+    ]
+    return normalizar(' '.join(p for p in partes if p))
+
+
+def _safra_ativa(safra: Safra) -> bool:
+    return safra.status == 'disponivel' and (safra.quantidade_disponivel or 0) > 0
+
+
+# --- ÍNDICE INVERTIDO (FALLBACK SQLITE) ---
+class IndiceInvertido:
+    """
+    Índice invertido thread-safe: token -> {safra_id: peso}.
+    Os tokens ficam numa lista ordenada para pesquisa por prefixo com bisect,
+    o que mantém o custo proporcional ao número de resultados e não ao de safras.
+    """
+
+    def __init__(self, ttl_segundos: int = 300):
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._tokens_ordenados: List[str] = []
+        self._docs: Dict[int, List[str]] = {}
+        self._construido_em: Optional[float] = None
+        self.ttl_segundos = ttl_segundos
+
+    @property
+    def precisa_reconstrucao(self) -> bool:
+        if self._construido_em is None:
+            return True
+        return (time.monotonic() - self._construido_em) > self.ttl_segundos
+
+    def limpar(self):
+        with self._lock:
+            self._postings.clear()
+            self._tokens_ordenados = []
+            self._docs.clear()
+            self._construido_em = None
+
+    def reconstruir(self, documentos: List[Tuple[int, str]]):
+        """Substitui o conteúdo do índice por (safra_id, texto_busca)."""
+        with self._lock:
+            self._postings = {}
+            self._docs = {}
+            for safra_id, texto in documentos:
+                self._adicionar(safra_id, texto)
+            self._tokens_ordenados = sorted(self._postings)
+            self._construido_em = time.monotonic()
+
+    def atualizar(self, safra_id: int, texto: Optional[str], ativa: bool):
+        """Reindexa uma safra (remove-a se já não estiver disponível)."""
+        with self._lock:
+            self._remover(safra_id)
+            if ativa and texto:
+                for token in self._adicionar(safra_id, texto):
+                    pos = bisect.bisect_left(self._tokens_ordenados, token)
+                    if pos >= len(self._tokens_ordenados) or self._tokens_ordenados[pos] != token:
+                        self._tokens_ordenados.insert(pos, token)
+
+    def remover(self, safra_id: int):
+        with self._lock:
+            self._remover(safra_id)
+
+    def pesquisar(self, termo: str, limite: int = MAX_RESULTADOS_FALLBACK) -> List[int]:
+        """
+        Devolve IDs ordenados por relevância.
+        Todos os tokens da pesquisa têm de corresponder (AND); correspondência
+        exata vale mais do que correspondência por prefixo.
+        """
+        tokens = tokenizar(termo)
+        if not tokens:
+            return []
+
+        with self._lock:
+            pontuacao: Optional[Dict[int, int]] = None
+            for token in tokens:
+                parcial: Dict[int, int] = {}
+                inicio = bisect.bisect_left(self._tokens_ordenados, token)
+                for candidato in self._tokens_ordenados[inicio:]:
+                    if not candidato.startswith(token):
+                        break
+                    bonus = 2 if candidato == token else 1
+                    for safra_id, peso in self._postings.get(candidato, {}).items():
+                        parcial[safra_id] = max(parcial.get(safra_id, 0), peso * bonus)
+
+                if pontuacao is None:
+                    pontuacao = parcial
+                else:
+                    pontuacao = {
+                        sid: pontos + parcial[sid]
+                        for sid, pontos in pontuacao.items() if sid in parcial
+                    }
+                if not pontuacao:
+                    return []
+
+        ordenados = sorted(pontuacao.items(), key=lambda item: (-item[1], -item[0]))
+        return [safra_id for safra_id, _ in ordenados[:limite]]
+
+    # Operações internas (chamar com o lock adquirido)
+    def _adicionar(self, safra_id: int, texto: str) -> List[str]:
+        tokens = texto.split()
+        self._docs[safra_id] = tokens
+        # Tokens no início do documento (nome do produto) pesam mais
+        for posicao, token in enumerate(tokens):
+            peso = 3 if posicao == 0 else 1
+            postings = self._postings.setdefault(token, {})
+            postings[safra_id] = max(postings.get(safra_id, 0), peso)
+        return tokens
+
+    def _remover(self, safra_id: int):
+        for token in self._docs.pop(safra_id, []):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(safra_id, None)
+            if not postings:
+                del self._postings[token]
+                pos = bisect.bisect_left(self._tokens_ordenados, token)
+                if pos < len(self._tokens_ordenados) and self._tokens_ordenados[pos] == token:
+                    self._tokens_ordenados.pop(pos)
+
+
+indice_memoria = IndiceInvertido()
+
+
+# --- API DE PESQUISA ---
+def _usa_postgres() -> bool:
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _tsquery(termo: str) -> Optional[str]:
+    """Converte o termo num tsquery com prefixo: 'mandioca luanda' -> 'mandioca:* & luanda:*'."""
+    tokens = tokenizar(termo)
+    if not tokens:
+        return None
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def _garantir_indice_memoria():
+    if not indice_memoria.precisa_reconstrucao:
+        return
+    linhas = db.session.query(Safra.id, Safra.texto_busca).filter(
+        Safra.status == 'disponivel',
+        Safra.quantidade_disponivel > 0,
+        Safra.texto_busca.isnot(None)
+    ).all()
+    indice_memoria.reconstruir([(safra_id, texto) for safra_id, texto in linhas])
+    current_app.logger.info(f"Índice de pesquisa em memória reconstruído: {len(linhas)} safras")
+
+
+def filtrar_safras(query, termo: str, ordenar: bool = True):
+    """
+    Aplica a pesquisa de texto a uma query de Safra e ordena por relevância.
+    A ordenação por relevância fica primeiro; a rota pode acrescentar critérios de desempate.
+    Com `ordenar=False` só filtra (ex.: paginação por cursor, que ordena por data).
+    """
+    tsquery = _tsquery(termo)
+    if not tsquery:
+        return query
+
+    if _usa_postgres():
+        documento = func.to_tsvector(TS_CONFIG, func.coalesce(Safra.texto_busca, ''))
+        consulta = func.to_tsquery(TS_CONFIG, tsquery)
+        query = query.filter(documento.op('@@')(consulta))
+        return query.order_by(func.ts_rank(documento, consulta).desc()) if ordenar else query
+
+    _garantir_indice_memoria()
+    ids = indice_memoria.pesquisar(termo)
+    if not ids:
+        return query.filter(false())
+
+    query = query.filter(Safra.id.in_(ids))
+    if not ordenar:
+        return query
+    ranking = {safra_id: posicao for posicao, safra_id in enumerate(ids)}
+    return query.order_by(case(ranking, value=Safra.id))
+
+
+# --- MANUTENÇÃO AUTOMÁTICA DO ÍNDICE ---
+def _atributo_alterado(obj, nome: str) -> bool:
+    historico = sa_inspect(obj).attrs[nome].history
+    return historico.has_changes()
+
+
+def _reindexar_produto(session, produto: Produto):
+    """
+    Recalcula `texto_busca` das safras de um produto renomeado ou recategorizado.
+    Um produto pode ter milhares de safras: lê só as colunas necessárias, escreve num
+    UPDATE em bloco e agenda o índice em memória como qualquer UPDATE direto.
+    """
+    linhas = session.query(Safra.id, Safra.status, Safra.quantidade_disponivel, Usuario.nome) \
+        .outerjoin(Usuario, Usuario.id == Safra.produtor_id) \
+        .filter(Safra.produto_id == produto.id).all()
+    if not linhas:
+        return
+
+    textos = {}
+    for safra_id, status, quantidade, produtor in linhas:
+        textos[safra_id] = normalizar(' '.join(p for p in (produto.nome, produto.categoria, produtor) if p))
+        registar_safra(session, safra_id, textos[safra_id], status == 'disponivel' and (quantidade or 0) > 0)
+
+    tabela = Safra.__table__
+    session.connection().execute(
+        tabela.update().where(tabela.c.id == bindparam('safra_id')).values(texto_busca=bindparam('texto')),
+        [{'safra_id': safra_id, 'texto': texto} for safra_id, texto in textos.items()])
+    # Safras já carregadas nesta sessão ficam com o valor novo sem novo SELECT
+    for safra in list(session.identity_map.values()):
+        if isinstance(safra, Safra) and safra.id in textos:
+            set_committed_value(safra, 'texto_busca', textos[safra.id])
+
+
+def _before_flush(session, flush_context, instances):
+    """Recalcula `texto_busca` para safras novas/alteradas e produtores ou produtos renomeados."""
+    with session.no_autoflush:
+        for obj in list(session.dirty):
+            if isinstance(obj, Produto) and (_atributo_alterado(obj, 'nome')
+                                             or _atributo_alterado(obj, 'categoria')):
+                _reindexar_produto(session, obj)
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, Safra):
+                if (obj.texto_busca is None or obj in session.new
+                        or _atributo_alterado(obj, 'produto_id')
+                        or _atributo_alterado(obj, 'produtor_id')):
+                    obj.texto_busca = documento_safra(obj)
+            elif isinstance(obj, Usuario) and obj not in session.new:
+                if _atributo_alterado(obj, 'nome') and obj.tipo == 'produtor':
+                    for safra in obj.safras:
+                        safra.texto_busca = documento_safra(safra)
+
+
+def _after_flush(session, flush_context):
+    """Guarda as alterações de safras para aplicar ao índice em memória após o commit."""
+    pendentes = session.info.setdefault('pesquisa_pendentes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Safra) and obj.id is not None:
+            pendentes[obj.id] = (obj.texto_busca, _safra_ativa(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Safra) and obj.id is not None:
+            pendentes[obj.id] = (None, False)
+
+
+def registar_safra(session, safra_id: int, texto: Optional[str], ativa: bool):
+    """Agenda a atualização do índice para uma safra alterada por UPDATE direto."""
+    session.info.setdefault('pesquisa_pendentes', {})[safra_id] = (texto, ativa)
+
+
+def _after_commit(session):
+    pendentes = session.info.pop('pesquisa_pendentes', None)
+    if not pendentes or indice_memoria.precisa_reconstrucao:
+        return
+    for safra_id, (texto, ativa) in pendentes.items():
+        indice_memoria.atualizar(safra_id, texto, ativa)
+
+
+def _after_rollback(session):
+    session.info.pop('pesquisa_pendentes', None)
+
+
+def reindexar_todas(lote: int = 500) -> int:
+    """Recalcula `texto_busca` de todas as safras (backfill após migração), em lotes por ID."""
+    total = 0
+    ultimo_id = 0
+    while True:
+        safras = Safra.query.filter(Safra.id > ultimo_id).order_by(Safra.id).limit(lote).all()
+        if not safras:
+            break
+        for safra in safras:
+            safra.texto_busca = documento_safra(safra)
+        db.session.commit()
+        total += len(safras)
+        ultimo_id = safras[-1].id
+    indice_memoria.limpar()
+    return total
+
+
+def init_app(app):
+    """Regista os listeners de sessão e o comando `flask pesquisa reindexar`."""
+    for nome, listener in (('before_flush', _before_flush),
+                           ('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not event.contains(db.session, nome, listener):
+            event.listen(db.session, nome, listener)
+
+    @app.cli.group('pesquisa')
+    def pesquisa_cli():
+        """Gestão do índice de pesquisa da vitrine."""
+
+    @pesquisa_cli.command('reindexar')
+    def reindexar_cmd():
+        """Recalcula o texto pesquisável de todas as safras."""
+        total = reindexar_todas()
+        click.echo(f"✅ {total} safras reindexadas.")
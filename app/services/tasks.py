@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta, timezone
 from app.models import Transacao, TransactionStatus, Notificacao, Safra, db
+from app.services.maquina_estados import MaquinaEstados
 
 
 def monitorar_transacoes_estagnadas():
@@ -39,7 +40,7 @@ def monitorar_transacoes_estagnadas():
                     safra.status = 'disponivel'
 
             # B. Mudar status da transação
-            t.status = TransactionStatus.CANCELADO
+            MaquinaEstados.transitar(t, TransactionStatus.CANCELADO, "Reserva expirada sem pagamento")
 
             # C. Notificar o comprador do cancelamento
             aviso = Notificacao(
@@ -71,6 +71,66 @@ if CELERY_AVAILABLE and celery is not None:
             except Exception as e:
                 logger.error(f"Erro na limpeza de sessões: {e}")
                 return "Erro na limpeza"
+
+    @celery.task(name="tasks.reconciliar_kpis")
+    def reconciliar_kpis():
+        """Verifica e corrige o resumo financeiro contra as transações (agendar 1x/dia)."""
+        with app.app_context():
+            from app.services.kpi_service import KpiService
+            resultado = KpiService.reconciliar(corrigir=True)
+            return f"{len(resultado['divergencias'])} divergências corrigidas."
+
+    @celery.task(name="tasks.gerar_relatorio", acks_late=True, ignore_result=True, time_limit=1800)
+    def gerar_relatorio(job_id):
+        """Gera o artefacto de um RelatorioJob (exportação financeira ou fatura)."""
+        with app.app_context():
+            from app.services.relatorio_service import RelatorioService
+            try:
+                RelatorioService.executar(job_id)
+                return f"Relatório {job_id} processado."
+            finally:
+                db.session.remove()
+
+    @celery.task(name="tasks.limpar_relatorios_expirados")
+    def limpar_relatorios_expirados():
+        """Apaga artefactos de relatórios expirados (agendar de hora a hora)."""
+        with app.app_context():
+            from app.services.relatorio_service import RelatorioService
+            return f"{RelatorioService.limpar_expirados()} relatórios expirados removidos."
+
+    @celery.task(name="tasks.pregerar_faturas", ignore_result=True)
+    def pregerar_faturas(transacao_ids):
+        """Gera em cache os PDFs das faturas das transações que entraram em ESCROW (um lote por commit)."""
+        with app.app_context():
+            from app.services import fatura_service
+            try:
+                return f"{fatura_service.pregerar_faturas(transacao_ids)} faturas pré-geradas."
+            finally:
+                db.session.remove()
+
+    @celery.task(name="tasks.limpar_chaves_idempotencia")
+    def limpar_chaves_idempotencia():
+        """Apaga as chaves de idempotência expiradas (agendar de hora a hora)."""
+        with app.app_context():
+            from app.services.idempotencia_service import IdempotenciaService
+            return f"{IdempotenciaService.limpar_expirados()} chaves expiradas removidas."
+
+    @celery.task(name="tasks.despachar_outbox", ignore_result=True)
+    def despachar_outbox():
+        """Cria e entrega as notificações dos eventos pendentes (agendar de minuto a minuto)."""
+        with app.app_context():
+            from app.services.outbox_service import OutboxService
+            try:
+                return f"{OutboxService.despachar_pendentes()} eventos despachados."
+            finally:
+                db.session.remove()
+
+    @celery.task(name="tasks.limpar_outbox")
+    def limpar_outbox():
+        """Apaga os eventos de outbox já processados (agendar diariamente)."""
+        with app.app_context():
+            from app.services.outbox_service import OutboxService
+            return f"{OutboxService.limpar_processados()} eventos removidos."
 else:
     # Fallback síncrono quando Celery não está disponível
     logger.warning("Celery não disponível - usando fallback síncrono")
@@ -113,3 +173,46 @@ else:
                 logger.error(f"Erro na limpeza de sessões: {e}")
                 return "Erro na limpeza"
 
+    def reconciliar_kpis():
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services.kpi_service import KpiService
+            resultado = KpiService.reconciliar(corrigir=True)
+            return f"{len(resultado['divergencias'])} divergências corrigidas."
+
+    def gerar_relatorio(job_id):
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services.relatorio_service import RelatorioService
+            RelatorioService.executar(job_id)
+            return f"Relatório {job_id} processado."
+
+    def limpar_relatorios_expirados():
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services.relatorio_service import RelatorioService
+            return f"{RelatorioService.limpar_expirados()} relatórios expirados removidos."
+
+    def pregerar_faturas(transacao_ids):
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services import fatura_service
+            return f"{fatura_service.pregerar_faturas(transacao_ids)} faturas pré-geradas."
+
+    def limpar_chaves_idempotencia():
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services.idempotencia_service import IdempotenciaService
+            return f"{IdempotenciaService.limpar_expirados()} chaves expiradas removidas."
+
+    def despachar_outbox():
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services.outbox_service import OutboxService
+            return f"{OutboxService.despachar_pendentes()} eventos despachados."
+
+    def limpar_outbox():
+        """Versão síncrona para quando Celery não está disponível."""
+        with app.app_context():
+            from app.services.outbox_service import OutboxService
+            return f"{OutboxService.limpar_processados()} eventos removidos."
@@ -0,0 +1,101 @@
+"""
+Circuit Breaker para dependências externas (Redis: cache, broker do Celery).
+Após `limite_falhas` erros seguidos o circuito abre e as chamadas falham de
+imediato (microssegundos) em vez de esperarem pelo timeout do socket.
+Passado `tempo_reset`, uma única chamada de teste (meio-aberto) decide se fecha.
+`ao_fechar` é chamado quando o circuito volta a fechar (ex.: repetir o que ficou
+por fazer enquanto esteve aberto).
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+FECHADO = 'fechado'
+ABERTO = 'aberto'
+MEIO_ABERTO = 'meio_aberto'
+
+
+class CircuitBreaker:
+    """Breaker thread-safe partilhado por todos os pedidos do processo."""
+
+    def __init__(self, nome: str, limite_falhas: int = 3, tempo_reset: float = 30.0,
+                 ao_fechar: Optional[Callable[[], None]] = None):
+        self.nome = nome
+        self.ao_fechar = ao_fechar
+        self.limite_falhas = limite_falhas
+        self.tempo_reset = tempo_reset
+        self._lock = threading.Lock()
+        self._estado = FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._teste_em_curso = False
+        self.rejeitadas = 0
+
+    @property
+    def estado(self) -> str:
+        with self._lock:
+            if self._estado == ABERTO and time.monotonic() - self._aberto_em >= self.tempo_reset:
+                return MEIO_ABERTO
+            return self._estado
+
+    def permitir(self) -> bool:
+        """Indica se a chamada pode seguir. No estado meio-aberto só passa uma sonda."""
+        with self._lock:
+            if self._estado == FECHADO:
+                return True
+            if self._estado == ABERTO and time.monotonic() - self._aberto_em < self.tempo_reset:
+                self.rejeitadas += 1
+                return False
+            if self._teste_em_curso:
+                self.rejeitadas += 1
+                return False
+            self._estado = MEIO_ABERTO
+            self._teste_em_curso = True
+            return True
+
+    def registar_sucesso(self):
+        with self._lock:
+            recuperou = self._estado != FECHADO
+            self._estado = FECHADO
+            self._falhas = 0
+            self._teste_em_curso = False
+        if recuperou and self.ao_fechar:
+            try:
+                self.ao_fechar()
+            except Exception as e:
+                logger.error(f"Erro ao recuperar o circuito {self.nome}: {e}")
+
+    def registar_falha(self):
+        with self._lock:
+            self._falhas += 1
+            self._teste_em_curso = False
+            if self._estado == MEIO_ABERTO or self._falhas >= self.limite_falhas:
+                self._estado = ABERTO
+                self._aberto_em = time.monotonic()
+
+    def resumo(self) -> Dict:
+        return {
+            'estado': self.estado,
+            'falhas_consecutivas': self._falhas,
+            'rejeitadas': self.rejeitadas,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registo_lock = threading.Lock()
+
+
+def obter_breaker(nome: str, **kwargs) -> CircuitBreaker:
+    """Devolve o breaker com este nome (criado na primeira utilização)."""
+    with _registo_lock:
+        if nome not in _breakers:
+            _breakers[nome] = CircuitBreaker(nome, **kwargs)
+        return _breakers[nome]
+
+
+def estado_breakers() -> Dict[str, Dict]:
+    with _registo_lock:
+        return {nome: breaker.resumo() for nome, breaker in _breakers.items()}
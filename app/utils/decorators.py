@@ -1,6 +1,7 @@
 from functools import wraps
-from flask import jsonify
+from flask import Response, jsonify, make_response, request
 from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_login import current_user
 from app.models import Usuario
 
 def role_required(roles):
@@ -52,4 +53,66 @@ def kyc_required():
 
             return fn(*args, **kwargs)
         return decorator
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def _identidade_pedido():
+    """Utilizador do pedido: sessão Flask-Login ou, nas APIs, o JWT."""
+    if current_user and current_user.is_authenticated:
+        return current_user.id
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def idempotente():
+    """
+    Decorador para POSTs repetidos por clientes móveis (cabeçalho `Idempotency-Key`).
+    A primeira execução é guardada; repetições com a mesma chave e o mesmo corpo
+    recebem a resposta original sem voltar a executar a rota. Sem o cabeçalho a
+    rota corre normalmente. Aplicar depois dos decoradores de autenticação.
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            cabecalho = request.headers.get('Idempotency-Key')
+            if not cabecalho or request.method not in ('POST', 'PUT', 'PATCH', 'DELETE'):
+                return fn(*args, **kwargs)
+            if len(cabecalho) > 255:
+                return jsonify({'error': 'Idempotency-Key demasiado longa (máx. 255).'}), 400
+
+            from app.services.idempotencia_service import (
+                IdempotenciaService, NOVO, REPETIDO, EM_CURSO)
+
+            usuario_id = _identidade_pedido()
+            endpoint = f"{request.method} {request.path}"
+            chave = IdempotenciaService.chave(usuario_id, endpoint, cabecalho)
+            impressao = IdempotenciaService.impressao(request.get_data(cache=True))
+            resultado, guardada = IdempotenciaService.iniciar(chave, usuario_id, endpoint, impressao)
+
+            if resultado == REPETIDO:
+                resposta = Response(guardada['corpo'], status=guardada['status'], mimetype=guardada['mimetype'])
+                resposta.headers['Idempotent-Replayed'] = 'true'
+                return resposta
+            if resultado == EM_CURSO:
+                resposta = jsonify({'error': 'Pedido com esta Idempotency-Key ainda em processamento.'})
+                resposta.status_code = 409
+                resposta.headers['Retry-After'] = '1'
+                return resposta
+            if resultado != NOVO:
+                return jsonify({'error': 'Idempotency-Key já usada com outro pedido.'}), 422
+
+            try:
+                resposta = make_response(fn(*args, **kwargs))
+            except Exception:
+                IdempotenciaService.libertar(chave)
+                raise
+            if resposta.status_code >= 500 or resposta.is_streamed:
+                IdempotenciaService.libertar(chave)
+            else:
+                IdempotenciaService.concluir(chave, resposta.status_code, resposta.get_data(as_text=True),
+                                             resposta.mimetype, impressao)
+            return resposta
+        return decorator
+    return wrapper
@@ -0,0 +1,106 @@
+"""
+JSON rápido AgroKongo (orjson, com recurso ao json da biblioteca padrão).
+Usado pelo Flask (`app.json`, logo por todos os jsonify) e pela CacheService.
+
+- datetime/date (com ou sem fuso), UUID e dataclasses são codificados de forma
+  nativa pelo orjson, sem callback Python por objeto;
+- Decimal como número (float, o que as rotas já faziam campo a campo) ou como
+  texto exato ('texto', usado pela cache para não perder casas decimais);
+  configurável na app com JSON_DECIMAL_COMO.
+
+Sem orjson instalado tudo continua a funcionar com o módulo json, mais lento.
+"""
+import dataclasses
+import json
+import uuid
+from decimal import Decimal
+from typing import Any
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+DECIMAL_NUMERO = 'numero'
+DECIMAL_TEXTO = 'texto'
+
+
+def _conversor(decimal_como: str, estrito: bool):
+    """Callback para os tipos que o codificador não conhece (o orjson só o chama para Decimal/Markup)."""
+    def converter(obj):
+        if isinstance(obj, Decimal):
+            return str(obj) if decimal_como == DECIMAL_TEXTO else float(obj)
+        if hasattr(obj, '__html__'):  # Markup
+            return str(obj.__html__())
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            return dataclasses.asdict(obj)
+        if hasattr(obj, 'isoformat'):  # datetime, date, time
+            return obj.isoformat()
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+        if estrito:
+            raise TypeError(f"Objeto do tipo {type(obj).__name__} não é serializável em JSON")
+        return str(obj)
+    return converter
+
+
+_CONVERSORES = {(d, e): _conversor(d, e) for d in (DECIMAL_NUMERO, DECIMAL_TEXTO) for e in (True, False)}
+
+
+def dumps_bytes(obj: Any, decimal_como: str = DECIMAL_NUMERO, estrito: bool = True,
+                ordenar: bool = False, indentar: bool = False) -> bytes:
+    """JSON em UTF-8. Com `estrito=False` tipos desconhecidos passam a str (como a cache sempre fez)."""
+    default = _CONVERSORES[(decimal_como, estrito)]
+    if ORJSON_AVAILABLE:
+        opcoes = orjson.OPT_NON_STR_KEYS
+        if ordenar:
+            opcoes |= orjson.OPT_SORT_KEYS
+        if indentar:
+            opcoes |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=opcoes)
+    return json.dumps(obj, default=default, ensure_ascii=False, sort_keys=ordenar,
+                      indent=2 if indentar else None, separators=None if indentar else (',', ':')).encode()
+
+
+def dumps(obj: Any, **kwargs) -> str:
+    return dumps_bytes(obj, **kwargs).decode()
+
+
+def loads(dados) -> Any:
+    if ORJSON_AVAILABLE:
+        return orjson.loads(dados)
+    return json.loads(dados)
+
+
+class JSONProviderRapido(JSONProvider):
+    """Provider JSON do Flask sobre `dumps_bytes`/`loads` (ativo em create_app)."""
+
+    sort_keys = False
+    compact = None  # None: indentado só em modo debug, como o provider por defeito
+    mimetype = 'application/json'
+
+    @property
+    def decimal_como(self) -> str:
+        return self._app.config.get('JSON_DECIMAL_COMO', DECIMAL_NUMERO)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            # Argumentos específicos do módulo json (ex.: indent, cls): respeitá-los
+            kwargs.setdefault('default', _CONVERSORES[(self.decimal_como, True)])
+            return json.dumps(obj, **kwargs)
+        return dumps(obj, decimal_como=self.decimal_como, ordenar=self.sort_keys)
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return json.loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        indentar = self.compact is False or (self.compact is None and self._app.debug)
+        corpo = dumps_bytes(obj, decimal_como=self.decimal_como, ordenar=self.sort_keys, indentar=indentar)
+        return self._app.response_class(corpo + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,120 @@
+"""
+Paginação por cursor (keyset) para Safra e Transacao.
+Em vez de OFFSET + COUNT(*), cada página continua a partir do último
+(data_criacao, id) visto: a página N custa o mesmo que a página 1.
+
+O cursor é opaco para o cliente (base64 de JSON); o total é opcional:
+- 'none'   -> não conta (por defeito, ideal para scroll infinito)
+- 'approx' -> estimativa do planner no PostgreSQL (EXPLAIN), contagem exata noutros motores
+- 'exact'  -> COUNT(*) sobre a query filtrada
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional
+
+from sqlalchemy import and_, or_
+
+from app.extensions import db
+
+MODOS_TOTAL = ('none', 'approx', 'exact')
+LIMITE_MAXIMO = 100
+
+
+class CursorInvalido(ValueError):
+    """Cursor malformado ou adulterado pelo cliente."""
+
+
+def codificar_cursor(data_criacao: datetime, registo_id: int) -> str:
+    payload = json.dumps([data_criacao.isoformat(), registo_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def descodificar_cursor(cursor: str):
+    """Devolve (data_criacao, id) ou levanta CursorInvalido."""
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        data_iso, registo_id = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+        return datetime.fromisoformat(data_iso), int(registo_id)
+    except (ValueError, TypeError, json.JSONDecodeError) as e:
+        raise CursorInvalido("Cursor de paginação inválido") from e
+
+
+class PaginaCursor:
+    """Resultado de uma página por cursor."""
+
+    def __init__(self, items: List[Any], per_page: int, next_cursor: Optional[str],
+                 total: Optional[int] = None, total_aproximado: bool = False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_aproximado = total_aproximado
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def meta(self) -> dict:
+        """Metadados para respostas JSON."""
+        dados = {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'has_next': self.has_next,
+        }
+        if self.total is not None:
+            dados['total'] = self.total
+            dados['total_aproximado'] = self.total_aproximado
+        return dados
+
+
+def _estimar_total(query) -> Optional[int]:
+    """Lê a estimativa de linhas do planner do PostgreSQL (sem executar a query)."""
+    instrucao = query.order_by(None).statement
+    compilado = instrucao.compile(dialect=db.engine.dialect)
+    conexao = db.session.connection()
+    plano = conexao.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compilado}", compilado.params).scalar()
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    return int(plano[0]['Plan']['Plan Rows'])
+
+
+def contar(query, modo: str):
+    """Devolve (total, aproximado) de acordo com o modo pedido."""
+    if modo == 'none':
+        return None, False
+    if modo == 'approx' and db.engine.dialect.name == 'postgresql':
+        return _estimar_total(query), True
+    return query.order_by(None).count(), False
+
+
+def paginar_por_cursor(query, modelo, cursor: Optional[str] = None, per_page: int = 12,
+                       total: str = 'none') -> PaginaCursor:
+    """
+    Pagina `query` por (data_criacao DESC, id DESC).
+    `modelo` tem de ter as colunas `data_criacao` e `id` (Safra, Transacao).
+    Qualquer ORDER BY anterior é substituído, pois o keyset exige uma ordem estável.
+    """
+    if total not in MODOS_TOTAL:
+        raise ValueError(f"Modo de total inválido: {total}")
+    per_page = max(1, min(per_page, LIMITE_MAXIMO))
+
+    total_valor, aproximado = contar(query, total)
+
+    query = query.order_by(None).order_by(modelo.data_criacao.desc(), modelo.id.desc())
+    if cursor:
+        data_ref, id_ref = descodificar_cursor(cursor)
+        query = query.filter(or_(
+            modelo.data_criacao < data_ref,
+            and_(modelo.data_criacao == data_ref, modelo.id < id_ref)
+        ))
+
+    # Pede uma linha a mais para saber se existe próxima página sem COUNT
+    items = query.limit(per_page + 1).all()
+    proximo = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        ultimo = items[-1]
+        proximo = codificar_cursor(ultimo.data_criacao, ultimo.id)
+
+    return PaginaCursor(items, per_page, proximo, total_valor, aproximado)
@@ -0,0 +1,141 @@
+"""
+Teste de carga: publicar uma safra com N subscrições de alertas para o produto.
+
+Compara o motor antigo (dentro do pedido: carregar todos os AlertaPreferencia e
+inserir uma Notificacao por alerta via ORM, com lazy loads do produto e da
+província) com o atual (o pedido só grava um EventoOutbox; o despachante cruza
+as subscrições com um único INSERT ... SELECT).
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/alertas_safra.py --subscricoes 100000
+
+ATENÇÃO: as tabelas da base indicada em DATABASE_URL são apagadas e recriadas.
+
+Sem DATABASE_URL usa um SQLite em ficheiro temporário. Um terço das subscrições
+restringe a província e outro terço o preço máximo, para exercitar os filtros.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A config lê DEV_DATABASE_URL ao ser importada: definir antes de importar a app
+os.environ['DEV_DATABASE_URL'] = os.environ.get('DATABASE_URL') or \
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_alertas.db')}"
+
+from sqlalchemy import insert  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import (AlertaPreferencia, Notificacao, Produto, Provincia, Safra,  # noqa: E402
+                        Usuario)
+from app.services import outbox_service  # noqa: E402
+from app.services.outbox_service import OutboxService  # noqa: E402
+
+BLOCO = 10000
+
+
+def preparar(app, subscricoes: int):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        huambo, luanda = Provincia(nome='Huambo'), Provincia(nome='Luanda')
+        produto = Produto(nome='Milho', categoria='Grãos')
+        db.session.add_all([huambo, luanda, produto])
+        db.session.flush()
+        produtor = Usuario(nome='Produtor Bench', telemovel='923000000', tipo='produtor', provincia_id=huambo.id)
+        produtor.senha = 'bench123'
+        db.session.add(produtor)
+        db.session.commit()
+
+        # Compradores e subscrições por INSERT em massa (sem validadores nem hash por linha)
+        senha = generate_password_hash('bench123')
+        for inicio in range(0, subscricoes, BLOCO):
+            fim = min(inicio + BLOCO, subscricoes)
+            db.session.execute(insert(Usuario), [
+                dict(nome=f'Comprador {i}', telemovel=f'93{i:07d}', senha_hash=senha, tipo='comprador')
+                for i in range(inicio, fim)])
+        ids = [i for (i,) in db.session.query(Usuario.id).filter(Usuario.tipo == 'comprador').order_by(Usuario.id)]
+        for inicio in range(0, len(ids), BLOCO):
+            db.session.execute(insert(AlertaPreferencia), [
+                dict(usuario_id=u, produto_id=produto.id,
+                     provincia_id=(luanda.id if n % 6 == 0 else huambo.id) if n % 3 == 0 else None,
+                     preco_maximo=(Decimal('50') if n % 2 else Decimal('500')) if n % 3 == 1 else None)
+                for n, u in enumerate(ids[inicio:inicio + BLOCO], start=inicio)])
+        db.session.commit()
+        return produtor.id, produto.id
+
+
+def nova_safra(produtor_id: int, produto_id: int) -> Safra:
+    safra = Safra(produtor_id=produtor_id, produto_id=produto_id,
+                  quantidade_disponivel=Decimal('1000'), preco_por_unidade=Decimal('100'))
+    db.session.add(safra)
+    db.session.flush()
+    return safra
+
+
+def publicar_antigo(produtor_id: int, produto_id: int) -> float:
+    """Réplica do fluxo anterior: tudo dentro do pedido do produtor."""
+    inicio = time.perf_counter()
+    safra = nova_safra(produtor_id, produto_id)
+    produtor = db.session.get(Usuario, produtor_id)
+    for alerta in AlertaPreferencia.query.filter_by(produto_id=safra.produto_id).all():
+        if alerta.usuario_id != produtor_id:
+            db.session.add(Notificacao(
+                usuario_id=alerta.usuario_id,
+                mensagem=f"🚨 Nova safra de {safra.produto.nome} em {produtor.provincia.nome}!",
+                link=f'/mercado/safra/{safra.id}'))
+    db.session.commit()
+    return time.perf_counter() - inicio
+
+
+def publicar_atual(produtor_id: int, produto_id: int) -> float:
+    inicio = time.perf_counter()
+    safra = nova_safra(produtor_id, produto_id)
+    outbox_service.publicar(outbox_service.SAFRA_PUBLICADA,
+                            {'safra_id': safra.id, 'link': f'/mercado/safra/{safra.id}'})
+    db.session.commit()
+    return time.perf_counter() - inicio
+
+
+def executar(app, modo: str, subscricoes: int) -> dict:
+    produtor_id, produto_id = preparar(app, subscricoes)
+    with app.app_context():
+        if modo == 'antes':
+            pedido, despacho = publicar_antigo(produtor_id, produto_id), 0.0
+        else:
+            pedido = publicar_atual(produtor_id, produto_id)
+            inicio = time.perf_counter()
+            OutboxService.despachar_pendentes()
+            despacho = time.perf_counter() - inicio
+        notificacoes = Notificacao.query.count()
+        db.session.remove()
+    total = pedido + despacho
+    return {'modo': modo, 'notificacoes': notificacoes, 'pedido': pedido, 'despacho': despacho,
+            'por_segundo': notificacoes / total if total else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscricoes', type=int, default=100000)
+    parser.add_argument('--modo', choices=['antes', 'depois', 'ambos'], default='ambos')
+    args = parser.parse_args()
+
+    app = create_app('dev')
+    app.config.update(FATURAS_PREGERAR=False, OUTBOX_DESPACHO_IMEDIATO=False)
+
+    modos = ['antes', 'depois'] if args.modo == 'ambos' else [args.modo]
+    print(f"{args.subscricoes} subscrições | {app.config['SQLALCHEMY_DATABASE_URI']}")
+    for modo in modos:
+        r = executar(app, modo, args.subscricoes)
+        print(f"{r['modo']:>7}: {r['notificacoes']:6d} notificações | pedido do produtor {r['pedido'] * 1000:8.1f} ms"
+              f" | despacho {r['despacho'] * 1000:8.1f} ms | {r['por_segundo']:,.0f} notificações/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+Harness de benchmark: reservas por segundo em cada ponto de entrada de compra.
+
+Todos os caminhos delegam em CompraService.iniciar_compra; este script mede cada
+um (serviços chamados diretamente e rotas pelo cliente de testes do Flask) sobre
+uma única safra, para confirmar que nenhum acrescenta custo ou trabalho diferente
+e que o stock final bate certo com as reservas aceites.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/caminhos_compra.py --threads 8 --compras 25
+
+ATENÇÃO: as tabelas da base indicada em DATABASE_URL são apagadas e recriadas.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Importa primeiro o teste de carga: define a base de dados antes de a app ser importada
+from reservas_safra import QUANTIDADE, STOCK_INICIAL, preparar  # noqa: E402
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from flask_login import FlaskLoginClient  # noqa: E402
+
+from app import create_app, limiter  # noqa: E402
+from app.extensions import db, login_manager  # noqa: E402
+from app.models import Safra, Transacao, Usuario  # noqa: E402
+from app.routes.transacoes_api import transacoes_api_bp  # noqa: E402
+from app.services.compra_service import CompraService  # noqa: E402
+from app.services.transaction_service import TransactionService  # noqa: E402
+
+
+def _servico_compra(app, safra_id, comprador_id):
+    return lambda: CompraService.iniciar_compra(safra_id, comprador_id, QUANTIDADE)[0]
+
+
+def _servico_transacao(app, safra_id, comprador_id):
+    return lambda: TransactionService.criar_reserva(safra_id, comprador_id, QUANTIDADE)[0]
+
+
+def _web_mercado(app, safra_id, comprador_id):
+    cliente = app.test_client(user=db.session.get(Usuario, comprador_id))
+    url = f'/safra/{safra_id}/encomendar'
+    return lambda: cliente.post(url, data={'quantidade': str(QUANTIDADE)}).status_code == 302
+
+
+def _api_sessao(app, safra_id, comprador_id):
+    cliente = app.test_client(user=db.session.get(Usuario, comprador_id))
+    corpo = {'safra_id': safra_id, 'quantidade': str(QUANTIDADE)}
+    return lambda: cliente.post('/api/v1/comprar', json=corpo).status_code == 200
+
+
+def _api_jwt(url):
+    def fabrica(app, safra_id, comprador_id):
+        cliente = app.test_client()
+        with app.test_request_context():
+            cabecalhos = {'Authorization': f'Bearer {create_access_token(identity=str(comprador_id))}'}
+        corpo = {'safra_id': safra_id, 'quantidade': str(QUANTIDADE)}
+        return lambda: cliente.post(url, json=corpo, headers=cabecalhos).status_code == 201
+    return fabrica
+
+
+CAMINHOS = {
+    'CompraService.iniciar_compra': _servico_compra,
+    'TransactionService.criar_reserva': _servico_transacao,
+    'mercado.iniciar_encomenda': _web_mercado,
+    'api.criar_pedido': _api_sessao,
+    'mercado_api.buy_safra': _api_jwt('/api/market/buy'),
+    'transacoes_api.iniciar_compra': _api_jwt('/api/transacoes/buy'),
+}
+
+
+def medir(app, caminho: str, threads: int, compras: int) -> dict:
+    safra_id, compradores = preparar(app, threads)
+    aceites = [0] * threads
+    barreira = threading.Barrier(threads + 1)
+
+    def trabalhador(indice):
+        with app.app_context():
+            comprar = CAMINHOS[caminho](app, safra_id, compradores[indice])
+            barreira.wait()
+            for _ in range(compras):
+                if comprar():
+                    aceites[indice] += 1
+            db.session.remove()
+
+    trabalhadores = [threading.Thread(target=trabalhador, args=(i,)) for i in range(threads)]
+    for t in trabalhadores:
+        t.start()
+    barreira.wait()
+    inicio = time.perf_counter()
+    for t in trabalhadores:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    with app.app_context():
+        total = sum(aceites)
+        stock = db.session.get(Safra, safra_id).quantidade_disponivel
+        consistente = stock == STOCK_INICIAL - total * QUANTIDADE and Transacao.query.count() == total
+    return {'caminho': caminho, 'aceites': total, 'segundos': duracao,
+            'reservas_por_segundo': total / duracao if duracao else 0.0, 'consistente': consistente}
+
+
+def criar_app():
+    app = create_app('dev')
+    # transacoes_api não é registado pela factory: montado aqui só para o medir
+    app.register_blueprint(transacoes_api_bp, url_prefix='/api/transacoes')
+    app.config.update(WTF_CSRF_ENABLED=False, FATURAS_PREGERAR=False)
+    app.test_client_class = FlaskLoginClient
+    limiter.enabled = False
+    login_manager.session_protection = None
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--compras', type=int, default=25, help='compras por thread')
+    parser.add_argument('--caminho', choices=[*CAMINHOS, 'todos'], default='todos')
+    args = parser.parse_args()
+
+    app = criar_app()
+    caminhos = list(CAMINHOS) if args.caminho == 'todos' else [args.caminho]
+    print(f"Safra única | {args.threads} threads x {args.compras} compras | {app.config['SQLALCHEMY_DATABASE_URI']}")
+    for caminho in caminhos:
+        r = medir(app, caminho, args.threads, args.compras)
+        print(f"{r['caminho']:>34}: {r['aceites']:5d} reservas em {r['segundos']:.2f}s "
+              f"= {r['reservas_por_segundo']:.1f} reservas/s | stock consistente: {r['consistente']}")
+
+
+if __name__ == '__main__':
+    main()
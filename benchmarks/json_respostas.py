@@ -0,0 +1,112 @@
+"""
+Micro-benchmark: tempo de serialização JSON das respostas mais pesadas da API.
+
+Compara o provider por defeito do Flask (json da biblioteca padrão) e o antigo
+serializador da cache com o JSON rápido (app/utils/json_rapido.py) para:
+- vitrine: 500 safras no formato de projecoes.safra_dict, mas com Decimal e
+  datetime tal como vêm da base de dados (o provider converte-os sozinho);
+- dashboard: três listas de transações do produtor (500 linhas no total).
+
+Não precisa de base de dados nem de Redis.
+
+Uso:
+    python benchmarks/json_respostas.py --linhas 500 --repeticoes 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from app.utils import json_rapido  # noqa: E402
+from app.utils.json_rapido import JSONProviderRapido  # noqa: E402
+
+AGORA = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+
+
+def vitrine(linhas: int) -> dict:
+    return {'success': True, 'data': [{
+        'id': i,
+        'produto': f'Produto {i % 40}',
+        'categoria': 'Grãos',
+        'quantidade': Decimal('1250.50') + i,
+        'preco': Decimal('350.00') + i % 17,
+        'status': 'disponivel',
+        'data_criacao': AGORA - timedelta(minutes=i),
+        'imagem_url': f'/uploads/safras/safra_{i}.webp',
+        'observacoes': 'Colheita recente, sacos de 50 kg.',
+        'produtor': {'id': i % 90, 'nome': f'Produtor {i % 90}', 'rating': Decimal('4.75'),
+                     'localizacao': 'Caála, Huambo'},
+    } for i in range(linhas)], 'meta': {'per_page': linhas, 'next_cursor': 'MjAyNi0xMC0xN1QxMjowMDowMCwxMjM', 'has_next': True}}
+
+
+def dashboard(linhas: int) -> dict:
+    def transacao(i):
+        return {'id': i, 'ref': f'AK-2026-{i:06d}', 'produto': f'Produto {i % 40}', 'safra_id': i % 300,
+                'quantidade': Decimal('12.50'), 'valor_total': Decimal('4375.00') + i,
+                'status': 'escrow', 'data_criacao': AGORA - timedelta(hours=i),
+                'comprador': f'Comprador {i % 200}', 'vendedor': 'Produtor 1',
+                'previsao_entrega': (AGORA + timedelta(days=3)).strftime('%d/%m/%Y')}
+    terco = linhas // 3
+    return {'success': True, 'data': {
+        'kpis': {'receita_total': Decimal('1250000.00'), 'receita_pendente': Decimal('87500.50'),
+                 'receita_a_liquidar': Decimal('43000.00'), 'saldo_disponivel': Decimal('15000.75')},
+        'listas': {'reservas': [transacao(i) for i in range(terco)],
+                   'vendas_ativas': [transacao(i) for i in range(terco, 2 * terco)],
+                   'historico': [transacao(i) for i in range(2 * terco, linhas)]}}}
+
+
+def cache_antiga(data) -> str:
+    """Réplica do antigo CacheService._serialize."""
+    def default_serializer(obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        elif hasattr(obj, 'isoformat'):
+            return obj.isoformat()
+        return str(obj)
+    return json.dumps(data, default=default_serializer)
+
+
+def medir(funcao, carga, repeticoes: int) -> float:
+    funcao(carga)  # aquecimento
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao(carga)
+    return (time.perf_counter() - inicio) / repeticoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, default=500)
+    parser.add_argument('--repeticoes', type=int, default=200)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    padrao, rapido = DefaultJSONProvider(app), JSONProviderRapido(app)
+    print(f"orjson: {'sim' if json_rapido.ORJSON_AVAILABLE else 'não (recurso ao json)'} | "
+          f"{args.linhas} linhas | média de {args.repeticoes} repetições")
+
+    for nome, carga in (('vitrine', vitrine(args.linhas)), ('dashboard', dashboard(args.linhas))):
+        casos = (
+            ('jsonify (json padrão)', padrao.dumps),
+            ('jsonify (json rápido)', rapido.dumps),
+            ('cache antiga', cache_antiga),
+            ('cache (json rápido)', lambda d: json_rapido.dumps(d, decimal_como=json_rapido.DECIMAL_TEXTO,
+                                                                 estrito=False)),
+        )
+        tempos = {rotulo: medir(funcao, carga, args.repeticoes) for rotulo, funcao in casos}
+        for rotulo, tempo in tempos.items():
+            print(f"{nome:>9} | {rotulo:<22} {tempo * 1000:8.3f} ms")
+        print(f"{nome:>9} | ganho jsonify {tempos['jsonify (json padrão)'] / tempos['jsonify (json rápido)']:.1f}x,"
+              f" cache {tempos['cache antiga'] / tempos['cache (json rápido)']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Teste de carga: compras por segundo numa única safra "quente".
+
+Compara a reserva antiga (SELECT ... FOR UPDATE mantido enquanto se criam a
+Transacao, o LogAuditoria e a Notificacao) com o motor atual (UPDATE condicional
++ auditoria depois do commit), com N compradores em paralelo sobre a mesma safra.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/reservas_safra.py --threads 16 --compras 50
+
+ATENÇÃO: as tabelas da base indicada em DATABASE_URL são apagadas e recriadas.
+
+Sem DATABASE_URL usa um SQLite em ficheiro temporário; o SQLite serializa todas
+as escritas e ignora o FOR UPDATE, pelo que os números só são representativos em
+PostgreSQL. No fim verifica que o stock final bate certo com as reservas aceites
+(em SQLite o fluxo antigo perde atualizações: é a corrida que o lock deveria evitar).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A config lê DEV_DATABASE_URL ao ser importada: definir antes de importar a app
+os.environ['DEV_DATABASE_URL'] = os.environ.get('DATABASE_URL') or \
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_reservas.db')}"
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models import (LogAuditoria, Notificacao, Produto, Safra, Transacao,  # noqa: E402
+                        TransactionStatus, Usuario)
+from app.services.compra_service import CompraService  # noqa: E402
+
+STOCK_INICIAL = Decimal('1000000')
+QUANTIDADE = Decimal('1')
+
+
+def compra_antiga(safra_id: int, comprador_id: int, quantidade: Decimal) -> bool:
+    """Réplica do fluxo anterior: lock pessimista durante toda a construção da reserva."""
+    try:
+        safra = Safra.query.with_for_update().get(safra_id)
+        if not safra or quantidade > safra.quantidade_disponivel:
+            db.session.rollback()
+            return False
+        transacao = Transacao(safra_id=safra.id, comprador_id=comprador_id, vendedor_id=safra.produtor_id,
+                              quantidade_comprada=quantidade,
+                              valor_total_pago=(quantidade * safra.preco_por_unidade).quantize(Decimal('0.01')),
+                              status=TransactionStatus.PENDENTE)
+        safra.quantidade_disponivel -= quantidade
+        if safra.quantidade_disponivel <= 0:
+            safra.status = 'esgotado'
+        db.session.add(transacao)
+        db.session.flush()
+        db.session.add(LogAuditoria(usuario_id=comprador_id, acao="COMPRA_INICIADA",
+                                    detalhes=f"Ref: {transacao.fatura_ref} | Qtd: {quantidade}"))
+        db.session.add(Notificacao(usuario_id=safra.produtor_id, mensagem="Novo pedido", link='/produtor/vendas'))
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        return False
+
+
+def compra_atual(safra_id: int, comprador_id: int, quantidade: Decimal) -> bool:
+    sucesso, _, _ = CompraService.iniciar_compra(safra_id, comprador_id, quantidade)
+    return sucesso
+
+
+MODOS = {'antes': compra_antiga, 'depois': compra_atual}
+
+
+def preparar(app, threads: int):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        produtor = Usuario(nome='Produtor Bench', telemovel='923000000', tipo='produtor')
+        produtor.senha = 'bench123'
+        produto = Produto(nome='Milho', categoria='Grãos')
+        db.session.add_all([produtor, produto])
+        compradores = []
+        for i in range(threads):
+            comprador = Usuario(nome=f'Comprador {i}', telemovel=f'93{i:07d}', tipo='comprador',
+                                conta_validada=True, perfil_completo=True)
+            comprador.senha = 'bench123'
+            compradores.append(comprador)
+        db.session.add_all(compradores)
+        db.session.flush()
+        safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                      quantidade_disponivel=STOCK_INICIAL, preco_por_unidade=Decimal('100'))
+        db.session.add(safra)
+        db.session.commit()
+        return safra.id, [c.id for c in compradores]
+
+
+def executar(app, modo: str, threads: int, compras: int) -> dict:
+    safra_id, compradores = preparar(app, threads)
+    funcao = MODOS[modo]
+    aceites = [0] * threads
+    barreira = threading.Barrier(threads + 1)
+
+    def trabalhador(indice):
+        with app.app_context():
+            barreira.wait()
+            for _ in range(compras):
+                if funcao(safra_id, compradores[indice], QUANTIDADE):
+                    aceites[indice] += 1
+            db.session.remove()
+
+    trabalhadores = [threading.Thread(target=trabalhador, args=(i,)) for i in range(threads)]
+    for t in trabalhadores:
+        t.start()
+    barreira.wait()
+    inicio = time.perf_counter()
+    for t in trabalhadores:
+        t.join()
+    duracao = time.perf_counter() - inicio
+
+    with app.app_context():
+        stock = db.session.get(Safra, safra_id).quantidade_disponivel
+        total = sum(aceites)
+        consistente = stock == STOCK_INICIAL - total * QUANTIDADE and Transacao.query.count() == total
+    return {'modo': modo, 'aceites': total, 'segundos': duracao,
+            'compras_por_segundo': total / duracao if duracao else 0.0, 'consistente': consistente}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--compras', type=int, default=25, help='compras por thread')
+    parser.add_argument('--modo', choices=[*MODOS, 'ambos'], default='ambos')
+    args = parser.parse_args()
+
+    app = create_app('dev')
+    app.config['FATURAS_PREGERAR'] = False
+
+    modos = list(MODOS) if args.modo == 'ambos' else [args.modo]
+    print(f"Safra única | {args.threads} threads x {args.compras} compras | {app.config['SQLALCHEMY_DATABASE_URI']}")
+    for modo in modos:
+        r = executar(app, modo, args.threads, args.compras)
+        print(f"{r['modo']:>7}: {r['aceites']:5d} compras em {r['segundos']:.2f}s "
+              f"= {r['compras_por_segundo']:.1f} compras/s | stock consistente: {r['consistente']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -23,12 +23,78 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)  # Aumentado para melhor UX em Angola
     
+    # --- REDIS (cache, rate limiting e broker do Celery) ---
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    # Timeouts curtos: um Redis lento não pode prender os workers do gunicorn
+    REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 0.25))
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 0.5))
+
     # --- RATE LIMITING ---
     RATELIMIT_ENABLED = True
-    RATELIMIT_STORAGE_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    RATELIMIT_STORAGE_URI = REDIS_URL
+    RATELIMIT_STORAGE_URL = REDIS_URL  # Nome antigo, mantido por compatibilidade
+    RATELIMIT_STORAGE_OPTIONS = {
+        'socket_connect_timeout': REDIS_CONNECT_TIMEOUT,
+        'socket_timeout': REDIS_SOCKET_TIMEOUT,
+    }
+    # Redis em baixo: limites passam para memória local e o Redis é re-sondado
+    # com backoff exponencial (o próprio Flask-Limiter faz de circuit breaker)
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True
+    RATELIMIT_SWALLOW_ERRORS = True
     RATELIMIT_STRATEGY = 'fixed-window'
     RATELIMIT_HEADERS_ENABLED = False  # Não expor headers de rate limit em produção
     
+    # --- CACHE ---
+    # L1 em processo à frente do Redis (só ativo com o subscritor pub/sub ligado)
+    CACHE_L1_ENABLED = os.environ.get('CACHE_L1_ENABLED', 'True').lower() == 'true'
+    CACHE_L1_MAX_BYTES = int(os.environ.get('CACHE_L1_MAX_BYTES', 32 * 1024 * 1024))
+    
+    # --- RELATÓRIOS ASSÍNCRONOS ---
+    # Artefactos em UPLOAD_FOLDER_PRIVATE/relatorios, apagados após este prazo
+    RELATORIOS_TTL_HORAS = int(os.environ.get('RELATORIOS_TTL_HORAS', 24))
+
+    # --- LOTES DE PAGAMENTO (ficheiro de transferências para o banco) ---
+    PLATAFORMA_NOME = os.environ.get('PLATAFORMA_NOME', 'AgroKongo')
+    PLATAFORMA_IBAN = os.environ.get('PLATAFORMA_IBAN', '')  # conta de onde saem as liquidações
+    PLATAFORMA_BIC = os.environ.get('PLATAFORMA_BIC')
+
+    # --- OUTBOX DE NOTIFICAÇÕES ---
+    # Acorda o despachante logo a seguir ao commit (o job periódico fica como rede de segurança)
+    OUTBOX_DESPACHO_IMEDIATO = os.environ.get('OUTBOX_DESPACHO_IMEDIATO', 'True').lower() == 'true'
+    OUTBOX_RETENCAO_DIAS = int(os.environ.get('OUTBOX_RETENCAO_DIAS', 7))
+    # Microsserviço de notificações (email/push); vazio = só notificações in-app
+    NOTIFICATION_SERVICE_URL = os.environ.get('NOTIFICATION_SERVICE_URL')
+
+    # --- NOTIFICAÇÕES DO SININHO ---
+    # SSE só com workers assíncronos (gunicorn -k gevent/eventlet): cada stream prende o
+    # worker durante NOTIFICACOES_STREAM_SEGUNDOS. Desligado, o sininho faz polling curto
+    # a /notificacoes/resumo (contador em Redis e últimas em cache: sem queries)
+    NOTIFICACOES_SSE = os.environ.get('NOTIFICACOES_SSE', 'False').lower() == 'true'
+    NOTIFICACOES_STREAM_SEGUNDOS = int(os.environ.get('NOTIFICACOES_STREAM_SEGUNDOS', 300))
+    NOTIFICACOES_POLL_SEGUNDOS = int(os.environ.get('NOTIFICACOES_POLL_SEGUNDOS', 60))
+
+    # --- JSON DAS RESPOSTAS ---
+    # 'numero' (float, como as rotas sempre devolveram) ou 'texto' (valor exato)
+    JSON_DECIMAL_COMO = os.environ.get('JSON_DECIMAL_COMO', 'numero')
+
+    # --- INSTRUMENTAÇÃO SQL POR PEDIDO ---
+    # Conta instruções/tempo de BD por pedido e deteta N+1 (agregado em /api/v1/admin/sql)
+    SQL_INSTRUMENTACAO = os.environ.get('SQL_INSTRUMENTACAO', 'True').lower() == 'true'
+    SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', 'True').lower() == 'true'
+    # Vezes que a mesma instrução (a menos dos parâmetros) se repete até contar como N+1
+    SQL_N_MAIS_1_LIMIAR = int(os.environ.get('SQL_N_MAIS_1_LIMIAR', 5))
+
+    # --- IDEMPOTÊNCIA ---
+    # Respostas a pedidos com Idempotency-Key são repetidas durante este prazo
+    IDEMPOTENCIA_TTL_HORAS = int(os.environ.get('IDEMPOTENCIA_TTL_HORAS', 24))
+
+    # --- FATURAS PDF ---
+    # Motor: 'weasyprint' (em processo) ou 'wkhtmltopdf'; vazio = o primeiro disponível
+    FATURA_MOTOR_PDF = os.environ.get('FATURA_MOTOR_PDF') or None
+    WKHTMLTOPDF_PATH = os.environ.get('WKHTMLTOPDF_PATH')  # vazio = procurar no PATH
+    # Gera o PDF (em cache) assim que a transação entra em ESCROW
+    FATURAS_PREGERAR = os.environ.get('FATURAS_PREGERAR', 'True').lower() == 'true'
+    
     # --- CDN PARA IMAGENS ---
     CDN_ENABLED = os.environ.get('CDN_ENABLED', 'False').lower() == 'true'
     CDN_URL = os.environ.get('CDN_URL', '')  # ex: https://cdn.agrokongo.ao
@@ -63,6 +129,9 @@ class ProductionConfig(Config):
         uri = uri.replace("postgres://", "postgresql://", 1)
     SQLALCHEMY_DATABASE_URI = uri
 
+    # O tempo de BD no header Server-Timing fica visível a qualquer cliente
+    SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', 'False').lower() == 'true'
+
     # --- SEGURANÇA DE COOKIES (ESSENCIAL PARA HTTPS/PRODUÇÃO) ---
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SECURE = True
@@ -0,0 +1,53 @@
+"""lotes de pagamento bancario
+
+Revision ID: a8c0e6d4f2b7
+Revises: f7b9d5c3e1a6
+Create Date: 2026-10-17 17:12:06.351904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8c0e6d4f2b7'
+down_revision = 'f7b9d5c3e1a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('lotes_pagamento',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('referencia', sa.String(length=35), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('admin_id', sa.Integer(), nullable=True),
+    sa.Column('quantidade_transacoes', sa.Integer(), nullable=False),
+    sa.Column('quantidade_beneficiarios', sa.Integer(), nullable=False),
+    sa.Column('valor_total', sa.Numeric(precision=16, scale=2), nullable=False),
+    sa.Column('data_criacao', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('data_confirmacao', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['admin_id'], ['usuarios.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('referencia')
+    )
+    with op.batch_alter_table('lotes_pagamento', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_lotes_pagamento_estado'), ['estado'], unique=False)
+
+    with op.batch_alter_table('transacoes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('lote_pagamento_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_transacoes_lote_pagamento_id'), ['lote_pagamento_id'], unique=False)
+        batch_op.create_foreign_key('fk_transacoes_lote_pagamento_id', 'lotes_pagamento',
+                                    ['lote_pagamento_id'], ['id'], ondelete='SET NULL')
+
+
+def downgrade():
+    with op.batch_alter_table('transacoes', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_transacoes_lote_pagamento_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_transacoes_lote_pagamento_id'))
+        batch_op.drop_column('lote_pagamento_id')
+
+    with op.batch_alter_table('lotes_pagamento', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_lotes_pagamento_estado'))
+
+    op.drop_table('lotes_pagamento')
@@ -0,0 +1,37 @@
+"""pesquisa de texto completo nas safras
+
+Revision ID: b3c1d9e4f2a7
+Revises: 7a474bd9890e
+Create Date: 2026-10-17 09:12:41.203118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3c1d9e4f2a7'
+down_revision = '7a474bd9890e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('safras', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('texto_busca', sa.Text(), nullable=True))
+
+    # Índice GIN só no PostgreSQL; no SQLite a pesquisa usa o índice em memória.
+    # Após a migração: `flask pesquisa reindexar` para preencher as safras existentes.
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE INDEX idx_safra_texto_busca ON safras "
+            "USING gin (to_tsvector('simple', coalesce(texto_busca, '')))"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS idx_safra_texto_busca")
+
+    with op.batch_alter_table('safras', schema=None) as batch_op:
+        batch_op.drop_column('texto_busca')
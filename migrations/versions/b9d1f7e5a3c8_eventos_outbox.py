@@ -0,0 +1,39 @@
+"""eventos outbox
+
+Revision ID: b9d1f7e5a3c8
+Revises: a8c0e6d4f2b7
+Create Date: 2026-10-17 18:42:10.275311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d1f7e5a3c8'
+down_revision = 'a8c0e6d4f2b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('eventos_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('tentativas', sa.Integer(), nullable=False),
+    sa.Column('erro', sa.String(length=255), nullable=True),
+    sa.Column('data_criacao', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('data_processamento', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('eventos_outbox', schema=None) as batch_op:
+        batch_op.create_index('idx_outbox_estado_id', ['estado', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('eventos_outbox', schema=None) as batch_op:
+        batch_op.drop_index('idx_outbox_estado_id')
+
+    op.drop_table('eventos_outbox')
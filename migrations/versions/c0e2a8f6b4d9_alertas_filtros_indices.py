@@ -0,0 +1,36 @@
+"""alertas: filtros de provincia e preco, indices de cruzamento
+
+Revision ID: c0e2a8f6b4d9
+Revises: b9d1f7e5a3c8
+Create Date: 2026-10-17 19:20:44.618302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c0e2a8f6b4d9'
+down_revision = 'b9d1f7e5a3c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('alertas_preferencias', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('provincia_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('preco_maximo', sa.Numeric(precision=12, scale=2), nullable=True))
+        batch_op.create_foreign_key('fk_alertas_preferencias_provincia_id', 'provincias',
+                                    ['provincia_id'], ['id'], ondelete='CASCADE')
+        batch_op.create_index('idx_alerta_produto_provincia_preco',
+                              ['produto_id', 'provincia_id', 'preco_maximo', 'usuario_id'], unique=False)
+        batch_op.create_index('idx_alerta_usuario', ['usuario_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('alertas_preferencias', schema=None) as batch_op:
+        batch_op.drop_index('idx_alerta_usuario')
+        batch_op.drop_index('idx_alerta_produto_provincia_preco')
+        batch_op.drop_constraint('fk_alertas_preferencias_provincia_id', type_='foreignkey')
+        batch_op.drop_column('preco_maximo')
+        batch_op.drop_column('provincia_id')
@@ -0,0 +1,34 @@
+"""indices para paginacao por cursor
+
+Revision ID: c4e8a2f1d6b3
+Revises: b3c1d9e4f2a7
+Create Date: 2026-10-17 11:40:05.918342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a2f1d6b3'
+down_revision = 'b3c1d9e4f2a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('safras', schema=None) as batch_op:
+        batch_op.create_index('idx_safra_status_data', ['status', 'data_criacao', 'id'], unique=False)
+
+    with op.batch_alter_table('transacoes', schema=None) as batch_op:
+        batch_op.create_index('idx_transacao_comprador_data', ['comprador_id', 'data_criacao', 'id'], unique=False)
+        batch_op.create_index('idx_transacao_vendedor_data', ['vendedor_id', 'data_criacao', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('transacoes', schema=None) as batch_op:
+        batch_op.drop_index('idx_transacao_vendedor_data')
+        batch_op.drop_index('idx_transacao_comprador_data')
+
+    with op.batch_alter_table('safras', schema=None) as batch_op:
+        batch_op.drop_index('idx_safra_status_data')
@@ -0,0 +1,26 @@
+"""notificacoes: indice (usuario_id, lida, data_criacao) para o sininho
+
+Revision ID: d1f3b9a7c5e0
+Revises: c0e2a8f6b4d9
+Create Date: 2026-10-17 21:05:12.447810
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1f3b9a7c5e0'
+down_revision = 'c0e2a8f6b4d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notificacoes', schema=None) as batch_op:
+        batch_op.create_index('idx_notificacao_usuario_lida_data',
+                              ['usuario_id', 'lida', 'data_criacao'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('notificacoes', schema=None) as batch_op:
+        batch_op.drop_index('idx_notificacao_usuario_lida_data')
@@ -0,0 +1,57 @@
+"""resumo financeiro materializado por utilizador
+
+Revision ID: d5f7b3a9c1e4
+Revises: c4e8a2f1d6b3
+Create Date: 2026-10-17 14:05:12.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5f7b3a9c1e4'
+down_revision = 'c4e8a2f1d6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('resumos_financeiros',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('papel', sa.String(length=10), nullable=False),
+    sa.Column('status', sa.String(length=30), nullable=False),
+    sa.Column('quantidade', sa.Integer(), nullable=False),
+    sa.Column('valor_total', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('valor_liquido', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('comissao', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('data_atualizacao', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('usuario_id', 'papel', 'status', name='uq_resumo_usuario_papel_status')
+    )
+    with op.batch_alter_table('resumos_financeiros', schema=None) as batch_op:
+        batch_op.create_index('idx_resumo_papel_status', ['papel', 'status'], unique=False)
+
+    # Preenche o resumo a partir das transações existentes
+    for papel, coluna in (('vendedor', 'vendedor_id'), ('comprador', 'comprador_id')):
+        op.execute(f"""
+            INSERT INTO resumos_financeiros
+                (usuario_id, papel, status, quantidade, valor_total, valor_liquido, comissao, data_atualizacao)
+            SELECT {coluna}, '{papel}', status, COUNT(id),
+                   COALESCE(SUM(valor_total_pago), 0),
+                   COALESCE(SUM(valor_liquido_vendedor), 0),
+                   COALESCE(SUM(comissao_plataforma), 0),
+                   CURRENT_TIMESTAMP
+            FROM transacoes
+            WHERE status IS NOT NULL
+            GROUP BY {coluna}, status
+        """)
+
+
+def downgrade():
+    with op.batch_alter_table('resumos_financeiros', schema=None) as batch_op:
+        batch_op.drop_index('idx_resumo_papel_status')
+
+    op.drop_table('resumos_financeiros')
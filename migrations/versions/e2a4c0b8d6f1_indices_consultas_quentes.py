@@ -0,0 +1,46 @@
+"""indices compostos e parcial para as consultas quentes de transacoes, safras e mensagens
+
+Revision ID: e2a4c0b8d6f1
+Revises: d1f3b9a7c5e0
+Create Date: 2026-10-17 22:14:37.902415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a4c0b8d6f1'
+down_revision = 'd1f3b9a7c5e0'
+branch_labels = None
+depends_on = None
+
+SAFRAS_A_VENDA = "status = 'disponivel' AND quantidade_disponivel > 0"
+
+
+def upgrade():
+    with op.batch_alter_table('transacoes', schema=None) as batch_op:
+        batch_op.create_index('idx_transacao_comprador_status_data',
+                              ['comprador_id', 'status', 'data_criacao'], unique=False)
+        batch_op.create_index('idx_transacao_vendedor_status_data',
+                              ['vendedor_id', 'status', 'data_criacao'], unique=False)
+        batch_op.create_index('idx_transacao_status_transferencia',
+                              ['status', 'transferencia_concluida'], unique=False)
+
+    op.create_index('idx_safra_vitrine', 'safras', ['data_criacao', 'id'], unique=False,
+                    postgresql_where=sa.text(SAFRAS_A_VENDA), sqlite_where=sa.text(SAFRAS_A_VENDA))
+
+    with op.batch_alter_table('mensagens', schema=None) as batch_op:
+        batch_op.create_index('idx_mensagem_transacao_envio', ['transacao_id', 'data_envio'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('mensagens', schema=None) as batch_op:
+        batch_op.drop_index('idx_mensagem_transacao_envio')
+
+    op.drop_index('idx_safra_vitrine', table_name='safras')
+
+    with op.batch_alter_table('transacoes', schema=None) as batch_op:
+        batch_op.drop_index('idx_transacao_status_transferencia')
+        batch_op.drop_index('idx_transacao_vendedor_status_data')
+        batch_op.drop_index('idx_transacao_comprador_status_data')
@@ -0,0 +1,53 @@
+"""jobs de relatorios assincronos
+
+Revision ID: e6a8c4b2d0f5
+Revises: d5f7b3a9c1e4
+Create Date: 2026-10-17 15:22:48.117305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a8c4b2d0f5'
+down_revision = 'd5f7b3a9c1e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('relatorio_jobs',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('tipo', sa.String(length=30), nullable=False),
+    sa.Column('parametros', sa.Text(), nullable=False),
+    sa.Column('chave', sa.String(length=64), nullable=False),
+    sa.Column('chave_ativa', sa.String(length=64), nullable=True),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('progresso', sa.Integer(), nullable=False),
+    sa.Column('linhas', sa.Integer(), nullable=True),
+    sa.Column('caminho', sa.String(length=255), nullable=True),
+    sa.Column('nome_ficheiro', sa.String(length=120), nullable=True),
+    sa.Column('erro', sa.String(length=255), nullable=True),
+    sa.Column('data_criacao', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('data_inicio', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('data_conclusao', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('expira_em', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuarios.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('chave_ativa')
+    )
+    with op.batch_alter_table('relatorio_jobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_relatorio_jobs_chave'), ['chave'], unique=False)
+        batch_op.create_index(batch_op.f('ix_relatorio_jobs_estado'), ['estado'], unique=False)
+        batch_op.create_index(batch_op.f('ix_relatorio_jobs_expira_em'), ['expira_em'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('relatorio_jobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_relatorio_jobs_expira_em'))
+        batch_op.drop_index(batch_op.f('ix_relatorio_jobs_estado'))
+        batch_op.drop_index(batch_op.f('ix_relatorio_jobs_chave'))
+
+    op.drop_table('relatorio_jobs')
@@ -0,0 +1,27 @@
+"""divergencias dos lotes de pagamento (vendas pagas pelo banco que mudaram de estado)
+
+Revision ID: f4b6d2e8a0c3
+Revises: e2a4c0b8d6f1
+Create Date: 2026-10-18 10:05:12.417733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b6d2e8a0c3'
+down_revision = 'e2a4c0b8d6f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('lotes_pagamento', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('quantidade_divergencias', sa.Integer(), nullable=False,
+                                      server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('lotes_pagamento', schema=None) as batch_op:
+        batch_op.drop_column('quantidade_divergencias')
@@ -0,0 +1,41 @@
+"""chaves de idempotencia
+
+Revision ID: f7b9d5c3e1a6
+Revises: e6a8c4b2d0f5
+Create Date: 2026-10-17 16:05:31.482190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b9d5c3e1a6'
+down_revision = 'e6a8c4b2d0f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chaves_idempotencia',
+    sa.Column('chave', sa.String(length=64), nullable=False),
+    sa.Column('usuario_id', sa.String(length=36), nullable=True),
+    sa.Column('endpoint', sa.String(length=120), nullable=False),
+    sa.Column('impressao', sa.String(length=64), nullable=False),
+    sa.Column('estado', sa.String(length=20), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('corpo', sa.Text(), nullable=True),
+    sa.Column('mimetype', sa.String(length=100), nullable=True),
+    sa.Column('data_criacao', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('expira_em', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('chave')
+    )
+    with op.batch_alter_table('chaves_idempotencia', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_chaves_idempotencia_expira_em'), ['expira_em'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('chaves_idempotencia', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_chaves_idempotencia_expira_em'))
+
+    op.drop_table('chaves_idempotencia')
@@ -21,6 +21,8 @@ def app():
         "SERVER_NAME": "localhost.localdomain", # Necessário para url_for funcionar sem request context
         "UPLOAD_FOLDER_PUBLIC": "/tmp/uploads/public",
         "UPLOAD_FOLDER_PRIVATE": "/tmp/uploads/private",
+        "FATURAS_PREGERAR": False,  # Sem threads de PDF a correr contra a BD em memória
+        "OUTBOX_DESPACHO_IMEDIATO": False,  # Os testes chamam o despachante explicitamente
     })
 
     with app.app_context():
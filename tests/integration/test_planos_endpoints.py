@@ -0,0 +1,185 @@
+"""
+Testes de Regressão dos Planos de Consulta dos Endpoints Quentes
+Semeia uma massa de dados grande, captura o SQL emitido por cada endpoint e
+verifica o número de instruções e a forma do plano de cada SELECT: sem
+varrimentos sequenciais nas tabelas grandes e sem nested loops explosivos.
+Uma alteração que transforme um index scan num seq scan (ou que volte a trazer
+um N+1) falha aqui.
+"""
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+from flask import g
+from flask_jwt_extended import create_access_token
+from flask_login.utils import _create_identifier
+from sqlalchemy import insert, text
+from werkzeug.security import generate_password_hash
+
+from app.extensions import db as _db
+from app.models import (Usuario, Provincia, Produto, Safra, Transacao, Mensagem, Notificacao,
+                        TransactionStatus, aware_utcnow)
+from app.services import plano_consultas
+
+PRODUTORES, COMPRADORES, PRODUTOS = 120, 300, 30
+SAFRAS, TRANSACOES, MENSAGENS = 2400, 6000, 3000
+
+TABELAS_GRANDES = {'usuarios', 'safras', 'transacoes', 'mensagens', 'notificacoes'}
+# Produto externo x interno estimado pelo PostgreSQL a partir do qual um nested loop é explosivo
+LIMITE_NESTED_LOOP = 1_000_000
+
+ESTADOS = [TransactionStatus.PENDENTE, TransactionStatus.AGUARDANDO_PAGAMENTO, TransactionStatus.ANALISE,
+           TransactionStatus.ESCROW, TransactionStatus.ENVIADO, TransactionStatus.ENTREGUE,
+           TransactionStatus.FINALIZADO, TransactionStatus.CANCELADO]
+
+
+@pytest.fixture(scope='module')
+def massa(app):
+    """Massa de dados partilhada pelo módulo (inserida em bloco, sem listeners do ORM)."""
+    agora = aware_utcnow()
+    senha = generate_password_hash('senha123')
+    provincia = Provincia(nome='Bié Planos')
+    _db.session.add(provincia)
+    _db.session.flush()
+    _db.session.execute(insert(Produto), [dict(nome=f'Produto Planos {i}', categoria='Grãos')
+                                          for i in range(PRODUTOS)])
+    _db.session.execute(insert(Usuario), [
+        dict(nome=f'Utilizador Planos {i}', telemovel=f'95{i:07d}', senha_hash=senha,
+             tipo='produtor' if i < PRODUTORES else 'comprador', provincia_id=provincia.id,
+             iban=f'AO06{i:021d}', perfil_completo=True, conta_validada=i % 7 != 0)
+        for i in range(PRODUTORES + COMPRADORES)])
+    admin = Usuario(nome='Admin Planos', telemovel='959999999', tipo='admin', senha_hash=senha)
+    _db.session.add(admin)
+    _db.session.flush()
+
+    produtores = [i for (i,) in _db.session.query(Usuario.id).filter(Usuario.tipo == 'produtor')
+                  .filter(Usuario.telemovel.like('95%')).order_by(Usuario.id)]
+    compradores = [i for (i,) in _db.session.query(Usuario.id).filter(Usuario.tipo == 'comprador')
+                   .filter(Usuario.telemovel.like('95%')).order_by(Usuario.id)]
+    produtos = [i for (i,) in _db.session.query(Produto.id).filter(Produto.nome.like('Produto Planos%'))]
+
+    _db.session.execute(insert(Safra), [
+        dict(produtor_id=produtores[i % PRODUTORES], produto_id=produtos[i % PRODUTOS],
+             quantidade_disponivel=Decimal(0 if i % 5 == 0 else 100), preco_por_unidade=Decimal('250'),
+             status='disponivel' if i % 4 else 'esgotado', data_criacao=agora - timedelta(minutes=i))
+        for i in range(SAFRAS)])
+    safras = _db.session.execute(text('SELECT id, produtor_id FROM safras ORDER BY id')).all()
+
+    _db.session.execute(insert(Transacao), [
+        dict(fatura_ref=f'PLN-{i:06d}', safra_id=safras[i % SAFRAS].id, vendedor_id=safras[i % SAFRAS].produtor_id,
+             comprador_id=compradores[i % COMPRADORES], quantidade_comprada=Decimal('2'),
+             valor_total_pago=Decimal('500.00'), comissao_plataforma=Decimal('25.00'),
+             valor_liquido_vendedor=Decimal('475.00'), status=ESTADOS[i % len(ESTADOS)],
+             transferencia_concluida=False, data_criacao=agora - timedelta(minutes=i))
+        for i in range(TRANSACOES)])
+    transacoes = _db.session.execute(text('SELECT id, comprador_id, vendedor_id FROM transacoes ORDER BY id')).all()
+    _db.session.execute(insert(Mensagem), [
+        dict(transacao_id=transacoes[i % 500].id, remetente_id=transacoes[i % 500].comprador_id,
+             destinatario_id=transacoes[i % 500].vendedor_id, conteudo='Olá', data_envio=agora - timedelta(seconds=i))
+        for i in range(MENSAGENS)])
+    _db.session.execute(insert(Notificacao), [
+        dict(usuario_id=compradores[i % COMPRADORES], mensagem='Aviso', lida=bool(i % 3), data_criacao=agora)
+        for i in range(MENSAGENS)])
+    _db.session.commit()
+    _db.session.execute(text('ANALYZE'))
+    _db.session.commit()
+
+    yield {'admin': admin, 'produtor': _db.session.get(Usuario, produtores[0]),
+           'comprador': _db.session.get(Usuario, compradores[0])}
+
+    _db.session.remove()
+    for tabela in reversed(_db.metadata.sorted_tables):
+        _db.session.execute(tabela.delete())
+    if _db.engine.dialect.name == 'sqlite':
+        # Sem estatísticas de uma massa que já não existe para os restantes testes
+        _db.session.execute(text('DROP TABLE IF EXISTS sqlite_stat1'))
+    _db.session.commit()
+
+
+@pytest.fixture(autouse=True)
+def sem_utilizador_em_cache():
+    # O contexto de app da sessão de testes partilha o `g` entre pedidos: sem isto o
+    # Flask-Login reutilizaria o utilizador do pedido anterior (também nos módulos seguintes)
+    g.pop('_login_user', None)
+    yield
+    g.pop('_login_user', None)
+
+
+def _cliente_sessao(app, usuario):
+    cliente = app.test_client()
+    with app.test_request_context(environ_base=cliente.environ_base):
+        identificador = _create_identifier()
+    with cliente.session_transaction() as sessao:
+        sessao.update(_user_id=usuario.get_id(), _fresh=True, _id=identificador)
+    return cliente
+
+
+def _pedir_jwt(app, usuario, url):
+    with app.test_request_context():
+        token = create_access_token(identity=str(usuario.id))
+    return app.test_client().get(url, headers={'Authorization': f'Bearer {token}'})
+
+
+def _executar(funcao):
+    """Corre o pedido e devolve (resposta, SELECTs capturados)."""
+    with plano_consultas.capturar() as instrucoes:
+        resposta = funcao()
+        resposta.get_data()  # consome respostas em streaming dentro da captura
+    selects = [(sql, p) for sql, p in instrucoes if sql.lstrip().upper().startswith(('SELECT', 'WITH'))]
+    return resposta, selects
+
+
+def _verificar_planos(selects, seq_scan_permitido=()):
+    for sql, parametros in selects:
+        plano = plano_consultas.explicar_sql(sql, parametros)
+        proibidos = (set(plano['seq_scans']) & TABELAS_GRANDES) - set(seq_scan_permitido)
+        assert not proibidos, f"Seq scan em {proibidos}:\n{sql}\n{plano['detalhe']}"
+        assert all(l <= LIMITE_NESTED_LOOP for l in plano['loops_aninhados']), plano['detalhe']
+
+
+# (nome, pedido, máximo de instruções SQL, tabelas onde o seq scan é o plano certo)
+CASOS = {
+    'api_safras_cursor': (lambda app, m: app.test_client().get('/api/v1/safras?cursor=&per_page=24'), 1, ()),
+    'api_safras_pagina': (lambda app, m: app.test_client().get('/api/v1/safras?page=3'), 2, ()),
+    'dashboard_produtor': (lambda app, m: _pedir_jwt(app, m['produtor'], '/api/dashboard/produtor'), 6, ()),
+    'dashboard_comprador': (lambda app, m: _pedir_jwt(app, m['comprador'], '/api/dashboard/comprador'), 5, ()),
+    'dashboard_admin': (lambda app, m: _pedir_jwt(app, m['admin'], '/api/dashboard/admin'), 6, ()),
+    'admin_tarefas': (lambda app, m: _cliente_sessao(app, m['admin']).get('/api/v1/admin/tarefas'), 4, ()),
+    # A exportação lê o período inteiro por ordem de id: o varrimento de transacoes é o plano certo,
+    # mas o vendedor tem de vir pela chave primária (sem scan de usuarios por linha)
+    'exportar_financeiro': (lambda app, m: _cliente_sessao(app, m['admin']).get(
+        '/admin/exportar-financeiro-agro?formato=csv'), 2, ('transacoes',)),
+}
+
+
+@pytest.mark.parametrize('nome', list(CASOS))
+def test_endpoint_quente(app, massa, nome):
+    pedido, maximo, permitido = CASOS[nome]
+    resposta, selects = _executar(lambda: pedido(app, massa))
+
+    assert resposta.status_code == 200, resposta.get_data(as_text=True)[:300]
+    assert len(selects) <= maximo, f"{nome}: {len(selects)} SELECTs (máximo {maximo})\n" + \
+        '\n'.join(sql for sql, _ in selects)
+    _verificar_planos(selects, permitido)
+
+
+def test_inbox_chat(app, massa):
+    # Só a query da vista: o template do inbox não faz parte deste teste
+    cliente = _cliente_sessao(app, massa['comprador'])
+    with patch('app.routes.chat.render_template', return_value='') as render:
+        resposta, selects = _executar(lambda: cliente.get('/chat/inbox'))
+
+    assert resposta.status_code == 200
+    assert len(render.call_args.kwargs['vendas']) == TRANSACOES // COMPRADORES
+    assert len(selects) <= 2
+    _verificar_planos(selects)
+
+
+def test_exportacao_em_numero_constante_de_instrucoes(app, massa):
+    """O número de SELECTs da exportação não cresce com as linhas (vendedor no mesmo SELECT)."""
+    cliente = _cliente_sessao(app, massa['admin'])
+    resposta, selects = _executar(lambda: cliente.get('/admin/exportar-financeiro-agro?formato=csv'))
+
+    assert resposta.get_data(as_text=True).count('\n') == TRANSACOES + 1
+    assert len(selects) <= 2
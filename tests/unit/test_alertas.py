@@ -0,0 +1,73 @@
+"""
+Testes Unitários do Motor de Alertas de Safras
+Testa o cruzamento das subscrições (produto, província, preço máximo) e a API.
+"""
+import pytest
+from decimal import Decimal
+
+from app.models import Usuario, Produto, Provincia, Safra, Notificacao, AlertaPreferencia
+from app.services.alerta_service import AlertaService, notificar_safra
+
+
+@pytest.fixture
+def partes(db):
+    luanda, huambo = Provincia(nome='Luanda Alertas'), Provincia(nome='Huambo Alertas')
+    produto, outro = Produto(nome='Tomate', categoria='Hortícolas'), Produto(nome='Cebola', categoria='Hortícolas')
+    db.session.add_all([luanda, huambo, produto, outro])
+    db.session.flush()
+    produtor = Usuario(nome='Produtor Alertas', telemovel='929100001', tipo='produtor', provincia_id=huambo.id)
+    compradores = [Usuario(nome=f'Comprador Alertas {i}', telemovel=f'92910001{i}', tipo='comprador')
+                   for i in range(6)]
+    for u in (produtor, *compradores):
+        u.senha = 'senha123'
+    db.session.add_all([produtor, *compradores])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('100'), preco_por_unidade=Decimal('300'))
+    db.session.add(safra)
+    db.session.commit()
+    return produtor, compradores, safra, produto, outro, luanda, huambo
+
+
+class TestCruzamento:
+
+    def test_filtros_de_provincia_e_preco(self, db, partes):
+        produtor, c, safra, produto, outro, luanda, huambo = partes
+        db.session.add_all([
+            AlertaPreferencia(usuario_id=c[0].id, produto_id=produto.id),  # qualquer província/preço
+            AlertaPreferencia(usuario_id=c[1].id, produto_id=produto.id, provincia_id=huambo.id),
+            AlertaPreferencia(usuario_id=c[2].id, produto_id=produto.id, preco_maximo=Decimal('300')),
+            AlertaPreferencia(usuario_id=c[3].id, produto_id=produto.id, provincia_id=luanda.id),  # outra província
+            AlertaPreferencia(usuario_id=c[4].id, produto_id=produto.id, preco_maximo=Decimal('250')),  # caro demais
+            AlertaPreferencia(usuario_id=c[5].id, produto_id=outro.id),  # outro produto
+            AlertaPreferencia(usuario_id=produtor.id, produto_id=produto.id),  # o próprio produtor
+            # Duas subscrições que casam para o mesmo utilizador: uma só notificação
+            AlertaPreferencia(usuario_id=c[0].id, produto_id=produto.id, provincia_id=huambo.id),
+        ])
+        db.session.commit()
+
+        gravadas = notificar_safra(safra.id, '/safra/x')
+        db.session.commit()
+
+        esperados = {c[0].id, c[1].id, c[2].id}
+        (mensagem, link), usuarios = next(iter(gravadas.items()))
+        assert set(usuarios) == esperados and link == '/safra/x'
+        assert 'Tomate em Huambo Alertas' in mensagem
+        assert {n.usuario_id for n in Notificacao.query.all()} == esperados
+        assert Notificacao.query.count() == 3
+
+    def test_safra_inexistente(self, db, partes):
+        assert notificar_safra(999999) == {}
+
+
+class TestSubscrever:
+
+    def test_nao_duplica_nem_aceita_preco_invalido(self, db, partes):
+        _, compradores, _, produto, _, luanda, _ = partes
+        ok, alerta, _ = AlertaService.subscrever(compradores[0].id, produto.id, luanda.id, '150.5')
+        ok2, repetido, _ = AlertaService.subscrever(compradores[0].id, produto.id, luanda.id, 150.50)
+
+        assert ok and ok2 and repetido.id == alerta.id
+        assert alerta.preco_maximo == Decimal('150.50')
+        assert not AlertaService.subscrever(compradores[0].id, produto.id, None, -1)[0]
+        assert not AlertaService.subscrever(compradores[0].id, 999999)[0]
@@ -0,0 +1,113 @@
+"""
+Testes Unitários do Cache Local (L1)
+Testa o LRU em processo e a sua integração com o CacheService.
+"""
+import json
+import pytest
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from app.services.cache_local import CacheLocalLRU, AUSENTE
+from app.services.cache_service import CacheService
+
+
+class TestCacheLocalLRU:
+    """Testes do LRU limitado por bytes e TTL."""
+
+    def test_get_set(self):
+        l1 = CacheLocalLRU()
+        l1.set('a', {'x': 1}, tamanho=10, ttl_segundos=60)
+        assert l1.get('a') == {'x': 1}
+        assert l1.get('b') is AUSENTE
+
+    def test_expiracao(self):
+        l1 = CacheLocalLRU()
+        with patch('app.services.cache_local.time.monotonic', return_value=1000.0):
+            l1.set('a', 1, tamanho=1, ttl_segundos=5)
+        with patch('app.services.cache_local.time.monotonic', return_value=1006.0):
+            assert l1.get('a') is AUSENTE
+        assert l1.estatisticas()['entradas'] == 0
+
+    def test_evicao_por_bytes_remove_menos_usada(self):
+        l1 = CacheLocalLRU(max_bytes=100)
+        l1.set('a', 'A', tamanho=40, ttl_segundos=60)
+        l1.set('b', 'B', tamanho=40, ttl_segundos=60)
+        l1.get('a')  # 'b' passa a ser a menos usada
+        l1.set('c', 'C', tamanho=40, ttl_segundos=60)
+
+        assert l1.get('b') is AUSENTE
+        assert l1.get('a') == 'A'
+        assert l1.estatisticas()['bytes'] == 80
+        assert l1.evictions == 1
+
+    def test_valor_maior_que_limite_nao_entra(self):
+        l1 = CacheLocalLRU(max_bytes=10)
+        l1.set('grande', 'x', tamanho=11, ttl_segundos=60)
+        assert l1.get('grande') is AUSENTE
+
+    def test_delete_pattern(self):
+        l1 = CacheLocalLRU()
+        for key in ('geo:provincias', 'geo:municipios:1', 'produtos:catalogo'):
+            l1.set(key, 1, tamanho=1, ttl_segundos=60)
+        assert l1.delete_pattern('geo:*') == 2
+        assert list(l1.keys()) == ['produtos:catalogo']
+
+    def test_estatisticas(self):
+        l1 = CacheLocalLRU()
+        l1.set('a', 1, tamanho=1, ttl_segundos=60)
+        l1.get('a')
+        l1.get('b')
+        stats = l1.estatisticas()
+        assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
+
+
+class TestCacheDoisNiveis:
+    """Testes do L1 à frente do Redis no CacheService."""
+
+    @pytest.fixture
+    def cache(self):
+        with patch('app.services.cache_service.redis') as mock_redis:
+            mock_redis.from_url.return_value = MagicMock()
+            cache = CacheService()
+            with patch.object(CacheService, '_l1_ativo', return_value=True):
+                yield cache
+
+    def test_segundo_get_nao_vai_ao_redis(self, cache):
+        cache.redis.get.return_value = json.dumps([{'id': 1, 'nome': 'Luanda'}])
+
+        assert cache.get('geo:provincias') == [{'id': 1, 'nome': 'Luanda'}]
+        assert cache.get('geo:provincias') == [{'id': 1, 'nome': 'Luanda'}]
+
+        cache.redis.get.assert_called_once()
+        stats = cache.estatisticas()
+        assert stats['l1']['hits'] == 1
+        assert stats['l2']['hits'] == 1
+
+    def test_chaves_fora_da_politica_nao_usam_l1(self, cache):
+        cache.redis.get.return_value = json.dumps({'id': 1})
+        cache.get('safra:1')
+        cache.get('safra:1')
+        assert cache.redis.get.call_count == 2
+
+    def test_set_guarda_forma_desserializada(self, cache):
+        from decimal import Decimal
+        cache.set('produtos:catalogo', [{'preco': Decimal('10.50')}], ttl=timedelta(minutes=5))
+        assert cache.get('produtos:catalogo') == [{'preco': '10.50'}]
+        cache.redis.get.assert_not_called()
+
+    def test_delete_difunde_invalidacao(self, cache):
+        cache.l1.set('geo:provincias', [], tamanho=2, ttl_segundos=60)
+
+        cache.delete('geo:provincias')
+
+        assert cache.l1.get('geo:provincias') is AUSENTE
+        canal, mensagem = cache.redis.publish.call_args[0]
+        assert canal == CacheService.CANAL_INVALIDACAO
+        assert json.loads(mensagem)['keys'] == ['geo:provincias']
+
+    def test_mensagem_de_outro_worker_limpa_l1(self, cache):
+        cache.l1.set('geo:provincias', [], tamanho=2, ttl_segundos=60)
+
+        cache._on_invalidacao({'data': json.dumps({'origem': 'outro:1', 'keys': ['geo:provincias']})})
+
+        assert cache.l1.get('geo:provincias') is AUSENTE
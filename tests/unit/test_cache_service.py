@@ -50,6 +50,19 @@ class TestCacheService:
         key = cache._key_safras_disponiveis(provincia_id=1, categoria_id=2)
         assert key == "safras:disponiveis:prov:1:cat:2"
     
+    def test_key_safras_disponiveis_com_pagina_e_ordenacao(self, cache):
+        """Testa que página, tamanho, ordenação e termo fazem parte da chave."""
+        key = cache._key_safras_disponiveis(provincia_id=1, page=2, per_page=12, sort='preco_asc')
+        assert key == "safras:disponiveis:prov:1:p:2:pp:12:sort:preco_asc"
+        
+        assert cache._key_safras_disponiveis(page=1, per_page=12) != \
+            cache._key_safras_disponiveis(page=2, per_page=12)
+        
+        # Termo normalizado e reduzido a hash
+        assert cache._key_safras_disponiveis(termo='Milho ') == \
+            cache._key_safras_disponiveis(termo='milho')
+        assert 'Milho' not in cache._key_safras_disponiveis(termo='Milho')
+    
     def test_serialize_decimal(self, cache):
         """Testa serialização de valores Decimal."""
         data = {
@@ -97,13 +110,14 @@ class TestCacheService:
         assert cache.exists("teste:key") is False
     
     def test_invalidate_pattern(self, cache, mock_redis):
-        """Testa invalidação em lote por padrão."""
-        mock_redis.keys.return_value = ['safra:1', 'safra:2', 'safra:3']
+        """Testa invalidação em lote por padrão (SCAN, nunca KEYS)."""
+        mock_redis.scan_iter.return_value = iter(['safra:1', 'safra:2', 'safra:3'])
         mock_redis.delete.return_value = 3
         
         count = cache.invalidate_pattern("safra:*")
         assert count == 3
-        mock_redis.keys.assert_called_once_with("safra:*")
+        mock_redis.scan_iter.assert_called_once_with(match="safra:*", count=500)
+        mock_redis.keys.assert_not_called()
     
     def test_cache_safra(self, cache, mock_redis):
         """Testa cache especifico de safra."""
@@ -115,9 +129,10 @@ class TestCacheService:
         
         cache.cache_safra(safra_data)
         
-        # Verificar que setex foi chamado
-        assert mock_redis.setex.called
-        args = mock_redis.setex.call_args
+        # Verificar que setex foi chamado (com as tags, no mesmo MULTI)
+        pipe = mock_redis.pipeline.return_value
+        assert pipe.setex.called
+        args = pipe.setex.call_args
         assert args is not None
         assert args[0][0] == "safra:123"
     
@@ -158,24 +173,80 @@ class TestCacheService:
         
         cache.cache_safras_disponiveis(safras, provincia_id=1)
         
-        # Verificar que setex foi chamado
-        assert mock_redis.setex.called
-        args = mock_redis.setex.call_args
+        # Verificar que setex foi chamado (com as tags, no mesmo MULTI)
+        pipe = mock_redis.pipeline.return_value
+        assert pipe.setex.called
+        args = pipe.setex.call_args
         assert args is not None
         assert args[0][0] == "safras:disponiveis:prov:1"
     
     def test_invalidate_safras_cache(self, cache, mock_redis):
         """Testa invalidação de todo cache de safras."""
-        mock_redis.keys.return_value = [
+        mock_redis.scan_iter.return_value = iter([
             'safras:disponiveis',
             'safras:disponiveis:prov:1',
             'safras:disponiveis:cat:2'
-        ]
+        ])
         mock_redis.delete.return_value = 3
         
         count = cache.invalidate_safras_cache()
         assert count == 3
     
+    def test_set_com_tags_regista_conjuntos(self, cache, mock_redis):
+        """Testa que set com tags adiciona a chave aos conjuntos de tags."""
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.return_value = [True, 1, True]
+        
+        assert cache.cache_safras_disponiveis([{'id': 1}], provincia_id=3) is True
+        
+        # Entrada e tag escritas no mesmo MULTI
+        mock_redis.pipeline.assert_called_once_with(transaction=True)
+        assert pipe.setex.call_args[0][0] == "safras:disponiveis:prov:3"
+        pipe.sadd.assert_called_once_with("tag:prov:3", "safras:disponiveis:prov:3")
+        mock_redis.setex.assert_not_called()
+    
+    def test_tags_vitrine(self, cache):
+        """Testa a tag da listagem conforme o filtro mais específico."""
+        assert cache.tags_vitrine() == ["vitrine"]
+        assert cache.tags_vitrine(categoria_id=2) == ["cat:2"]
+        assert cache.tags_vitrine(provincia_id=1, categoria_id=2) == ["prov:1"]
+    
+    def test_invalidate_tags(self, cache, mock_redis):
+        """Testa que só as entradas das tags são removidas, sem KEYS."""
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.side_effect = [
+            [{'safras:disponiveis'}, {'safras:disponiveis:cat:2', 'safras:disponiveis'}],
+            [2, 1, 2]
+        ]
+        
+        count = cache.invalidate_tags('vitrine', 'cat:2')
+        
+        assert count == 2
+        pipe.smembers.assert_any_call('tag:vitrine')
+        pipe.smembers.assert_any_call('tag:cat:2')
+        apagadas = set(pipe.delete.call_args_list[0][0])
+        assert apagadas == {'safras:disponiveis', 'safras:disponiveis:cat:2'}
+        # Só os membros lidos saem das tags; os conjuntos não são apagados
+        assert pipe.delete.call_count == 1
+        retiradas = {c[0][0]: set(c[0][1:]) for c in pipe.srem.call_args_list}
+        assert retiradas == {'tag:cat:2': {'safras:disponiveis'},
+                             'tag:vitrine': {'safras:disponiveis:cat:2', 'safras:disponiveis'}}
+        mock_redis.keys.assert_not_called()
+    
+    def test_invalidate_tags_sem_membros_muda_a_geracao(self, cache, mock_redis):
+        """Testa que a geração muda mesmo sem entradas (cálculo em curso ainda por guardar)."""
+        pipe = mock_redis.pipeline.return_value
+        pipe.execute.side_effect = [[set()], [1, True]]
+
+        assert cache.invalidate_tags('vitrine') == 0
+        pipe.incr.assert_called_once_with('gen:vitrine')
+        pipe.delete.assert_not_called()
+
+    def test_invalidate_tags_vazio(self, cache, mock_redis):
+        """Testa que sem tags não há chamadas ao Redis."""
+        assert cache.invalidate_tags() == 0
+        mock_redis.pipeline.assert_not_called()
+    
     def test_cached_decorator(self, cache, mock_redis):
         """Testa decorator de cache automático."""
         # Simular cache miss primeiro, depois hit
@@ -201,6 +272,83 @@ class TestCacheService:
         assert mock_redis.get.call_count == 2
 
 
+class TestGetOrCompute:
+    """Testa o recálculo protegido contra stampede."""
+    
+    @pytest.fixture
+    def cache(self):
+        with patch('app.services.cache_service.redis') as mock_redis:
+            mock_redis.from_url.return_value = MagicMock()
+            yield CacheService()
+    
+    @staticmethod
+    def _envelope(valor, fresco):
+        import time
+        return json.dumps({'v': valor, 'fresco_ate': time.time() + (60 if fresco else -1)})
+    
+    def test_valor_fresco_nao_recalcula(self, cache):
+        cache.redis.get.return_value = self._envelope({'a': 1}, fresco=True)
+        compute = Mock()
+        
+        assert cache.get_or_compute('k', compute) == {'a': 1}
+        compute.assert_not_called()
+        cache.redis.set.assert_not_called()
+    
+    def test_valor_expirado_com_lock_recalcula(self, cache):
+        cache.redis.get.return_value = self._envelope('antigo', fresco=False)
+        cache.redis.set.return_value = True
+        
+        assert cache.get_or_compute('k', lambda: 'novo', ttl=timedelta(minutes=1)) == 'novo'
+        
+        # Guardado com margem para servir valores antigos e lock libertado
+        chave, segundos, _ = cache.redis.setex.call_args[0]
+        assert chave == 'k'
+        assert segundos == 60 + int(CacheService.STALE_TTL.total_seconds())
+        cache.redis.eval.assert_called_once()
+    
+    def test_valor_expirado_sem_lock_serve_antigo(self, cache):
+        cache.redis.get.return_value = self._envelope('antigo', fresco=False)
+        cache.redis.set.return_value = None  # Outro worker tem o lock
+        compute = Mock()
+        
+        assert cache.get_or_compute('k', compute) == 'antigo'
+        compute.assert_not_called()
+    
+    def test_chave_fria_sem_lock_espera_pelo_valor(self, cache):
+        cache.redis.get.side_effect = [None, None, self._envelope('calculado', fresco=True)]
+        cache.redis.set.return_value = None
+        compute = Mock()
+        
+        assert cache.get_or_compute('k', compute) == 'calculado'
+        compute.assert_not_called()
+    
+    def test_guarda_so_se_as_tags_nao_foram_invalidadas(self, cache):
+        cache.redis.get.return_value = None
+        cache.redis.set.return_value = True
+        ordem = []
+        cache.redis.mget.side_effect = lambda chaves: ordem.append('geracoes') or ['4', None]
+
+        def compute():
+            ordem.append('compute')
+            return 'novo'
+
+        cache.redis.eval.side_effect = [0, 1]  # invalidada durante o cálculo; libertar o lock
+        assert cache.get_or_compute('k', compute, tags=['vitrine', 'cat:2']) == 'novo'
+
+        assert ordem == ['geracoes', 'compute']
+        cache.redis.mget.assert_called_once_with(['gen:vitrine', 'gen:cat:2'])
+        guardar = cache.redis.eval.call_args_list[0][0]
+        assert guardar[0] == CacheService._SCRIPT_GUARDAR_SE_GERACAO
+        assert guardar[1:6] == (5, 'k', 'gen:vitrine', 'gen:cat:2', 'tag:vitrine')
+        assert guardar[-2:] == ('4', '0')
+        cache.redis.setex.assert_not_called()
+
+    def test_redis_indisponivel_calcula_diretamente(self, cache):
+        cache.redis.get.side_effect = Exception("Redis connection error")
+        
+        assert cache.get_or_compute('k', lambda: 42) == 42
+
+
 class TestCacheServiceErrorHandling:
     """Testa tratamento de erros do CacheService."""
     
@@ -225,3 +373,56 @@ class TestCacheServiceErrorHandling:
         cache = CacheService()
         result = cache.set("teste:key", {'data': 'value'})
         assert result is False
+
+
+class TestInvalidacaoPorEventos:
+    """Testa que os commits emitem as tags certas para o cache."""
+    
+    @pytest.fixture
+    def invalidate_tags(self):
+        from app.services.cache_service import cache_service
+        with patch.object(cache_service, 'invalidate_tags') as mock_invalidate:
+            yield mock_invalidate
+    
+    @pytest.fixture
+    def safra(self, db, invalidate_tags):
+        from app.models import Usuario, Produto, Provincia, Safra
+        prov = Provincia(nome='Huíla')
+        db.session.add(prov)
+        db.session.flush()
+        produtor = Usuario(nome='Produtor Tags', telemovel='923444555', tipo='produtor', provincia_id=prov.id)
+        produtor.senha = 'senha123'
+        produto = Produto(nome='Batata', categoria='Tubérculos')
+        db.session.add_all([produtor, produto])
+        db.session.flush()
+        safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                      quantidade_disponivel=Decimal('50'), preco_por_unidade=Decimal('200'))
+        db.session.add(safra)
+        db.session.commit()
+        invalidate_tags.reset_mock()
+        return safra
+    
+    def test_alterar_stock_invalida_vitrine(self, db, safra, invalidate_tags):
+        safra.quantidade_disponivel = Decimal('40')
+        db.session.commit()
+        
+        tags = set(invalidate_tags.call_args[0])
+        assert tags == {
+            'vitrine', f'safra:{safra.id}',
+            f'cat:{safra.produto_id}', f'prov:{safra.produtor.provincia_id}'
+        }
+    
+    def test_rollback_nao_invalida(self, db, safra, invalidate_tags):
+        safra.quantidade_disponivel = Decimal('10')
+        db.session.flush()
+        db.session.rollback()
+        
+        invalidate_tags.assert_not_called()
+    
+    def test_renomear_produtor_invalida_as_suas_safras(self, db, safra, invalidate_tags):
+        safra.produtor.nome = 'Novo Nome'
+        db.session.commit()
+        
+        tags = set(invalidate_tags.call_args[0])
+        assert f'safra:{safra.id}' in tags
+        assert f'cat:{safra.produto_id}' in tags
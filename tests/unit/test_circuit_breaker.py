@@ -0,0 +1,144 @@
+"""
+Testes Unitários do Circuit Breaker
+Testa as transições de estado e a degradação do CacheService com o Redis em baixo.
+"""
+import pytest
+from unittest.mock import patch, MagicMock
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from app.utils.circuit_breaker import CircuitBreaker, FECHADO, ABERTO, MEIO_ABERTO
+from app.services.cache_service import CacheService
+
+
+class TestCircuitBreaker:
+    """Testes das transições fechado -> aberto -> meio-aberto -> fechado."""
+
+    def test_abre_apos_limite_de_falhas(self):
+        breaker = CircuitBreaker('teste', limite_falhas=3, tempo_reset=30)
+        for _ in range(2):
+            breaker.registar_falha()
+        assert breaker.estado == FECHADO
+
+        breaker.registar_falha()
+        assert breaker.estado == ABERTO
+        assert breaker.permitir() is False
+        assert breaker.rejeitadas == 1
+
+    def test_sucesso_reinicia_contagem(self):
+        breaker = CircuitBreaker('teste', limite_falhas=2)
+        breaker.registar_falha()
+        breaker.registar_sucesso()
+        breaker.registar_falha()
+        assert breaker.estado == FECHADO
+
+    def test_meio_aberto_deixa_passar_uma_unica_sonda(self):
+        breaker = CircuitBreaker('teste', limite_falhas=1, tempo_reset=10)
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=100.0):
+            breaker.registar_falha()
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=111.0):
+            assert breaker.estado == MEIO_ABERTO
+            assert breaker.permitir() is True
+            assert breaker.permitir() is False
+
+            breaker.registar_sucesso()
+        assert breaker.estado == FECHADO
+
+    def test_sonda_falhada_reabre(self):
+        breaker = CircuitBreaker('teste', limite_falhas=1, tempo_reset=10)
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=100.0):
+            breaker.registar_falha()
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=111.0):
+            assert breaker.permitir() is True
+            breaker.registar_falha()
+            assert breaker.permitir() is False
+
+    def test_ao_fechar_so_na_recuperacao(self):
+        recuperado = MagicMock()
+        breaker = CircuitBreaker('teste', limite_falhas=1, tempo_reset=10, ao_fechar=recuperado)
+        breaker.registar_sucesso()
+        recuperado.assert_not_called()
+
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=100.0):
+            breaker.registar_falha()
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=111.0):
+            assert breaker.permitir() is True
+            breaker.registar_sucesso()
+            breaker.registar_sucesso()
+        recuperado.assert_called_once()
+
+
+class TestCacheServiceDegradado:
+    """Com o circuito aberto o CacheService não toca no Redis."""
+
+    @pytest.fixture
+    def cache(self):
+        with patch('app.services.cache_service.redis') as mock_redis:
+            redis_instance = MagicMock()
+            redis_instance.get.side_effect = RedisConnectionError("Connection refused")
+            mock_redis.from_url.return_value = redis_instance
+            yield CacheService()
+
+    def test_falhas_de_ligacao_abrem_o_circuito(self, cache):
+        for _ in range(cache.breaker.limite_falhas):
+            assert cache.get('k') is None
+        assert cache.breaker.estado == ABERTO
+
+        cache.redis.get.reset_mock()
+        assert cache.get('k') is None
+        assert cache.set('k', 1) is False
+        cache.redis.get.assert_not_called()
+        cache.redis.setex.assert_not_called()
+
+    def test_get_or_compute_com_circuito_aberto_calcula(self, cache):
+        for _ in range(cache.breaker.limite_falhas):
+            cache.breaker.registar_falha()
+
+        assert cache.get_or_compute('k', lambda: 42) == 42
+        cache.redis.set.assert_not_called()
+
+    def test_erro_que_nao_e_de_ligacao_nao_abre(self, cache):
+        cache.redis.get.side_effect = ValueError("resposta inesperada")
+        for _ in range(5):
+            cache.get('k')
+        assert cache.breaker.estado == FECHADO
+
+    def test_ping_com_circuito_aberto_nao_contacta_redis(self, cache):
+        for _ in range(cache.breaker.limite_falhas):
+            cache.breaker.registar_falha()
+
+        assert cache.ping() is False
+        cache.redis.ping.assert_not_called()
+
+    def test_invalidacoes_com_circuito_aberto_repetidas_na_recuperacao(self, cache):
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=100.0):
+            for _ in range(cache.breaker.limite_falhas):
+                cache.breaker.registar_falha()
+            assert cache.invalidate_tags('vitrine', 'prov:1') == 0
+            assert cache.delete('safra:1') is False
+            assert cache.invalidate_pattern('stats:*') == 0
+        cache.redis.pipeline.assert_not_called()
+        cache.redis.delete.assert_not_called()
+
+        cache.redis.delete.return_value = 1
+        cache.redis.scan_iter.return_value = iter([])
+        with patch('app.utils.circuit_breaker.time.monotonic', return_value=200.0):
+            assert cache.ping() is True
+
+        pipe = cache.redis.pipeline.return_value
+        assert {c.args[0] for c in pipe.smembers.call_args_list} == {'tag:vitrine', 'tag:prov:1'}
+        cache.redis.delete.assert_called_once_with('safra:1')
+        cache.redis.scan_iter.assert_called_once_with(match='stats:*', count=500)
+
+        # Já repetidas: uma segunda recuperação não as volta a enviar
+        cache.redis.delete.reset_mock()
+        cache.breaker.registar_sucesso()
+        cache.redis.delete.assert_not_called()
+
+    def test_acima_do_limite_recupera_por_padrao(self, cache):
+        for _ in range(cache.breaker.limite_falhas):
+            cache.breaker.registar_falha()
+        with patch.object(CacheService, 'LIMITE_INVALIDACOES_ADIADAS', 2):
+            cache.invalidate_tags('a', 'b', 'c')
+
+        assert cache._adiadas['tags'] == set()
+        assert cache._adiadas['padroes'] == set(CacheService.PADROES_RECUPERACAO)
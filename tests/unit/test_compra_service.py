@@ -0,0 +1,99 @@
+"""
+Testes Unitários do Caminho Único de Compra
+Testa CompraService.iniciar_compra e a delegação das rotas/serviços de compra.
+"""
+import pytest
+from decimal import Decimal
+from flask_jwt_extended import create_access_token
+
+from app.models import (Usuario, Produto, Safra, Transacao, HistoricoStatus,
+                        Notificacao, LogAuditoria, TransactionStatus)
+from app.services.compra_service import CompraService
+from app.services.transaction_service import TransactionService
+
+
+@pytest.fixture
+def cenario(db):
+    produtor = Usuario(nome='Produtor Compras', telemovel='924111111', tipo='produtor')
+    comprador = Usuario(nome='Comprador Compras', telemovel='924111222', tipo='comprador',
+                        conta_validada=True, perfil_completo=True)
+    for u in (produtor, comprador):
+        u.senha = 'senha123'
+    produto = Produto(nome='Tomate', categoria='Hortícolas')
+    db.session.add_all([produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('20'), preco_por_unidade=Decimal('150'))
+    db.session.add(safra)
+    db.session.commit()
+    return produtor, comprador, safra
+
+
+class TestIniciarCompra:
+
+    def test_reserva_completa(self, db, cenario):
+        produtor, comprador, safra = cenario
+        ok, transacao, _ = CompraService.iniciar_compra(safra.id, comprador.id, '5', ip='10.0.0.1')
+
+        assert ok
+        assert transacao.valor_total_pago == Decimal('750.00')
+        assert transacao.comissao_plataforma == Decimal('37.50')
+        assert db.session.get(Safra, safra.id).quantidade_disponivel == Decimal('15')
+
+        historico = HistoricoStatus.query.filter_by(transacao_id=transacao.id).all()
+        assert [(h.status_anterior, h.status_novo) for h in historico] == [(None, TransactionStatus.PENDENTE)]
+
+        log = LogAuditoria.query.filter_by(usuario_id=comprador.id).one()
+        assert log.acao == 'COMPRA_INICIADA' and log.ip == '10.0.0.1'
+        assert Notificacao.query.filter_by(usuario_id=produtor.id).count() == 1
+
+    def test_ultima_unidade_esgota_safra(self, db, cenario):
+        _, comprador, safra = cenario
+        ok, _, _ = CompraService.iniciar_compra(safra.id, comprador.id, Decimal('20'))
+        assert ok
+        assert db.session.get(Safra, safra.id).status == 'esgotado'
+
+    def test_perfil_incompleto_recusado(self, db, cenario):
+        _, comprador, safra = cenario
+        comprador.perfil_completo = False
+        db.session.commit()
+
+        ok, _, mensagem = CompraService.iniciar_compra(safra.id, comprador.id, Decimal('1'))
+        assert not ok and 'perfil' in mensagem
+
+    def test_quantidade_invalida(self, db, cenario):
+        _, comprador, safra = cenario
+        for quantidade in ('abc', 'NaN', '-1'):
+            ok, _, _ = CompraService.iniciar_compra(safra.id, comprador.id, quantidade)
+            assert not ok
+        assert Transacao.query.count() == 0
+
+    @pytest.mark.parametrize('safra_id, esperado', [(999999, 404), (None, 400)])
+    def test_codigo_http_das_recusas(self, db, cenario, safra_id, esperado):
+        _, comprador, safra = cenario
+        ok, _, mensagem = CompraService.iniciar_compra(
+            safra_id or safra.id, comprador.id, Decimal('21'))
+        assert not ok
+        assert CompraService.codigo_http(mensagem) == esperado
+
+
+class TestDelegacao:
+
+    def test_transaction_service_usa_o_mesmo_caminho(self, db, cenario):
+        _, comprador, safra = cenario
+        ok, transacao = TransactionService.criar_reserva(safra.id, str(comprador.id), 2)
+
+        assert ok
+        assert HistoricoStatus.query.filter_by(transacao_id=transacao.id).count() == 1
+        assert LogAuditoria.query.filter_by(acao='COMPRA_API').count() == 1
+
+    def test_api_jwt_compra_pelo_servico(self, app, db, cenario):
+        _, comprador, safra = cenario
+        with app.test_request_context():
+            token = create_access_token(identity=str(comprador.id))
+
+        resposta = app.test_client().post('/api/market/buy', json={'safra_id': safra.id, 'quantidade': 3},
+                                          headers={'Authorization': f'Bearer {token}'})
+
+        assert resposta.status_code == 201
+        assert db.session.get(Safra, safra.id).quantidade_disponivel == Decimal('17')
@@ -0,0 +1,110 @@
+"""
+Testes Unitários do Motor de Exportação Financeira
+Testa filtros, o Excel em constant_memory e o CSV em streaming.
+"""
+import pytest
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import BytesIO
+
+from openpyxl import load_workbook
+from sqlalchemy import event
+
+from app.models import Usuario, Produto, Safra, Transacao, TransactionStatus
+from app.services import export_service
+
+
+@pytest.fixture
+def transacoes(db):
+    comprador = Usuario(nome='Comprador Export', telemovel='923555666', tipo='comprador')
+    comprador.senha = 'senha123'
+    produto = Produto(nome='Mandioca', categoria='Tubérculos')
+    db.session.add_all([comprador, produto])
+    criadas = []
+    for i, (status, dia) in enumerate([(TransactionStatus.FINALIZADO, 5),
+                                       (TransactionStatus.ESCROW, 10),
+                                       (TransactionStatus.FINALIZADO, 20)]):
+        produtor = Usuario(nome=f'Produtor {i}', telemovel=f'92400000{i}', tipo='produtor', iban=f'AO06{i}')
+        produtor.senha = 'senha123'
+        db.session.add(produtor)
+        db.session.flush()
+        safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                      quantidade_disponivel=Decimal('100'), preco_por_unidade=Decimal('100'))
+        db.session.add(safra)
+        db.session.flush()
+        transacao = Transacao(safra_id=safra.id, comprador_id=comprador.id, vendedor_id=produtor.id,
+                              quantidade_comprada=Decimal('1'), valor_total_pago=Decimal('1000.00'),
+                              status=status, data_criacao=datetime(2026, 3, dia, tzinfo=timezone.utc))
+        db.session.add(transacao)
+        criadas.append(transacao)
+    db.session.commit()
+    return criadas
+
+
+class TestFiltros:
+
+    def test_filtros_validos(self):
+        filtros, erro = export_service.validar_filtros(
+            {'data_inicio': '2026-03-01', 'data_fim': '2026-03-31', 'status': TransactionStatus.ESCROW})
+        assert erro is None
+        assert filtros['status'] == TransactionStatus.ESCROW
+        assert filtros['data_inicio'].day == 1
+
+    @pytest.mark.parametrize('args', [
+        {'data_inicio': '01/03/2026'},
+        {'data_inicio': '2026-04-01', 'data_fim': '2026-03-01'},
+        {'status': 'inexistente'},
+    ])
+    def test_filtros_invalidos(self, args):
+        filtros, erro = export_service.validar_filtros(args)
+        assert filtros == {} and erro
+
+    def test_filtra_por_periodo_e_status(self, db, transacoes):
+        filtros, _ = export_service.validar_filtros(
+            {'data_inicio': '2026-03-01', 'data_fim': '2026-03-10', 'status': TransactionStatus.FINALIZADO})
+        linhas = list(export_service.linhas_financeiras(**filtros))
+        assert [linha[0] for linha in linhas] == [f"AGK-{transacoes[0].id:06d}"]
+
+
+class TestExportacao:
+
+    def test_vendedor_carregado_sem_n_mais_1(self, db, transacoes):
+        db.session.expunge_all()
+        selects = []
+
+        def contar(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith('SELECT'):
+                selects.append(statement)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', contar)
+        try:
+            linhas = list(export_service.linhas_financeiras())
+        finally:
+            event.remove(engine, 'before_cursor_execute', contar)
+
+        assert len(linhas) == 3
+        assert len(selects) == 1
+
+    def test_excel(self, db, transacoes):
+        destino = BytesIO()
+        total = export_service.escrever_excel(destino)
+        assert total == 3
+
+        destino.seek(0)
+        folha = load_workbook(destino)['Dashboard_Financeiro']
+        assert folha['A6'].value == 'ID OPERAÇÃO'
+        assert folha['A7'].value == f"AGK-{transacoes[0].id:06d}"
+        assert folha['D7'].value == 'PRODUTOR 0'
+        assert folha['I7'].value == 950.0
+        assert folha['G3'].value.startswith('=SUM(G7:')
+
+    def test_csv_em_blocos(self, db, transacoes, monkeypatch):
+        monkeypatch.setattr(export_service, 'TAMANHO_LOTE', 2)
+        blocos = list(export_service.gerar_csv())
+
+        assert len(blocos) == 2
+        linhas = ''.join(blocos).lstrip('\ufeff').splitlines()
+        assert linhas[0].startswith('ID OPERAÇÃO;DATA VALOR')
+        assert len(linhas) == 4
+        assert linhas[1].split(';')[6:9] == ['1000.00', '50.00', '950.00']
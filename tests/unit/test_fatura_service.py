@@ -0,0 +1,156 @@
+"""
+Testes Unitários do Serviço de Faturas
+Testa o cache em disco dos PDFs, a memorização do QR code e a pré-geração ao entrar em ESCROW.
+"""
+import os
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+
+from app.models import Usuario, Produto, Safra, Transacao, TransactionStatus
+from app.services import fatura_service
+
+PDF_FALSO = b'%PDF-1.4 fatura'
+
+
+@pytest.fixture
+def pasta_privada(app, tmp_path):
+    anterior = app.config['UPLOAD_FOLDER_PRIVATE']
+    app.config['UPLOAD_FOLDER_PRIVATE'] = str(tmp_path)
+    yield tmp_path
+    app.config['UPLOAD_FOLDER_PRIVATE'] = anterior
+
+
+@pytest.fixture
+def gerar_pdf():
+    with patch.object(fatura_service, 'gerar_pdf_fatura', return_value=PDF_FALSO) as mock_gerar:
+        yield mock_gerar
+
+
+@pytest.fixture
+def venda(db):
+    produtor = Usuario(nome='Produtor Faturas', telemovel='923888111', tipo='produtor')
+    comprador = Usuario(nome='Comprador Faturas', telemovel='923888222', tipo='comprador')
+    for u in (produtor, comprador):
+        u.senha = 'senha123'
+    produto = Produto(nome='Feijão', categoria='Grãos')
+    db.session.add_all([produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('10'), preco_por_unidade=Decimal('400'))
+    db.session.add(safra)
+    db.session.flush()
+    transacao = Transacao(safra_id=safra.id, comprador_id=comprador.id, vendedor_id=produtor.id,
+                          quantidade_comprada=Decimal('2'), valor_total_pago=Decimal('800.00'),
+                          status=TransactionStatus.ANALISE)
+    db.session.add(transacao)
+    db.session.commit()
+    return transacao
+
+
+class TestCacheDisco:
+
+    def test_fatura_por_pagar_nao_vai_para_cache(self, db, venda, pasta_privada, gerar_pdf):
+        assert fatura_service.obter_pdf_fatura(venda) is None
+        gerar_pdf.assert_not_called()
+
+    def test_fatura_paga_gerada_uma_unica_vez(self, db, venda, pasta_privada, gerar_pdf):
+        venda.status = TransactionStatus.FINALIZADO
+        db.session.commit()
+
+        caminho = fatura_service.obter_pdf_fatura(venda)
+        outra_vez = fatura_service.obter_pdf_fatura(venda)
+
+        assert caminho == outra_vez
+        assert os.path.basename(caminho) == f"{venda.fatura_ref}-{fatura_service.hash_verificacao(venda)}.pdf"
+        with open(caminho, 'rb') as ficheiro:
+            assert ficheiro.read() == PDF_FALSO
+        gerar_pdf.assert_called_once()
+        assert not [f for f in os.listdir(os.path.dirname(caminho)) if f.endswith('.parcial')]
+
+    def test_alteracao_de_valor_muda_o_ficheiro(self, db, venda, pasta_privada, gerar_pdf):
+        venda.status = TransactionStatus.ESCROW
+        db.session.commit()
+        original = fatura_service.caminho_cache(venda)
+
+        venda.valor_total_pago = Decimal('900.00')
+        assert fatura_service.caminho_cache(venda) != original
+
+    def test_falha_do_motor_nao_deixa_ficheiro(self, db, venda, pasta_privada):
+        venda.status = TransactionStatus.ESCROW
+        db.session.commit()
+
+        with patch.object(fatura_service, 'gerar_pdf_fatura', side_effect=OSError('sem motor')):
+            assert fatura_service.pregerar_fatura(venda.id) is False
+        assert not os.path.exists(fatura_service.caminho_cache(venda))
+
+
+class TestQrCode:
+
+    def test_qr_memorizado_por_link(self, db, venda):
+        fatura_service._qr_png_base64.cache_clear()
+        primeiro = fatura_service.qr_code_base64(venda)
+        segundo = fatura_service.qr_code_base64(venda)
+
+        assert primeiro == segundo
+        assert fatura_service._qr_png_base64.cache_info().hits == 1
+
+
+class TestPreGeracao:
+
+    @pytest.fixture
+    def pregerar(self, app):
+        app.config['FATURAS_PREGERAR'] = True
+        with patch.object(fatura_service, 'motor_disponivel', return_value=True):
+            yield
+        app.config['FATURAS_PREGERAR'] = False
+
+    def test_entrada_em_escrow_agenda_fatura(self, db, venda, pregerar):
+        with patch.object(fatura_service, '_despachar') as despachar:
+            venda.mudar_status(TransactionStatus.ESCROW, "Pagamento validado")
+            db.session.commit()
+            despachar.assert_called_once_with({venda.id})
+
+            venda.status = TransactionStatus.ENVIADO
+            db.session.commit()
+            despachar.assert_called_once()
+
+    def test_rollback_nao_agenda(self, db, venda, pregerar):
+        with patch.object(fatura_service, '_despachar') as despachar:
+            venda.status = TransactionStatus.ESCROW
+            db.session.flush()
+            db.session.rollback()
+            db.session.commit()
+            despachar.assert_not_called()
+
+    def test_sem_motor_pdf_nao_agenda(self, app, db, venda):
+        app.config['FATURAS_PREGERAR'] = True
+        try:
+            with patch.object(fatura_service, 'motor_disponivel', return_value=False), \
+                    patch.object(fatura_service, '_despachar') as despachar:
+                venda.status = TransactionStatus.ESCROW
+                db.session.commit()
+                fatura_service.registar_escrow(db.session, [venda.id])
+                db.session.commit()
+        finally:
+            app.config['FATURAS_PREGERAR'] = False
+        despachar.assert_not_called()
+
+    def test_lote_numa_so_tarefa(self, app):
+        with patch('app.extensions.CELERY_AVAILABLE', True), \
+                patch('app.extensions.celery') as celery, \
+                patch('app.services.cache_service.cache_service.ping', return_value=True):
+            fatura_service._despachar({3, 1, 2})
+        celery.send_task.assert_called_once_with('tasks.pregerar_faturas', args=[[1, 2, 3]], ignore_result=True)
+
+    def test_sem_broker_um_so_thread_drena_a_fila(self, app):
+        with patch('app.extensions.CELERY_AVAILABLE', False), \
+                patch.object(fatura_service.threading, 'Thread') as thread, \
+                patch.object(fatura_service, 'pregerar_faturas') as pregerar_faturas:
+            fatura_service._despachar(range(1, 501))
+            fatura_service._despachar([600])
+            thread.assert_called_once()
+            fatura_service._drenar_fila(thread.call_args.kwargs['args'][0])
+
+        pregerar_faturas.assert_called_once_with(list(range(1, 501)) + [600])
+        assert not fatura_service._drenar_ativo and not fatura_service._fila_local
@@ -0,0 +1,99 @@
+"""
+Testes Unitários das Chaves de Idempotência
+Testa a repetição de POSTs com `Idempotency-Key` na compra da API de mercado.
+"""
+import pytest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from flask_jwt_extended import create_access_token
+
+from app.models import Usuario, Produto, Safra, Transacao, ChaveIdempotencia
+from app.services.compra_service import CompraService
+from app.services.idempotencia_service import IdempotenciaService
+
+
+@pytest.fixture
+def compra(app, db):
+    produtor = Usuario(nome='Produtor Idem', telemovel='925111111', tipo='produtor')
+    comprador = Usuario(nome='Comprador Idem', telemovel='925111222', tipo='comprador',
+                        conta_validada=True, perfil_completo=True)
+    for u in (produtor, comprador):
+        u.senha = 'senha123'
+    produto = Produto(nome='Feijão', categoria='Grãos')
+    db.session.add_all([produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('20'), preco_por_unidade=Decimal('100'))
+    db.session.add(safra)
+    db.session.commit()
+    with app.test_request_context():
+        token = create_access_token(identity=str(comprador.id))
+    cliente = app.test_client()
+
+    def comprar(chave, quantidade=2):
+        return cliente.post('/api/market/buy', json={'safra_id': safra.id, 'quantidade': quantidade},
+                            headers={'Authorization': f'Bearer {token}', 'Idempotency-Key': chave})
+    return safra, comprador, comprar
+
+
+class TestIdempotencia:
+
+    def test_repeticao_devolve_a_resposta_original(self, db, compra):
+        safra, _, comprar = compra
+        primeira = comprar('pedido-1')
+        repetida = comprar('pedido-1')
+
+        assert primeira.status_code == repetida.status_code == 201
+        assert repetida.get_json() == primeira.get_json()
+        assert repetida.headers['Idempotent-Replayed'] == 'true'
+        assert 'Idempotent-Replayed' not in primeira.headers
+        assert Transacao.query.count() == 1
+        assert db.session.get(Safra, safra.id).quantidade_disponivel == Decimal('18')
+
+    def test_chaves_diferentes_executam_de_novo(self, db, compra):
+        safra, _, comprar = compra
+        comprar('pedido-a')
+        comprar('pedido-b')
+        assert Transacao.query.count() == 2
+
+    def test_mesma_chave_com_outro_corpo(self, db, compra):
+        _, _, comprar = compra
+        comprar('pedido-2')
+        assert comprar('pedido-2', quantidade=5).status_code == 422
+        assert Transacao.query.count() == 1
+
+    def test_pedido_em_curso_devolve_409(self, app, db, compra):
+        safra, comprador, comprar = compra
+        agora = datetime.now(timezone.utc)
+        endpoint = 'POST /api/market/buy'
+        corpo = app.json.dumps({'safra_id': safra.id, 'quantidade': 2}).encode()
+        db.session.add(ChaveIdempotencia(
+            chave=IdempotenciaService.chave(str(comprador.id), endpoint, 'pedido-3'),
+            usuario_id=str(comprador.id), endpoint=endpoint,
+            impressao=IdempotenciaService.impressao(corpo), estado=ChaveIdempotencia.EM_CURSO,
+            data_criacao=agora, expira_em=agora + timedelta(hours=1)))
+        db.session.commit()
+
+        resposta = comprar('pedido-3')
+        assert resposta.status_code == 409
+        assert resposta.headers['Retry-After'] == '1'
+        assert Transacao.query.count() == 0
+
+    def test_erro_interno_liberta_a_chave(self, db, compra, monkeypatch):
+        safra, _, comprar = compra
+
+        def falha(*args, **kwargs):
+            raise RuntimeError('base de dados indisponível')
+        monkeypatch.setattr(CompraService, 'iniciar_compra', falha)
+        assert comprar('pedido-4').status_code == 500
+        assert ChaveIdempotencia.query.count() == 0
+
+        monkeypatch.undo()
+        assert comprar('pedido-4').status_code == 201
+
+    def test_limpar_expirados(self, db):
+        passado = datetime.now(timezone.utc) - timedelta(hours=1)
+        db.session.add(ChaveIdempotencia(chave='x' * 64, endpoint='POST /x', impressao='0' * 64,
+                                         estado=ChaveIdempotencia.CONCLUIDO, expira_em=passado))
+        db.session.commit()
+        assert IdempotenciaService.limpar_expirados() == 1
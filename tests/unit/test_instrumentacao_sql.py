@@ -0,0 +1,140 @@
+"""
+Testes Unitários da Instrumentação SQL por Pedido
+Testa a impressão digital das instruções, o header Server-Timing, a deteção de
+N+1 (com aviso no log) e o endpoint de administração com os piores endpoints.
+"""
+import logging
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from flask_login.utils import _create_identifier
+
+from app.models import Usuario, Produto, Safra, Transacao
+from app.services import instrumentacao_sql, plano_consultas
+
+
+@pytest.fixture(autouse=True)
+def agregado_limpo(app):
+    instrumentacao_sql.agregado.limpar()
+    g.pop('_login_user', None)  # `g` é partilhado pelo contexto de app da sessão de testes
+    yield
+    g.pop('_login_user', None)
+
+
+def _cliente_sessao(app, usuario):
+    cliente = app.test_client()
+    with app.test_request_context(environ_base=cliente.environ_base):
+        identificador = _create_identifier()
+    with cliente.session_transaction() as sessao:
+        sessao.update(_user_id=usuario.get_id(), _fresh=True, _id=identificador)
+    return cliente
+
+
+@pytest.fixture
+def vendas(db):
+    """Um produtor com uma venda a cada um de 6 compradores diferentes."""
+    produtor = Usuario(nome='Produtor Instrumentado', telemovel='929400001', tipo='produtor')
+    admin = Usuario(nome='Admin Instrumentado', telemovel='929400002', tipo='admin')
+    compradores = [Usuario(nome=f'Comprador {i}', telemovel=f'92941000{i}', tipo='comprador') for i in range(6)]
+    for u in (produtor, admin, *compradores):
+        u.senha = 'senha123'
+    produto = Produto(nome='Feijão Instrumentado', categoria='Grãos')
+    db.session.add_all([produtor, admin, produto, *compradores])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('100'), preco_por_unidade=Decimal('50'))
+    db.session.add(safra)
+    db.session.flush()
+    db.session.add_all([Transacao(safra_id=safra.id, comprador_id=c.id, vendedor_id=produtor.id,
+                                  quantidade_comprada=Decimal('1'), valor_total_pago=Decimal('50.00'))
+                        for c in compradores])
+    db.session.commit()
+    return produtor, admin
+
+
+def test_impressao_digital_ignora_parametros():
+    a = instrumentacao_sql.impressao_digital("SELECT *  FROM usuarios\nWHERE id IN (?, ?, ?) AND nome = 'Ana'")
+    b = instrumentacao_sql.impressao_digital("SELECT * FROM usuarios WHERE id IN (?) AND nome = 'O''Neil'")
+    c = instrumentacao_sql.impressao_digital("SELECT * FROM usuarios WHERE id IN (__[POSTCOMPILE_id_1]) "
+                                            "AND nome = 'x'")
+
+    assert a == b == c == "SELECT * FROM usuarios WHERE id IN (?) AND nome = ?"
+    assert instrumentacao_sql.impressao_digital("SELECT 1 LIMIT 20") == "SELECT ? LIMIT ?"
+
+
+def test_instrucao_que_falha_nao_fica_na_ligacao(app, db):
+    with app.test_request_context('/'):
+        instrumentacao_sql._iniciar_pedido()
+        try:
+            with pytest.raises(OperationalError):
+                db.session.execute(text('SELECT * FROM tabela_inexistente'))
+            db.session.rollback()
+            db.session.execute(text('SELECT 1'))
+            ligacao = db.session.connection()
+            medicao = g._medicao_sql
+        finally:
+            g.pop('_medicao_sql', None)
+
+    assert medicao.instrucoes == 1 and medicao.repeticoes == {'SELECT ?': 1}
+    assert not any(chave.startswith('_inicio') for chave in ligacao.info)
+    db.session.rollback()
+
+
+def test_server_timing(app, db):
+    with plano_consultas.capturar() as instrucoes:
+        resposta = app.test_client().get('/api/v1/safras')
+
+    assert resposta.status_code == 200
+    assert resposta.headers['Server-Timing'].startswith('db;dur=')
+    assert resposta.headers['Server-Timing'].endswith(f'desc="{len(instrucoes)} queries"')
+
+    app.config['SQL_SERVER_TIMING'] = False
+    try:
+        assert 'Server-Timing' not in app.test_client().get('/api/v1/safras').headers
+    finally:
+        app.config['SQL_SERVER_TIMING'] = True
+
+
+def test_deteta_n_mais_1(app, vendas, caplog):
+    produtor, _ = vendas
+    cliente = _cliente_sessao(app, produtor)
+
+    # Um template que mostra o comprador de cada conversa carrega-os um a um
+    def template(_, vendas):
+        return ', '.join(v.comprador.nome for v in vendas)
+
+    with patch('app.routes.chat.render_template', side_effect=template), \
+            caplog.at_level(logging.WARNING, logger=instrumentacao_sql.__name__):
+        assert cliente.get('/chat/inbox').status_code == 200
+
+    [linha] = instrumentacao_sql.agregado.piores()
+    assert linha['endpoint'] == 'chat.inbox' and linha['pedidos'] == 1
+    assert linha['pedidos_n_mais_1'] == 1
+    assert linha['exemplo_n_mais_1']['vezes'] == 6
+    assert linha['exemplo_n_mais_1']['sql'].startswith('SELECT ... FROM usuarios WHERE usuarios.id = ?')
+    assert 'Possível N+1 em chat.inbox: 6 x' in caplog.text
+
+
+def test_admin_lista_piores_endpoints(app, vendas):
+    produtor, admin = vendas
+    app.test_client().get('/api/v1/safras')
+    with patch('app.routes.chat.render_template', return_value=''):
+        _cliente_sessao(app, produtor).get('/chat/inbox')
+    g.pop('_login_user', None)
+    cliente = _cliente_sessao(app, admin)
+
+    resposta = cliente.get('/api/v1/admin/sql?ordem=n_mais_1')
+    invalida = cliente.get('/api/v1/admin/sql?ordem=outra')
+
+    assert resposta.status_code == 200
+    endpoints = [linha['endpoint'] for linha in resposta.get_json()['data']]
+    assert {'api.listar_safras', 'chat.inbox'} <= set(endpoints)
+    assert 'api.admin_sql_stats' not in endpoints  # o próprio pedido só conta no teardown
+    assert invalida.status_code == 400
+
+    g.pop('_login_user', None)
+    assert _cliente_sessao(app, produtor).get('/api/v1/admin/sql').status_code == 403
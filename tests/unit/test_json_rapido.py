@@ -0,0 +1,68 @@
+"""
+Testes Unitários do JSON rápido
+Testa a codificação de Decimal/datetime/dataclasses, o provider do Flask e o
+recurso ao json da biblioteca padrão quando o orjson não está instalado.
+"""
+import dataclasses
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from flask import jsonify
+
+from app.services.cache_service import CacheService
+from app.utils import json_rapido
+
+
+@dataclasses.dataclass
+class Resumo:
+    total: Decimal
+    data: datetime
+
+
+DADOS = {'valor': Decimal('1250.10'), 'quando': datetime(2026, 10, 17, 9, 30, tzinfo=timezone.utc),
+         'resumo': Resumo(Decimal('3.50'), datetime(2026, 1, 2, tzinfo=timezone.utc)), 'nome': 'Huíla'}
+
+
+@pytest.mark.parametrize('orjson_disponivel', [True, False])
+def test_tipos_nativos(orjson_disponivel):
+    with patch.object(json_rapido, 'ORJSON_AVAILABLE', orjson_disponivel and json_rapido.ORJSON_AVAILABLE):
+        numero = json.loads(json_rapido.dumps(DADOS))
+        texto = json.loads(json_rapido.dumps(DADOS, decimal_como=json_rapido.DECIMAL_TEXTO))
+
+    assert numero['valor'] == 1250.1 and texto['valor'] == '1250.10'
+    assert numero['quando'] == '2026-10-17T09:30:00+00:00'
+    assert texto['resumo'] == {'total': '3.50', 'data': '2026-01-02T00:00:00+00:00'}
+    assert numero['nome'] == 'Huíla'
+
+
+def test_tipo_desconhecido():
+    with pytest.raises(TypeError):
+        json_rapido.dumps({'x': object()})
+
+    class Qualquer:
+        def __str__(self):
+            return 'qualquer'
+    assert json_rapido.dumps({'x': Qualquer()}, estrito=False) == '{"x":"qualquer"}'
+
+
+def test_jsonify_usa_o_provider(app):
+    with app.test_request_context():
+        resposta = jsonify(DADOS)
+        app.config['JSON_DECIMAL_COMO'] = json_rapido.DECIMAL_TEXTO
+        try:
+            exata = jsonify(valor=Decimal('0.10'))
+        finally:
+            app.config['JSON_DECIMAL_COMO'] = json_rapido.DECIMAL_NUMERO
+
+    assert isinstance(app.json, json_rapido.JSONProviderRapido)
+    assert resposta.mimetype == 'application/json'
+    assert resposta.get_json()['valor'] == 1250.1
+    assert exata.get_json() == {'valor': '0.10'}
+
+
+def test_cache_preserva_decimal_exato():
+    serializado = CacheService._serialize({'preco': Decimal('199.90'), 'quando': DADOS['quando']})
+    assert CacheService._deserialize(serializado) == {'preco': '199.90', 'quando': '2026-10-17T09:30:00+00:00'}
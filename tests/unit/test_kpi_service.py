@@ -0,0 +1,127 @@
+"""
+Testes Unitários do Serviço de KPIs
+Testa a manutenção incremental do resumo financeiro e a reconciliação.
+"""
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+
+from sqlalchemy.exc import OperationalError
+
+from app.models import Usuario, Produto, Safra, Transacao, TransactionStatus, ResumoFinanceiro
+from app.services.kpi_service import KpiService
+
+
+@pytest.fixture
+def partes(db):
+    produtor = Usuario(nome='Produtor KPI', telemovel='923111222', tipo='produtor')
+    produtor.senha = 'senha123'
+    comprador = Usuario(nome='Comprador KPI', telemovel='923333444', tipo='comprador')
+    comprador.senha = 'senha123'
+    produto = Produto(nome='Feijão', categoria='Leguminosas')
+    db.session.add_all([produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('500'), preco_por_unidade=Decimal('100'))
+    db.session.add(safra)
+    db.session.commit()
+    return produtor, comprador, safra
+
+
+def _transacao(db, partes, valor, status=TransactionStatus.PENDENTE):
+    produtor, comprador, safra = partes
+    transacao = Transacao(safra_id=safra.id, comprador_id=comprador.id, vendedor_id=produtor.id,
+                          quantidade_comprada=Decimal('1'), valor_total_pago=Decimal(valor), status=status)
+    db.session.add(transacao)
+    db.session.commit()
+    return transacao
+
+
+class TestResumoIncremental:
+    """O resumo acompanha cada commit que cria ou muda transações."""
+
+    def test_mudanca_de_status_move_valores_entre_baldes(self, db, partes):
+        produtor, comprador, _ = partes
+        transacao = _transacao(db, partes, '1000.00')
+        assert KpiService.kpis_comprador(comprador.id) == {'total_gasto': Decimal('0.00'), 'compras_ativas': 1}
+
+        transacao.mudar_status(TransactionStatus.ESCROW)
+        db.session.commit()
+        assert KpiService.kpis_produtor(produtor.id)['em_custodia'] == Decimal('950.00')
+        assert KpiService.kpis_comprador(comprador.id)['total_gasto'] == Decimal('1000.00')
+
+        transacao.status = TransactionStatus.FINALIZADO
+        db.session.commit()
+        kpis = KpiService.kpis_produtor(produtor.id)
+        assert kpis == {'receita_total': Decimal('950.00'), 'em_custodia': Decimal('0.00'),
+                        'a_liquidar': Decimal('0.00')}
+        assert KpiService.kpis_comprador(comprador.id)['compras_ativas'] == 0
+        assert KpiService.kpis_plataforma()['comissao_total'] == Decimal('50.00')
+
+    def test_rollback_nao_altera_resumo(self, db, partes):
+        produtor, _, _ = partes
+        transacao = _transacao(db, partes, '200.00', TransactionStatus.ENTREGUE)
+
+        transacao.status = TransactionStatus.FINALIZADO
+        db.session.flush()
+        db.session.rollback()
+
+        assert KpiService.kpis_produtor(produtor.id)['a_liquidar'] == Decimal('190.00')
+        assert KpiService.kpis_produtor(produtor.id)['receita_total'] == Decimal('0.00')
+
+    def test_remover_transacao(self, db, partes):
+        produtor, _, _ = partes
+        transacao = _transacao(db, partes, '300.00', TransactionStatus.ENTREGUE)
+        db.session.delete(transacao)
+        db.session.commit()
+
+        assert KpiService.kpis_produtor(produtor.id)['a_liquidar'] == Decimal('0.00')
+
+
+class TestReconciliacao:
+    """A reconciliação deteta e corrige desvios face às transações."""
+
+    def test_sem_divergencias(self, db, partes):
+        _transacao(db, partes, '100.00')
+        _transacao(db, partes, '250.00', TransactionStatus.FINALIZADO)
+
+        assert KpiService.reconciliar()['divergencias'] == []
+
+    def test_corrige_linha_adulterada(self, db, partes):
+        produtor, _, _ = partes
+        _transacao(db, partes, '400.00', TransactionStatus.FINALIZADO)
+        db.session.execute(ResumoFinanceiro.__table__.update()
+                           .where(ResumoFinanceiro.papel == 'vendedor').values(valor_liquido=0))
+        db.session.commit()
+
+        resultado = KpiService.reconciliar(corrigir=True)
+        assert len(resultado['divergencias']) == 1
+        assert KpiService.kpis_produtor(produtor.id)['receita_total'] == Decimal('380.00')
+        assert KpiService.reconciliar()['divergencias'] == []
+
+    def test_leituras_no_mesmo_instantaneo(self, db, partes):
+        _transacao(db, partes, '100.00')
+        ligacoes = []
+        agregados, resumo = KpiService._agregados_reais, KpiService._resumo_guardado
+
+        def espiar(leitura):
+            def ler(conexao):
+                ligacoes.append((conexao, conexao.get_transaction()))
+                return leitura(conexao)
+            return ler
+
+        with patch.object(KpiService, '_agregados_reais', espiar(agregados)), \
+                patch.object(KpiService, '_resumo_guardado', espiar(resumo)):
+            assert KpiService.reconciliar()['divergencias'] == []
+
+        (ligacao, transacao), segunda = ligacoes
+        assert transacao is not None and segunda == (ligacao, transacao)
+
+    def test_repete_em_conflito_de_serializacao(self, db, partes):
+        _transacao(db, partes, '100.00')
+        conflito = OperationalError('UPDATE resumos_financeiros', {}, type('Erro', (Exception,), {'pgcode': '40001'})())
+        original = KpiService._reconciliar
+
+        with patch.object(KpiService, '_reconciliar', side_effect=[conflito, original(True)]) as reconciliar:
+            assert KpiService.reconciliar(corrigir=True)['divergencias'] == []
+        assert reconciliar.call_count == 2
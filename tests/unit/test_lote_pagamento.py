@@ -0,0 +1,179 @@
+"""
+Testes Unitários dos Lotes de Pagamento Bancário
+Testa a geração do lote, os ficheiros CSV/pain.001, a confirmação e o cancelamento.
+"""
+import pytest
+from decimal import Decimal
+from flask_login.utils import _create_identifier
+
+from app.models import Usuario, Produto, Safra, Transacao, LotePagamento, TransactionStatus
+from app.services.lote_pagamento_service import LotePagamentoService, RESULTADO_RECONCILIAR
+from app.services.maquina_estados import MaquinaEstados, TransacaoEmLotePagamento
+from app.services.pagamento_service import PagamentoService, LOTE_OK, LOTE_ESTADO_INVALIDO, LOTE_EM_PROCESSAMENTO
+
+
+@pytest.fixture
+def partes(db):
+    admin = Usuario(nome='Admin Banco', telemovel='928000000', tipo='admin')
+    produtores = [Usuario(nome=f'Produtor Banco {i}', telemovel=f'92800000{i + 1}', tipo='produtor',
+                          iban=f'AO06 0040 0000 1234 5678 9012 {i}', saldo_disponivel=Decimal('0.00'))
+                  for i in range(2)]
+    sem_iban = Usuario(nome='Produtor Sem IBAN', telemovel='928000008', tipo='produtor')
+    comprador = Usuario(nome='Comprador Banco', telemovel='928000009', tipo='comprador')
+    for u in (admin, comprador, sem_iban, *produtores):
+        u.senha = 'senha123'
+    produto = Produto(nome='Feijão', categoria='Grãos')
+    db.session.add_all([admin, comprador, sem_iban, produto, *produtores])
+    db.session.flush()
+    safras = [Safra(produtor_id=p.id, produto_id=produto.id, quantidade_disponivel=Decimal('100'),
+                    preco_por_unidade=Decimal('100')) for p in (*produtores, sem_iban)]
+    db.session.add_all(safras)
+    db.session.commit()
+    return admin, comprador, safras
+
+
+def _entregues(db, partes, por_produtor=2):
+    _, comprador, safras = partes
+    transacoes = [Transacao(safra_id=s.id, comprador_id=comprador.id, vendedor_id=s.produtor_id,
+                            quantidade_comprada=Decimal('1'), valor_total_pago=Decimal('1000.00'),
+                            status=TransactionStatus.ENTREGUE)
+                  for s in safras for _ in range(por_produtor)]
+    db.session.add_all(transacoes)
+    db.session.commit()
+    return [t.id for t in transacoes]
+
+
+class TestGerarLote:
+
+    def test_agrupa_por_produtor_e_ignora_sem_iban(self, db, partes):
+        admin, _, safras = partes
+        ids = _entregues(db, partes)
+
+        ok, lote, _ = LotePagamentoService.criar_lote(admin.id)
+
+        assert ok
+        assert (lote.quantidade_transacoes, lote.quantidade_beneficiarios) == (4, 2)
+        assert lote.valor_total == Decimal('3800.00')  # 4 x 950
+        sem_iban = Transacao.query.filter_by(vendedor_id=safras[2].produtor_id).all()
+        assert all(t.lote_pagamento_id is None for t in sem_iban)
+        assert Transacao.query.filter(Transacao.id.in_(ids), Transacao.lote_pagamento_id == lote.id).count() == 4
+
+    def test_sem_pendentes(self, db, partes):
+        ok, lote, _ = LotePagamentoService.criar_lote(partes[0].id)
+        assert not ok and lote is None
+        assert LotePagamento.query.count() == 0
+
+    def test_ficheiros_csv_e_pain001(self, db, partes):
+        _entregues(db, partes)
+        _, lote, _ = LotePagamentoService.criar_lote(partes[0].id)
+
+        linhas = ''.join(LotePagamentoService.gerar_csv(lote)).lstrip('\ufeff').splitlines()
+        assert len(linhas) == 3
+        assert 'AO06004000001234567890120' in linhas[1] and '1900.00' in linhas[1]
+
+        xml = ''.join(LotePagamentoService.gerar_pain001(lote))
+        assert xml.count('<CdtTrfTxInf>') == 2
+        assert '<NbOfTxs>2</NbOfTxs><CtrlSum>3800.00</CtrlSum>' in xml
+
+
+class TestFecharLote:
+
+    def test_confirmar_liquida_uma_so_vez(self, db, partes):
+        admin, _, safras = partes
+        _entregues(db, partes)
+        _, lote, _ = LotePagamentoService.criar_lote(admin.id)
+
+        ok, resultados, _ = LotePagamentoService.confirmar_lote(lote.id, admin.id)
+
+        assert ok and set(resultados.values()) == {LOTE_OK}
+        assert db.session.get(Usuario, safras[0].produtor_id).saldo_disponivel == Decimal('1900.00')
+        assert db.session.get(LotePagamento, lote.id).estado == LotePagamento.CONFIRMADO
+        ok, _, _ = LotePagamentoService.confirmar_lote(lote.id, admin.id)
+        assert not ok
+        assert db.session.get(Usuario, safras[0].produtor_id).saldo_disponivel == Decimal('1900.00')
+
+    def test_venda_que_mudou_de_estado_fica_no_lote_para_reconciliar(self, db, partes):
+        admin, _, safras = partes
+        ids = _entregues(db, partes)
+        _, lote, _ = LotePagamentoService.criar_lote(admin.id)
+        # Estado alterado por fora da máquina de estados (ex.: dados anteriores à regra do lote)
+        disputada = db.session.get(Transacao, ids[0])
+        disputada.status = TransactionStatus.DISPUTA
+        db.session.commit()
+
+        ok, resultados, mensagem = LotePagamentoService.confirmar_lote(lote.id, admin.id)
+
+        assert ok and resultados[ids[0]] == RESULTADO_RECONCILIAR
+        assert '1 para reconciliação manual' in mensagem
+        assert db.session.get(Transacao, ids[0]).lote_pagamento_id == lote.id  # o banco já a pagou
+        assert db.session.get(LotePagamento, lote.id).quantidade_divergencias == 1
+        assert [d['id'] for d in LotePagamentoService.divergencias(lote.id)] == [ids[0]]
+        # Não volta à fila: o próximo lote não a paga outra vez
+        disputada = db.session.get(Transacao, ids[0])
+        MaquinaEstados.transitar(disputada, TransactionStatus.ENTREGUE, "Disputa resolvida")
+        db.session.commit()
+        ok, _, _ = LotePagamentoService.criar_lote(admin.id)
+        assert not ok
+
+        ok, _ = LotePagamentoService.reconciliar_venda(lote.id, ids[0], admin.id)
+
+        reconciliada = db.session.get(Transacao, ids[0])
+        assert ok and reconciliada.status == TransactionStatus.FINALIZADO and reconciliada.transferencia_concluida
+        assert db.session.get(LotePagamento, lote.id).quantidade_divergencias == 0
+        assert LotePagamentoService.divergencias(lote.id) == []
+        assert db.session.get(Usuario, safras[0].produtor_id).saldo_disponivel == Decimal('1900.00')
+
+    def test_venda_no_lote_so_fecha_pelo_lote(self, db, partes):
+        admin, _, _ = partes
+        ids = _entregues(db, partes)
+        _, lote, _ = LotePagamentoService.criar_lote(admin.id)
+        venda = db.session.get(Transacao, ids[0])
+
+        for destino in (TransactionStatus.DISPUTA, TransactionStatus.FINALIZADO):
+            with pytest.raises(TransacaoEmLotePagamento):
+                MaquinaEstados.transitar(venda, destino)
+        no_lote = ids[:4]  # as do produtor sem IBAN ficaram fora
+        assert MaquinaEstados.transitar_em_lote(no_lote, TransactionStatus.ENTREGUE, TransactionStatus.DISPUTA) == []
+        assert db.session.get(Transacao, ids[0]).status == TransactionStatus.ENTREGUE
+
+    def test_liquidacao_individual_nao_toca_no_lote(self, db, partes):
+        admin, _, _ = partes
+        ids = _entregues(db, partes)
+        LotePagamentoService.criar_lote(admin.id)
+
+        _, resultados, _ = PagamentoService.processar_lote('liquidar', ids[:2], admin.id)
+
+        assert set(resultados.values()) == {LOTE_EM_PROCESSAMENTO}
+
+    def test_cancelar_devolve_a_fila(self, db, partes):
+        admin, _, _ = partes
+        _entregues(db, partes)
+        _, lote, _ = LotePagamentoService.criar_lote(admin.id)
+
+        ok, _ = LotePagamentoService.cancelar_lote(lote.id, admin.id)
+
+        assert ok
+        assert Transacao.query.filter(Transacao.lote_pagamento_id.isnot(None)).count() == 0
+        ok, novo, _ = LotePagamentoService.criar_lote(admin.id)
+        assert ok and novo.quantidade_transacoes == 4
+
+
+class TestApiLotePagamento:
+
+    def test_gerar_e_descarregar(self, app, db, partes):
+        admin, _, _ = partes
+        _entregues(db, partes, por_produtor=1)
+        cliente = app.test_client()
+        with app.test_request_context(environ_base=cliente.environ_base):
+            identificador = _create_identifier()
+        with cliente.session_transaction() as sessao:
+            sessao.update(_user_id=admin.get_id(), _fresh=True, _id=identificador)
+
+        resposta = cliente.post('/api/v1/admin/lotes-pagamento', json={})
+        assert resposta.status_code == 201
+        lote_id = resposta.get_json()['data']['id']
+
+        ficheiro = cliente.get(f'/api/v1/admin/lotes-pagamento/{lote_id}/ficheiro?formato=xml')
+        assert ficheiro.status_code == 200
+        assert b'pain.001.001.03' in ficheiro.data
+        assert cliente.get(f'/api/v1/admin/lotes-pagamento/{lote_id}/ficheiro?formato=pdf').status_code == 400
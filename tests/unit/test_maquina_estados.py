@@ -0,0 +1,131 @@
+"""
+Testes Unitários da Máquina de Estados das Transações
+Testa a validação das transições, o histórico, os eventos e as transições em lote.
+"""
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+
+from app.models import Usuario, Produto, Safra, Transacao, HistoricoStatus, TransactionStatus
+from app.services import fatura_service
+from app.services.kpi_service import KpiService
+from app.services.maquina_estados import MaquinaEstados, TransicaoInvalida, pode_transitar, transicao_estado
+
+
+@pytest.fixture
+def partes(db):
+    produtor = Usuario(nome='Produtor Estados', telemovel='926111111', tipo='produtor')
+    comprador = Usuario(nome='Comprador Estados', telemovel='926111222', tipo='comprador')
+    for u in (produtor, comprador):
+        u.senha = 'senha123'
+    produto = Produto(nome='Batata', categoria='Tubérculos')
+    db.session.add_all([produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('500'), preco_por_unidade=Decimal('100'))
+    db.session.add(safra)
+    db.session.commit()
+    return produtor, comprador, safra
+
+
+def _transacoes(db, partes, quantidade, status=TransactionStatus.ANALISE):
+    produtor, comprador, safra = partes
+    transacoes = [Transacao(safra_id=safra.id, comprador_id=comprador.id, vendedor_id=produtor.id,
+                            quantidade_comprada=Decimal('1'), valor_total_pago=Decimal('100.00'), status=status)
+                  for _ in range(quantidade)]
+    db.session.add_all(transacoes)
+    db.session.commit()
+    return transacoes
+
+
+class TestTransitar:
+
+    def test_tabela_de_transicoes(self):
+        assert pode_transitar(TransactionStatus.ANALISE, TransactionStatus.ESCROW)
+        assert not pode_transitar(TransactionStatus.PENDENTE, TransactionStatus.ESCROW)
+        assert not pode_transitar(TransactionStatus.FINALIZADO, TransactionStatus.DISPUTA)
+
+    def test_grava_historico_e_carimbo(self, db, partes):
+        transacao, = _transacoes(db, partes, 1)
+        MaquinaEstados.transitar(transacao, TransactionStatus.ESCROW, "Pagamento validado")
+        db.session.commit()
+
+        historico = HistoricoStatus.query.filter_by(transacao_id=transacao.id).one()
+        assert (historico.status_anterior, historico.status_novo) == (TransactionStatus.ANALISE,
+                                                                      TransactionStatus.ESCROW)
+        assert transacao.data_pagamento_escrow is not None
+
+    def test_transicao_invalida(self, db, partes):
+        transacao, = _transacoes(db, partes, 1, TransactionStatus.PENDENTE)
+        with pytest.raises(TransicaoInvalida):
+            MaquinaEstados.transitar(transacao, TransactionStatus.FINALIZADO)
+        assert transacao.status == TransactionStatus.PENDENTE
+
+    def test_evento_so_depois_do_commit(self, db, partes):
+        a, b = _transacoes(db, partes, 2)
+        recebidos = []
+
+        def recetor(app, **dados):
+            recebidos.append(dados)
+
+        with transicao_estado.connected_to(recetor):
+            MaquinaEstados.transitar(a, TransactionStatus.ESCROW)
+            db.session.rollback()
+            MaquinaEstados.transitar(b, TransactionStatus.ESCROW)
+            assert recebidos == []
+            db.session.commit()
+
+        assert recebidos == [{'transacao_ids': [b.id], 'origem': TransactionStatus.ANALISE,
+                              'destino': TransactionStatus.ESCROW}]
+
+
+class TestTransitarEmLote:
+
+    def test_so_transita_as_elegiveis(self, db, partes):
+        transacoes = _transacoes(db, partes, 4)
+        outra, = _transacoes(db, partes, 1, TransactionStatus.PENDENTE)
+        carregada = transacoes[0]
+
+        ids = MaquinaEstados.transitar_em_lote([t.id for t in transacoes] + [outra.id, 999999],
+                                               TransactionStatus.ANALISE, TransactionStatus.ESCROW,
+                                               "Validação em lote")
+        db.session.commit()
+
+        assert ids == sorted(t.id for t in transacoes)
+        assert carregada.status == TransactionStatus.ESCROW
+        assert carregada.data_pagamento_escrow is not None
+        assert db.session.get(Transacao, outra.id).status == TransactionStatus.PENDENTE
+        assert HistoricoStatus.query.filter_by(status_novo=TransactionStatus.ESCROW).count() == 4
+
+    def test_kpis_acompanham_o_update_em_massa(self, db, partes):
+        produtor, _, _ = partes
+        transacoes = _transacoes(db, partes, 3)
+
+        MaquinaEstados.transitar_em_lote([t.id for t in transacoes],
+                                         TransactionStatus.ANALISE, TransactionStatus.ESCROW)
+        db.session.commit()
+
+        assert KpiService.kpis_produtor(produtor.id)['em_custodia'] == Decimal('285.00')
+        assert KpiService.reconciliar()['divergencias'] == []
+
+    def test_agenda_faturas_e_evento(self, app, db, partes):
+        transacoes = _transacoes(db, partes, 2)
+        ids = [t.id for t in transacoes]
+        recebidos = []
+
+        app.config['FATURAS_PREGERAR'] = True
+        try:
+            with patch.object(fatura_service, '_despachar') as despachar, \
+                    patch.object(fatura_service, 'motor_disponivel', return_value=True), \
+                    transicao_estado.connected_to(lambda app, **dados: recebidos.append(dados)):
+                MaquinaEstados.transitar_em_lote(ids, TransactionStatus.ANALISE, TransactionStatus.ESCROW)
+                db.session.commit()
+        finally:
+            app.config['FATURAS_PREGERAR'] = False
+
+        despachar.assert_called_once_with(set(ids))  # uma tarefa para o lote inteiro
+        assert recebidos[0]['transacao_ids'] == ids
+
+    def test_transicao_invalida_em_lote(self, db, partes):
+        with pytest.raises(TransicaoInvalida):
+            MaquinaEstados.transitar_em_lote([1], TransactionStatus.PENDENTE, TransactionStatus.FINALIZADO)
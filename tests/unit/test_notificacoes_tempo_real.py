@@ -0,0 +1,212 @@
+"""
+Testes Unitários das Notificações em Tempo Real
+Testa o contador de não lidas mantido em Redis depois do commit, a cache das
+últimas notificações, a publicação para o stream SSE e a degradação para
+COUNT quando o Redis falta.
+"""
+import json
+import pytest
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+from flask_login.utils import _create_identifier
+
+from app.models import Usuario, Notificacao
+from app.services import notificacao_service
+from app.services.cache_service import cache_service
+from app.utils.circuit_breaker import CircuitBreaker
+
+
+class RedisFalso:
+    """O mínimo de Redis usado pelas notificações: get/set/setex/delete, pipeline de eval e publish."""
+
+    def __init__(self):
+        self.dados = {}
+        self.publicadas = []
+
+    def get(self, key):
+        return self.dados.get(key)
+
+    def set(self, key, valor, ex=None, nx=False):
+        if nx and key in self.dados:
+            return None
+        self.dados[key] = str(valor)
+        return True
+
+    def setex(self, key, segundos, valor):
+        self.dados[key] = valor
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.dados.pop(key, None) is not None)
+
+    def pipeline(self, transaction=False):
+        return PipelineFalso(self)
+
+    def eval(self, script, numkeys, key, delta):
+        if key not in self.dados:
+            return None
+        valor = int(self.dados[key]) + int(delta)
+        if valor < 0:
+            del self.dados[key]
+            return None
+        self.dados[key] = str(valor)
+        return valor
+
+    def publish(self, canal, mensagem):
+        self.publicadas.append((canal, json.loads(mensagem)))
+        return 0
+
+
+class PipelineFalso:
+
+    def __init__(self, redis):
+        self.redis, self.comandos = redis, []
+
+    def __getattr__(self, nome):
+        return lambda *args, **kwargs: self.comandos.append((nome, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.redis, nome)(*args, **kwargs) for nome, args, kwargs in self.comandos]
+
+
+@pytest.fixture
+def redis_falso():
+    falso = RedisFalso()
+    with patch.object(cache_service, 'redis', falso), \
+            patch.object(cache_service, 'breaker', CircuitBreaker('teste-notificacoes')):
+        yield falso
+
+
+@pytest.fixture
+def utilizador(db):
+    u = Usuario(nome='Comprador Sininho', telemovel='929200001', tipo='comprador')
+    u.senha = 'senha123'
+    db.session.add(u)
+    db.session.commit()
+    return u
+
+
+class TestContador:
+
+    def test_contador_mantido_por_deltas(self, db, utilizador, redis_falso):
+        chave = notificacao_service.CHAVE_CONTADOR.format(utilizador.id)
+        assert utilizador.notificacoes_nao_lidas() == 0  # COUNT inicial semeia o Redis
+        assert redis_falso.dados[chave] == '0'
+
+        db.session.add_all([Notificacao(usuario_id=utilizador.id, mensagem=f'Aviso {i}') for i in range(2)])
+        db.session.commit()
+
+        assert redis_falso.dados[chave] == '2'
+        canal, dados = redis_falso.publicadas[-1]
+        assert canal == notificacao_service.CANAL.format(utilizador.id)
+        assert dados == {'tipo': 'nova', 'mensagem': 'Aviso 1', 'link': None, 'nao_lidas': 2}
+
+        with patch.object(Notificacao, 'query') as query:
+            assert utilizador.notificacoes_nao_lidas() == 2
+        query.filter_by.assert_not_called()
+
+    def test_marcar_lidas_zera(self, db, utilizador, redis_falso):
+        db.session.add(Notificacao(usuario_id=utilizador.id, mensagem='Aviso'))
+        db.session.commit()
+        utilizador.notificacoes_nao_lidas()
+
+        Notificacao.query.filter_by(usuario_id=utilizador.id).update({'lida': True})
+        notificacao_service.registar_lidas(db.session, utilizador.id)
+        db.session.commit()
+
+        assert utilizador.notificacoes_nao_lidas() == 0
+        assert redis_falso.publicadas[-1][1] == {'tipo': 'lidas', 'nao_lidas': 0}
+
+    def test_rollback_descarta_efeitos(self, db, utilizador, redis_falso):
+        utilizador.notificacoes_nao_lidas()
+        db.session.add(Notificacao(usuario_id=utilizador.id, mensagem='Descartada'))
+        db.session.flush()
+        db.session.rollback()
+
+        assert utilizador.notificacoes_nao_lidas() == 0
+        assert redis_falso.publicadas == []
+
+    def test_sem_redis_usa_count(self, db, utilizador):
+        db.session.add(Notificacao(usuario_id=utilizador.id, mensagem='Aviso'))
+        db.session.commit()
+        with patch.object(cache_service, 'obter_contador', return_value=None):
+            assert utilizador.notificacoes_nao_lidas() == 1
+
+
+class TestUltimas:
+
+    def test_navbar_sem_queries_em_estado_estacionario(self, app, db, utilizador, redis_falso):
+        db.session.add_all([Notificacao(usuario_id=utilizador.id, mensagem=f'Aviso {i}') for i in range(7)])
+        db.session.commit()
+        utilizador.notificacoes_nao_lidas()
+        assert len(utilizador.ultimas_notificacoes()) == 5
+
+        instrucoes = []
+        contar = lambda *args: instrucoes.append(args[2])  # noqa: E731
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        try:
+            assert utilizador.notificacoes_nao_lidas() == 7
+            assert [n['mensagem'] for n in utilizador.ultimas_notificacoes()][0] == 'Aviso 6'
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', contar)
+        assert instrucoes == []
+
+    def test_commit_invalida_as_ultimas(self, db, utilizador, redis_falso):
+        db.session.add(Notificacao(usuario_id=utilizador.id, mensagem='Antiga'))
+        db.session.commit()
+        assert [n['lida'] for n in utilizador.ultimas_notificacoes()] == [False]
+
+        notificacao = Notificacao.query.one()
+        notificacao.lida = True
+        db.session.commit()
+        assert [n['lida'] for n in utilizador.ultimas_notificacoes()] == [True]
+
+        db.session.add(Notificacao(usuario_id=utilizador.id, mensagem='Nova'))
+        db.session.commit()
+        assert utilizador.ultimas_notificacoes()[0]['mensagem'] == 'Nova'
+
+
+def _cliente(app, utilizador):
+    cliente = app.test_client()
+    with app.test_request_context(environ_base=cliente.environ_base):
+        identificador = _create_identifier()
+    with cliente.session_transaction() as sessao:
+        sessao.update(_user_id=utilizador.get_id(), _fresh=True, _id=identificador)
+    return cliente
+
+
+class TestStream:
+
+    def test_stream_envia_contador(self, app, db, utilizador):
+        cliente = _cliente(app, utilizador)
+
+        app.config['NOTIFICACOES_SSE'] = True
+        try:
+            with patch.object(cache_service, 'subscrever', return_value=None):
+                resposta = cliente.get('/notificacoes/stream')
+        finally:
+            app.config['NOTIFICACOES_SSE'] = False
+
+        assert resposta.mimetype == 'text/event-stream'
+        corpo = resposta.get_data(as_text=True)
+        assert f'retry: {notificacao_service.RETRY_SEM_REDIS_MS}' in corpo
+        assert 'event: contador\ndata: {"nao_lidas": 0}' in corpo
+
+    def test_sem_sse_nao_prende_o_worker(self, app, db, utilizador, redis_falso):
+        # Workers síncronos: nem subscreve o canal, devolve o contador e fecha
+        db.session.add(Notificacao(usuario_id=utilizador.id, mensagem='Pagamento recebido', link='/x'))
+        db.session.commit()
+        cliente = _cliente(app, utilizador)
+
+        with patch.object(cache_service, 'subscrever') as subscrever:
+            corpo = cliente.get('/notificacoes/stream').get_data(as_text=True)
+        resumo = cliente.get('/notificacoes/resumo').get_json()
+        pagina = cliente.get('/').get_data(as_text=True)
+
+        subscrever.assert_not_called()
+        assert 'event: contador\ndata: {"nao_lidas": 1}' in corpo
+        assert resumo['nao_lidas'] == 1
+        assert [(n['mensagem'], n['link'], n['lida']) for n in resumo['ultimas']] == [('Pagamento recebido', '/x', False)]
+        assert 'EventSource' not in pagina and '/notificacoes/resumo' in pagina
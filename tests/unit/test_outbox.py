@@ -0,0 +1,132 @@
+"""
+Testes Unitários da Outbox de Notificações
+Testa a gravação dos eventos no commit do negócio e o despachante em lote.
+"""
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+
+from app.models import (Usuario, Produto, Safra, Transacao, Notificacao, EventoOutbox, AlertaPreferencia,
+                        TransactionStatus)
+from app.services import outbox_service
+from app.services.outbox_service import OutboxService, MAX_TENTATIVAS
+
+
+@pytest.fixture
+def partes(db):
+    produtor = Usuario(nome='Produtor Outbox', telemovel='929000001', tipo='produtor')
+    comprador = Usuario(nome='Comprador Outbox', telemovel='929000002', tipo='comprador')
+    interessados = [Usuario(nome=f'Interessado {i}', telemovel=f'92900001{i}', tipo='comprador')
+                    for i in range(3)]
+    for u in (produtor, comprador, *interessados):
+        u.senha = 'senha123'
+    produto = Produto(nome='Mandioca', categoria='Tubérculos')
+    db.session.add_all([produtor, comprador, produto, *interessados])
+    db.session.flush()
+    db.session.add_all([AlertaPreferencia(usuario_id=u.id, produto_id=produto.id)
+                        for u in (produtor, *interessados)])
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('100'), preco_por_unidade=Decimal('100'))
+    db.session.add(safra)
+    db.session.flush()
+    transacao = Transacao(safra_id=safra.id, comprador_id=comprador.id, vendedor_id=produtor.id,
+                          quantidade_comprada=Decimal('1'), valor_total_pago=Decimal('100.00'),
+                          status=TransactionStatus.ESCROW)
+    db.session.add(transacao)
+    db.session.commit()
+    return produtor, comprador, interessados, safra, transacao
+
+
+class TestPublicar:
+
+    def test_evento_so_existe_com_o_commit(self, db, partes):
+        produtor, *_ = partes
+        outbox_service.notificar([produtor.id], "Descartada")
+        db.session.rollback()
+        outbox_service.notificar([produtor.id], "Gravada")
+        db.session.commit()
+
+        assert [e.tipo for e in EventoOutbox.query.all()] == [outbox_service.NOTIFICACAO]
+        assert Notificacao.query.count() == 0  # só depois do despachante
+
+    def test_commit_acorda_o_despachante(self, app, db, partes):
+        app.config['OUTBOX_DESPACHO_IMEDIATO'] = True
+        try:
+            with patch.object(outbox_service, '_acordar_despachante') as acordar:
+                outbox_service.notificar([partes[0].id], "Olá")
+                db.session.commit()
+                db.session.commit()  # sem eventos novos não volta a acordar
+        finally:
+            app.config['OUTBOX_DESPACHO_IMEDIATO'] = False
+        assert acordar.call_count == 1
+
+
+class TestDespachar:
+
+    def test_safra_publicada_notifica_interessados(self, db, partes):
+        produtor, _, interessados, safra, _ = partes
+        outbox_service.publicar(outbox_service.SAFRA_PUBLICADA, {'safra_id': safra.id, 'link': '/safra/1'})
+        db.session.commit()
+
+        assert OutboxService.despachar_pendentes() == 1
+
+        destinatarios = {n.usuario_id for n in Notificacao.query.all()}
+        assert destinatarios == {u.id for u in interessados}  # o próprio produtor fica de fora
+        assert EventoOutbox.query.one().estado == EventoOutbox.PROCESSADO
+
+    def test_mensagens_chat_agrupadas_e_sem_repetir(self, db, partes):
+        produtor, comprador, _, _, transacao = partes
+        evento = {'transacao_id': transacao.id, 'remetente_id': comprador.id,
+                  'destinatario_id': produtor.id, 'link': f'/chat/{transacao.id}'}
+        for _ in range(3):
+            outbox_service.publicar(outbox_service.MENSAGEM_CHAT, evento)
+        db.session.commit()
+        OutboxService.despachar()
+
+        notificacao = Notificacao.query.one()
+        assert notificacao.mensagem.startswith('💬 3 novas mensagens de Comprador Outbox')
+
+        outbox_service.publicar(outbox_service.MENSAGEM_CHAT, evento)
+        db.session.commit()
+        OutboxService.despachar()
+        assert Notificacao.query.count() == 1  # ainda há uma por ler
+
+    def test_notificacoes_duplicadas_no_lote(self, db, partes):
+        produtor, comprador, *_ = partes
+        for _ in range(2):
+            outbox_service.notificar([produtor.id, comprador.id], "Manutenção às 22h")
+        db.session.commit()
+
+        OutboxService.despachar()
+
+        assert Notificacao.query.count() == 2
+
+    def test_falha_isolada_por_tipo(self, db, partes):
+        produtor, *_ = partes
+        outbox_service.publicar('tipo_desconhecido', {})
+        outbox_service.notificar([produtor.id], "Ok")
+        db.session.commit()
+
+        for _ in range(MAX_TENTATIVAS):
+            OutboxService.despachar()
+
+        estados = {e.tipo: e.estado for e in EventoOutbox.query.all()}
+        assert estados == {'tipo_desconhecido': EventoOutbox.FALHA,
+                           outbox_service.NOTIFICACAO: EventoOutbox.PROCESSADO}
+        assert Notificacao.query.count() == 1
+
+    def test_entrega_ao_microsservico(self, app, db, partes):
+        produtor, comprador, *_ = partes
+        outbox_service.notificar([produtor.id, comprador.id], "Nova funcionalidade")
+        db.session.commit()
+
+        app.config['NOTIFICATION_SERVICE_URL'] = 'http://notificacoes:5002'
+        try:
+            with patch.object(outbox_service.requests, 'post') as post:
+                OutboxService.despachar()
+        finally:
+            app.config['NOTIFICATION_SERVICE_URL'] = None
+
+        post.assert_called_once()
+        assert post.call_args.args[0] == 'http://notificacoes:5002/api/v1/notificacoes/broadcast'
+        assert sorted(post.call_args.kwargs['json']['usuarios_ids']) == sorted([produtor.id, comprador.id])
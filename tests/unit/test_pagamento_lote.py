@@ -0,0 +1,108 @@
+"""
+Testes Unitários do Processamento em Lote do Admin
+Testa a validação e a liquidação em lote (PagamentoService.processar_lote e a API).
+"""
+import pytest
+from decimal import Decimal
+from flask_login.utils import _create_identifier
+
+from app.models import (Usuario, Produto, Safra, Transacao, HistoricoStatus, Notificacao,
+                        LogAuditoria, TransactionStatus)
+from app.services.pagamento_service import (PagamentoService, LOTE_OK, LOTE_NAO_ENCONTRADA,
+                                            LOTE_ESTADO_INVALIDO, LIMITE_LOTE)
+
+
+@pytest.fixture
+def partes(db):
+    admin = Usuario(nome='Admin Lote', telemovel='927000000', tipo='admin')
+    produtores = [Usuario(nome=f'Produtor Lote {i}', telemovel=f'92700000{i + 1}', tipo='produtor',
+                          saldo_disponivel=Decimal('10.00')) for i in range(2)]
+    comprador = Usuario(nome='Comprador Lote', telemovel='927000009', tipo='comprador')
+    for u in (admin, comprador, *produtores):
+        u.senha = 'senha123'
+    produto = Produto(nome='Café', categoria='Grãos')
+    db.session.add_all([admin, comprador, produto, *produtores])
+    db.session.flush()
+    safras = [Safra(produtor_id=p.id, produto_id=produto.id, quantidade_disponivel=Decimal('100'),
+                    preco_por_unidade=Decimal('100')) for p in produtores]
+    db.session.add_all(safras)
+    db.session.commit()
+    return admin, comprador, safras
+
+
+def _transacoes(db, partes, status, por_produtor=2):
+    _, comprador, safras = partes
+    transacoes = [Transacao(safra_id=s.id, comprador_id=comprador.id, vendedor_id=s.produtor_id,
+                            quantidade_comprada=Decimal('1'), valor_total_pago=Decimal('1000.00'), status=status)
+                  for s in safras for _ in range(por_produtor)]
+    db.session.add_all(transacoes)
+    db.session.commit()
+    return [t.id for t in transacoes]
+
+
+class TestProcessarLote:
+
+    def test_validar_pagamentos(self, db, partes):
+        admin, _, _ = partes
+        ids = _transacoes(db, partes, TransactionStatus.ANALISE)
+        enviada = _transacoes(db, partes, TransactionStatus.ENVIADO, por_produtor=1)[0]
+
+        ok, resultados, _ = PagamentoService.processar_lote('validar', ids + [enviada, 999999], admin.id)
+
+        assert ok
+        assert [resultados[i] for i in ids] == [LOTE_OK] * 4
+        assert resultados[enviada] == LOTE_ESTADO_INVALIDO
+        assert resultados[999999] == LOTE_NAO_ENCONTRADA
+        assert Transacao.query.filter_by(status=TransactionStatus.ESCROW).count() == 4
+        assert HistoricoStatus.query.filter_by(status_novo=TransactionStatus.ESCROW).count() == 4
+        assert LogAuditoria.query.filter_by(acao='VALIDACAO_PAGAMENTO').count() == 4
+        assert Notificacao.query.count() == 4
+
+    def test_liquidar_agrega_saldo_por_produtor(self, db, partes):
+        admin, _, safras = partes
+        ids = _transacoes(db, partes, TransactionStatus.ENTREGUE)
+
+        ok, resultados, _ = PagamentoService.processar_lote('liquidar', ids, admin.id)
+
+        assert ok and set(resultados.values()) == {LOTE_OK}
+        for safra in safras:
+            produtor = db.session.get(Usuario, safra.produtor_id)
+            assert produtor.saldo_disponivel == Decimal('1910.00')  # 10 + 2 x 950
+            assert produtor.vendas_concluidas == 2
+        assert all(t.transferencia_concluida and t.data_liquidacao
+                   for t in Transacao.query.filter(Transacao.id.in_(ids)))
+
+    def test_repetir_lote_nao_paga_duas_vezes(self, db, partes):
+        admin, _, safras = partes
+        ids = _transacoes(db, partes, TransactionStatus.ENTREGUE)
+        PagamentoService.processar_lote('liquidar', ids, admin.id)
+
+        ok, resultados, _ = PagamentoService.processar_lote('liquidar', ids, admin.id)
+
+        assert ok and set(resultados.values()) == {LOTE_ESTADO_INVALIDO}
+        assert db.session.get(Usuario, safras[0].produtor_id).saldo_disponivel == Decimal('1910.00')
+
+    @pytest.mark.parametrize('acao, ids', [('apagar', [1]), ('validar', []),
+                                           ('validar', list(range(LIMITE_LOTE + 1)))])
+    def test_pedidos_invalidos(self, db, partes, acao, ids):
+        ok, _, _ = PagamentoService.processar_lote(acao, ids, partes[0].id)
+        assert not ok
+
+
+class TestApiLote:
+
+    def test_endpoint_devolve_resultado_por_id(self, app, db, partes):
+        admin, _, _ = partes
+        ids = _transacoes(db, partes, TransactionStatus.ANALISE, por_produtor=1)
+        cliente = app.test_client()
+        with app.test_request_context(environ_base=cliente.environ_base):
+            identificador = _create_identifier()
+        with cliente.session_transaction() as sessao:
+            sessao.update(_user_id=admin.get_id(), _fresh=True, _id=identificador)
+
+        resposta = cliente.post('/api/v1/admin/transacoes/lote', json={'acao': 'validar', 'ids': ids + [999999]})
+
+        assert resposta.status_code == 200
+        dados = resposta.get_json()['data']
+        assert dados['processadas'] == 2
+        assert dados['resultados']['999999'] == LOTE_NAO_ENCONTRADA
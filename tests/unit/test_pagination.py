@@ -0,0 +1,81 @@
+"""
+Testes Unitários da Paginação por Cursor
+Testa a codificação do cursor e a paginação keyset de safras.
+"""
+import pytest
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+
+from app.models import Usuario, Produto, Safra
+from app.utils.pagination import (
+    codificar_cursor, descodificar_cursor, paginar_por_cursor, CursorInvalido
+)
+
+
+class TestCursor:
+    """Testes do formato opaco do cursor."""
+
+    def test_ida_e_volta(self):
+        data = datetime(2026, 3, 1, 10, 30, tzinfo=timezone.utc)
+        assert descodificar_cursor(codificar_cursor(data, 42)) == (data, 42)
+
+    @pytest.mark.parametrize('cursor', ['lixo', 'W10', codificar_cursor(datetime(2026, 1, 1), 1)[:-3]])
+    def test_cursor_invalido(self, cursor):
+        with pytest.raises(CursorInvalido):
+            descodificar_cursor(cursor)
+
+
+class TestPaginarPorCursor:
+    """Testes da paginação keyset sobre Safra."""
+
+    @pytest.fixture
+    def safras(self, db):
+        produtor = Usuario(nome='Produtor Cursor', telemovel='923000555', tipo='produtor')
+        produtor.senha = 'senha123'
+        produto = Produto(nome='Tomate', categoria='Hortícolas')
+        db.session.add_all([produtor, produto])
+        db.session.flush()
+
+        base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        for i in range(7):
+            # Pares com a mesma data para validar o desempate por id
+            db.session.add(Safra(
+                produtor_id=produtor.id, produto_id=produto.id,
+                quantidade_disponivel=Decimal('10'), preco_por_unidade=Decimal('100'),
+                data_criacao=base + timedelta(days=i // 2)
+            ))
+        db.session.commit()
+        return Safra.query.filter_by(produtor_id=produtor.id)
+
+    def test_percorre_todas_as_paginas_sem_repetir(self, safras):
+        vistos = []
+        cursor = None
+        while True:
+            pagina = paginar_por_cursor(safras, Safra, cursor=cursor, per_page=3)
+            vistos.extend(s.id for s in pagina.items)
+            if not pagina.has_next:
+                break
+            cursor = pagina.next_cursor
+
+        esperados = [s.id for s in safras.order_by(Safra.data_criacao.desc(), Safra.id.desc())]
+        assert vistos == esperados
+        assert len(vistos) == 7
+
+    def test_ultima_pagina_sem_cursor(self, safras):
+        pagina = paginar_por_cursor(safras, Safra, per_page=10)
+        assert len(pagina.items) == 7
+        assert pagina.next_cursor is None
+
+    def test_total_opcional(self, safras):
+        assert paginar_por_cursor(safras, Safra, per_page=2).total is None
+
+        pagina = paginar_por_cursor(safras, Safra, per_page=2, total='exact')
+        assert pagina.total == 7
+        assert pagina.meta()['total'] == 7
+
+        # Sem PostgreSQL, o modo aproximado recorre à contagem exata
+        assert paginar_por_cursor(safras, Safra, per_page=2, total='approx').total == 7
+
+    def test_modo_total_invalido(self, safras):
+        with pytest.raises(ValueError):
+            paginar_por_cursor(safras, Safra, total='tudo')
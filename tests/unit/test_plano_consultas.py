@@ -0,0 +1,47 @@
+"""
+Testes Unitários da Verificação de Planos
+Testa a leitura dos planos (SQLite e JSON do PostgreSQL) e que nenhuma consulta
+quente lê uma tabela inteira com os índices atuais.
+"""
+from sqlalchemy import select
+
+from app.models import Usuario
+from app.services import plano_consultas
+
+
+def test_consultas_quentes_sem_varrimentos_sequenciais(db):
+    planos = plano_consultas.verificar()
+
+    assert {p['nome'] for p in planos} == set(plano_consultas.CONSULTAS_QUENTES)
+    assert [p['nome'] for p in planos if p['seq_scans']] == []
+    # O planner escolhe entre índices equivalentes; só se exige que use algum
+    assert all(p['indices'] for p in planos)
+    assert {p['nome']: p['indices'] for p in planos}['conversa_chat'] == ['idx_mensagem_transacao_envio']
+
+
+def test_deteta_varrimento_sequencial(db):
+    plano = plano_consultas.explicar(select(Usuario.id).where(Usuario.nome == 'Ninguém'))
+    assert plano['seq_scans'] == ['usuarios'] and plano['indices'] == []
+
+
+def test_plano_postgres():
+    plano = [{'Plan': {
+        'Node Type': 'Sort', 'Plan Rows': 40,
+        'Plans': [{'Node Type': 'Nested Loop', 'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'produtos'},
+            {'Node Type': 'Index Scan', 'Index Name': 'idx_safra_vitrine', 'Relation Name': 'safras'},
+        ]}],
+    }}]
+
+    resultado = plano_consultas._analisar_postgres(plano)
+
+    assert resultado['seq_scans'] == ['produtos']
+    assert resultado['indices'] == ['idx_safra_vitrine']
+    assert resultado['ordenacao'] and resultado['linhas_estimadas'] == 40
+
+
+def test_cli_estrito(app, db):
+    resultado = app.test_cli_runner().invoke(args=['indices', 'verificar', '--estrito'])
+
+    assert resultado.exit_code == 0, resultado.output
+    assert '0 consultas com varrimentos sequenciais' in resultado.output
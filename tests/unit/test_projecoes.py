@@ -0,0 +1,96 @@
+"""
+Testes Unitários das Projeções de Leitura
+Testa que as projeções produzem os mesmos dicts que os `to_dict` dos modelos e
+que as listas custam um número constante de queries, qualquer que seja o tamanho.
+"""
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from app.models import (Usuario, Produto, Provincia, Municipio, Safra, Transacao, TransactionStatus,
+                        aware_utcnow)
+from app.services import projecoes
+
+
+@pytest.fixture
+def partes(db):
+    provincia = Provincia(nome='Malanje Projeções')
+    produto = Produto(nome='Batata Doce', categoria='Tubérculos')
+    db.session.add_all([provincia, produto])
+    db.session.flush()
+    municipio = Municipio(nome='Cacuso', provincia_id=provincia.id)
+    db.session.add(municipio)
+    db.session.flush()
+    produtor = Usuario(nome='Produtor Projeções', telemovel='929300001', tipo='produtor',
+                       provincia_id=provincia.id, municipio_id=municipio.id)
+    sem_local = Usuario(nome='Produtor Sem Local', telemovel='929300002', tipo='produtor')
+    comprador = Usuario(nome='Comprador Projeções', telemovel='929300003', tipo='comprador')
+    for u in (produtor, sem_local, comprador):
+        u.senha = 'senha123'
+    db.session.add_all([produtor, sem_local, comprador])
+    db.session.flush()
+    safras = [Safra(produtor_id=p.id, produto_id=produto.id,
+                    quantidade_disponivel=Decimal('500'), preco_por_unidade=Decimal('120'))
+              for p in (produtor, sem_local)]
+    db.session.add_all(safras)
+    db.session.commit()
+    return produtor, comprador, safras
+
+
+def _comprar(db, safra, comprador, quantas):
+    for i in range(quantas):
+        db.session.add(Transacao(
+            safra_id=safra.id, comprador_id=comprador.id, vendedor_id=safra.produtor_id,
+            quantidade_comprada=Decimal('2'), valor_total_pago=Decimal('240.00'),
+            status=TransactionStatus.ESCROW if i % 2 else TransactionStatus.PENDENTE,
+            previsao_entrega=aware_utcnow() + timedelta(days=3) if i % 2 else None))
+    db.session.commit()
+
+
+class TestFormato:
+
+    def test_transacoes_iguais_ao_to_dict(self, db, partes):
+        _, comprador, safras = partes
+        _comprar(db, safras[0], comprador, 2)
+
+        linhas = projecoes.query_transacoes().order_by(Transacao.id).all()
+        assert projecoes.transacoes(linhas) == [t.to_dict() for t in Transacao.query.order_by(Transacao.id)]
+
+    def test_safras_iguais_ao_to_dict(self, db, partes):
+        linhas = projecoes.query_safras().order_by(Safra.id).all()
+        esperadas = [s.to_dict() for s in Safra.query.order_by(Safra.id)]
+
+        assert projecoes.safras(linhas) == esperadas
+        assert esperadas[0]['produtor']['localizacao'] == 'Cacuso, Malanje Projeções'
+        assert esperadas[1]['produtor']['localizacao'] == 'Localização N/D'
+
+
+class TestNumeroDeQueries:
+
+    def _instrucoes_dashboard(self, app, db, comprador):
+        with app.test_request_context():
+            token = create_access_token(identity=str(comprador.id))
+        instrucoes = []
+        contar = lambda *args: instrucoes.append(args[2])  # noqa: E731
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        try:
+            resposta = app.test_client().get('/api/dashboard/comprador',
+                                              headers={'Authorization': f'Bearer {token}'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', contar)
+        assert resposta.status_code == 200
+        return resposta.get_json()['data']['listas'], len(instrucoes)
+
+    def test_dashboard_com_numero_constante_de_queries(self, app, db, partes):
+        _, comprador, safras = partes
+        _comprar(db, safras[0], comprador, 1)
+        _, poucas = self._instrucoes_dashboard(app, db, comprador)
+
+        _comprar(db, safras[1], comprador, 9)
+        listas, muitas = self._instrucoes_dashboard(app, db, comprador)
+
+        assert len(listas['pendentes']) + len(listas['em_transito']) == 10
+        assert muitas == poucas
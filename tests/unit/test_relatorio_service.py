@@ -0,0 +1,151 @@
+"""
+Testes Unitários dos Relatórios Assíncronos
+Testa submissão com deduplicação, execução, falhas e expiração dos artefactos.
+"""
+import os
+import pytest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from unittest.mock import patch
+
+from app.models import Usuario, Produto, Safra, Transacao, TransactionStatus, RelatorioJob
+from app.services.relatorio_service import RelatorioService
+
+
+@pytest.fixture
+def despachar():
+    with patch.object(RelatorioService, '_despachar') as mock_despachar:
+        yield mock_despachar
+
+
+@pytest.fixture
+def cenario(db):
+    admin = Usuario(nome='Admin Relatórios', telemovel='923777000', tipo='admin')
+    produtor = Usuario(nome='Produtor Relatórios', telemovel='923777111', tipo='produtor')
+    comprador = Usuario(nome='Comprador Relatórios', telemovel='923777222', tipo='comprador')
+    for u in (admin, produtor, comprador):
+        u.senha = 'senha123'
+    produto = Produto(nome='Café', categoria='Grãos')
+    db.session.add_all([admin, produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('10'), preco_por_unidade=Decimal('500'))
+    db.session.add(safra)
+    db.session.flush()
+    venda = Transacao(safra_id=safra.id, comprador_id=comprador.id, vendedor_id=produtor.id,
+                      quantidade_comprada=Decimal('2'), valor_total_pago=Decimal('1000.00'),
+                      status=TransactionStatus.FINALIZADO)
+    db.session.add(venda)
+    db.session.commit()
+    return admin, produtor, comprador, venda
+
+
+class TestSubmissao:
+
+    def test_pedidos_identicos_partilham_o_job(self, db, cenario, despachar):
+        admin = cenario[0]
+        ok, job, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+        ok2, job2, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+
+        assert ok and ok2
+        assert job.id == job2.id
+        despachar.assert_called_once_with(job.id)
+
+    def test_parametros_diferentes_criam_outro_job(self, db, cenario, despachar):
+        admin = cenario[0]
+        _, job, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+        _, outro, _ = RelatorioService.submeter('financeiro', {'formato': 'xlsx'}, admin)
+        assert job.id != outro.id
+
+    def test_intervalo_aberto_nao_reutiliza_fora_da_janela(self, db, cenario, despachar):
+        admin = cenario[0]
+        agora = datetime(2026, 3, 2, 10, 5, tzinfo=timezone.utc)
+        fechado = {'formato': 'csv', 'data_fim': '2026-03-01'}
+
+        with patch('app.services.relatorio_service._agora', return_value=agora):
+            _, job, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+            _, job_fechado, _ = RelatorioService.submeter('financeiro', fechado, admin)
+        with patch('app.services.relatorio_service._agora', return_value=agora + timedelta(minutes=30)):
+            _, mesma_janela, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+        with patch('app.services.relatorio_service._agora', return_value=agora + timedelta(hours=1)):
+            _, outra_janela, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+            _, fechado_depois, _ = RelatorioService.submeter('financeiro', fechado, admin)
+
+        assert mesma_janela.id == job.id
+        assert outra_janela.id != job.id
+        assert fechado_depois.id == job_fechado.id
+
+    def test_financeiro_so_para_admin(self, db, cenario, despachar):
+        produtor = cenario[1]
+        ok, job, mensagem = RelatorioService.submeter('financeiro', {}, produtor)
+        assert not ok and job is None and 'administradores' in mensagem
+
+    def test_fatura_de_terceiros_recusada(self, db, cenario, despachar):
+        _, _, _, venda = cenario
+        estranho = Usuario(nome='Outro', telemovel='923777333', tipo='comprador')
+        estranho.senha = 'senha123'
+        db.session.add(estranho)
+        db.session.commit()
+
+        ok, _, _ = RelatorioService.submeter('fatura', {'transacao_id': venda.id}, estranho)
+        assert not ok
+
+
+class TestExecucao:
+
+    def test_exportacao_vazia_tem_zero_linhas(self, db, cenario, despachar):
+        admin = cenario[0]
+        _, job, _ = RelatorioService.submeter(
+            'financeiro', {'formato': 'csv', 'data_inicio': '2001-01-01', 'data_fim': '2001-01-31'}, admin)
+
+        assert RelatorioService.executar(job.id) is True
+        db.session.refresh(job)
+        assert job.estado == RelatorioJob.CONCLUIDO and job.linhas == 0
+
+    def test_gera_artefacto_e_conclui(self, db, cenario, despachar):
+        admin = cenario[0]
+        _, job, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+
+        assert RelatorioService.executar(job.id) is True
+        db.session.refresh(job)
+        assert job.estado == RelatorioJob.CONCLUIDO
+        assert job.progresso == 100
+        assert job.linhas == 1
+        assert job.nome_ficheiro.endswith('.csv')
+
+        caminho = RelatorioService.caminho_artefacto(job)
+        with open(caminho, encoding='utf-8') as ficheiro:
+            assert 'AGK-' in ficheiro.read()
+
+        # Reentrega da mesma tarefa não volta a gerar
+        assert RelatorioService.executar(job.id) is False
+
+    def test_falha_liberta_a_chave(self, db, cenario, despachar):
+        _, _, comprador, venda = cenario
+        _, job, _ = RelatorioService.submeter('fatura', {'transacao_id': venda.id}, comprador)
+
+        with patch('app.services.fatura_service.gerar_pdf_fatura', side_effect=OSError('wkhtmltopdf ausente')):
+            RelatorioService.executar(job.id)
+
+        db.session.refresh(job)
+        assert job.estado == RelatorioJob.FALHOU
+        assert 'wkhtmltopdf' in job.erro
+        assert job.chave_ativa is None
+
+        _, novo, _ = RelatorioService.submeter('fatura', {'transacao_id': venda.id}, comprador)
+        assert novo.id != job.id
+
+    def test_expiracao_remove_artefacto(self, db, cenario, despachar):
+        admin = cenario[0]
+        _, job, _ = RelatorioService.submeter('financeiro', {'formato': 'csv'}, admin)
+        RelatorioService.executar(job.id)
+        caminho = RelatorioService.caminho_artefacto(job)
+
+        job.expira_em = datetime.now(timezone.utc) - timedelta(minutes=1)
+        db.session.commit()
+
+        assert RelatorioService.limpar_expirados() == 1
+        assert not os.path.exists(caminho)
+        db.session.refresh(job)
+        assert job.estado == RelatorioJob.EXPIRADO
+        assert job.chave_ativa is None
@@ -0,0 +1,107 @@
+"""
+Testes Unitários do Motor de Reservas
+Testa o abate condicional do stock, as recusas e a devolução de stock.
+"""
+import pytest
+from decimal import Decimal
+
+from app.models import Usuario, Produto, Safra
+from app.services.reserva_service import ReservaService
+
+
+@pytest.fixture
+def safra(db):
+    produtor = Usuario(nome='Produtor Reservas', telemovel='923999111', tipo='produtor')
+    comprador = Usuario(nome='Comprador Reservas', telemovel='923999222', tipo='comprador')
+    for u in (produtor, comprador):
+        u.senha = 'senha123'
+    produto = Produto(nome='Mandioca', categoria='Tubérculos')
+    db.session.add_all([produtor, comprador, produto])
+    db.session.flush()
+    safra = Safra(produtor_id=produtor.id, produto_id=produto.id,
+                  quantidade_disponivel=Decimal('10'), preco_por_unidade=Decimal('250'))
+    db.session.add(safra)
+    db.session.commit()
+    return safra, comprador
+
+
+class TestReservar:
+
+    def test_abate_stock_e_devolve_preco(self, db, safra):
+        safra, comprador = safra
+        ok, reserva, _ = ReservaService.reservar(safra.id, comprador.id, Decimal('4'))
+        db.session.commit()
+
+        assert ok
+        assert reserva.preco_por_unidade == Decimal('250')
+        assert reserva.quantidade_disponivel == Decimal('6')
+        assert db.session.get(Safra, safra.id).quantidade_disponivel == Decimal('6')
+
+    def test_ultimo_kg_esgota_a_safra(self, db, safra):
+        safra, comprador = safra
+        ok, reserva, _ = ReservaService.reservar(safra.id, comprador.id, Decimal('10'))
+        db.session.commit()
+
+        assert ok and reserva.status == 'esgotado'
+        assert db.session.get(Safra, safra.id).status == 'esgotado'
+
+    def test_stock_insuficiente_nao_altera_nada(self, db, safra):
+        safra, comprador = safra
+        ok, reserva, mensagem = ReservaService.reservar(safra.id, comprador.id, Decimal('11'))
+
+        assert not ok and reserva is None
+        assert 'Máximo' in mensagem
+        assert db.session.get(Safra, safra.id).quantidade_disponivel == Decimal('10')
+
+    @pytest.mark.parametrize('caso, esperado', [
+        ('propria', 'própria safra'),
+        ('inexistente', 'não encontrada'),
+        ('esgotada', 'indisponível'),
+    ])
+    def test_motivos_de_recusa(self, db, safra, caso, esperado):
+        safra, comprador = safra
+        safra_id, comprador_id = safra.id, comprador.id
+        if caso == 'propria':
+            comprador_id = safra.produtor_id
+        elif caso == 'inexistente':
+            safra_id = 999999
+        else:
+            safra.status = 'esgotado'
+            db.session.commit()
+
+        ok, _, mensagem = ReservaService.reservar(safra_id, comprador_id, Decimal('1'))
+        assert not ok and esperado in mensagem
+
+    def test_quantidade_invalida(self, db, safra):
+        safra, comprador = safra
+        ok, _, _ = ReservaService.reservar(safra.id, comprador.id, Decimal('0'))
+        assert not ok
+
+    def test_safra_carregada_fica_sincronizada(self, db, safra):
+        safra, comprador = safra
+        carregada = db.session.get(Safra, safra.id)
+        ReservaService.reservar(safra.id, comprador.id, Decimal('3'))
+        assert carregada.quantidade_disponivel == Decimal('7')
+        db.session.rollback()
+
+    def test_agenda_invalidacao_do_cache(self, db, safra):
+        safra, comprador = safra
+        ReservaService.reservar(safra.id, comprador.id, Decimal('1'))
+        tags = db.session.info.get('cache_tags_pendentes', set())
+        assert {f'safra:{safra.id}', 'vitrine', f'cat:{safra.produto_id}'} <= tags
+        db.session.rollback()
+
+
+class TestDevolver:
+
+    def test_devolucao_reativa_safra_esgotada(self, db, safra):
+        safra, comprador = safra
+        ReservaService.reservar(safra.id, comprador.id, Decimal('10'))
+        db.session.commit()
+
+        assert ReservaService.devolver(safra.id, Decimal('10'))
+        db.session.commit()
+
+        safra = db.session.get(Safra, safra.id)
+        assert safra.status == 'disponivel'
+        assert safra.quantidade_disponivel == Decimal('10')
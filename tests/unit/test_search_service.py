@@ -0,0 +1,149 @@
+"""
+Testes Unitários do Serviço de Pesquisa
+Testa a normalização, o índice invertido e a pesquisa de safras.
+"""
+import pytest
+from decimal import Decimal
+from unittest.mock import patch
+
+from app.models import Usuario, Produto, Safra
+from app.services import search_service
+from app.services.search_service import IndiceInvertido, normalizar, tokenizar
+
+
+class TestNormalizacao:
+    """Testes da normalização de texto."""
+
+    def test_remove_acentos_e_maiusculas(self):
+        assert normalizar('Mandióca Açúcar') == 'mandioca acucar'
+
+    def test_colapsa_separadores(self):
+        assert normalizar('  Feijão-Macunde, (Huíla) ') == 'feijao macunde huila'
+
+    def test_texto_vazio(self):
+        assert normalizar(None) == ''
+        assert tokenizar('') == []
+
+    def test_tokens_unicos(self):
+        assert tokenizar('milho Milho MILHO branco') == ['milho', 'branco']
+
+
+class TestIndiceInvertido:
+    """Testes do índice em memória usado sem PostgreSQL."""
+
+    @pytest.fixture
+    def indice(self):
+        indice = IndiceInvertido()
+        indice.reconstruir([
+            (1, 'mandioca tuberculos joao silva'),
+            (2, 'milho cereais maria santos'),
+            (3, 'milheto cereais joao pedro'),
+        ])
+        return indice
+
+    def test_pesquisa_por_prefixo(self, indice):
+        assert set(indice.pesquisar('mil')) == {2, 3}
+
+    def test_correspondencia_exata_primeiro(self, indice):
+        assert indice.pesquisar('milho')[0] == 2
+
+    def test_todos_os_termos_obrigatorios(self, indice):
+        assert indice.pesquisar('cereais joao') == [3]
+        assert indice.pesquisar('mandioca maria') == []
+
+    def test_atualizar_e_remover(self, indice):
+        indice.atualizar(4, 'batata tuberculos ana', ativa=True)
+        assert indice.pesquisar('batata') == [4]
+
+        indice.atualizar(4, 'batata tuberculos ana', ativa=False)
+        assert indice.pesquisar('batata') == []
+
+        indice.remover(1)
+        assert indice.pesquisar('mandioca') == []
+
+
+class TestPesquisaSafras:
+    """Testes da pesquisa integrada com a base de dados."""
+
+    @pytest.fixture
+    def safras(self, db):
+        search_service.indice_memoria.limpar()
+        produtor = Usuario(nome='João Kiala', telemovel='923111222', tipo='produtor')
+        produtor.senha = 'senha123'
+        mandioca = Produto(nome='Mandioca', categoria='Tubérculos')
+        feijao = Produto(nome='Feijão', categoria='Leguminosas')
+        db.session.add_all([produtor, mandioca, feijao])
+        db.session.flush()
+
+        s1 = Safra(produtor_id=produtor.id, produto_id=mandioca.id,
+                   quantidade_disponivel=Decimal('100'), preco_por_unidade=Decimal('50'))
+        s2 = Safra(produtor_id=produtor.id, produto_id=feijao.id,
+                   quantidade_disponivel=Decimal('20'), preco_por_unidade=Decimal('300'))
+        db.session.add_all([s1, s2])
+        db.session.commit()
+        yield produtor, s1, s2
+        search_service.indice_memoria.limpar()
+
+    def _pesquisar(self, termo):
+        query = Safra.query.filter(Safra.status == 'disponivel')
+        return [s.id for s in search_service.filtrar_safras(query, termo).all()]
+
+    def test_texto_busca_preenchido_automaticamente(self, safras):
+        _, s1, _ = safras
+        assert s1.texto_busca == 'mandioca tuberculos joao kiala'
+
+    def test_pesquisa_sem_acentos(self, safras):
+        _, s1, s2 = safras
+        assert self._pesquisar('feijao') == [s2.id]
+        assert self._pesquisar('MANDIÓCA') == [s1.id]
+
+    def test_pesquisa_por_produtor(self, safras):
+        _, s1, s2 = safras
+        assert set(self._pesquisar('kia')) == {s1.id, s2.id}
+
+    def test_safra_esgotada_sai_do_indice(self, db, safras):
+        _, s1, _ = safras
+        self._pesquisar('mandioca')  # Constrói o índice
+
+        s1.status = 'esgotado'
+        db.session.commit()
+        assert self._pesquisar('mandioca') == []
+
+    def test_renomear_produtor_reindexa_safras(self, db, safras):
+        produtor, s1, s2 = safras
+        produtor.nome = 'Maria Ngola'
+        db.session.commit()
+
+        assert set(self._pesquisar('ngola')) == {s1.id, s2.id}
+        assert self._pesquisar('kiala') == []
+
+    def test_renomear_produto_reindexa_safras(self, db, safras):
+        _, s1, s2 = safras
+        self._pesquisar('mandioca')  # Constrói o índice
+        s1.produto.nome = 'Aipim'
+        s2.produto.categoria = 'Grãos'
+        db.session.commit()
+
+        assert s1.texto_busca == 'aipim tuberculos joao kiala'
+        assert self._pesquisar('aipim') == [s1.id]
+        assert self._pesquisar('mandioca') == []
+        assert self._pesquisar('graos') == [s2.id]
+
+    def test_vitrine_com_pesquisa_mantem_relevancia(self, app, db, safras):
+        produtor, _, s2 = safras
+        parecido = Produto(nome='Feijãozinho', categoria='Leguminosas')
+        db.session.add(parecido)
+        db.session.flush()
+        recente = Safra(produtor_id=produtor.id, produto_id=parecido.id,
+                        quantidade_disponivel=Decimal('5'), preco_por_unidade=Decimal('400'))
+        db.session.add(recente)
+        db.session.commit()
+
+        with patch('app.routes.mercado.render_template', return_value='') as render:
+            assert app.test_client().get('/explorar?q=feijao').status_code == 200
+            assert app.test_client().get('/explorar?q=feijao&page=2').status_code == 200
+
+        primeira, segunda = (c.kwargs for c in render.call_args_list)
+        # Correspondência exata antes da mais recente, paginada por página (não por cursor)
+        assert [s.id for s in primeira['safras']] == [s2.id, recente.id]
+        assert primeira['pagination'].page == 1 and segunda['safras'] == []